@@ -148,6 +148,9 @@ def aggregate_mbr_data(
             user_filter = " AND user_id = ?"
             user_params = [user_id]
 
+        # Month filters compare the raw column (ISO dates) so the
+        # (user_id, rechnungs_datum) index can serve them
+
         # Get user name
         user_name = None
         if user_id:
@@ -158,7 +161,7 @@ def aggregate_mbr_data(
 
         # Month coverage check
         cur = conn.execute(
-            f"SELECT COUNT(*) AS n FROM {invoice_table} WHERE DATE({date_col}) >= DATE(?) AND DATE({date_col}) < DATE(?){user_filter};",
+            f"SELECT COUNT(*) AS n FROM {invoice_table} WHERE {date_col} >= ? AND {date_col} < ?{user_filter};",
             [win.start.isoformat(), win.end_exclusive.isoformat()] + user_params,
         )
         n = int(cur.fetchone()["n"])
@@ -189,7 +192,7 @@ def aggregate_mbr_data(
                 )
 
                 cur = conn.execute(
-                    f"SELECT COUNT(*) AS n FROM {invoice_table} WHERE DATE({date_col}) >= DATE(?) AND DATE({date_col}) < DATE(?){user_filter};",
+                    f"SELECT COUNT(*) AS n FROM {invoice_table} WHERE {date_col} >= ? AND {date_col} < ?{user_filter};",
                     [win.start.isoformat(), win.end_exclusive.isoformat()] + user_params,
                 )
                 n = int(cur.fetchone()["n"])
@@ -205,7 +208,7 @@ def aggregate_mbr_data(
               COALESCE(SUM({gross_col}), 0) AS total_gross,
               COUNT(*) AS cnt
             FROM {invoice_table}
-            WHERE DATE({date_col}) >= DATE(?) AND DATE({date_col}) < DATE(?){user_filter};
+            WHERE {date_col} >= ? AND {date_col} < ?{user_filter};
             """,
             [win.start.isoformat(), win.end_exclusive.isoformat()] + user_params,
         )
@@ -221,7 +224,7 @@ def aggregate_mbr_data(
               COALESCE(NULLIF(TRIM({supplier_col}), ''), 'Unbekannt') AS supplier,
               COALESCE(SUM({net_col}), 0) AS amount_net
             FROM {invoice_table}
-            WHERE DATE({date_col}) >= DATE(?) AND DATE({date_col}) < DATE(?){user_filter}
+            WHERE {date_col} >= ? AND {date_col} < ?{user_filter}
             GROUP BY supplier
             ORDER BY amount_net DESC
             LIMIT 5;
@@ -257,7 +260,7 @@ def aggregate_mbr_data(
               COALESCE({category_col}, -1) AS category_id,
               COALESCE(SUM({net_col}), 0) AS actual_net
             FROM {invoice_table}
-            WHERE DATE({date_col}) >= DATE(?) AND DATE({date_col}) < DATE(?){user_filter}
+            WHERE {date_col} >= ? AND {date_col} < ?{user_filter}
             GROUP BY category_id;
             """,
             [win.start.isoformat(), win.end_exclusive.isoformat()] + user_params,
@@ -0,0 +1,282 @@
+"""
+SBS Deutschland – API Key Cache
+Cached API-key validation with cross-worker revocation.
+
+validate_api_key (api_keys.py) hashed the key, looked it up in api_keys
+and wrote last_used on every API-key authenticated call – integrations
+polling the API turned each request into a read plus a write. Now:
+- validated keys are cached in an LRU keyed by sha256(key) – the plain key
+  is never kept – for API_KEY_CACHE_TTL seconds; unknown keys are cached
+  for API_KEY_NEGATIVE_TTL seconds so guessing does not reach the DB
+- revoke() evicts the key locally and publishes the revocation on the
+  progress hub's event backplane (one poller per worker, shared with job
+  progress and alerts), so every worker evicts it immediately (with the
+  local backplane only this worker – fine for a single worker); a
+  validation that raced with a revocation is not cached
+- cache hits record last_used in memory; the flusher writes them as one
+  batch every API_KEY_FLUSH_INTERVAL seconds
+"""
+
+import hashlib
+import os
+import threading
+import time
+import logging
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from web.db_pool import DB_PATH, pool_for
+from web.progress_events import ProgressHub, progress_hub
+
+logger = logging.getLogger(__name__)
+
+API_KEY_CACHE_TTL = float(os.getenv("API_KEY_CACHE_TTL", "60"))
+API_KEY_NEGATIVE_TTL = float(os.getenv("API_KEY_NEGATIVE_TTL", "10"))
+API_KEY_CACHE_SIZE = int(os.getenv("API_KEY_CACHE_SIZE", "5000"))
+API_KEY_FLUSH_INTERVAL = float(os.getenv("API_KEY_FLUSH_INTERVAL", "30"))
+
+REVOCATION_TOPIC = "api_keys:revoked"
+# Checked in this order; api_keys.py owns the schema
+LAST_USED_COLUMNS = ("last_used_at", "last_used")
+
+Validate = Callable[[str], Optional[Dict[str, Any]]]
+
+
+def key_hash(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+class _Entry:
+    __slots__ = ("info", "expires")
+
+    def __init__(self, info: Optional[Dict[str, Any]], expires: float):
+        self.info = info        # None: invalid key (negative entry)
+        self.expires = expires
+
+
+class ApiKeyCache:
+    """
+    Usage:
+        api_key_cache.register(validate_api_key)     # api_keys.validate_api_key
+        key_info = api_key_cache.validate(raw_key)   # dict or None
+        api_key_cache.revoke(key_id)                 # after revoke_api_key() succeeded
+    """
+
+    def __init__(self, db_path: str = DB_PATH, ttl: float = API_KEY_CACHE_TTL,
+                 negative_ttl: float = API_KEY_NEGATIVE_TTL, max_entries: int = API_KEY_CACHE_SIZE,
+                 flush_interval: float = API_KEY_FLUSH_INTERVAL, hub: Optional[ProgressHub] = None,
+                 clock: Callable[[], float] = time.time):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.flush_interval = flush_interval
+        self.hub = hub if hub is not None else progress_hub
+        self._clock = clock
+        self._pool = pool_for(db_path)
+        self._validate: Optional[Validate] = None
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._by_key_id: Dict[Any, Set[str]] = {}
+        self._by_user_id: Dict[Any, Set[str]] = {}
+        # Bumped on every revocation: loads that started before are not cached
+        self._generation = 0
+        self._last_used: Dict[Any, float] = {}
+        self._last_used_column: Optional[str] = None
+        self._started = False
+        self._flusher: Optional[threading.Thread] = None
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self.hits = 0
+        self.misses = 0
+        self.revocations = 0
+        self.remote_revocations = 0
+        self.flushes = 0
+        self.flush_errors = 0
+
+    def register(self, validate: Validate):
+        """validate(raw_key) -> key info dict (with "id" and "user_id") or None."""
+        self._validate = validate
+
+    def start(self):
+        """Subscribe to revocations from other workers."""
+        if not self._started:
+            self._started = True
+            self.hub.add_listener(REVOCATION_TOPIC, self._on_message)
+
+    # ------------------------------------------------------------------
+    # Validation
+    # ------------------------------------------------------------------
+
+    def validate(self, api_key: str) -> Optional[Dict[str, Any]]:
+        if not api_key:
+            return None
+        digest = key_hash(api_key)
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None and entry.expires > now:
+                self._entries.move_to_end(digest)
+                self.hits += 1
+                if entry.info is None:
+                    return None
+                self._last_used[entry.info.get("id")] = now
+                info = dict(entry.info)
+            else:
+                self.misses += 1
+                generation = self._generation
+                info = None
+        if info is not None:
+            self._ensure_flusher()
+            return info
+
+        if self._validate is None:
+            raise RuntimeError("ApiKeyCache.register() was not called")
+        # Miss: api_keys.py validates (and writes last_used itself)
+        result = self._validate(api_key)
+        with self._lock:
+            if self._generation == generation:
+                self._store(digest, dict(result) if result else None, now)
+        return dict(result) if result else None
+
+    def _store(self, digest: str, info: Optional[Dict[str, Any]], now: float):
+        """Caller holds the lock."""
+        self._drop(digest)
+        ttl = self.ttl if info is not None else self.negative_ttl
+        self._entries[digest] = _Entry(info, now + ttl)
+        if info is not None:
+            self._by_key_id.setdefault(info.get("id"), set()).add(digest)
+            self._by_user_id.setdefault(info.get("user_id"), set()).add(digest)
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, digest: str):
+        """Caller holds the lock."""
+        entry = self._entries.pop(digest, None)
+        if entry is None or entry.info is None:
+            return
+        for index, value in ((self._by_key_id, entry.info.get("id")), (self._by_user_id, entry.info.get("user_id"))):
+            digests = index.get(value)
+            if digests is not None:
+                digests.discard(digest)
+                if not digests:
+                    del index[value]
+
+    # ------------------------------------------------------------------
+    # Revocation
+    # ------------------------------------------------------------------
+
+    def _evict(self, key_id=None, user_id=None) -> int:
+        with self._lock:
+            self._generation += 1
+            digests = set()
+            if key_id is not None:
+                digests |= self._by_key_id.get(key_id, set())
+            if user_id is not None:
+                digests |= self._by_user_id.get(user_id, set())
+            for digest in digests:
+                self._drop(digest)
+            return len(digests)
+
+    def revoke(self, key_id=None, user_id=None):
+        """Evict a key (or all keys of a user) here and on every other worker."""
+        self._evict(key_id, user_id)
+        with self._lock:
+            self.revocations += 1
+        backplane = self.hub.backplane
+        if getattr(backplane, "distributed", False):
+            backplane.publish(REVOCATION_TOPIC, {"key_id": key_id, "user_id": user_id})
+
+    def _on_message(self, topic: str, message: Dict[str, Any]):
+        """Hub listener for REVOCATION_TOPIC (backplane poller thread)."""
+        self._evict(message.get("key_id"), message.get("user_id"))
+        with self._lock:
+            self.remote_revocations += 1
+
+    # ------------------------------------------------------------------
+    # last_used write-back
+    # ------------------------------------------------------------------
+
+    def _ensure_flusher(self):
+        if self._flusher is not None or self.flush_interval <= 0:
+            return
+        with self._flush_lock:
+            if self._flusher is None:
+                self._stop.clear()
+                self._flusher = threading.Thread(target=self._flush_loop, daemon=True, name="api-key-flush")
+                self._flusher.start()
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def _column(self, conn) -> Optional[str]:
+        if self._last_used_column is None:
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(api_keys)").fetchall()}
+            self._last_used_column = next((c for c in LAST_USED_COLUMNS if c in columns), "")
+            if not self._last_used_column:
+                logger.warning("api_keys has no last_used column – last-used timestamps are not written")
+        return self._last_used_column or None
+
+    def flush(self) -> int:
+        """Write buffered last-used timestamps in one transaction; returns the number of keys updated."""
+        with self._flush_lock:
+            with self._lock:
+                batch: List[Tuple[Any, float]] = list(self._last_used.items())
+                self._last_used.clear()
+            if not batch:
+                return 0
+            try:
+                conn = self._pool.connect()
+                try:
+                    column = self._column(conn)
+                    if column is None:
+                        return 0
+                    conn.executemany(
+                        f"UPDATE api_keys SET {column} = ? WHERE id = ?",
+                        [(time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(ts)), key_id) for key_id, ts in batch],
+                    )
+                    conn.commit()
+                finally:
+                    conn.close()
+            except Exception as e:
+                logger.error(f"API key last_used flush failed: {e}")
+                with self._lock:
+                    self.flush_errors += 1
+                    for key_id, ts in batch:
+                        # Keep the newer timestamp if the key was used again meanwhile
+                        self._last_used[key_id] = max(ts, self._last_used.get(key_id, 0))
+                return 0
+            with self._lock:
+                self.flushes += 1
+            return len(batch)
+
+    def stop(self):
+        """Stop the flusher and the revocation listener (the hub's backplane keeps running); write what is pending."""
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join(timeout=self.flush_interval + 1)
+            self._flusher = None
+        if self._started:
+            self.hub.remove_listener(REVOCATION_TOPIC, self._on_message)
+            self._started = False
+        self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "revocations": self.revocations,
+                "remote_revocations": self.remote_revocations,
+                "pending_last_used": len(self._last_used),
+                "flushes": self.flushes,
+                "flush_errors": self.flush_errors,
+                "distributed": bool(getattr(self.hub.backplane, "distributed", False)),
+            }
+
+
+# Global instance
+api_key_cache = ApiKeyCache()
@@ -117,6 +117,26 @@ from export import ExportManager
 from dashboard import generate_dashboard
 from datev_exporter import export_to_datev
 from notifications import send_notifications, check_low_confidence
+from web.job_store import JobStore, JobQueueWorker
+from web.extraction_scheduler import extraction_scheduler
+from web.extraction_cache import extraction_cache, hash_file
+from web.upload_stream import stream_upload_to_disk, UploadRejected
+from web.result_journal import ResultJournal
+from web.post_processing import JobPostProcessor, PostProcessingWriter
+from web.duplicate_index import duplicate_index
+from web.parse_pool import parse_pool, parse_einvoice_file, run_staged
+from web.einvoice_validation import validate_einvoice
+from web.progress_events import progress_hub, job_snapshot, is_terminal, sse_format
+from web.export_artifacts import ExportArtifactStore, download_url, is_download_url
+from web.zip_stream import stream_zip, render_ordered, start as start_zip_entries
+from web.datev_stream import iter_invoices, write_extf_csv
+from web.db_pool import db_pool, get_db
+from web.offload import adb, run_blocking, offload_route, http_post, pool_stats, shutdown_pool
+from web.loop_monitor import loop_monitor, ENABLED as LOOP_MONITOR_ENABLED
+from web import query_indexes
+from web.quota import quota, DEMO_UPLOAD, COPILOT_DEMO, INVOICES
+from web.identity import identities, identity_for
+from web.retention import retention_index, RetentionSweeper, UPLOAD_RETENTION_MINUTES, UPLOAD_MAX_RETENTION_HOURS
 
 # FastAPI App
 app = FastAPI(
@@ -139,14 +159,24 @@ from einvoice import generate_xrechnung, export_xrechnung_file, validate_xrechnu
 from einvoice_import import parse_einvoice, is_einvoice
 from shared_auth import create_sso_token, verify_sso_token, get_sso_cookie_settings, COOKIE_NAME
 from multi_product_subscriptions import get_user_products, has_product_access, get_user_dashboard_redirect
-from rate_limiter import check_rate_limit, get_client_ip
+from rate_limiter import check_rate_limit, get_client_ip, invalidate_user_plan, limiter as rate_limiter
 from api_keys import validate_api_key, create_api_key, list_api_keys, revoke_api_key
+from web.api_key_cache import api_key_cache
+
+# API-Key-Prüfung über den Cache (LRU nach Key-Hash, last_used gebündelt)
+api_key_cache.register(validate_api_key)
+validate_api_key = api_key_cache.validate
 from audit import log_audit, AuditAction, get_audit_logs
 from audit import get_audit_stats
 from rbac import (
     Permission, has_permission, is_admin_or_owner, 
     get_user_permissions_for_template, ensure_default_role
 )
+
+# Entitlement-Checks anderer Module: pro Identity (User) einmal pro TTL
+identities.register("permission", has_permission)
+identities.register("admin_or_owner", is_admin_or_owner)
+identities.register("product", has_product_access)
 from webhooks import create_webhook, get_webhooks, delete_webhook, trigger_webhooks, WebhookEvent
 from system_alerts import get_system_status, run_system_check
 
@@ -212,13 +242,16 @@ templates = Jinja2Templates(directory=str(BASE_DIR / "templates"))
 config = Config()
 processor = InvoiceProcessor(config)
 
-# In-memory storage for results (in production: use database)
-processing_jobs = {}
+# Persistenter Job-Store (SQLite/WAL) – von allen Workern gemeinsam genutzt
+processing_jobs = JobStore()
+# Journal für Einzelergebnisse – Resume nach Crash ohne erneute LLM-Kosten
+result_journal = ResultJournal()
 app_start_time = __import__("time").time()
 
 
 @app.get("/", response_class=HTMLResponse)
-async def home(request: Request):
+@offload_route
+def home(request: Request):
 
     redirect = require_login(request)
     if redirect:
@@ -247,8 +280,7 @@ async def upload_files(request: Request, files: List[UploadFile] = File(default=
     user_id = request.session["user_id"]
     
     # 2) Subscription-Check (Admins haben unbegrenzten Zugang)
-    from database import check_invoice_limit
-    limit_status = check_invoice_limit(user_id)
+    limit_status = (await run_blocking(quota.status, user_id, INVOICES)).info
     
     if not limit_status.get('allowed') and not limit_status.get('is_admin'):
         reason = limit_status.get('reason', 'unknown')
@@ -278,8 +310,12 @@ async def upload_files(request: Request, files: List[UploadFile] = File(default=
     log_job_event(app_logger, job_id, "created", user_id=user_id, file_count=len(files))
     upload_path = UPLOAD_DIR / job_id
     upload_path.mkdir(exist_ok=True)
+    # DSGVO: Löschung sofort vormerken – greift auch, wenn der Job nie fertig wird
+    await run_blocking(retention_index.schedule_path, upload_path,
+                       datetime.now() + timedelta(hours=UPLOAD_MAX_RETENTION_HOURS), tenant_id=user_id)
 
     uploaded_files = []
+    rejected_files = []
     MAX_FILE_SIZE = 20 * 1024 * 1024  # 20 MB
 
     for file in files:
@@ -287,21 +323,19 @@ async def upload_files(request: Request, files: List[UploadFile] = File(default=
         if not file.filename.lower().endswith(".pdf"):
             continue
 
-        file_path = upload_path / file.filename
-
-        # Optional: rudimentärer Größen-Check (wenn verfügbar)
-        size = getattr(file, "size", None)
-        if size is not None and size > MAX_FILE_SIZE:
-            # Im DEV: einfach überspringen
+        # Chunkweise auf Platte schreiben (blockiert den Event-Loop nicht),
+        # Hash + Größenlimit + PDF-Magic-Bytes schon beim Streamen prüfen
+        try:
+            stored = await stream_upload_to_disk(file, upload_path, MAX_FILE_SIZE)
+        except UploadRejected as e:
+            rejected_files.append({"filename": file.filename, "reason": e.reason})
             continue
 
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-
         uploaded_files.append(
             {
-                "filename": file.filename,
-                "size": file_path.stat().st_size,
+                "filename": stored.filename,
+                "size": stored.size,
+                "sha256": stored.sha256,
             }
         )
 
@@ -309,11 +343,11 @@ async def upload_files(request: Request, files: List[UploadFile] = File(default=
     if not uploaded_files:
         return JSONResponse(
             status_code=400,
-            content={"error": "Keine gültigen PDF-Dateien hochgeladen."},
+            content={"error": "Keine gültigen PDF-Dateien hochgeladen.", "rejected": rejected_files},
         )
 
-    # 4) Job in processing_jobs ablegen (RAM – wird von /api/process genutzt)
-    processing_jobs[job_id] = {
+    # 4) Job im Job-Store ablegen (wird von /api/process genutzt)
+    await run_blocking(processing_jobs.create, job_id, {
         "user_id": user_id,
         "status": JobStatus.UPLOADED.value,
         "files": uploaded_files,
@@ -325,7 +359,7 @@ async def upload_files(request: Request, files: List[UploadFile] = File(default=
         "failed_count": 0,
         "total_amount": 0.0,
         "stats": {},
-    }
+    })
     
     # Audit: Job erstellt
     log_audit(AuditAction.JOB_CREATED, user_id=user_id, resource_type="job", resource_id=job_id, 
@@ -345,27 +379,25 @@ async def upload_files(request: Request, files: List[UploadFile] = File(default=
         "job_id": job_id,
         "files_uploaded": len(uploaded_files),
         "files": uploaded_files,
+        "rejected": rejected_files,
         "subscription": dev_limit,
     }
 @app.post("/api/process/{job_id}", tags=["Jobs"])
-async def process_job(job_id: str, background_tasks: BackgroundTasks):
+async def process_job(job_id: str):
     """
     Process uploaded PDFs
-    Returns immediately, processing happens in background
+    Returns immediately, the job is queued and claimed by any worker
     """
-    if job_id not in processing_jobs:
+    job = await run_blocking(processing_jobs.get, job_id)
+    if not job:
         raise JobNotFoundError(job_id)
     
-    job = processing_jobs[job_id]
-    
-    if job["status"] == "processing":
+    if job["status"] in ("queued", "processing"):
         return {"status": "already_processing"}
     
-    # Update status
-    processing_jobs[job_id]["status"] = "processing"
-    
-    # Process in background
-    background_tasks.add_task(process_invoices_background, job_id)
+    # In die Queue stellen – ein beliebiger Worker übernimmt den Job per Lease
+    if not await run_blocking(processing_jobs.enqueue, job_id):
+        return {"status": "already_processing"}
     
     return {
         "success": True,
@@ -377,204 +409,274 @@ async def process_job(job_id: str, background_tasks: BackgroundTasks):
 async def process_invoices_background(job_id: str):
     log_job_event(app_logger, job_id, "processing_started")
     """Background task to process invoices with parallel processing"""
-    job = processing_jobs[job_id]
+    job = await run_blocking(processing_jobs.get, job_id)
+    if not job:
+        raise JobNotFoundError(job_id)
     upload_path = Path(job["path"])
     
-    results = []
+    # Bereits journalisierte Ergebnisse laden (Job wurde nach Crash/Deploy neu übernommen)
+    results, done_files = await run_blocking(result_journal.load, job_id)
     failed = []
     
     # Get all PDFs
     pdf_files = list(upload_path.glob("*.pdf"))
     total_files = len(pdf_files)
+    pending_files = [pdf for pdf in pdf_files if pdf.name not in done_files]
+    if done_files:
+        log_job_event(app_logger, job_id, "resumed", already_done=len(results), pending=len(pending_files))
     
     # Update job with total count
-    processing_jobs[job_id]["total"] = total_files
-    processing_jobs[job_id]["processed"] = 0
-    
-    # Process PDFs in parallel (8 threads)
-    def process_single_pdf(pdf_path):
-        try:
-            # 1. Prüfe zuerst ob es eine E-Rechnung ist (ZUGFeRD/XRechnung)
-            is_einv, einv_data = parse_einvoice(str(pdf_path))
-            
-            if is_einv and einv_data.get('rechnungsnummer') and einv_data.get('betrag_brutto'):
-                # E-Rechnung erkannt - nutze strukturierte Daten (spart KI-Kosten!)
-                app_logger.info(f"📋 E-Rechnung erkannt: {einv_data.get('profile', 'Unknown')} - {pdf_path.name}")
-                data = einv_data
-                data['extraction_method'] = 'einvoice'
-                data['ki_score'] = 99  # Strukturierte Daten = höchste Confidence
-            else:
-                # Keine E-Rechnung - nutze KI-Extraktion
-                data = processor.process_invoice(pdf_path)
-                data['extraction_method'] = 'ki'
-            
-            # Invoice-Model für Validierung und Standardwerte
-            # invoice = Invoice.from_dict(data)  # DISABLED - keeps German fields
-            # invoice.filename = pdf_path.name
-            data["filename"] = pdf_path.name
-            return ("success", data, pdf_path.name)
-        except Exception as e:
-            return ("error", str(e), pdf_path.name)
-    
-    # Use ThreadPoolExecutor for parallel processing
-    max_workers = min(12, total_files) if total_files > 0 else 1
-    
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        future_to_pdf = {executor.submit(process_single_pdf, pdf): pdf for pdf in pdf_files}
+    await run_blocking(processing_jobs.update, job_id, {"total": total_files, "processed": len(results)})
+    
+    tenant_key = job.get("user_id") or job_id
+    cache_hits = []
+    # SHA-256 wurde schon beim Upload-Streaming berechnet
+    file_hashes = {f["filename"]: f.get("sha256") for f in job.get("files", [])}
+    content_hashes = {}
+    # Prefilter-Entscheidung und Zeiten pro Datei (eingesparte Parse-Zeit messbar)
+    prefilter_log = {}
+    
+    # Zweistufige Pipeline: Parsing (CPU) im Prozess-Pool, KI-Extraktion (Netzwerk)
+    # im globalen Extraction-Pool, fair pro User
+    def extract_single_pdf(pdf_path, parsed):
+        progress_hub.publish(job_id, "file_started", filename=pdf_path.name)
+        # 1. Prüfe zuerst ob es eine E-Rechnung ist (ZUGFeRD/XRechnung)
+        is_einv, einv_data, prefilter = parsed
+        prefilter_log[pdf_path.name] = prefilter
         
-        for future in as_completed(future_to_pdf):
-            status, data, filename = future.result()
-            
-            if status == "success" and data:
-                results.append(data)
-            else:
-                failed.append(filename if status == "success" else f"{filename}: {data}")
-                app_logger.warning(f"Invoice failed: {filename} - {data if status != 'success' else 'empty result'}", extra={"job_id": job_id, "filename": filename})
+        if is_einv and einv_data.get('rechnungsnummer') and einv_data.get('betrag_brutto'):
+            # E-Rechnung erkannt - nutze strukturierte Daten (spart KI-Kosten!)
+            app_logger.info(f"📋 E-Rechnung erkannt: {einv_data.get('profile', 'Unknown')} - {pdf_path.name}")
+            data = einv_data
+            data['extraction_method'] = 'einvoice'
+            data['ki_score'] = 99  # Strukturierte Daten = höchste Confidence
+        else:
+            # Keine E-Rechnung - nutze KI-Extraktion
+            data = processor.process_invoice(pdf_path)
+            data['extraction_method'] = 'ki'
+        if data:
+            extraction_cache.put(tenant_key, content_hashes[pdf_path.name], data)
+            data["filename"] = pdf_path.name
+        return data
+    
+    def run_extraction():
+        # Jedes Ergebnis sofort ins Journal (Commit alle N Zeilen), nicht erst am Batch-Ende
+        with result_journal.writer(job_id) as journal:
+            def record(filename, status, data):
+                if status == "success" and data:
+                    results.append(data)
+                    journal.add_result(filename, data)
+                else:
+                    failed.append(filename if status == "success" else f"{filename}: {data}")
+                    journal.add_failure(filename, data if status != "success" else "empty result")
+                    app_logger.warning(f"Invoice failed: {filename} - {data if status != 'success' else 'empty result'}", extra={"job_id": job_id, "filename": filename})
             
-            # Update progress
-            processing_jobs[job_id]["processed"] = len(results) + len(failed)
-            processing_jobs[job_id]["progress"] = int((len(results) + len(failed)) / total_files * 100) if total_files > 0 else 100
-    
-    # Calculate statistics
-    stats = calculate_statistics(results) if results else None
-    
-    # Füge Rechnungsanzahl hinzu
-    if stats:
-        stats['total_invoices'] = len(results)
-    
-    # Export (XLSX, CSV, DATEV)
-    exported_files = {}
-    if results:
+                # Update progress
+                progress = {
+                    "processed": len(results) + len(failed),
+                    "progress": int((len(results) + len(failed)) / total_files * 100) if total_files > 0 else 100,
+                }
+                processing_jobs.update(job_id, progress)
+                progress_hub.publish(
+                    job_id, "file_extracted" if status == "success" and data else "file_failed",
+                    filename=filename, total=total_files, **progress,
+                )
+        
+            # Identische Bytes (gleicher User) → Ergebnis aus dem Cache, weder Parsing noch LLM-Call
+            to_extract = []
+            for pdf_path in pending_files:
+                content_hashes[pdf_path.name] = file_hashes.get(pdf_path.name) or hash_file(pdf_path)
+                cached = extraction_cache.get(tenant_key, content_hashes[pdf_path.name])
+                if cached is not None:
+                    cache_hits.append(pdf_path.name)
+                    cached["filename"] = pdf_path.name
+                    record(pdf_path.name, "success", cached)
+                else:
+                    to_extract.append(pdf_path)
+        
+            for pdf_path, status, data in run_staged(
+                to_extract, parse_einvoice_file, extract_single_pdf,
+                lambda fn, *args: extraction_scheduler.submit(tenant_key, fn, *args),
+                parse_pool,
+            ):
+                record(pdf_path.name, status, data)
+    
+    # Blockierende Pipeline im Thread – Event-Loop bleibt frei für WebSocket/SSE-Updates
+    await asyncio.to_thread(run_extraction)
+    
+    def finish_job():
+        # Statistik, Benachrichtigung, DB-Writes, Post-Processing und Quota – alles blockierend
+        # Calculate statistics
+        stats = calculate_statistics(results) if results else None
+    
+        # Füge Rechnungsanzahl hinzu
+        if stats:
+            stats['total_invoices'] = len(results)
+            stats['cache_hits'] = len(cache_hits)
+            stats['cache_hit_ratio'] = round(len(cache_hits) / total_files, 3) if total_files else 0.0
+            stats['prefilter_skipped'] = sum(1 for p in prefilter_log.values() if not p["has_embedded_xml"])
+            stats['prefilter_scan_ms'] = round(sum(p["scan_ms"] for p in prefilter_log.values()), 1)
+    
+        # Export (XLSX, CSV, DATEV) – erst beim ersten Download erzeugt, siehe /api/download
+        exported_files = {}
+        if results:
+            export_formats = ['xlsx', 'csv']
+            if config.config.get('datev', {}).get('enabled', False):
+                export_formats.append('datev')
+            exported_files = {fmt: download_url(job_id, fmt) for fmt in export_formats}
+            progress_hub.publish(job_id, "exported", formats=export_formats)
+    
+        # Email Notification
         try:
-            # Standard Exports
-            manager = ExportManager()
-            exported_files = manager.export_all(results, ['xlsx', 'csv'])
-            
-            # DATEV Export
-            from datev_exporter import export_to_datev
-            datev_config = config.config.get('datev', {})
-            if datev_config.get('enabled', False):
-                datev_file = export_to_datev(results, datev_config)
-                exported_files['datev'] = datev_file
-            
+            from notifications import send_notifications, check_low_confidence
+            notification_config = config.config.get('notifications', {})
+            if notification_config.get('email', {}).get('enabled', False):
+                # Anhänge brauchen echte Dateien: Artefakte jetzt bauen (werden für Downloads wiederverwendet)
+                attachments = export_artifacts.attachments(job_id, exported_files, results)
+                send_notifications(config.config, stats, attachments)
         except Exception as e:
-            app_logger.error(f"Export error: {e}")
+            app_logger.error(f"Notification error: {e}")
     
-    # Email Notification
-    try:
-        from notifications import send_notifications, check_low_confidence
-        notification_config = config.config.get('notifications', {})
-        if notification_config.get('email', {}).get('enabled', False):
-            send_notifications(config.config, stats, exported_files)
-    except Exception as e:
-        app_logger.error(f"Notification error: {e}")
+        # Ergebnisse ablegen – Status bleibt "processing", bis alles gespeichert ist
+        # (der Worker hält den Lease bis zum release())
+        processing_jobs.update(job_id, {
+            "results": results,
+            "stats": stats,
+            "failed": failed,
+            "exported_files": exported_files,
+            "completed_at": datetime.now().isoformat(),
+            "total_amount": stats.get('total_brutto', 0) if stats else 0,
+            "total_netto": stats.get("total_netto", 0) if stats else 0,
+            "total_mwst": stats.get("total_mwst", 0) if stats else 0,
+            "total": total_files,
+            "successful": len(results),
+            "cache_hits": len(cache_hits),
+            "prefilter": prefilter_log,
+        })
     
-    # Update job with results
-    processing_jobs[job_id].update({
-        "status": JobStatus.COMPLETED.value,
-        "results": results,
-        "stats": stats,
-        "failed": failed,
-        "exported_files": exported_files,
-        "completed_at": datetime.now().isoformat(),
-        "total_amount": stats.get('total_brutto', 0) if stats else 0,
-        "total_netto": stats.get("total_netto", 0) if stats else 0,
-        "total_mwst": stats.get("total_mwst", 0) if stats else 0,
-        "total": total_files,
-        "successful": len(results)
-    })
-    log_job_event(app_logger, job_id, "completed", total=total_files, successful=len(results), failed=len(failed))
-    
-    # Save to database
-    logger.info(f"💾 Saving job {job_id} with {len(results)} results")
-    save_job(job_id, processing_jobs[job_id], processing_jobs[job_id].get("user_id"))
-    logger.info(f"✅ Job saved, now saving invoices")
-    # --- E-Rechnungs-Metadaten anreichern ---------------------------
-    enriched_results = []
-    for invoice in results:
-        source_format = invoice.get("source_format") or "pdf"
-        einvoice_raw_xml = (
-            invoice.get("einvoice_raw_xml")
-            or invoice.get("raw_xml")
-            or invoice.get("xml")
-            or ""
-        )
-        einvoice_profile = invoice.get("einvoice_profile", "")
-        is_valid, message, detected_profile = validate_einvoice(einvoice_raw_xml)
-        if detected_profile and not einvoice_profile:
-            einvoice_profile = detected_profile
-        invoice["source_format"] = source_format
-        invoice["einvoice_raw_xml"] = einvoice_raw_xml
-        invoice["einvoice_profile"] = einvoice_profile
-        invoice["einvoice_valid"] = bool(is_valid)
-        invoice["einvoice_validation_message"] = message or ""
-        enriched_results.append(invoice)
-    # ---------------------------------------------------------------
-    if results:
-        logger.info(f"💾 Saving {len(results)} invoices to database")
-        save_invoices(job_id, enriched_results)
-        # Low-Confidence Warnung prüfen
-        check_low_confidence(job_id, enriched_results, config.config if config else None)
-        logger.info(f"✅ Invoices saved successfully")
-        
-        # Check for duplicates (Hash + AI)
-        from database import get_invoices_by_job
-        from duplicate_detection import get_duplicates_for_invoice, detect_all_duplicates
-        saved_invoices = get_invoices_by_job(job_id)
-        duplicate_count = 0
-        similar_count = 0
-        
-        for inv in saved_invoices:
-            # Check existing duplicates from hash
-            duplicates = get_duplicates_for_invoice(inv['id'])
-            if duplicates:
-                duplicate_count += len(duplicates)
-            
-            # Run AI similarity check (only if no hash duplicate found)
-            if not duplicates:
-                dup_results = detect_all_duplicates(dict(inv), job.get('user_id'))
-                if dup_results['similar']:
-                    similar_count += len(dup_results['similar'])
-                    # Save AI-detected similarities
-                    from duplicate_detection import save_duplicate_detection
-                    for sim in dup_results['similar']:
-                        save_duplicate_detection(inv['id'], sim['id'], method='ai', confidence=sim['confidence'])
+        # Save to database
+        logger.info(f"💾 Saving job {job_id} with {len(results)} results")
+        save_job(job_id, {**processing_jobs[job_id], "status": JobStatus.COMPLETED.value}, job.get("user_id"))
+        logger.info(f"✅ Job saved, now saving invoices")
+        # --- E-Rechnungs-Metadaten anreichern ---------------------------
+        enriched_results = []
+        for invoice in results:
+            source_format = invoice.get("source_format") or "pdf"
+            einvoice_raw_xml = (
+                invoice.get("einvoice_raw_xml")
+                or invoice.get("raw_xml")
+                or invoice.get("xml")
+                or ""
+            )
+            einvoice_profile = invoice.get("einvoice_profile", "")
+            is_valid, message, detected_profile = validate_einvoice(einvoice_raw_xml)
+            if detected_profile and not einvoice_profile:
+                einvoice_profile = detected_profile
+            invoice["source_format"] = source_format
+            invoice["einvoice_raw_xml"] = einvoice_raw_xml
+            invoice["einvoice_profile"] = einvoice_profile
+            invoice["einvoice_valid"] = bool(is_valid)
+            invoice["einvoice_validation_message"] = message or ""
+            enriched_results.append(invoice)
+        # ---------------------------------------------------------------
+        if results:
+            logger.info(f"💾 Saving {len(results)} invoices to database")
+            save_invoices(job_id, enriched_results)
+            # Rechnungen sind jetzt in der DB – Journal wird nicht mehr gebraucht
+            result_journal.clear(job_id)
+            # Low-Confidence Warnung prüfen
+            check_low_confidence(job_id, enriched_results, config.config if config else None)
+            logger.info(f"✅ Invoices saved successfully")
+            progress_hub.publish(job_id, "saved", invoices=len(enriched_results))
         
-        total_issues = duplicate_count + similar_count
-        if total_issues > 0:
-            logger.warning(f"⚠️ {duplicate_count} exact + {similar_count} similar duplicate(s) detected!")
-            processing_jobs[job_id]['duplicates_detected'] = total_issues
-    else:
-        logger.warning("⚠️ No results to save!")
-    
-    # Auto-Kategorisierung
-    try:
-        from database import assign_category_to_invoice, get_invoices_by_job
-        # Hole die gespeicherten Invoices mit IDs
-        saved_invoices = get_invoices_by_job(job_id)
-        for invoice in saved_invoices:
-            category_id, confidence, reasoning = predict_category(invoice, job.get("user_id"))
-            assign_category_to_invoice(invoice['id'], category_id, confidence, 'ai')
-            logger.info(f"📊 Invoice {invoice['id']}: Category {category_id} (conf: {confidence:.2f})")
-    except Exception as e:
-        logger.warning(f"Auto-categorization failed: {e}")
+            # Duplikate (Hash + Batch + KI) und Auto-Kategorisierung als ein Batch-Schritt
+            try:
+                post = build_post_processor().run(job_id, job.get("user_id"))
+                logger.info(
+                    f"📊 Post-Processing: {post.categorized} Rechnungen kategorisiert "
+                    f"({post.category_predictions} Vorhersagen)"
+                )
+                if post.total_issues > 0:
+                    logger.warning(f"⚠️ {post.duplicate_count} exact + {post.similar_count} similar duplicate(s) detected!")
+                    processing_jobs.update(job_id, {'duplicates_detected': post.total_issues})
+            except Exception as e:
+                logger.warning(f"Post-processing failed: {e}")
+                # Ohne match_and_add fehlten die Rechnungen sonst im Near-Duplicate-Index
+                try:
+                    duplicate_index.index_job(job.get("user_id") or "anon", job_id)
+                except Exception as e:
+                    logger.warning(f"Duplicate index update failed: {e}")
+        else:
+            logger.warning("⚠️ No results to save!")
 
     
-    # Track invoice usage
-    if results and job.get("user_id"):
-        from database import increment_invoice_usage
-        increment_invoice_usage(job["user_id"], len(results))
+        # Track invoice usage
+        if results and job.get("user_id"):
+            quota.add(job["user_id"], INVOICES, len(results))
     
-    # Schedule cleanup of uploaded PDFs (nach 60 Minuten)
-    asyncio.create_task(cleanup_uploads(upload_path, delay_minutes=60))
+        # Erst jetzt abgeschlossen: Job und Rechnungen liegen in der DB
+        processing_jobs.update(job_id, {"status": JobStatus.COMPLETED.value})
+        log_job_event(app_logger, job_id, "completed", total=total_files, successful=len(results), failed=len(failed))
+        progress_hub.publish(
+            job_id, "completed", status=JobStatus.COMPLETED.value,
+            successful=len(results), failed=len(failed), processed=total_files, total=total_files, progress=100,
+        )
+    
+    await run_blocking(finish_job)
+    
+    # Uploads nach UPLOAD_RETENTION_MINUTES löschen (persistenter Retention-Index, übersteht Restarts)
+    await run_blocking(retention_index.schedule_path, upload_path,
+                       datetime.now() + timedelta(minutes=UPLOAD_RETENTION_MINUTES), tenant_id=job.get("user_id"))
+
+
+def _find_similar_invoices(invoices, user_id):
+    """Ähnlichkeitsprüfung über den Near-Duplicate-Index statt Scan der Historie."""
+    return [
+        (invoice_id, other_id, similarity, 'lsh')
+        for invoice_id, other_id, similarity in duplicate_index.match_and_add(user_id or "anon", invoices)
+    ]
+
+
+def _render_export(fmt: str):
+    def render(results):
+        return ExportManager().export_all(results, [fmt]).get(fmt)
+    return render
+
+
+def _render_datev(results):
+    from datev_exporter import export_to_datev
+    datev_config = (config.config.get('datev') if config else None) or {
+        'sachkonto': '4900', 'gegenkonto': '1200', 'waehrung': 'EUR'
+    }
+    return export_to_datev(results, datev_config)
+
+
+export_artifacts = ExportArtifactStore({
+    "xlsx": _render_export("xlsx"),
+    "csv": _render_export("csv"),
+    "datev": _render_datev,
+})
+
+
+def build_post_processor() -> JobPostProcessor:
+    from database import get_invoices_by_job, get_duplicates_for_job
+    return JobPostProcessor(
+        load_invoices=get_invoices_by_job,
+        hash_duplicates=get_duplicates_for_job,
+        find_similar=_find_similar_invoices,
+        predict_category=predict_category,
+        # Duplikat-Paare und Kategorien in einer Transaktion
+        write=PostProcessingWriter(db_pool.db_path),
+    )
+
+
 @app.get("/api/status/{job_id}", response_model=JobStatusResponse, tags=["Jobs"])
 async def get_status(job_id: str):
     """Get processing status"""
-    if job_id not in processing_jobs:
+    job = await run_blocking(processing_jobs.get, job_id)
+    if not job:
         raise JobNotFoundError(job_id)
     
-    job = processing_jobs[job_id]
-    
     return {
         "job_id": job_id,
         "status": job["status"],
@@ -585,14 +687,53 @@ async def get_status(job_id: str):
     }
 
 
+@app.get("/api/status/{job_id}/events", tags=["Jobs"])
+async def stream_status(job_id: str, request: Request):
+    """Job-Fortschritt als Server-Sent Events (Fallback, wenn kein WebSocket möglich ist)"""
+    from fastapi.responses import StreamingResponse
+    
+    job = await asyncio.to_thread(processing_jobs.get, job_id)
+    if not job:
+        raise JobNotFoundError(job_id)
+    subscription = progress_hub.subscribe(job_id)
+    
+    async def events():
+        try:
+            snapshot = job_snapshot(job_id, job)
+            yield sse_format(snapshot)
+            if is_terminal(snapshot):
+                return
+            while not await request.is_disconnected():
+                message = await subscription.get(timeout=15)
+                if message is None:
+                    # Kein Update: Abbruch ohne Event (z.B. Worker-Crash) über den Job-Store erkennen
+                    current = await asyncio.to_thread(processing_jobs.get, job_id)
+                    snapshot = job_snapshot(job_id, current or {"status": "failed"})
+                    if is_terminal(snapshot):
+                        yield sse_format(snapshot)
+                        return
+                    yield ": keep-alive\n\n"
+                    continue
+                yield sse_format(message)
+                if is_terminal(message):
+                    return
+        finally:
+            progress_hub.unsubscribe(subscription)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.get("/api/results/{job_id}", tags=["Jobs"])
 async def get_results(job_id: str):
     """Get processing results"""
-    if job_id not in processing_jobs:
+    job = await run_blocking(processing_jobs.get, job_id)
+    if not job:
         raise JobNotFoundError(job_id)
     
-    job = processing_jobs[job_id]
-    
     if job["status"] != "completed":
         return {
             "job_id": job_id,
@@ -615,11 +756,10 @@ async def download_export(job_id: str, format: str, request: Request):
     """Download exported file"""
     from database import get_job
     
-    # Try RAM first, then DB
-    if job_id in processing_jobs:
-        job = processing_jobs[job_id]
-    else:
-        job = get_job(job_id)
+    # Try job store first, then DB
+    job = await run_blocking(processing_jobs.get, job_id)
+    if not job:
+        job = await run_blocking(get_job, job_id)
         if not job:
             raise JobNotFoundError(job_id)
     
@@ -631,9 +771,30 @@ async def download_export(job_id: str, format: str, request: Request):
     if format not in exported_files:
         raise HTTPException(status_code=404, detail=f"Format {format} not found")
     
+    # Export beim ersten Abruf erzeugen und als Artefakt cachen (gleichzeitige Abrufe warten auf einen Build)
+    results = job.get("results") or await asyncio.to_thread(get_invoices_by_job, job_id)
+    if results and format in export_artifacts.renderers:
+        try:
+            artifact = await asyncio.to_thread(export_artifacts.get_or_build, job_id, format, results)
+        except Exception as e:
+            app_logger.error(f"Export error ({format}) for {job_id}: {e}")
+            raise HTTPException(status_code=500, detail="Export fehlgeschlagen")
+        
+        headers = {"ETag": artifact.etag, "Cache-Control": "private, no-cache"}
+        if artifact.etag in request.headers.get("if-none-match", ""):
+            return Response(status_code=304, headers=headers)
+        # FileResponse beantwortet Range-Requests selbst
+        return FileResponse(
+            artifact.path,
+            media_type='application/octet-stream',
+            filename=f"{format}_export_{job_id[:8]}{artifact.path.suffix}",
+            headers=headers,
+        )
+    
+    # Ältere Jobs: beim Abschluss erzeugte Datei (Download-URLs ohne Renderer sind keine Datei)
     file_path = exported_files[format]
     
-    if not Path(file_path).exists():
+    if is_download_url(file_path) or not Path(file_path).exists():
         raise HTTPException(status_code=404, detail="File not found")
     
     return FileResponse(
@@ -648,12 +809,11 @@ async def results_page(request: Request, job_id: str):
     """Results page - with DB fallback"""
     from database import get_job
     
-    # Try RAM first (for active jobs)
-    if job_id in processing_jobs:
-        job = processing_jobs[job_id]
-    else:
+    # Try job store first (for active jobs)
+    job = await run_blocking(processing_jobs.get, job_id)
+    if not job:
         # Fallback to DB (for completed jobs)
-        job = get_job(job_id)
+        job = await run_blocking(get_job, job_id)
         if not job:
             raise JobNotFoundError(job_id)
     
@@ -677,7 +837,8 @@ def _get_backup_info():
         return {"error": "Backup-Modul nicht verfügbar"}
 
 @app.get("/health", tags=["System"])
-async def health_check(request: Request):
+@offload_route
+def health_check(request: Request):
     """
     Health check endpoint mit HTML-Dashboard für Browser
     und JSON für Monitoring / Uptime-Checks.
@@ -706,6 +867,22 @@ async def health_check(request: Request):
         "version": "1.0.0",
         "database": db_status,
         "jobs_in_memory": len(processing_jobs),
+        "job_queue": processing_jobs.queue_stats(),
+        "job_worker": job_worker.stats(),
+        "extraction": extraction_scheduler.stats(),
+        "duplicate_index": duplicate_index.stats(),
+        "parse_pool": parse_pool.stats(),
+        "progress_events": progress_hub.stats(),
+        "export_artifacts": export_artifacts.stats(),
+        "retention": retention_index.stats(),
+        "db_pool": db_pool.stats(),
+        "blocking_io": pool_stats(),
+        "event_loop": loop_monitor.stats(),
+        "query_indexes": query_indexes.stats(),
+        "rate_limiter": rate_limiter.stats(),
+        "quota": quota.stats(),
+        "identity_cache": identities.stats(),
+        "api_key_cache": api_key_cache.stats(),
         "uptime_hours": uptime_hours,
         "backup": backup_info,
     }
@@ -731,7 +908,8 @@ async def health_check(request: Request):
 
 
 @app.get("/api/health", tags=["System"])
-async def health_check_json():
+@offload_route
+def health_check_json():
     """Health check - JSON only (für Monitoring/Tests)"""
     import time
     from database import get_connection
@@ -752,6 +930,12 @@ async def health_check_json():
         "version": "1.0.0",
         "database": db_status,
         "jobs_in_memory": len(processing_jobs),
+        "job_queue": processing_jobs.queue_stats(),
+        "extraction": extraction_scheduler.stats(),
+        "duplicate_index": duplicate_index.stats(),
+        "parse_pool": parse_pool.stats(),
+        "progress_events": progress_hub.stats(),
+        "export_artifacts": export_artifacts.stats(),
         "uptime_hours": uptime_hours,
         "backup": _get_backup_info()
     }
@@ -759,7 +943,7 @@ async def health_check_json():
 @app.get("/api/system/status", tags=["System"])
 async def system_status():
     """Detaillierter System-Status mit Alerts"""
-    return get_system_status()
+    return await run_blocking(get_system_status)
 
 @app.post("/api/system/check", tags=["System"])
 async def trigger_system_check(request: Request):
@@ -767,7 +951,10 @@ async def trigger_system_check(request: Request):
     if "user_id" not in request.session:
         return JSONResponse({"error": "Not authenticated"}, status_code=401)
     
-    alerts = run_system_check()
+    alerts = await run_blocking(run_system_check)
+    if alerts:
+        # An alle Worker verteilen – Admin-Clients hängen evtl. an einem anderen Prozess
+        progress_hub.broadcast_alert({"alerts": alerts, "count": len(alerts)})
     return {"alerts": alerts, "count": len(alerts)}
 @app.post("/api/send-email/{job_id}", tags=["Notifications"])
 async def send_email_route(job_id: str, request: Request):
@@ -779,11 +966,10 @@ async def send_email_route(job_id: str, request: Request):
         if not emails:
             return {"success": False, "error": "Keine Email-Adressen angegeben"}
         
-        if job_id not in processing_jobs:
+        job = await run_blocking(processing_jobs.get, job_id)
+        if not job:
             return {"success": False, "error": "Job nicht gefunden"}
         
-        job = processing_jobs[job_id]
-        
         if job["status"] != "completed":
             return {"success": False, "error": "Verarbeitung noch nicht abgeschlossen"}
         
@@ -792,13 +978,17 @@ async def send_email_route(job_id: str, request: Request):
         stats = job.get("stats")
         exported_files = job.get("exported_files", {})
         
+        # Anhänge: exported_files enthält Download-URLs – Artefakte bauen und deren Pfade anhängen
+        results = job.get("results") or await run_blocking(get_invoices_by_job, job_id)
+        attachments = await run_blocking(export_artifacts.attachments, job_id, exported_files, results)
+        
         # Temporäre Email-Config mit Custom-Empfängern
         email_config = config.config.copy()
         email_config['notifications']['email']['to_addresses'] = emails
         
         # Sende Email
         from notifications import send_notifications, check_low_confidence
-        result = send_notifications(email_config, stats, exported_files)
+        result = await run_blocking(send_notifications, email_config, stats, attachments)
         
         if result.get('email'):
             return {"success": True}
@@ -809,18 +999,47 @@ async def send_email_route(job_id: str, request: Request):
         print(f"Email error: {e}")
         return {"success": False, "error": str(e)}
 
-async def cleanup_uploads(upload_path: Path, delay_minutes: int = 60):
-    """
-    Löscht Upload-Ordner nach X Minuten (DSGVO-Compliance)
-    """
-    await asyncio.sleep(delay_minutes * 60)  # Warte X Minuten
-    
+async def run_processing_job(job_id: str):
+    """Job-Handler für den Queue-Worker; meldet Abbrüche an WebSocket/SSE-Clients."""
     try:
-        if upload_path.exists():
-            shutil.rmtree(upload_path)
-            print(f"🗑️  Auto-Cleanup: {upload_path} gelöscht (nach {delay_minutes} Min)")
+        job = await run_blocking(processing_jobs.get, job_id) or {}
+        if job.get("type") == "datev_export":
+            await run_datev_export_job(job_id)
+        else:
+            await process_invoices_background(job_id)
     except Exception as e:
-        print(f"⚠️  Cleanup-Fehler: {e}")
+        progress_hub.publish(job_id, "failed", status="failed", error=str(e))
+        raise
+
+
+job_worker = JobQueueWorker(processing_jobs, run_processing_job)
+retention_sweeper = RetentionSweeper(retention_index, hooks=[export_artifacts.prune, processing_jobs.prune])
+
+
+def _load_invoice_limit(user_id: str) -> dict:
+    from database import check_invoice_limit
+    return check_invoice_limit(int(user_id))
+
+
+def _record_invoice_usage(user_id: str, count: int):
+    from database import increment_invoice_usage
+    increment_invoice_usage(int(user_id), count)
+    # Nutzungsanzeige (Produktzugang) neu laden
+    identities.invalidate(int(user_id))
+
+
+# Rechnungs-Kontingent gehört database.py – der Quota-Service cached den Status
+quota.register_external(INVOICES, _load_invoice_limit, _record_invoice_usage)
+
+
+def ensure_query_indexes():
+    conn = get_db()
+    try:
+        query_indexes.ensure_indexes(conn)
+    except sqlite3.Error as e:
+        logger.warning(f"Query indexes not ensured: {e}")
+    finally:
+        conn.close()
 
 
 @app.on_event("startup")
@@ -828,6 +1047,30 @@ async def startup_event():
     """Start background tasks on server startup"""
     from email_scheduler import email_scheduler
     email_scheduler.start()
+    # Job-Worker: holt Jobs aus der gemeinsamen Queue (auch nach Restart/Deploy)
+    asyncio.create_task(job_worker.run())
+    # Composite-Indizes für die heißen Dashboard/Audit/Zahlungen-Queries
+    await asyncio.to_thread(ensure_query_indexes)
+    # Retention: Uploads aus der Zeit vor dem Index übernehmen, dann ein Sweeper pro Worker
+    await asyncio.to_thread(retention_index.adopt_orphans, UPLOAD_DIR, UPLOAD_MAX_RETENTION_HOURS * 3600)
+    asyncio.create_task(retention_sweeper.run())
+    # Event-Loop-Lag messen, blockierende Aufrufe per Watchdog erfassen
+    if LOOP_MONITOR_ENABLED:
+        loop_monitor.start()
+    # Widerrufene API-Keys anderer Worker sofort aus dem Cache entfernen
+    api_key_cache.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    job_worker.stop()
+    retention_sweeper.stop()
+    loop_monitor.stop()
+    quota.stop()
+    api_key_cache.stop()
+    parse_pool.shutdown(wait=False)
+    shutdown_pool(wait=False)
+    progress_hub.shutdown()
 
 
 
@@ -853,30 +1096,10 @@ def get_user_initials(user_info):
 
 
 def get_user_info(user_id):
-    """Holt User-Informationen aus der Datenbank"""
+    """User-Informationen für Templates (aus dem Identity-Cache)"""
     if not user_id:
         return {"id": 0, "email": "", "name": "User", "is_admin": False, "plan": "Free"}
-    
-    try:
-        conn = sqlite3.connect("invoices.db", check_same_thread=False)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, email, name, is_admin FROM users WHERE id = ?", (user_id,))
-        row = cursor.fetchone()
-        conn.close()
-        
-        if row:
-            return {
-                "id": row["id"],
-                "email": row["email"] or "",
-                "name": row["name"] or "",
-                "is_admin": bool(row["is_admin"]),
-                "plan": "Enterprise" if row["is_admin"] else "Free"
-            }
-    except Exception as e:
-        print(f"Error getting user info: {e}")
-    
-    return {"id": user_id, "email": "", "name": "User", "is_admin": False, "plan": "Free"}
+    return identities.get(user_id).user_info()
 
 
 def require_login(request: Request):
@@ -909,22 +1132,15 @@ def require_login(request: Request):
 def require_admin(request: Request):
     """Prüft ob User Admin ist. Gibt None wenn OK, sonst Redirect/Error."""
     from fastapi.responses import FileResponse, RedirectResponse
-    from database import get_connection
     
     # Erst Login prüfen
     login_check = require_login(request)
     if login_check:
         return login_check
     
-    # Admin-Status prüfen
-    user_id = request.session.get("user_id")
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT is_admin FROM users WHERE id = ?", (user_id,))
-    row = cursor.fetchone()
-    conn.close()
-    
-    if not row or not row[0]:
+    # Admin-Status prüfen (einmal pro Request geladen)
+    identity = identity_for(request)
+    if identity is None or not identity.is_admin:
         # Nicht Admin - zurück zur History mit Fehlermeldung
         return RedirectResponse(url="/history?error=admin_required", status_code=303)
     
@@ -932,13 +1148,8 @@ def require_admin(request: Request):
 
 def is_admin_user(user_id: int) -> bool:
     """Hilfsfunktion: Prüft ob User Admin ist."""
-    from database import get_connection
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT is_admin FROM users WHERE id = ?", (user_id,))
-    row = cursor.fetchone()
-    conn.close()
-    return bool(row and row[0])
+    identity = identities.get(user_id)
+    return bool(identity and identity.is_admin)
 
     if not user_id:
         from fastapi.responses import FileResponse, RedirectResponse
@@ -950,7 +1161,8 @@ def is_admin_user(user_id: int) -> bool:
 
 
 @app.get("/mbr/monthly.pptx")
-async def download_monthly_mbr(request: Request, year: int = None, month: int = None):
+@offload_route
+def download_monthly_mbr(request: Request, year: int = None, month: int = None):
     """
     Enterprise Monthly Business Review (MBR) download.
     - Auth-guarded via session
@@ -994,7 +1206,7 @@ async def download_monthly_mbr(request: Request, year: int = None, month: int =
     try:
         from mbr.generator import generate_presentation
 
-        conn = sqlite3.connect("invoices.db", check_same_thread=False)
+        conn = get_db()
         pptx_bytes = generate_presentation(
             conn, 
             api_key=api_key, 
@@ -1035,7 +1247,8 @@ async def download_monthly_mbr(request: Request, year: int = None, month: int =
 
 
 @app.get("/dashboard", response_class=HTMLResponse)
-async def unified_dashboard(request: Request):
+@offload_route
+def unified_dashboard(request: Request):
     """Unified Dashboard für Multi-Product User"""
     redirect = require_login(request)
     if redirect:
@@ -1043,31 +1256,22 @@ async def unified_dashboard(request: Request):
     
     user_id = request.session["user_id"]
     
-    # User Info
-    from database import get_connection
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, email, name, is_admin FROM users WHERE id = ?", (user_id,))
-    user_row = cursor.fetchone()
+    # User Info + Product Subscriptions (Identity-Cache, einmal pro Request)
+    identity = identity_for(request)
     user = {
-        "id": user_row[0],
-        "email": user_row[1],
-        "name": user_row[2],
-        "is_admin": user_row[3]
+        "id": identity.user_id,
+        "email": identity.email,
+        "name": identity.name,
+        "is_admin": identity.is_admin
     }
-    
-    # Product Subscriptions
-    from multi_product_subscriptions import get_user_products, has_product_access
-    
-    invoice_access = has_product_access(user_id, "invoice")
-    contract_access = has_product_access(user_id, "contract")
+    invoice_access = identity.product_access("invoice")
+    contract_access = identity.product_access("contract")
     
     # Invoice Stats
-    cursor.execute("""
-        SELECT COUNT(*) FROM invoices i
-        JOIN jobs j ON i.job_id = j.job_id
-        WHERE j.user_id = ?
-    """, (user_id,))
+    from database import get_connection
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(query_indexes.USER_INVOICE_COUNT_SQL, (user_id,))
     total_invoices = cursor.fetchone()[0] or 0
     
     # Contract Stats (wenn Tabelle existiert)
@@ -1092,14 +1296,7 @@ async def unified_dashboard(request: Request):
     recent_activity = []
     conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute("""
-        SELECT i.rechnungsnummer, i.rechnungsaussteller, i.created_at 
-        FROM invoices i
-        JOIN jobs j ON i.job_id = j.job_id
-        WHERE j.user_id = ? 
-        ORDER BY i.created_at DESC 
-        LIMIT 5
-    """, (user_id,))
+    cursor.execute(query_indexes.USER_RECENT_INVOICES_SQL, (user_id,))
     for row in cursor.fetchall():
         recent_activity.append({
             "type": "invoice",
@@ -1136,7 +1333,8 @@ async def unified_dashboard(request: Request):
 
 
 @app.get("/history", response_class=HTMLResponse)
-async def history_page(request: Request):
+@offload_route
+def history_page(request: Request):
 
     redirect = require_login(request)
     if redirect:
@@ -1156,7 +1354,8 @@ async def history_page(request: Request):
     })
 
 @app.get("/job_old/{job_id}", response_class=HTMLResponse)
-async def job_details_page_old(request: Request, job_id: str):
+@offload_route
+def job_details_page_old(request: Request, job_id: str):
     # Detailed job view mit RAM + DB Fallback
     from database import (
         get_job,
@@ -1223,7 +1422,8 @@ async def job_details_page_old(request: Request, job_id: str):
 
 
 @app.get("/analytics", response_class=HTMLResponse)
-async def analytics_page(request: Request):
+@offload_route
+def analytics_page(request: Request):
     """Expense analytics dashboard"""
     redirect = require_login(request)
     if redirect:
@@ -1249,10 +1449,11 @@ async def analytics_page(request: Request):
     })
 
 @app.get("/admin", response_class=HTMLResponse, tags=["Admin"])
-async def admin_page(request: Request):
+@offload_route
+def admin_page(request: Request):
     # RBAC: Nur Admins
     user_id = request.session.get("user_id")
-    if not user_id or not is_admin_or_owner(user_id):
+    if not user_id or not identity_for(request).is_admin_or_owner():
         return RedirectResponse("/dashboard", status_code=303)
     """Admin Dashboard - nur für Admins"""
     admin_check = require_admin(request)
@@ -1276,10 +1477,10 @@ async def admin_page(request: Request):
     cursor.execute("SELECT COALESCE(SUM(betrag_brutto), 0) FROM invoices")
     total_amount = cursor.fetchone()[0]
     
-    cursor.execute("SELECT COUNT(*) FROM invoices WHERE DATE(created_at) = DATE('now')")
+    cursor.execute(query_indexes.INVOICES_TODAY_SQL)
     invoices_today = cursor.fetchone()[0]
     
-    cursor.execute("SELECT COUNT(*) FROM jobs WHERE DATE(created_at) = DATE('now')")
+    cursor.execute(query_indexes.JOBS_TODAY_SQL)
     jobs_today = cursor.fetchone()[0]
     
     conn.close()
@@ -1312,10 +1513,11 @@ async def admin_page(request: Request):
     })
 
 @app.get("/admin/users", response_class=HTMLResponse, tags=["Admin"])
-async def admin_users_page(request: Request):
+@offload_route
+def admin_users_page(request: Request):
     # RBAC: User-Verwaltung nur für Admins
     user_id = request.session.get("user_id")
-    if not user_id or not is_admin_or_owner(user_id):
+    if not user_id or not identity_for(request).is_admin_or_owner():
         return RedirectResponse("/dashboard", status_code=303)
     """User Management - nur für Admins"""
     admin_check = require_admin(request)
@@ -1352,13 +1554,18 @@ async def admin_users_page(request: Request):
 @app.post("/api/admin/users", tags=["Admin"])
 async def create_user(request: Request):
     """Neuen User anlegen"""
+    body = await request.body()
+    return await run_blocking(_create_user_sync, request, body)
+
+
+def _create_user_sync(request: Request, body: bytes):
     if "user_id" not in request.session:
         return JSONResponse({"error": "Not authenticated"}, status_code=401)
     
     from database import get_connection
     import hashlib
     
-    data = await request.json()
+    data = json.loads(body)
     password_hash = hashlib.sha256(data["password"].encode()).hexdigest()
     
     conn = get_connection()
@@ -1373,11 +1580,16 @@ async def create_user(request: Request):
 @app.put("/api/admin/users/{user_id}", tags=["Admin"])
 async def update_user_admin(user_id: int, request: Request):
     """User bearbeiten"""
+    body = await request.body()
+    return await run_blocking(_update_user_admin_sync, user_id, request, body)
+
+
+def _update_user_admin_sync(user_id: int, request: Request, body: bytes):
     if "user_id" not in request.session:
         return JSONResponse({"error": "Not authenticated"}, status_code=401)
     
     from database import get_connection
-    data = await request.json()
+    data = json.loads(body)
     
     conn = get_connection()
     cursor = conn.cursor()
@@ -1385,29 +1597,53 @@ async def update_user_admin(user_id: int, request: Request):
         (data.get("name"), data["email"], user_id))
     conn.commit()
     conn.close()
+    identities.invalidate(user_id)
     
     return {"success": True}
 
 @app.post("/api/admin/users/{user_id}/toggle", tags=["Admin"])
 async def toggle_user_status(user_id: int, request: Request):
     """User aktivieren/deaktivieren"""
+    body = await request.body()
+    return await run_blocking(_toggle_user_status_sync, user_id, request, body)
+
+
+def _toggle_user_status_sync(user_id: int, request: Request, body: bytes):
     if "user_id" not in request.session:
         return JSONResponse({"error": "Not authenticated"}, status_code=401)
     
     from database import get_connection
-    data = await request.json()
+    data = json.loads(body)
     
     conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("UPDATE users SET is_active = ? WHERE id = ?", (data["is_active"], user_id))
     conn.commit()
     conn.close()
+    identities.invalidate(user_id)
+    # Gecachte API-Keys des Users neu prüfen lassen
+    api_key_cache.revoke(user_id=user_id)
     
     return {"success": True}
 
 
+@app.get("/api/admin/loop-stalls", tags=["Admin"])
+@offload_route
+def loop_stalls(request: Request, limit: int = 20, reset: bool = False):
+    """Event-Loop-Blockaden dieses Workers nach Route und Aufrufstelle (nur Admin)"""
+    admin_check = require_admin(request)
+    if admin_check:
+        return admin_check
+    
+    report = loop_monitor.report(limit=limit)
+    if reset:
+        loop_monitor.reset()
+    return report
+
+
 @app.get("/exports", response_class=HTMLResponse, tags=["Export"])
-async def export_history_page(request: Request):
+@offload_route
+def export_history_page(request: Request):
     """Export-Historie anzeigen"""
     if "user_id" not in request.session:
         return RedirectResponse(url="/login?next=/exports", status_code=303)
@@ -1431,7 +1667,7 @@ async def get_invoice(invoice_id: int):
     """Get single invoice for editing"""
     from database import get_invoice_by_id
     
-    invoice = get_invoice_by_id(invoice_id)
+    invoice = await run_blocking(get_invoice_by_id, invoice_id)
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found")
     
@@ -1443,7 +1679,7 @@ async def update_invoice_endpoint(invoice_id: int, request: Request):
     from database import get_invoice_by_id, update_invoice, save_correction
     
     # Get current invoice
-    current = get_invoice_by_id(invoice_id)
+    current = await run_blocking(get_invoice_by_id, invoice_id)
     if not current:
         raise HTTPException(status_code=404, detail="Invoice not found")
     
@@ -1455,10 +1691,10 @@ async def update_invoice_endpoint(invoice_id: int, request: Request):
     for field, new_value in updates.items():
         old_value = current.get(field, '')
         if str(old_value) != str(new_value):
-            save_correction(invoice_id, supplier, field, str(old_value), str(new_value))
+            await run_blocking(save_correction, invoice_id, supplier, field, str(old_value), str(new_value))
     
     # Update invoice
-    update_invoice(invoice_id, updates)
+    await run_blocking(update_invoice, invoice_id, updates)
     
     return {"success": True, "message": "Invoice updated and corrections saved for learning"}
 
@@ -1469,7 +1705,7 @@ async def get_supplier_patterns_endpoint(supplier: str):
     from urllib.parse import unquote
     
     supplier = unquote(supplier)
-    patterns = get_supplier_patterns(supplier)
+    patterns = await run_blocking(get_supplier_patterns, supplier)
     
     return patterns
 
@@ -1478,7 +1714,7 @@ async def get_invoice(invoice_id: int):
     """Get single invoice for editing"""
     from database import get_invoice_by_id
     
-    invoice = get_invoice_by_id(invoice_id)
+    invoice = await run_blocking(get_invoice_by_id, invoice_id)
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found")
     
@@ -1490,7 +1726,7 @@ async def update_invoice_endpoint(invoice_id: int, request: Request):
     from database import get_invoice_by_id, update_invoice, save_correction
     
     # Get current invoice
-    current = get_invoice_by_id(invoice_id)
+    current = await run_blocking(get_invoice_by_id, invoice_id)
     if not current:
         raise HTTPException(status_code=404, detail="Invoice not found")
     
@@ -1502,10 +1738,10 @@ async def update_invoice_endpoint(invoice_id: int, request: Request):
     for field, new_value in updates.items():
         old_value = current.get(field, '')
         if str(old_value) != str(new_value):
-            save_correction(invoice_id, supplier, field, str(old_value), str(new_value))
+            await run_blocking(save_correction, invoice_id, supplier, field, str(old_value), str(new_value))
     
     # Update invoice
-    update_invoice(invoice_id, updates)
+    await run_blocking(update_invoice, invoice_id, updates)
     
     return {"success": True, "message": "Invoice updated and corrections saved for learning"}
 
@@ -1516,7 +1752,7 @@ async def get_supplier_patterns_endpoint(supplier: str):
     from urllib.parse import unquote
     
     supplier = unquote(supplier)
-    patterns = get_supplier_patterns(supplier)
+    patterns = await run_blocking(get_supplier_patterns, supplier)
     
     return patterns
 
@@ -1531,7 +1767,7 @@ async def email_config_page(request: Request):
     """Email inbox configuration page"""
     from database import get_email_config
     
-    config = get_email_config()
+    config = await run_blocking(get_email_config)
     
     return templates.TemplateResponse("email_config.html", {
         "request": request,
@@ -1545,7 +1781,7 @@ async def save_email_config_endpoint(request: Request):
     
     try:
         config = await request.json()
-        save_email_config(config)
+        await run_blocking(save_email_config, config)
         return {"success": True}
     except Exception as e:
         return {"success": False, "error": str(e)}
@@ -1589,7 +1825,18 @@ async def websocket_endpoint(websocket: WebSocket, job_id: str):
     """WebSocket endpoint for real-time job updates"""
     await websocket.accept()
     await manager.connect(websocket, job_id)
+    subscription = progress_hub.subscribe(job_id)
+    
+    async def push_updates():
+        # Aktueller Stand sofort, danach gebündelte Progress-Events
+        job = await asyncio.to_thread(processing_jobs.get, job_id)
+        if job:
+            await websocket.send_text(json.dumps(job_snapshot(job_id, job), default=str))
+        while True:
+            message = await subscription.get()
+            await websocket.send_text(json.dumps(message, ensure_ascii=False, default=str))
     
+    sender = asyncio.create_task(push_updates())
     try:
         while True:
             # Keep connection alive
@@ -1601,6 +1848,38 @@ async def websocket_endpoint(websocket: WebSocket, job_id: str):
     except Exception as e:
         logger.error(f"WebSocket error: {e}")
         manager.disconnect(websocket, job_id)
+    finally:
+        sender.cancel()
+        progress_hub.unsubscribe(subscription)
+
+@app.websocket("/ws/system/alerts")
+async def alerts_websocket(websocket: WebSocket):
+    """WebSocket für System-Alerts (von jedem Worker über den Event-Backplane) – nur für Admins"""
+    user_id = websocket.session.get("user_id") if "session" in websocket.scope else None
+    identity = await run_blocking(identities.get, user_id) if user_id else None
+    if identity is None or not identity.is_admin:
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    subscription = progress_hub.subscribe_alerts()
+    
+    async def push_alerts():
+        while True:
+            message = await subscription.get()
+            await websocket.send_text(json.dumps(message, ensure_ascii=False, default=str))
+    
+    sender = asyncio.create_task(push_alerts())
+    try:
+        while True:
+            await websocket.receive_text()
+            await websocket.send_text(json.dumps({"type": "pong"}))
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.error(f"WebSocket error: {e}")
+    finally:
+        sender.cancel()
+        progress_hub.unsubscribe(subscription)
 
 # Session Management
 from starlette.middleware.sessions import SessionMiddleware
@@ -1657,48 +1936,22 @@ def require_login(request: Request):
 
 def get_demo_usage(ip_address: str) -> dict:
     """Prüft Demo-Nutzung für eine IP-Adresse. Max 3 pro Tag."""
-    import sqlite3
-    conn = sqlite3.connect('invoices.db', check_same_thread=False)
-    cursor = conn.cursor()
-    
-    # Erstelle Tabelle falls nicht existiert
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS demo_usage (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            ip_address TEXT NOT NULL,
-            used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            filename TEXT
-        )
-    """)
-    conn.commit()
-    
-    # Zähle Nutzungen heute
-    today = datetime.now().strftime('%Y-%m-%d')
-    cursor.execute("""
-        SELECT COUNT(*) FROM demo_usage 
-        WHERE ip_address = ? AND DATE(used_at) = ?
-    """, (ip_address, today))
-    
-    count = cursor.fetchone()[0]
-    conn.close()
-    
+    status = quota.status(ip_address, DEMO_UPLOAD)
     return {
-        "used_today": count,
-        "limit": 3,
-        "remaining": max(0, 3 - count),
-        "allowed": count < 3
+        "used_today": status.used,
+        "limit": status.limit,
+        "remaining": status.remaining,
+        "allowed": status.allowed
     }
 
 def record_demo_usage(ip_address: str, filename: str):
-    """Zeichnet Demo-Nutzung auf."""
-    import sqlite3
-    conn = sqlite3.connect('invoices.db', check_same_thread=False)
-    cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO demo_usage (ip_address, filename) VALUES (?, ?)
-    """, (ip_address, filename))
-    conn.commit()
-    conn.close()
+    """Zeichnet den Dateinamen als Log auf (gezählt wird vorab per quota.consume, Tabelle legt der Quota-Service an)."""
+    conn = db_pool.connect()
+    try:
+        conn.execute("INSERT INTO demo_usage (ip_address, filename) VALUES (?, ?)", (ip_address, filename))
+        conn.commit()
+    finally:
+        conn.close()
 
 
 @app.post("/api/demo/upload")
@@ -1720,25 +1973,10 @@ async def demo_upload_live(request: Request, file: UploadFile = File(...)):
     user_id = None
     if "user_id" in request.session:
         user_id = request.session["user_id"]
-        user = get_user_by_id(user_id)
+        user = await run_blocking(get_user_by_id, user_id)
         if user and user.get("is_admin"):
             is_admin = True
     
-    # Rate-Limit prüfen (nur für Nicht-Admins)
-    usage = get_demo_usage(ip_address)
-    if not usage["allowed"] and not is_admin:
-        return JSONResponse(
-            status_code=429,
-            content={
-                "error": "Demo-Limit erreicht",
-                "message": f"Sie haben heute bereits {usage['limit']} Demo-Rechnungen verarbeitet. Registrieren Sie sich für unbegrenzten Zugang!",
-                "used": usage["used_today"],
-                "limit": usage["limit"],
-                "cta_url": "/register",
-                "cta_text": "Kostenlos registrieren"
-            }
-        )
-    
     # Nur PDFs erlauben
     if not file.filename.lower().endswith(".pdf"):
         return JSONResponse(
@@ -1746,43 +1984,79 @@ async def demo_upload_live(request: Request, file: UploadFile = File(...)):
             content={"error": "Nur PDF-Dateien erlaubt"}
         )
     
-    # Größenlimit: 10 MB für Demo
-    file_content = await file.read()
-    if len(file_content) > 10 * 1024 * 1024:
+    # Rate-Limit prüfen und zählen in einem Schritt (nur für Nicht-Admins) –
+    # parallele Uploads derselben IP können das Limit so nicht überschreiten;
+    # schlägt die Verarbeitung fehl, wird der Versuch zurückgegeben
+    usage = None
+    if not is_admin:
+        usage = await run_blocking(quota.consume, ip_address, DEMO_UPLOAD)
+        if not usage.allowed:
+            return JSONResponse(
+                status_code=429,
+                content={
+                    "error": "Demo-Limit erreicht",
+                    "message": f"Sie haben heute bereits {usage.limit} Demo-Rechnungen verarbeitet. Registrieren Sie sich für unbegrenzten Zugang!",
+                    "used": usage.used,
+                    "limit": usage.limit,
+                    "cta_url": "/register",
+                    "cta_text": "Kostenlos registrieren"
+                }
+            )
+    
+    # Erstelle Demo-Job ID
+    demo_job_id = f"demo-{str(uuid.uuid4())[:8]}"
+    
+    # Upload-Verzeichnis für Demo-Job
+    demo_upload_path = UPLOAD_DIR / demo_job_id
+    demo_upload_path.mkdir(exist_ok=True)
+    await run_blocking(retention_index.schedule_path, demo_upload_path,
+                       datetime.now() + timedelta(minutes=UPLOAD_RETENTION_MINUTES))
+    
+    # Speichere Datei (gestreamt, Größenlimit: 10 MB für Demo)
+    try:
+        stored = await stream_upload_to_disk(file, demo_upload_path, 10 * 1024 * 1024)
+    except UploadRejected as e:
+        shutil.rmtree(demo_upload_path, ignore_errors=True)
+        if usage is not None:
+            await run_blocking(quota.refund, ip_address, DEMO_UPLOAD)
+        message = "Datei zu groß. Maximum: 10 MB" if e.reason == "too_large" else "Nur PDF-Dateien erlaubt"
         return JSONResponse(
             status_code=400,
-            content={"error": "Datei zu groß. Maximum: 10 MB"}
+            content={"error": message}
         )
+    except Exception:
+        shutil.rmtree(demo_upload_path, ignore_errors=True)
+        if usage is not None:
+            await run_blocking(quota.refund, ip_address, DEMO_UPLOAD)
+        raise
+    pdf_path = stored.path
     
     try:
-        # Erstelle Demo-Job ID
-        demo_job_id = f"demo-{str(uuid.uuid4())[:8]}"
-        
-        # Upload-Verzeichnis für Demo-Job
-        demo_upload_path = UPLOAD_DIR / demo_job_id
-        demo_upload_path.mkdir(exist_ok=True)
-        
-        # Speichere Datei
-        pdf_path = demo_upload_path / file.filename
-        with open(pdf_path, "wb") as f:
-            f.write(file_content)
         
         # ═══════════════════════════════════════════════════════════════
         # ENTERPRISE-STANDARD: Identischer Prozess wie normaler Upload
         # ═══════════════════════════════════════════════════════════════
         
-        # 1. KI-Verarbeitung (E-Rechnung oder GPT)
-        is_einv, einv_data = parse_einvoice(str(pdf_path))
+        # 1. KI-Verarbeitung (E-Rechnung oder GPT) – Demo-Dateien kommen oft mehrfach
+        def extract_demo_pdf():
+            is_einv, einv_data, _ = parse_einvoice_file(pdf_path)
+            
+            if is_einv and einv_data.get('rechnungsnummer') and einv_data.get('betrag_brutto'):
+                data = einv_data
+                data['extraction_method'] = 'einvoice'
+                data['confidence'] = 99
+            else:
+                data = processor.process_invoice(pdf_path)
+                data['extraction_method'] = 'ki'
+                if 'confidence' not in data:
+                    data['confidence'] = data.get('ki_score', 85)
+            return data
         
-        if is_einv and einv_data.get('rechnungsnummer') and einv_data.get('betrag_brutto'):
-            data = einv_data
-            data['extraction_method'] = 'einvoice'
-            data['confidence'] = 99
-        else:
-            data = processor.process_invoice(pdf_path)
-            data['extraction_method'] = 'ki'
-            if 'confidence' not in data:
-                data['confidence'] = data.get('ki_score', 85)
+        # Extraktion (PDF-Parsing, KI-Aufruf) läuft im Threadpool, nicht auf dem Event-Loop
+        data, _ = await run_blocking(
+            extraction_cache.get_or_extract,
+            user_id or "demo", pdf_path, extract_demo_pdf, content_hash=stored.sha256
+        )
         
         data['filename'] = file.filename
         
@@ -1800,20 +2074,8 @@ async def demo_upload_live(request: Request, file: UploadFile = File(...)):
             'average_brutto': total_brutto
         }
         
-        # 3. Exports erstellen
-        exported_files = {}
-        try:
-            manager = ExportManager()
-            exported_files = manager.export_all(results, ['xlsx', 'csv'])
-            
-            # DATEV Export
-            from datev_exporter import export_to_datev
-            datev_config = {'sachkonto': '4900', 'gegenkonto': '1200', 'waehrung': 'EUR'}
-            datev_path = export_to_datev(results, datev_config)
-            if datev_path:
-                exported_files['datev'] = datev_path
-        except Exception as e:
-            app_logger.warning(f"Export creation failed: {e}")
+        # 3. Exports werden erst beim Download erzeugt
+        exported_files = {fmt: download_url(demo_job_id, fmt) for fmt in ('xlsx', 'csv', 'datev')}
         
         # 4. Job-Daten vorbereiten
         job_data = {
@@ -1833,32 +2095,40 @@ async def demo_upload_live(request: Request, file: UploadFile = File(...)):
         }
         
         # 5. ENTERPRISE: Job in Datenbank speichern
-        save_job(demo_job_id, job_data, user_id)
+        await run_blocking(save_job, demo_job_id, job_data, user_id)
         app_logger.info(f"✅ Demo job saved: {demo_job_id}")
         
         # 6. ENTERPRISE: Rechnungen in Datenbank speichern
-        save_invoices(demo_job_id, results)
+        await run_blocking(save_invoices, demo_job_id, results)
         app_logger.info(f"✅ Demo invoices saved for job: {demo_job_id}")
         
-        # 7. ENTERPRISE: Auto-Kategorisierung (wie normaler Upload)
+        # Demo-Rechnungen laufen nicht durch das Job-Post-Processing: direkt indexieren
         try:
+            await run_blocking(duplicate_index.index_job, user_id or "anon", demo_job_id)
+        except Exception as e:
+            app_logger.warning(f"Demo duplicate index update failed: {e}")
+        
+        # 7. ENTERPRISE: Auto-Kategorisierung (wie normaler Upload)
+        def categorize_demo_invoices():
             saved_invoices = get_invoices_by_job(demo_job_id)
             for invoice in saved_invoices:
                 category_id, confidence, reasoning = predict_category(invoice, user_id)
                 assign_category_to_invoice(invoice['id'], category_id, confidence, 'ai')
                 app_logger.info(f"📊 Demo Invoice {invoice['id']}: Category {category_id} (conf: {confidence:.2f})")
+        
+        try:
+            await run_blocking(categorize_demo_invoices)
         except Exception as e:
             app_logger.warning(f"Demo auto-categorization failed: {e}")
         
-        # 8. Job auch in RAM speichern (für sofortige Anzeige)
-        processing_jobs[demo_job_id] = job_data
-        processing_jobs[demo_job_id]["results"] = results
+        # 8. Job auch im Job-Store speichern (für sofortige Anzeige)
+        await run_blocking(processing_jobs.create, demo_job_id, {**job_data, "results": results})
         
         # 9. Demo-Nutzung aufzeichnen
-        record_demo_usage(ip_address, file.filename)
+        await run_blocking(record_demo_usage, ip_address, file.filename)
         
-        # Verbleibende Demo-Nutzungen
-        remaining = usage["remaining"] - 1 if not is_admin else 999
+        # Verbleibende Demo-Nutzungen (usage ist der Stand vor diesem Upload)
+        remaining = usage.remaining - 1 if usage is not None else 999
         
         return {
             "success": True,
@@ -1868,13 +2138,15 @@ async def demo_upload_live(request: Request, file: UploadFile = File(...)):
             "data": data,
             "usage": {
                 "remaining": remaining,
-                "limit": usage["limit"] if not is_admin else 999,
+                "limit": usage.limit if usage is not None else 999,
                 "message": f"Noch {remaining} Demo-Verarbeitungen heute verfügbar" if remaining < 999 else "Admin: Unbegrenzt"
             }
         }
         
     except Exception as e:
         app_logger.error(f"Demo processing error: {e}")
+        if usage is not None:
+            await run_blocking(quota.refund, ip_address, DEMO_UPLOAD)
         import traceback
         traceback.print_exc()
         return JSONResponse(
@@ -1884,7 +2156,8 @@ async def demo_upload_live(request: Request, file: UploadFile = File(...)):
 
 
 @app.get("/api/demo/status")
-async def demo_status(request: Request):
+@offload_route
+def demo_status(request: Request):
     """Prüft verbleibende Demo-Versuche für aktuelle IP."""
     ip_address = request.headers.get("X-Forwarded-For", request.client.host)
     if ip_address and "," in ip_address:
@@ -1965,7 +2238,7 @@ async def login_submit(request: Request):
 
     logger.info(f"LOGIN_DEBUG: POST /login email={email}, next={next_url}")
 
-    user = verify_user(email, password)
+    user = await run_blocking(verify_user, email, password)
 
     if not user:
         logger.info("LOGIN_DEBUG: ungültige Credentials")
@@ -2103,14 +2376,14 @@ async def register_submit(request: Request):
             "error": "Passwort muss mindestens eine Zahl enthalten"
         })
     
-    if email_exists(email):
+    if await run_blocking(email_exists, email):
         return templates.TemplateResponse("register.html", {
             "request": request,
             "error": "Email ist bereits registriert"
         })
     
     # Create user
-    user_id = create_user(email, password, name, company)
+    user_id = await run_blocking(create_user, email, password, name, company)
     
     # Webhook für neue Registrierung
     try:
@@ -2165,7 +2438,8 @@ async def logout(request: Request):
     return response
 
 @app.get("/api/user", tags=["Auth"])
-async def get_current_user(request: Request):
+@offload_route
+def get_current_user(request: Request):
     """Get current logged in user"""
     if 'user_id' in request.session:
         # Admin-Status prüfen
@@ -2187,7 +2461,7 @@ async def unified_settings_page(request: Request):
         return RedirectResponse(url='/login', status_code=303)
     
     from database import get_user_by_id
-    user = get_user_by_id(request.session['user_id'])
+    user = await run_blocking(get_user_by_id, request.session['user_id'])
     
     return templates.TemplateResponse("settings_unified.html", {
         "request": request,
@@ -2255,6 +2529,9 @@ async def delete_api_key(key_id: int, request: Request):
         return JSONResponse({"error": "Not authenticated"}, status_code=401)
     
     success = revoke_api_key(key_id, request.session["user_id"])
+    if success:
+        # Auf allen Workern sofort ungültig, nicht erst nach Ablauf der Cache-TTL
+        api_key_cache.revoke(key_id)
     return {"success": success}
 
 
@@ -2588,7 +2865,7 @@ async def export_job_sepa(job_id: str, request: Request):
     if not debtor.get("iban"):
         return JSONResponse({"error": "Absender-IBAN erforderlich"}, status_code=400)
     
-    invoices = get_invoices_by_job(job_id)
+    invoices = await run_blocking(get_invoices_by_job, job_id)
     if not invoices:
         return JSONResponse({"error": "Keine Rechnungen gefunden"}, status_code=404)
     
@@ -2598,7 +2875,7 @@ async def export_job_sepa(job_id: str, request: Request):
         return JSONResponse({"error": result.get("error"), "warnings": result.get("warnings", [])}, status_code=400)
     
     from database import log_export
-    log_export(request.session["user_id"], job_id, "sepa", f"sepa_{job_id[:8]}.xml", len(result["xml"]), result["count"], result["total"])
+    await run_blocking(log_export, request.session["user_id"], job_id, "sepa", f"sepa_{job_id[:8]}.xml", len(result["xml"]), result["count"], result["total"])
     
     return Response(
         content=result["xml"],
@@ -2776,7 +3053,8 @@ async def create_checkout_session(request: Request):
         return {"error": str(e)}
 
 @app.get("/checkout/success", response_class=HTMLResponse)
-async def checkout_success(request: Request, session_id: str = None):
+@offload_route
+def checkout_success(request: Request, session_id: str = None):
     """Handle successful checkout - Multi-Product Support"""
     from database import create_subscription
     from multi_product_subscriptions import create_product_subscription
@@ -2809,6 +3087,9 @@ async def checkout_success(request: Request, session_id: str = None):
                         stripe_customer_id=session.customer,
                         stripe_subscription_id=session.subscription
                     )
+                invalidate_user_plan(user_id)
+                quota.invalidate(INVOICES, user_id)
+                identities.invalidate(user_id)
                     
                 app_logger.info(f"✅ Checkout erfolgreich: User {user_id}, Product {product}, Plan {plan}")
                 
@@ -2816,7 +3097,7 @@ async def checkout_success(request: Request, session_id: str = None):
                 try:
                     from sendgrid_mailer import send_subscription_email
                     # User-Daten aus DB holen
-                    conn = get_db_connection()
+                    conn = get_db()
                     user_row = conn.execute("SELECT email, name FROM users WHERE id = ?", (user_id,)).fetchone()
                     conn.close()
                     
@@ -2920,12 +3201,12 @@ async def get_subscription_status(request: Request):
     if 'user_id' not in request.session:
         return {"error": "Not logged in"}
     
-    from database import check_invoice_limit
-    status = check_invoice_limit(request.session['user_id'])
-    return status
+    status = await run_blocking(quota.status, request.session['user_id'], INVOICES)
+    return status.info
 
 @app.post("/api/subscription/cancel")
-async def cancel_subscription(request: Request):
+@offload_route
+def cancel_subscription(request: Request):
     """Cancel user's subscription"""
     if 'user_id' not in request.session:
         return {"error": "Not logged in"}
@@ -2956,6 +3237,8 @@ async def cancel_subscription(request: Request):
         ''', (subscription['id'],))
         conn.commit()
         conn.close()
+        quota.invalidate(INVOICES, user_id)
+        identities.invalidate(user_id)
         
         return {"success": True, "message": "Abonnement wird zum Ende der Laufzeit gekündigt"}
     except Exception as e:
@@ -2966,6 +3249,10 @@ async def cancel_subscription(request: Request):
 async def stripe_webhook(request: Request):
     """Handle Stripe webhook events"""
     payload = await request.body()
+    return await run_blocking(_stripe_webhook_sync, request, payload)
+
+
+def _stripe_webhook_sync(request: Request, payload: bytes):
     sig_header = request.headers.get('stripe-signature')
     
     # Webhook secret (muss in Stripe Dashboard konfiguriert werden)
@@ -3007,6 +3294,8 @@ async def stripe_webhook(request: Request):
             ''', (subscription_id,))
             conn.commit()
             conn.close()
+            quota.invalidate(INVOICES)
+            identities.invalidate()
             print(f"Subscription renewed: {subscription_id}")
             
     elif event_type == 'invoice.payment_failed':
@@ -3023,6 +3312,8 @@ async def stripe_webhook(request: Request):
             ''', (subscription_id,))
             conn.commit()
             conn.close()
+            quota.invalidate(INVOICES)
+            identities.invalidate()
             print(f"Payment failed for: {subscription_id}, email: {customer_email}")
             
     elif event_type == 'customer.subscription.deleted':
@@ -3038,6 +3329,9 @@ async def stripe_webhook(request: Request):
             ''', (subscription_id,))
             conn.commit()
             conn.close()
+            invalidate_user_plan()
+            quota.invalidate(INVOICES)
+            identities.invalidate()
             print(f"Subscription cancelled: {subscription_id}")
             
     elif event_type == 'customer.subscription.updated':
@@ -3057,6 +3351,9 @@ async def stripe_webhook(request: Request):
             ''', (new_status, subscription_id,))
             conn.commit()
             conn.close()
+            invalidate_user_plan()
+            quota.invalidate(INVOICES)
+            identities.invalidate()
             print(f"Subscription updated: {subscription_id}, status: {new_status}")
     
     return {"received": True}
@@ -3226,7 +3523,7 @@ async def download_invoice(request: Request, subscription_id: int):
     
     from database import get_user_by_id_subscription, get_user_by_id
     
-    user = get_user_by_id(request.session['user_id'])
+    user = await run_blocking(get_user_by_id, request.session['user_id'])
     subscription = get_user_subscription(request.session['user_id'])
     
     if not subscription or subscription['id'] != subscription_id:
@@ -3323,7 +3620,8 @@ async def test_upload_page(request: Request):
 # Zusätzliche Navigationsseiten (leichte Placeholder)
 
 @app.get("/copilot", response_class=HTMLResponse)
-async def copilot_page(request: Request):
+@offload_route
+def copilot_page(request: Request):
     """
     Vollbild-Finance-Copilot-Seite.
     """
@@ -3344,14 +3642,15 @@ async def account_page(request: Request):
     return RedirectResponse(url="/profile", status_code=303)
 
 @app.get("/team", response_class=HTMLResponse)
-async def team_page(request: Request):
+@offload_route
+def team_page(request: Request):
     """Team & Rollen Verwaltung"""
     redirect = require_login(request)
     if redirect:
         return redirect
     # RBAC: Nur Admins können Team verwalten
     user_id = request.session.get("user_id")
-    if not is_admin_or_owner(user_id):
+    if not identity_for(request).is_admin_or_owner():
         return RedirectResponse("/dashboard?error=no_permission", status_code=303)
     user_info = get_user_info(user_id)
     return templates.TemplateResponse("team.html", {"request": request, "user": user_info})
@@ -3360,7 +3659,7 @@ async def team_page(request: Request):
 async def audit_log_page(request: Request):
     # RBAC: Audit nur für Admins
     user_id = request.session.get("user_id")
-    if not user_id or not is_admin_or_owner(user_id):
+    if not user_id or not identity_for(request).is_admin_or_owner():
         return RedirectResponse("/dashboard", status_code=303)
     """Audit-Log Seite - Protokoll aller Systemaktivitäten"""
     redirect = require_login(request)
@@ -3370,7 +3669,8 @@ async def audit_log_page(request: Request):
 
 
 @app.get("/accounting", response_class=HTMLResponse)
-async def accounting_page(request: Request):
+@offload_route
+def accounting_page(request: Request):
     """Auto-Kontierung Seite"""
     redirect = require_login(request)
     if redirect:
@@ -3379,11 +3679,7 @@ async def accounting_page(request: Request):
     from database import get_connection
     conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute("""
-        SELECT job_id, upload_path, total_files, created_at 
-        FROM jobs WHERE user_id = ? AND status = 'completed' 
-        ORDER BY created_at DESC LIMIT 20
-    """, (request.session["user_id"],))
+    cursor.execute(query_indexes.USER_COMPLETED_JOBS_SQL, (request.session["user_id"],))
     jobs = [{"job_id": r[0], "filename": r[1] or "Upload", "invoice_count": r[2], "created_at": r[3]} for r in cursor.fetchall()]
     conn.close()
     
@@ -3407,61 +3703,16 @@ async def review_duplicate(detection_id: int, request: Request):
 
 
 
-def validate_einvoice(xml_string: str):
-    """
-    Sehr einfache E-Rechnungs-Erkennung / -Validierung:
-    - Versucht XML zu parsen
-    - Erkannt werden grob XRechnung / ZUGFeRD / Factur-X anhand Namespace / Text
-    - Gibt (is_valid, message, detected_profile) zurück
-    """
-    xml = (xml_string or "").strip()
-    if not xml:
-        return False, "Kein XML übergeben – PDF- oder Basis-Rechnung.", ""
-
-    import xml.etree.ElementTree as ET
-
-    try:
-        root = ET.fromstring(xml)
-    except Exception as e:
-        return False, f"XML nicht parsbar: {e}", ""
-
-    text_lower = xml.lower()
-
-    # Heuristik für Profile / Formate
-    profile = ""
-
-    # XRechnung / EN16931 / CII
-    if (
-        "xrechnung" in text_lower
-        or "urn:cen.eu:en16931:2017" in text_lower
-        or "crossindustryinvoice" in root.tag.lower()
-    ):
-        profile = "XRechnung / EN16931 (CII)"
-
-    # ZUGFeRD / Factur-X
-    if (
-        "zugferd" in text_lower
-        or "factur-x" in text_lower
-        or "crossindustrydocument" in root.tag.lower()
-    ):
-        if profile:
-            profile += " + ZUGFeRD/Factur-X"
-        else:
-            profile = "ZUGFeRD / Factur-X"
-
-    # einfache Minimal-Checks
-    # -> wenn wir irgendein Profil erkannt haben und das XML syntaktisch OK ist, werten wir es als 'valid'
-    if profile:
-        return True, f"E-Rechnung erkannt ({profile}), XML syntaktisch gültig.", profile
-
-    # Fallback: generische XML-Rechnung
-    return True, "XML syntaktisch gültig, aber kein spezifisches E-Rechnungs-Profil erkannt.", ""
-
 # === Plausibility API ===
 @app.post("/api/plausibility/{check_id}/review")
 async def review_plausibility(check_id: int, request: Request):
     """Review a plausibility check"""
-    data = await request.json()
+    body = await request.body()
+    return await run_blocking(_review_plausibility_sync, check_id, request, body)
+
+
+def _review_plausibility_sync(check_id: int, request: Request, body: bytes):
+    data = json.loads(body)
     status = data.get('status')
     
     if status not in ['reviewed', 'ignored']:
@@ -3470,7 +3721,7 @@ async def review_plausibility(check_id: int, request: Request):
     import sqlite3
     from datetime import datetime
     
-    conn = sqlite3.connect('invoices.db', check_same_thread=False)
+    conn = get_db()
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -3486,7 +3737,8 @@ async def review_plausibility(check_id: int, request: Request):
 
 # === Analytics Dashboard ===
 @app.get("/analytics/costs")
-async def analytics_costs(request: Request):
+@offload_route
+def analytics_costs(request: Request):
     """Analytics Dashboard für API-Kosten - Nur für Admins"""
     admin_check = require_admin(request)
     if admin_check:
@@ -3498,23 +3750,11 @@ async def analytics_costs(request: Request):
     monthly_costs = get_monthly_costs()
     
     # Hole alle Jobs mit Kosten
-    conn = sqlite3.connect('invoices.db', check_same_thread=False)
+    conn = get_db()
     conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
     
-    cursor.execute('''
-        SELECT 
-            j.job_id,
-            j.created_at,
-            j.total_files,
-            COALESCE(SUM(ac.cost_usd), 0) as total_cost
-        FROM jobs j
-        LEFT JOIN api_costs ac ON j.job_id = ac.job_id
-        WHERE j.user_id = ?
-        GROUP BY j.job_id
-        ORDER BY j.created_at DESC
-        LIMIT 50
-    ''', (request.session["user_id"],))
+    cursor.execute(query_indexes.USER_JOB_COSTS_SQL, (request.session["user_id"],))
     
     jobs = [dict(r) for r in cursor.fetchall()]
     conn.close()
@@ -3582,32 +3822,19 @@ async def export_job_xrechnung(job_id: str, request: Request):
     if "user_id" not in request.session:
         return JSONResponse({"error": "Not authenticated"}, status_code=401)
     
-    from database import get_invoices_by_job, log_export
-    import zipfile
-    import io
+    from database import get_invoices_by_job
     
     try:
-        invoices = get_invoices_by_job(job_id)
+        invoices = await asyncio.to_thread(get_invoices_by_job, job_id)
         if not invoices:
             return JSONResponse({"error": "Keine Rechnungen gefunden"}, status_code=404)
         
-        # ZIP mit allen XRechnungen erstellen
-        zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zf:
-            for inv in invoices:
-                xml_content = generate_xrechnung(inv)
-                inv_nr = (inv.get("invoice_number") or inv.get("rechnungsnummer") or "unknown").replace("/", "-")
-                filename = f"xrechnung_{inv_nr}.xml"
-                zf.writestr(filename, xml_content)
+        def render(inv):
+            inv_nr = (inv.get("invoice_number") or inv.get("rechnungsnummer") or "unknown").replace("/", "-")
+            return f"xrechnung_{inv_nr}.xml", generate_xrechnung(inv)
         
-        zip_buffer.seek(0)
         log_audit(AuditAction.EXPORT_XRECHNUNG, user_id=request.session["user_id"], resource_type="job", resource_id=job_id, ip_address=request.client.host)
-        log_export(request.session["user_id"], job_id, "xrechnung", f"xrechnung_{job_id[:8]}.zip", len(zip_buffer.getvalue()), len(invoices), sum(i.get("betrag_brutto", 0) or 0 for i in invoices))
-        return Response(
-            content=zip_buffer.getvalue(),
-            media_type="application/zip",
-            headers={"Content-Disposition": f"attachment; filename=xrechnung_{job_id[:8]}.zip"}
-        )
+        return await _zip_export_response(request.session["user_id"], job_id, "xrechnung", invoices, render)
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
 
@@ -3617,42 +3844,52 @@ async def export_job_zugferd(job_id: str, request: Request):
     if "user_id" not in request.session:
         return JSONResponse({"error": "Not authenticated"}, status_code=401)
     
-    from database import get_invoices_by_job, log_export
+    from database import get_invoices_by_job
     from zugferd import create_zugferd_from_invoice
-    import zipfile
-    import io
     
     try:
-        invoices = get_invoices_by_job(job_id)
+        invoices = await asyncio.to_thread(get_invoices_by_job, job_id)
         if not invoices:
             return JSONResponse({"error": "Keine Rechnungen gefunden"}, status_code=404)
         
-        zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zf:
-            for inv in invoices:
-                pdf_bytes = create_zugferd_from_invoice(inv)
-                if pdf_bytes:
-                    inv_nr = (inv.get("rechnungsnummer") or "unknown").replace("/", "-")
-                    zf.writestr(f"zugferd_{inv_nr}.pdf", pdf_bytes)
+        def render(inv):
+            inv_nr = (inv.get("rechnungsnummer") or "unknown").replace("/", "-")
+            return f"zugferd_{inv_nr}.pdf", create_zugferd_from_invoice(inv) or None
         
-        zip_buffer.seek(0)
         log_audit(AuditAction.EXPORT_XRECHNUNG, user_id=request.session["user_id"], resource_type="job", resource_id=job_id, ip_address=request.client.host)
-        log_export(request.session["user_id"], job_id, "zugferd", f"zugferd_{job_id[:8]}.zip", len(zip_buffer.getvalue()), len(invoices), sum(i.get("betrag_brutto", 0) or 0 for i in invoices))
-        
-        return Response(
-            content=zip_buffer.getvalue(),
-            media_type="application/zip",
-            headers={"Content-Disposition": f"attachment; filename=zugferd_{job_id[:8]}.zip"}
-        )
+        return await _zip_export_response(request.session["user_id"], job_id, "zugferd", invoices, render)
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
 
+
+async def _zip_export_response(user_id, job_id: str, export_type: str, invoices, render):
+    """ZIP-Export als Stream: Einträge werden im Render-Pool erzeugt und sofort geschrieben."""
+    from fastapi.responses import StreamingResponse
+    from database import log_export
+    
+    filename = f"{export_type}_{job_id[:8]}.zip"
+    total_brutto = sum(i.get("betrag_brutto", 0) or 0 for i in invoices)
+    
+    def on_complete(size_bytes, _entries):
+        # Größe erst nach dem letzten Chunk bekannt
+        log_export(user_id, job_id, export_type, filename, size_bytes, len(invoices), total_brutto)
+    
+    # Erster Eintrag vor dem Start der Antwort – Renderfehler ergeben noch einen 500er statt 200 + kaputtem ZIP
+    entries = await run_blocking(start_zip_entries, render_ordered(invoices, render))
+    
+    return StreamingResponse(
+        stream_zip(entries, on_complete=on_complete, name=filename),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+    )
+
 # === Überschriebene Job-Detail-Seite mit RAM + DB Fallback ===
 @app.get("/job/{job_id}", response_class=HTMLResponse)
-async def job_details_page(request: Request, job_id: str):
+@offload_route
+def job_details_page(request: Request, job_id: str):
     """
     Detailed job view from in-memory jobs (laufende Session) UND Datenbank.
-    - Zuerst wird in processing_jobs geschaut (aktuelle Verarbeitung)
+    - Zuerst wird im Job-Store geschaut (aktuelle Verarbeitung)
     - Fallback: get_job(job_id) aus der Datenbank
     """
     from database import (
@@ -3887,7 +4124,8 @@ async def password_reset_request_page(request: Request):
 
 
 @app.post("/password-reset/request", response_class=HTMLResponse)
-async def password_reset_request_submit(request: Request, email: str = Form(...)):
+@offload_route
+def password_reset_request_submit(request: Request, email: str = Form(...)):
     """Verarbeitet Formular: erstellt Token, sendet E-Mail."""
     logger.info("🔐 Password reset requested for: %s", email)
     token = create_password_reset_token(email)
@@ -3930,7 +4168,7 @@ async def password_reset_confirm_page(request: Request):
     error = None
 
     if token:
-        user_id = verify_reset_token(token)
+        user_id = await run_blocking(verify_reset_token, token)
         logger.info("🔐 [RESET-CONFIRM-GET] verify_reset_token -> %s", user_id)
         token_valid = user_id is not None
         if not token_valid:
@@ -4008,7 +4246,7 @@ async def password_reset_confirm_submit(
         )
 
     try:
-        ok = reset_password(token, new_password)
+        ok = await run_blocking(reset_password, token, new_password)
         logger.info("🔐 [RESET-CONFIRM-POST] reset_password result=%s", ok)
     except Exception as e:
         logger.exception("❌ [RESET-CONFIRM-POST] reset_password raised: %s", e)
@@ -4452,7 +4690,8 @@ async def api_finance_copilot_query(request: Request, payload: FinanceCopilotReq
 # ============================================================
 
 @app.get("/api/team/members", tags=["Team"])
-async def get_team_members(request: Request):
+@offload_route
+def get_team_members(request: Request):
     """Team-Mitglieder laden - Admins sehen alle, normale User nur sich selbst"""
     if "user_id" not in request.session:
         return {"error": "Not logged in"}
@@ -4520,7 +4759,7 @@ async def get_team_members(request: Request):
     
     # Heute aktive User zählen
     cursor = conn.cursor()
-    cursor.execute("SELECT COUNT(DISTINCT user_id) FROM audit_log WHERE DATE(timestamp) = DATE('now')")
+    cursor.execute(query_indexes.AUDIT_ACTIVE_USERS_TODAY_SQL)
     active_today = cursor.fetchone()[0]
     conn.close()
     
@@ -4530,12 +4769,17 @@ async def get_team_members(request: Request):
 @app.post("/api/team/role", tags=["Team"])
 async def assign_role(request: Request):
     """Rolle einem User zuweisen oder entfernen"""
+    body = await request.body()
+    return await run_blocking(_assign_role_sync, request, body)
+
+
+def _assign_role_sync(request: Request, body: bytes):
     # Nur Admins dürfen Rollen ändern
     admin_check = require_admin(request)
     if admin_check:
         return {"error": "Nur Admins können Rollen ändern"}
     
-    data = await request.json()
+    data = json.loads(body)
     user_id = data.get("user_id")
     role_id = data.get("role_id")
     action = data.get("action", "add")  # add oder remove
@@ -4560,6 +4804,7 @@ async def assign_role(request: Request):
         
         conn.commit()
         conn.close()
+        identities.invalidate(user_id)
         return {"success": True, "message": "Rolle aktualisiert"}
     except Exception as e:
         conn.close()
@@ -4569,6 +4814,11 @@ async def assign_role(request: Request):
 @app.post("/api/team/invite", tags=["Team"])
 async def invite_team_member(request: Request):
     """Neues Team-Mitglied per Email einladen"""
+    body = await request.body()
+    return await run_blocking(_invite_team_member_sync, request, body)
+
+
+def _invite_team_member_sync(request: Request, body: bytes):
     admin_check = require_admin(request)
     if admin_check:
         return {"error": "Nur Admins können einladen"}
@@ -4576,7 +4826,7 @@ async def invite_team_member(request: Request):
     import secrets
     from datetime import datetime, timedelta
     
-    data = await request.json()
+    data = json.loads(body)
     email = data.get("email", "").strip().lower()
     role_id = data.get("role_id", 3)  # Default: Viewer
     
@@ -4622,7 +4872,8 @@ async def invite_team_member(request: Request):
 
 
 @app.get("/api/team/invitations", tags=["Team"])
-async def get_invitations(request: Request):
+@offload_route
+def get_invitations(request: Request):
     """Alle offenen Einladungen laden"""
     if "user_id" not in request.session:
         return {"error": "Not logged in"}
@@ -4647,7 +4898,8 @@ async def get_invitations(request: Request):
 
 
 @app.delete("/api/team/invitation/{invitation_id}", tags=["Team"])
-async def cancel_invitation(invitation_id: int, request: Request):
+@offload_route
+def cancel_invitation(invitation_id: int, request: Request):
     """Einladung zurückziehen"""
     admin_check = require_admin(request)
     if admin_check:
@@ -4666,6 +4918,11 @@ async def cancel_invitation(invitation_id: int, request: Request):
 @app.put("/api/team/member/{user_id}/status", tags=["Team"])
 async def update_member_status(user_id: int, request: Request):
     """User aktivieren/deaktivieren"""
+    body = await request.body()
+    return await run_blocking(_update_member_status_sync, user_id, request, body)
+
+
+def _update_member_status_sync(user_id: int, request: Request, body: bytes):
     admin_check = require_admin(request)
     if admin_check:
         return {"error": "Nur Admins können User-Status ändern"}
@@ -4674,7 +4931,7 @@ async def update_member_status(user_id: int, request: Request):
     if user_id == request.session["user_id"]:
         return {"error": "Sie können sich nicht selbst deaktivieren"}
     
-    data = await request.json()
+    data = json.loads(body)
     is_active = data.get("is_active", True)
     
     from database import get_connection
@@ -4683,6 +4940,8 @@ async def update_member_status(user_id: int, request: Request):
     cursor.execute("UPDATE users SET is_active = ? WHERE id = ?", (1 if is_active else 0, user_id))
     conn.commit()
     conn.close()
+    identities.invalidate(user_id)
+    api_key_cache.revoke(user_id=user_id)
     
     return {"success": True, "message": f"User {'aktiviert' if is_active else 'deaktiviert'}"}
 
@@ -4692,7 +4951,8 @@ async def update_member_status(user_id: int, request: Request):
 # ============================================================
 
 @app.get("/api/audit-log", tags=["Audit"])
-async def get_audit_log(
+@offload_route
+def get_audit_log(
     request: Request,
     page: int = 1,
     limit: int = 50,
@@ -4738,18 +4998,18 @@ async def get_audit_log(
     
     # Stats - für Admins global, für andere nur eigene
     if is_admin:
-        cursor.execute("SELECT COUNT(*) as count FROM audit_log WHERE DATE(timestamp) = DATE('now')")
+        cursor.execute(query_indexes.AUDIT_TODAY_SQL)
         today = cursor.fetchone()['count']
-        cursor.execute("SELECT COUNT(*) as count FROM audit_log WHERE action = 'auth.login' AND timestamp >= datetime('now', '-7 days')")
+        cursor.execute(query_indexes.AUDIT_LOGINS_7D_SQL)
         logins_7d = cursor.fetchone()['count']
-        cursor.execute("SELECT COUNT(*) as count FROM audit_log WHERE action = 'auth.login_failed'")
+        cursor.execute(query_indexes.AUDIT_FAILED_LOGINS_SQL)
         failed_logins = cursor.fetchone()['count']
     else:
-        cursor.execute("SELECT COUNT(*) as count FROM audit_log WHERE user_id = ? AND DATE(timestamp) = DATE('now')", (user_id,))
+        cursor.execute(query_indexes.AUDIT_USER_TODAY_SQL, (user_id,))
         today = cursor.fetchone()['count']
-        cursor.execute("SELECT COUNT(*) as count FROM audit_log WHERE user_id = ? AND action = 'auth.login' AND timestamp >= datetime('now', '-7 days')", (user_id,))
+        cursor.execute(query_indexes.AUDIT_USER_LOGINS_7D_SQL, (user_id,))
         logins_7d = cursor.fetchone()['count']
-        cursor.execute("SELECT COUNT(*) as count FROM audit_log WHERE user_id = ? AND action = 'auth.login_failed'", (user_id,))
+        cursor.execute(query_indexes.AUDIT_USER_FAILED_LOGINS_SQL, (user_id,))
         failed_logins = cursor.fetchone()['count']
     
     # Paginated Results
@@ -4804,7 +5064,7 @@ async def get_2fa_status(request: Request):
         return JSONResponse({"error": "Not authenticated"}, status_code=401)
     
     from database import get_user_by_id
-    user = get_user_by_id(request.session["user_id"])
+    user = await run_blocking(get_user_by_id, request.session["user_id"])
     
     return {
         "enabled": bool(user.get("totp_enabled")) if user else False,
@@ -4813,13 +5073,14 @@ async def get_2fa_status(request: Request):
 
 
 @app.get("/api/notifications/settings", tags=["Settings"])
-async def get_notification_settings(request: Request):
+@offload_route
+def get_notification_settings(request: Request):
     """Holt Benachrichtigungseinstellungen aus DB"""
     if "user_id" not in request.session:
         return JSONResponse({"error": "Not authenticated"}, status_code=401)
     user_email = request.session.get("user_email", "")
     try:
-        conn = sqlite3.connect('invoices.db', check_same_thread=False)
+        conn = get_db()
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
         settings = cursor.execute("SELECT * FROM user_settings WHERE user_email = ?", (user_email,)).fetchone()
@@ -4833,12 +5094,17 @@ async def get_notification_settings(request: Request):
 @app.put("/api/notifications/settings", tags=["Settings"])
 async def update_notification_settings(request: Request):
     """Aktualisiert Benachrichtigungseinstellungen"""
+    body = await request.body()
+    return await run_blocking(_update_notification_settings_sync, request, body)
+
+
+def _update_notification_settings_sync(request: Request, body: bytes):
     if "user_id" not in request.session:
         return JSONResponse({"error": "Not authenticated"}, status_code=401)
     user_email = request.session.get("user_email", "")
-    data = await request.json()
+    data = json.loads(body)
     try:
-        conn = sqlite3.connect('invoices.db', check_same_thread=False)
+        conn = get_db()
         cursor = conn.cursor()
         existing = cursor.execute("SELECT user_email FROM user_settings WHERE user_email = ?", (user_email,)).fetchone()
         if not existing:
@@ -4858,16 +5124,21 @@ async def update_notification_settings(request: Request):
 @app.post("/api/settings/slack", tags=["Settings"])
 async def save_slack_settings(request: Request):
     """Speichert Slack Webhook URL"""
+    body = await request.body()
+    return await run_blocking(_save_slack_settings_sync, request, body)
+
+
+def _save_slack_settings_sync(request: Request, body: bytes):
     if "user_id" not in request.session:
         return JSONResponse({"error": "Not authenticated"}, status_code=401)
     user_email = request.session.get("user_email", "")
-    data = await request.json()
+    data = json.loads(body)
     enabled = data.get("enabled", False)
     webhook_url = data.get("webhook_url", "").strip()
     if enabled and webhook_url and not webhook_url.startswith("https://hooks.slack.com/"):
         return {"success": False, "error": "Ungueltige Slack Webhook URL"}
     try:
-        conn = sqlite3.connect('invoices.db', check_same_thread=False)
+        conn = get_db()
         cursor = conn.cursor()
         existing = cursor.execute("SELECT user_email FROM user_settings WHERE user_email = ?", (user_email,)).fetchone()
         if not existing:
@@ -4882,9 +5153,14 @@ async def save_slack_settings(request: Request):
 @app.post("/api/settings/slack/test", tags=["Settings"])
 async def test_slack_webhook(request: Request):
     """Testet Slack Webhook URL"""
+    body = await request.body()
+    return await run_blocking(_test_slack_webhook_sync, request, body)
+
+
+def _test_slack_webhook_sync(request: Request, body: bytes):
     if "user_id" not in request.session:
         return JSONResponse({"error": "Not authenticated"}, status_code=401)
-    data = await request.json()
+    data = json.loads(body)
     webhook_url = data.get("webhook_url", "").strip()
     user_name = request.session.get("user_name", "User")
     if not webhook_url or not webhook_url.startswith("https://hooks.slack.com/"):
@@ -4904,15 +5180,20 @@ async def test_slack_webhook(request: Request):
 @app.post("/api/settings/weekly-report", tags=["Settings"])
 async def save_weekly_report_settings(request: Request):
     """Speichert Woechentlicher Report Einstellungen"""
+    body = await request.body()
+    return await run_blocking(_save_weekly_report_settings_sync, request, body)
+
+
+def _save_weekly_report_settings_sync(request: Request, body: bytes):
     if "user_id" not in request.session:
         return JSONResponse({"error": "Not authenticated"}, status_code=401)
     user_email = request.session.get("user_email", "")
-    data = await request.json()
+    data = json.loads(body)
     enabled = data.get("enabled", False)
     day = int(data.get("day", 1))
     time_val = data.get("time", "07:00")
     try:
-        conn = sqlite3.connect('invoices.db', check_same_thread=False)
+        conn = get_db()
         cursor = conn.cursor()
         existing = cursor.execute("SELECT user_email FROM user_settings WHERE user_email = ?", (user_email,)).fetchone()
         if not existing:
@@ -4925,14 +5206,15 @@ async def save_weekly_report_settings(request: Request):
         return {"success": False, "error": str(e)}
 
 @app.post("/api/reports/send-now", tags=["Settings"])
-async def send_report_now(request: Request):
+@offload_route
+def send_report_now(request: Request):
     """Sendet sofort einen woechentlichen Report"""
     if "user_id" not in request.session:
         return JSONResponse({"error": "Not authenticated"}, status_code=401)
     user_email = request.session.get("user_email", "")
     results = {"email": False, "slack": False}
     try:
-        conn = sqlite3.connect('invoices.db', check_same_thread=False)
+        conn = get_db()
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
         settings = cursor.execute("SELECT * FROM user_settings WHERE user_email = ?", (user_email,)).fetchone()
@@ -4957,14 +5239,19 @@ async def send_report_now(request: Request):
 @app.put("/api/profile/company", tags=["Settings"])
 async def update_company_profile(request: Request):
     """Aktualisiert Firmendaten"""
+    body = await request.body()
+    return await run_blocking(_update_company_profile_sync, request, body)
+
+
+def _update_company_profile_sync(request: Request, body: bytes):
     if "user_id" not in request.session:
         return JSONResponse({"error": "Not authenticated"}, status_code=401)
     
-    data = await request.json()
+    data = json.loads(body)
     
     try:
         import sqlite3
-        conn = sqlite3.connect('invoices.db', check_same_thread=False)
+        conn = get_db()
         cursor = conn.cursor()
         
         cursor.execute(
@@ -4973,6 +5260,7 @@ async def update_company_profile(request: Request):
         )
         conn.commit()
         conn.close()
+        identities.invalidate(request.session["user_id"])
         
         return {"success": True}
     except Exception as e:
@@ -4987,7 +5275,7 @@ async def create_billing_portal(request: Request):
         return JSONResponse({"error": "Not authenticated"}, status_code=401)
     
     from database import get_user_by_id
-    user = get_user_by_id(request.session["user_id"])
+    user = await run_blocking(get_user_by_id, request.session["user_id"])
     
     if not user:
         return {"error": "User nicht gefunden"}
@@ -5033,7 +5321,8 @@ async def create_billing_portal(request: Request):
         return {"error": str(e)}
 
 @app.get("/api/subscription", tags=["Settings"])
-async def get_subscription_info(request: Request):
+@offload_route
+def get_subscription_info(request: Request):
     """Holt Abo-Informationen für alle SBS Produkte"""
     if "user_id" not in request.session:
         return JSONResponse({"error": "Not authenticated"}, status_code=401)
@@ -5073,7 +5362,7 @@ async def get_subscription_info(request: Request):
     
     try:
         import sqlite3
-        conn = sqlite3.connect('invoices.db', check_same_thread=False)
+        conn = get_db()
         cursor = conn.cursor()
         
         # Prüfe product_subscriptions
@@ -5143,7 +5432,8 @@ async def billing_page(request: Request):
 # Duplikat entfernt - Team-Route ist oben definiert
 
 @app.get("/export-historie", response_class=HTMLResponse)
-async def export_history_page(request: Request):
+@offload_route
+def export_history_page(request: Request):
     """Export-Historie"""
     if 'user_id' not in request.session:
         from starlette.responses import RedirectResponse
@@ -5185,7 +5475,8 @@ async def copilot_demo_page(request: Request):
     return templates.TemplateResponse("copilot_demo.html", {"request": request})
 
 @app.get("/api/demo/copilot/status")
-async def copilot_demo_status(request: Request):
+@offload_route
+def copilot_demo_status(request: Request):
     """Prüft Demo-Nutzung für Finance Copilot"""
     ip_address = request.headers.get("X-Forwarded-For", request.client.host)
     if ip_address and "," in ip_address:
@@ -5202,45 +5493,23 @@ async def copilot_demo_status(request: Request):
     if is_admin:
         return {"used_today": 0, "limit": 999, "remaining": 999, "allowed": True, "is_admin": True}
     
-    # Zähle heutige Nutzung
-    import sqlite3
-    from datetime import datetime
-    
-    conn = sqlite3.connect('invoices.db', check_same_thread=False)
-    cursor = conn.cursor()
-    
-    # Erstelle Tabelle falls nicht vorhanden
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS copilot_demo_usage (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            ip_address TEXT,
-            question TEXT,
-            created_at TEXT
-        )
-    """)
-    conn.commit()
-    
-    today = datetime.now().strftime('%Y-%m-%d')
-    cursor.execute(
-        "SELECT COUNT(*) FROM copilot_demo_usage WHERE ip_address = ? AND created_at LIKE ?",
-        (ip_address, f"{today}%")
-    )
-    used_today = cursor.fetchone()[0]
-    conn.close()
-    
-    limit = 3
-    remaining = max(0, limit - used_today)
-    
+    # Heutige Nutzung (Quota-Service, ohne DB-Scan)
+    status = quota.status(ip_address, COPILOT_DEMO)
     return {
-        "used_today": used_today,
-        "limit": limit,
-        "remaining": remaining,
-        "allowed": remaining > 0
+        "used_today": status.used,
+        "limit": status.limit,
+        "remaining": status.remaining,
+        "allowed": status.allowed
     }
 
 @app.post("/api/demo/copilot/query")
 async def copilot_demo_query(request: Request):
     """Finance Copilot Demo Query mit Rate-Limiting"""
+    body = await request.body()
+    return await run_blocking(_copilot_demo_query_sync, request, body)
+
+
+def _copilot_demo_query_sync(request: Request, body: bytes):
     import sqlite3
     from datetime import datetime
     
@@ -5256,31 +5525,9 @@ async def copilot_demo_query(request: Request):
         if user and user.get("is_admin"):
             is_admin = True
     
-    # Rate-Limit prüfen
-    if not is_admin:
-        conn = sqlite3.connect('invoices.db', check_same_thread=False)
-        cursor = conn.cursor()
-        
-        today = datetime.now().strftime('%Y-%m-%d')
-        cursor.execute(
-            "SELECT COUNT(*) FROM copilot_demo_usage WHERE ip_address = ? AND created_at LIKE ?",
-            (ip_address, f"{today}%")
-        )
-        used_today = cursor.fetchone()[0]
-        conn.close()
-        
-        if used_today >= 3:
-            return JSONResponse(
-                status_code=429,
-                content={
-                    "error": "Demo-Limit erreicht. Registrieren Sie sich für unbegrenzten Zugang.",
-                    "remaining": 0
-                }
-            )
-    
     # Parse Request
     try:
-        data = await request.json()
+        data = json.loads(body)
         question = data.get("question", "").strip()
     except:
         return {"error": "Ungültige Anfrage"}
@@ -5288,6 +5535,20 @@ async def copilot_demo_query(request: Request):
     if not question:
         return {"error": "Bitte stellen Sie eine Frage"}
     
+    # Rate-Limit prüfen und zählen in einem Schritt (vor dem LLM-Aufruf,
+    # damit parallele Anfragen derselben IP das Limit nicht überschreiten)
+    usage = None
+    if not is_admin:
+        usage = quota.consume(ip_address, COPILOT_DEMO)
+        if not usage.allowed:
+            return JSONResponse(
+                status_code=429,
+                content={
+                    "error": "Demo-Limit erreicht. Registrieren Sie sich für unbegrenzten Zugang.",
+                    "remaining": 0
+                }
+            )
+    
     # Demo-Finanzdaten (realistisches Beispiel-Unternehmen)
     demo_snapshot = {
         "period_days": 90,
@@ -5354,6 +5615,7 @@ WEITERE KENNZAHLEN:
 - Ø Zahlungsziel: {demo_snapshot['payment_terms_avg']} Tage
 """
     
+    answer = None
     try:
         # LLM-Anfrage
         client = _get_finance_copilot_client()
@@ -5387,23 +5649,18 @@ WICHTIG: Dies ist eine Demo mit Beispieldaten. Erwähne das NICHT in deiner Antw
         answer = response.choices[0].message.content.strip()
         
         # Nutzung aufzeichnen
-        if not is_admin:
-            conn = sqlite3.connect('invoices.db', check_same_thread=False)
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO copilot_demo_usage (ip_address, question, created_at) VALUES (?, ?, ?)",
-                (ip_address, question[:200], datetime.now().isoformat())
-            )
-            conn.commit()
-            
-            # Neue Remaining berechnen
-            cursor.execute(
-                "SELECT COUNT(*) FROM copilot_demo_usage WHERE ip_address = ? AND created_at LIKE ?",
-                (ip_address, f"{datetime.now().strftime('%Y-%m-%d')}%")
-            )
-            used = cursor.fetchone()[0]
-            conn.close()
-            remaining = max(0, 3 - used)
+        if usage is not None:
+            remaining = usage.remaining - 1
+            # Fragen-Log (gezählt wurde vorab per quota.consume, Tabelle legt der Quota-Service an)
+            conn = db_pool.connect()
+            try:
+                conn.execute(
+                    "INSERT INTO copilot_demo_usage (ip_address, question, created_at) VALUES (?, ?, ?)",
+                    (ip_address, question[:200], datetime.now().isoformat())
+                )
+                conn.commit()
+            finally:
+                conn.close()
         else:
             remaining = 999
         
@@ -5422,6 +5679,9 @@ WICHTIG: Dies ist eine Demo mit Beispieldaten. Erwähne das NICHT in deiner Antw
         
     except Exception as e:
         app_logger.error(f"Copilot demo error: {e}")
+        # Ohne Antwort zählt die Anfrage nicht
+        if usage is not None and answer is None:
+            quota.refund(ip_address, COPILOT_DEMO)
         return {"error": f"Analyse fehlgeschlagen: {str(e)}"}
 
 
@@ -5433,7 +5693,8 @@ WICHTIG: Dies ist eine Demo mit Beispieldaten. Erwähne das NICHT in deiner Antw
 from approval import get_approval_manager, InvoiceStatus, ApprovalAction
 
 @app.get("/approvals", response_class=HTMLResponse, tags=["Approvals"])
-async def approvals_page(request: Request, status: str = None):
+@offload_route
+def approvals_page(request: Request, status: str = None):
     """Freigabe-Queue Übersicht"""
     user_id = request.session.get("user_id")
     if not user_id:
@@ -5467,7 +5728,8 @@ async def approvals_page(request: Request, status: str = None):
 
 
 @app.get("/approvals/my", response_class=HTMLResponse, tags=["Approvals"])
-async def my_approvals_page(request: Request):
+@offload_route
+def my_approvals_page(request: Request):
     """Meine zugewiesenen Freigaben"""
     user_id = request.session.get("user_id")
     if not user_id:
@@ -5494,7 +5756,8 @@ async def approve_invoice(invoice_id: int, request: Request, comment: str = Form
     user_id = request.session.get("user_id")
     if not user_id:
         return JSONResponse({"error": "Nicht angemeldet"}, status_code=401)
-    if not has_permission(user_id, Permission.INVOICE_APPROVE) and not has_permission(user_id, "approve"):
+    identity = identity_for(request)
+    if not identity.has_permission(Permission.INVOICE_APPROVE) and not identity.has_permission("approve"):
         return JSONResponse({"error": "Keine Freigabe-Berechtigung"}, status_code=403)
     user_id = request.session.get("user_id")
     if not user_id:
@@ -5554,7 +5817,8 @@ async def reject_invoice(invoice_id: int, request: Request, comment: str = Form(
 
 
 @app.post("/api/approvals/{invoice_id}/assign", tags=["Approvals"])
-async def assign_invoice(invoice_id: int, request: Request, assignee_id: int = Form(...)):
+@offload_route
+def assign_invoice(invoice_id: int, request: Request, assignee_id: int = Form(...)):
     """Rechnung einem Benutzer zuweisen"""
     user_id = request.session.get("user_id")
     if not user_id:
@@ -5610,7 +5874,7 @@ async def bulk_approve_invoices(request: Request):
     user_id = request.session.get("user_id")
     if not user_id:
         return JSONResponse({"error": "Nicht angemeldet"}, status_code=401)
-    if not has_permission(user_id, Permission.INVOICE_APPROVE):
+    if not identity_for(request).has_permission(Permission.INVOICE_APPROVE):
         return JSONResponse({"error": "Keine Freigabe-Berechtigung"}, status_code=403)
     user_id = request.session.get("user_id")
     if not user_id:
@@ -5644,7 +5908,8 @@ async def get_approval_stats_api(request: Request, days: int = 30):
 
 # Approval Rules Management (Admin only)
 @app.get("/approvals/rules", response_class=HTMLResponse, tags=["Approvals"])
-async def approval_rules_page(request: Request):
+@offload_route
+def approval_rules_page(request: Request):
     """Freigabe-Regeln verwalten"""
     admin_check = require_admin(request)
     if admin_check:
@@ -5665,11 +5930,16 @@ async def approval_rules_page(request: Request):
 @app.post("/api/approvals/rules", tags=["Approvals"])
 async def create_approval_rule(request: Request):
     """Neue Freigabe-Regel erstellen"""
+    body = await request.body()
+    return await run_blocking(_create_approval_rule_sync, request, body)
+
+
+def _create_approval_rule_sync(request: Request, body: bytes):
     admin_check = require_admin(request)
     if admin_check:
         return JSONResponse({"error": "Admin required"}, status_code=403)
     
-    data = await request.json()
+    data = json.loads(body)
     user_id = request.session.get("user_id")
     
     manager = get_approval_manager()
@@ -5688,11 +5958,16 @@ async def create_approval_rule(request: Request):
 @app.put("/api/approvals/rules/{rule_id}", tags=["Approvals"])
 async def update_approval_rule(rule_id: int, request: Request):
     """Freigabe-Regel aktualisieren"""
+    body = await request.body()
+    return await run_blocking(_update_approval_rule_sync, rule_id, request, body)
+
+
+def _update_approval_rule_sync(rule_id: int, request: Request, body: bytes):
     admin_check = require_admin(request)
     if admin_check:
         return JSONResponse({"error": "Admin required"}, status_code=403)
     
-    data = await request.json()
+    data = json.loads(body)
     
     manager = get_approval_manager()
     manager.update_rule(rule_id, **data)
@@ -5701,7 +5976,8 @@ async def update_approval_rule(rule_id: int, request: Request):
 
 
 @app.delete("/api/approvals/rules/{rule_id}", tags=["Approvals"])
-async def delete_approval_rule(rule_id: int, request: Request):
+@offload_route
+def delete_approval_rule(rule_id: int, request: Request):
     """Freigabe-Regel löschen"""
     admin_check = require_admin(request)
     if admin_check:
@@ -5727,10 +6003,12 @@ from datev import (
 from datetime import date as date_type
 
 @app.get("/datev", response_class=HTMLResponse, tags=["DATEV"])
-async def datev_export_page(request: Request):
+@offload_route
+def datev_export_page(request: Request):
     # RBAC: Export-Berechtigung prüfen
     user_id = request.session.get("user_id")
-    if user_id and not has_permission(user_id, Permission.EXPORT_DATEV) and not has_permission(user_id, "export"):
+    identity = identity_for(request)
+    if identity and not identity.has_permission(Permission.EXPORT_DATEV) and not identity.has_permission("export"):
         return RedirectResponse("/dashboard?error=no_permission", status_code=303)
     """DATEV Export Konfiguration"""
     user_id = request.session.get("user_id")
@@ -5740,17 +6018,9 @@ async def datev_export_page(request: Request):
     user_info = get_user_info(user_id)
     
     # Get invoices for export
-    conn = sqlite3.connect("invoices.db", check_same_thread=False); conn.row_factory = sqlite3.Row
+    conn = get_db(); conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
-    cursor.execute("""
-        SELECT i.id, i.rechnungsnummer, i.datum, i.rechnungsaussteller, 
-               i.betrag_brutto, i.mwst_satz, i.waehrung, i.status
-        FROM invoices i
-        JOIN jobs j ON i.job_id = j.job_id
-        WHERE i.status = 'approved' AND j.user_id = ?
-        ORDER BY i.datum DESC
-        LIMIT 100
-    """, (user_id,))
+    cursor.execute(query_indexes.USER_APPROVED_INVOICES_SQL, (user_id,))
     invoices = [dict(row) for row in cursor.fetchall()]
     conn.close()
     
@@ -5762,6 +6032,95 @@ async def datev_export_page(request: Request):
     })
 
 
+DATEV_EXPORT_DIR = "/var/www/invoice-app/exports"
+# Ab dieser Anzahl läuft der Export als Hintergrund-Job mit Fortschrittsanzeige
+DATEV_BACKGROUND_THRESHOLD = int(os.getenv("DATEV_BACKGROUND_THRESHOLD", "5000"))
+
+
+def _datev_export_config(params: dict) -> DatevExportConfig:
+    wj_beginn = params.get('wirtschaftsjahr_beginn') or f'{datetime.now().year}-01-01'
+    try:
+        wj_parts = wj_beginn.split('-')
+        wj_date = date_type(int(wj_parts[0]), int(wj_parts[1]), int(wj_parts[2]))
+    except:
+        wj_date = date_type(datetime.now().year, 1, 1)
+    
+    return DatevExportConfig(
+        berater_nummer=params.get('berater_nummer', '12345'),
+        mandanten_nummer=params.get('mandanten_nummer', '00001'),
+        wirtschaftsjahr_beginn=wj_date,
+        kontenrahmen=Kontenrahmen.SKR03 if params.get('kontenrahmen', 'SKR03') == 'SKR03' else Kontenrahmen.SKR04,
+        bezeichnung=f"SBS Export {datetime.now().strftime('%Y-%m-%d')}"
+    )
+
+
+def run_datev_export(invoice_ids, params: dict, on_progress=None) -> dict:
+    """
+    Erzeugt eine DATEV-Exportdatei. Rechnungen werden in ID-Chunks geladen;
+    CSV (EXTF) wird chunkweise vom bestehenden Exporter erzeugt und angehängt,
+    XML/ZIP nutzen die bestehenden Exporter.
+    """
+    export_format = params.get('format', 'csv')
+    datev_config = _datev_export_config(params)
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    os.makedirs(DATEV_EXPORT_DIR, exist_ok=True)
+    invoices = iter_invoices(db_pool.db_path, invoice_ids, on_progress=on_progress)
+    
+    if export_format == 'csv':
+        filepath = f"{DATEV_EXPORT_DIR}/EXTF_Buchungen_{timestamp}.csv"
+        counts = {}
+        write_extf_csv(invoices, datev_config, filepath, export_invoices_to_datev_csv, stats=counts)
+        invoice_count = counts.get('invoices', 0)
+    elif export_format == 'xml':
+        filepath = f"{DATEV_EXPORT_DIR}/DATEV_Rechnungen_{timestamp}.xml"
+        invoice_list = list(invoices)
+        invoice_count = len(invoice_list)
+        if invoice_list:
+            export_invoices_to_datev_xml(invoice_list, datev_config, filepath)
+    elif export_format == 'zip':
+        filepath = f"{DATEV_EXPORT_DIR}/DATEV_Paket_{timestamp}.zip"
+        invoice_list = list(invoices)
+        invoice_count = len(invoice_list)
+        if invoice_list:
+            export_invoices_to_datev_zip(invoice_list, datev_config, output_path=filepath)
+    else:
+        raise ValueError(f"Unbekanntes Format: {export_format}")
+    
+    if not invoice_count:
+        if os.path.exists(filepath):
+            os.remove(filepath)
+        raise LookupError("Keine Rechnungen gefunden")
+    
+    filename = os.path.basename(filepath)
+    return {
+        "filename": filename,
+        "download_url": f"/api/datev/download/{filename}",
+        "invoice_count": invoice_count,
+        "format": export_format,
+    }
+
+
+async def run_datev_export_job(job_id: str):
+    """Hintergrund-Job für große DATEV-Exporte (über die Job-Queue, mit Fortschritt)."""
+    job = await run_blocking(processing_jobs.get, job_id)
+    if not job:
+        raise JobNotFoundError(job_id)
+    
+    def on_progress(done, total):
+        progress = {"processed": done, "total": total, "progress": int(done / total * 100) if total else 100}
+        processing_jobs.update(job_id, progress)
+        progress_hub.publish(job_id, "progress", **progress)
+    
+    result = await asyncio.to_thread(run_datev_export, job["invoice_ids"], job["datev"], on_progress)
+    await run_blocking(processing_jobs.update, job_id, {
+        "status": JobStatus.COMPLETED.value,
+        "completed_at": datetime.now().isoformat(),
+        **result,
+    })
+    progress_hub.publish(job_id, "completed", status=JobStatus.COMPLETED.value, progress=100, **result)
+    logger.info(f"DATEV Export (Job {job_id}): {result['invoice_count']} Rechnungen, Format: {result['format']}")
+
+
 @app.post("/api/datev/export", tags=["DATEV"])
 async def export_to_datev(request: Request):
     """Exportiert ausgewählte Rechnungen nach DATEV"""
@@ -5779,83 +6138,55 @@ async def export_to_datev(request: Request):
               details=f'{{"count": {len(invoice_ids)}, "format": "{data.get("format", "csv")}"}}',
               ip_address=request.client.host)
     export_format = data.get('format', 'csv')  # csv, xml, zip
-    berater_nr = data.get('berater_nummer', '12345')
-    mandanten_nr = data.get('mandanten_nummer', '00001')
-    kontenrahmen = data.get('kontenrahmen', 'SKR03')
-    wj_beginn = data.get('wirtschaftsjahr_beginn', f'{datetime.now().year}-01-01')
+    params = {
+        'format': export_format,
+        'berater_nummer': data.get('berater_nummer', '12345'),
+        'mandanten_nummer': data.get('mandanten_nummer', '00001'),
+        'kontenrahmen': data.get('kontenrahmen', 'SKR03'),
+        'wirtschaftsjahr_beginn': data.get('wirtschaftsjahr_beginn', f'{datetime.now().year}-01-01'),
+    }
     
     if not invoice_ids:
         return JSONResponse({"error": "Keine Rechnungen ausgewählt"}, status_code=400)
-    
-    # Load invoices
-    conn = sqlite3.connect("invoices.db", check_same_thread=False); conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    placeholders = ','.join(['?' for _ in invoice_ids])
-    cursor.execute(f"""
-        SELECT * FROM invoices WHERE id IN ({placeholders})
-    """, invoice_ids)
-    
-    invoices = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    
-    if not invoices:
-        return JSONResponse({"error": "Keine Rechnungen gefunden"}, status_code=404)
-    
-    # Parse wirtschaftsjahr
-    try:
-        wj_parts = wj_beginn.split('-')
-        wj_date = date_type(int(wj_parts[0]), int(wj_parts[1]), int(wj_parts[2]))
-    except:
-        wj_date = date_type(datetime.now().year, 1, 1)
-    
-    # Create config
-    config = DatevExportConfig(
-        berater_nummer=berater_nr,
-        mandanten_nummer=mandanten_nr,
-        wirtschaftsjahr_beginn=wj_date,
-        kontenrahmen=Kontenrahmen.SKR03 if kontenrahmen == 'SKR03' else Kontenrahmen.SKR04,
-        bezeichnung=f"SBS Export {datetime.now().strftime('%Y-%m-%d')}"
-    )
-    
-    # Generate export
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    export_dir = "/var/www/invoice-app/exports"
-    os.makedirs(export_dir, exist_ok=True)
-    
-    try:
-        if export_format == 'csv':
-            filepath = f"{export_dir}/EXTF_Buchungen_{timestamp}.csv"
-            export_invoices_to_datev_csv(invoices, config, filepath)
-            filename = os.path.basename(filepath)
-            
-        elif export_format == 'xml':
-            filepath = f"{export_dir}/DATEV_Rechnungen_{timestamp}.xml"
-            export_invoices_to_datev_xml(invoices, config, filepath)
-            filename = os.path.basename(filepath)
-            
-        elif export_format == 'zip':
-            filepath = f"{export_dir}/DATEV_Paket_{timestamp}.zip"
-            export_invoices_to_datev_zip(invoices, config, output_path=filepath)
-            filename = os.path.basename(filepath)
-            
-        else:
-            return JSONResponse({"error": f"Unbekanntes Format: {export_format}"}, status_code=400)
-        
-        # Log export
-        logger.info(f"DATEV Export: {len(invoices)} Rechnungen, Format: {export_format}, User: {user_id}")
-        
+    if export_format not in ('csv', 'xml', 'zip'):
+        return JSONResponse({"error": f"Unbekanntes Format: {export_format}"}, status_code=400)
+    
+    # Große Exporte: als Job in die Queue, Fortschritt über /api/status/{job_id}/events
+    if data.get('background') or len(invoice_ids) > DATEV_BACKGROUND_THRESHOLD:
+        job_id = str(uuid.uuid4())
+        await run_blocking(processing_jobs.create, job_id, {
+            "type": "datev_export",
+            "user_id": user_id,
+            "status": "uploaded",
+            "files": [],
+            "created_at": datetime.now().isoformat(),
+            "total": len(invoice_ids),
+            "invoice_ids": invoice_ids,
+            "datev": params,
+        })
+        await run_blocking(processing_jobs.enqueue, job_id)
         return JSONResponse({
             "success": True,
-            "filename": filename,
-            "download_url": f"/api/datev/download/{filename}",
-            "invoice_count": len(invoices),
+            "background": True,
+            "job_id": job_id,
+            "status_url": f"/api/status/{job_id}",
+            "events_url": f"/api/status/{job_id}/events",
+            "invoice_count": len(invoice_ids),
             "format": export_format
         })
-        
+    
+    try:
+        result = await asyncio.to_thread(run_datev_export, invoice_ids, params)
+    except LookupError as e:
+        return JSONResponse({"error": str(e)}, status_code=404)
     except Exception as e:
         logger.error(f"DATEV Export Fehler: {str(e)}")
         return JSONResponse({"error": f"Export fehlgeschlagen: {str(e)}"}, status_code=500)
+    
+    # Log export
+    logger.info(f"DATEV Export: {result['invoice_count']} Rechnungen, Format: {export_format}, User: {user_id}")
+    
+    return JSONResponse({"success": True, **result})
 
 
 @app.get("/api/datev/download/{filename}", tags=["DATEV"])
@@ -5870,7 +6201,7 @@ async def download_datev_export(filename: str, request: Request):
     if not re.match(r'^(EXTF_Buchungen_|DATEV_Rechnungen_|DATEV_Paket_)\d{8}_\d{6}\.(csv|xml|zip)$', filename):
         return JSONResponse({"error": "Invalid filename"}, status_code=400)
     
-    filepath = f"/var/www/invoice-app/exports/{filename}"
+    filepath = f"{DATEV_EXPORT_DIR}/{filename}"
     
     if not os.path.exists(filepath):
         return JSONResponse({"error": "Datei nicht gefunden"}, status_code=404)
@@ -5894,13 +6225,14 @@ async def download_datev_export(filename: str, request: Request):
 
 
 @app.get("/api/datev/preview", tags=["DATEV"])
-async def preview_datev_export(request: Request, invoice_id: int):
+@offload_route
+def preview_datev_export(request: Request, invoice_id: int):
     """Vorschau der DATEV-Buchung für eine Rechnung"""
     user_id = request.session.get("user_id")
     if not user_id:
         return JSONResponse({"error": "Not authenticated"}, status_code=401)
     
-    conn = sqlite3.connect("invoices.db", check_same_thread=False); conn.row_factory = sqlite3.Row
+    conn = get_db(); conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM invoices WHERE id = ?", (invoice_id,))
     row = cursor.fetchone()
@@ -6015,11 +6347,16 @@ async def suggest_kontierung(request: Request):
     Schlägt Buchungskonto für eine einzelne Rechnung vor.
     Berücksichtigt gelernte Kontierungen.
     """
+    body = await request.body()
+    return await run_blocking(_suggest_kontierung_sync, request, body)
+
+
+def _suggest_kontierung_sync(request: Request, body: bytes):
     user_id = request.session.get("user_id")
     if not user_id:
         return JSONResponse({"error": "Not authenticated"}, status_code=401)
     
-    data = await request.json()
+    data = json.loads(body)
     invoice_id = data.get('invoice_id')
     skr = data.get('kontenrahmen', 'SKR03')
     
@@ -6027,7 +6364,7 @@ async def suggest_kontierung(request: Request):
         return JSONResponse({"error": "invoice_id erforderlich"}, status_code=400)
     
     # Lade Rechnung
-    conn = sqlite3.connect("invoices.db", check_same_thread=False)
+    conn = get_db()
     conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM invoices WHERE id = ?", (invoice_id,))
@@ -6126,7 +6463,8 @@ async def get_kontenrahmen(request: Request, skr: str = "SKR03"):
 
 
 @app.get("/api/kontierung/historie", tags=["Kontierung"])
-async def get_kontierung_historie(request: Request, limit: int = 50):
+@offload_route
+def get_kontierung_historie(request: Request, limit: int = 50):
     """
     Zeigt die letzten Kontierungsentscheidungen (für Audit/Debugging).
     """
@@ -6134,7 +6472,7 @@ async def get_kontierung_historie(request: Request, limit: int = 50):
     if not user_id:
         return JSONResponse({"error": "Not authenticated"}, status_code=401)
     
-    conn = sqlite3.connect("invoices.db", check_same_thread=False)
+    conn = get_db()
     conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
     
@@ -6164,7 +6502,8 @@ sys.path.insert(0, '/var/www/invoice-app')
 from zahlungs_service import get_zahlungs_service, ZahlungsService
 
 @app.get("/zahlungen", response_class=HTMLResponse, tags=["Zahlungen"])
-async def zahlungen_dashboard(request: Request):
+@offload_route
+def zahlungen_dashboard(request: Request):
     """Zahlungsübersicht & Skonto-Dashboard"""
     user_id = request.session.get("user_id")
     if not user_id:
@@ -6293,7 +6632,8 @@ async def api_zahlung_status_update(request: Request):
 
 
 @app.get("/api/zahlungen/statistik", tags=["Zahlungen"])
-async def api_zahlungen_statistik(request: Request, monate: int = 6):
+@offload_route
+def api_zahlungen_statistik(request: Request, monate: int = 6):
     """API: Zahlungsstatistiken über Zeit"""
     user_id = request.session.get("user_id")
     if not user_id:
@@ -6305,22 +6645,7 @@ async def api_zahlungen_statistik(request: Request, monate: int = 6):
     cursor = conn.cursor()
     
     # Skonto-Nutzung über Zeit (nur für aktuellen User)
-    cursor.execute("""
-        SELECT 
-            strftime('%Y-%m', z.bezahlt_am) as monat,
-            COUNT(*) as anzahl,
-            SUM(CASE WHEN z.bezahlt_am <= z.skonto_datum THEN z.skonto_betrag ELSE 0 END) as skonto_genutzt,
-            SUM(CASE WHEN z.bezahlt_am > z.skonto_datum AND z.skonto_betrag > 0 THEN z.skonto_betrag ELSE 0 END) as skonto_verpasst,
-            SUM(z.bezahlt_betrag) as gesamt_bezahlt
-        FROM zahlungsbedingungen z
-        JOIN invoices i ON z.invoice_id = i.id
-        JOIN jobs j ON i.job_id = j.job_id
-        WHERE z.bezahlt_am IS NOT NULL
-          AND j.user_id = ?
-          AND z.bezahlt_am >= date('now', '-' || ? || ' months')
-        GROUP BY monat
-        ORDER BY monat
-    """, (user_id, monate))
+    cursor.execute(query_indexes.PAYMENT_STATS_SQL, (user_id, monate))
     
     monatsdaten = [dict(row) for row in cursor.fetchall()]
     conn.close()
@@ -6332,7 +6657,8 @@ async def api_zahlungen_statistik(request: Request, monate: int = 6):
 
 
 @app.get("/api/zahlungen/export/sepa", tags=["Zahlungen"])
-async def api_zahlungen_sepa_export(request: Request):
+@offload_route
+def api_zahlungen_sepa_export(request: Request):
     """API: SEPA-XML Export für ausgewählte Zahlungen"""
     user_id = request.session.get("user_id")
     if not user_id:
@@ -6343,13 +6669,7 @@ async def api_zahlungen_sepa_export(request: Request):
     conn = service._get_connection()
     cursor = conn.cursor()
     
-    cursor.execute("""
-        SELECT z.*, i.rechnungsaussteller, i.betrag_brutto, i.iban, i.bic
-        FROM zahlungsbedingungen z
-        JOIN invoices i ON z.invoice_id = i.id
-        WHERE z.zahlungsstatus = 'geplant'
-        ORDER BY z.geplantes_zahldatum
-    """)
+    cursor.execute(query_indexes.PLANNED_PAYMENTS_SQL)
     
     zahlungen = [dict(row) for row in cursor.fetchall()]
     conn.close()
@@ -6391,7 +6711,7 @@ from sevdesk import create_sevdesk_client, SevdeskInvoiceSync, test_sevdesk_conn
 
 # Integration settings table
 def init_integrations_table():
-    conn = sqlite3.connect("invoices.db", check_same_thread=False); conn.row_factory = sqlite3.Row
+    conn = get_db(); conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS integrations (
@@ -6415,7 +6735,8 @@ init_integrations_table()
 
 
 @app.get("/integrations", response_class=HTMLResponse, tags=["Integrations"])
-async def integrations_page(request: Request):
+@offload_route
+def integrations_page(request: Request):
     """Integrations Settings Page"""
     user_id = request.session.get("user_id")
     if not user_id:
@@ -6423,7 +6744,7 @@ async def integrations_page(request: Request):
     
     user_info = get_user_info(user_id)
     
-    conn = sqlite3.connect("invoices.db", check_same_thread=False); conn.row_factory = sqlite3.Row
+    conn = get_db(); conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM integrations WHERE org_id = 1")
     rows = cursor.fetchall()
@@ -6467,16 +6788,21 @@ async def test_integration(request: Request):
 @app.post("/api/integrations/save", tags=["Integrations"])
 async def save_integration(request: Request):
     """Save integration settings"""
+    body = await request.body()
+    return await run_blocking(_save_integration_sync, request, body)
+
+
+def _save_integration_sync(request: Request, body: bytes):
     user_id = request.session.get("user_id")
     if not user_id:
         return JSONResponse({"error": "Not authenticated"}, status_code=401)
     
-    data = await request.json()
+    data = json.loads(body)
     provider = data.get('provider')
     api_key = data.get('api_key')
     enabled = data.get('enabled', False)
     
-    conn = sqlite3.connect("invoices.db", check_same_thread=False); conn.row_factory = sqlite3.Row
+    conn = get_db(); conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
     cursor.execute("""
         INSERT INTO integrations (org_id, provider, api_key, enabled, updated_at)
@@ -6495,15 +6821,20 @@ async def save_integration(request: Request):
 @app.post("/api/integrations/sync", tags=["Integrations"])
 async def sync_to_integration(request: Request):
     """Sync invoices to external system"""
+    body = await request.body()
+    return await run_blocking(_sync_to_integration_sync, request, body)
+
+
+def _sync_to_integration_sync(request: Request, body: bytes):
     user_id = request.session.get("user_id")
     if not user_id:
         return JSONResponse({"error": "Not authenticated"}, status_code=401)
     
-    data = await request.json()
+    data = json.loads(body)
     provider = data.get('provider')
     invoice_ids = data.get('invoice_ids', [])
     
-    conn = sqlite3.connect("invoices.db", check_same_thread=False); conn.row_factory = sqlite3.Row
+    conn = get_db(); conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
     cursor.execute("SELECT api_key FROM integrations WHERE org_id = 1 AND provider = ? AND enabled = 1", (provider,))
     row = cursor.fetchone()
@@ -6613,10 +6944,10 @@ async def get_ai_dashboard_analysis():
 
 # --- AI DRILL-DOWN ENDPOINT ---
 @app.get("/api/ai/drilldown")
-async def get_ai_drilldown():
+@offload_route
+def get_ai_drilldown():
     try:
-        db_path = '/var/www/invoice-app/invoices.db'
-        conn = sqlite3.connect(db_path)
+        conn = get_db()
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
         
@@ -6676,35 +7007,34 @@ async def chat_with_cfo(request: Request):
         if not user_msg:
             return JSONResponse({"response": "Bitte stellen Sie eine Frage."})
         
-        # Datenbank-Kontext laden
-        db_path = '/var/www/invoice-app/invoices.db'
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        # Datenbank-Kontext laden (im Threadpool)
+        def load_finance_context(conn):
+            cursor = conn.cursor()
         
-        # Aktuelle Finanzdaten sammeln
-        cursor.execute("SELECT COUNT(*) as cnt, SUM(betrag_netto) as total FROM invoices")
-        row = cursor.fetchone()
-        total_invoices = row['cnt'] or 0
-        total_amount = row['total'] or 0
+            # Aktuelle Finanzdaten sammeln
+            cursor.execute("SELECT COUNT(*) as cnt, SUM(betrag_netto) as total FROM invoices")
+            row = cursor.fetchone()
+            total_invoices = row['cnt'] or 0
+            total_amount = row['total'] or 0
         
-        # Top 5 Lieferanten
-        cursor.execute("""
-            SELECT rechnungsaussteller, SUM(betrag_netto) as summe, COUNT(*) as anzahl
-            FROM invoices 
-            GROUP BY rechnungsaussteller 
-            ORDER BY summe DESC 
-            LIMIT 5
-        """)
-        top_suppliers = [{"name": r['rechnungsaussteller'], "summe": r['summe'], "anzahl": r['anzahl']} for r in cursor.fetchall()]
+            # Top 5 Lieferanten
+            cursor.execute("""
+                SELECT rechnungsaussteller, SUM(betrag_netto) as summe, COUNT(*) as anzahl
+                FROM invoices 
+                GROUP BY rechnungsaussteller 
+                ORDER BY summe DESC 
+                LIMIT 5
+            """)
+            top_suppliers = [{"name": r['rechnungsaussteller'], "summe": r['summe'], "anzahl": r['anzahl']} for r in cursor.fetchall()]
         
-        # Offene Rechnungen
-        cursor.execute("SELECT COUNT(*) as cnt, SUM(betrag_netto) as total FROM invoices WHERE payment_status != 'paid' OR payment_status IS NULL")
-        row = cursor.fetchone()
-        open_count = row['cnt'] or 0
-        open_amount = row['total'] or 0
+            # Offene Rechnungen
+            cursor.execute("SELECT COUNT(*) as cnt, SUM(betrag_netto) as total FROM invoices WHERE payment_status != 'paid' OR payment_status IS NULL")
+            row = cursor.fetchone()
+            open_count = row['cnt'] or 0
+            open_amount = row['total'] or 0
+            return total_invoices, total_amount, top_suppliers, open_count, open_amount
         
-        conn.close()
+        total_invoices, total_amount, top_suppliers, open_count, open_amount = await adb.run(load_finance_context)
         
         # Kontext für KI
         context = f"""
@@ -6752,7 +7082,8 @@ Beantworte die Frage des Users basierend auf diesen Daten."""
 # MBR ENTERPRISE PAGE
 # ============================================================
 @app.get("/mbr", response_class=HTMLResponse)
-async def mbr_page(request: Request):
+@offload_route
+def mbr_page(request: Request):
     """Enterprise MBR Dashboard with date selection."""
     redirect = require_login(request)
     if redirect:
@@ -6762,20 +7093,10 @@ async def mbr_page(request: Request):
     user_info = get_user_info(user_id)
     
     # Get available months with data for this user
-    conn = sqlite3.connect("invoices.db", check_same_thread=False)
+    conn = get_db()
     conn.row_factory = sqlite3.Row
     try:
-        cursor = conn.execute("""
-            SELECT DISTINCT 
-                strftime('%Y', rechnungs_datum) as year,
-                strftime('%m', rechnungs_datum) as month,
-                COUNT(*) as invoice_count
-            FROM rechnungen 
-            WHERE user_id = ? AND rechnungs_datum IS NOT NULL
-            GROUP BY year, month
-            ORDER BY year DESC, month DESC
-            LIMIT 24
-        """, (user_id,))
+        cursor = conn.execute(query_indexes.MBR_MONTHS_SQL, (user_id,))
         available_months = [dict(r) for r in cursor.fetchall()]
     finally:
         conn.close()
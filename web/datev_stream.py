@@ -0,0 +1,122 @@
+"""
+SBS Deutschland – Streaming DATEV Export
+Bounded-memory EXTF Buchungsstapel export for large invoice selections.
+
+/api/datev/export used to load every selected invoice with one
+IN (?, ?, ...) query – year-end exports of 50k bookings hit SQLite's
+variable limit – and built the whole export in memory. Now:
+- invoices are loaded in id chunks (DATEV_EXPORT_CHUNK) from the pool
+- each chunk is rendered by the existing exporter
+  (export_invoices_to_datev_csv), so rows keep its full EXTF 700 column set
+- the chunks' booking rows are appended to a temporary body file; the
+  header (whose Belegdatum range spans all chunks) is written last and the
+  body appended in blocks
+"""
+
+import os
+import shutil
+import tempfile
+import logging
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Union
+
+from web.db_pool import pool_for
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = int(os.getenv("DATEV_EXPORT_CHUNK", "500"))
+
+# EXTF header fields "Datum vom" / "Datum bis" (0-based)
+_DATE_FROM, _DATE_TO = 14, 15
+
+ProgressCallback = Callable[[int, int], None]
+# export_invoices_to_datev_csv(invoices, config, filepath)
+ExportCsv = Callable[[List[Dict[str, Any]], Any, str], Any]
+
+
+def iter_invoices(db_path: str, invoice_ids: Sequence[int], chunk_size: int = CHUNK_SIZE,
+                  on_progress: Optional[ProgressCallback] = None) -> Iterator[Dict[str, Any]]:
+    """Yield invoices for the given ids, loading at most chunk_size rows per query."""
+    ids = list(dict.fromkeys(invoice_ids))
+    pool = pool_for(db_path)
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        placeholders = ",".join("?" * len(chunk))
+        conn = pool.connect()
+        try:
+            cursor = conn.execute(f"SELECT * FROM invoices WHERE id IN ({placeholders}) ORDER BY id", chunk)
+            columns = [col[0] for col in cursor.description]
+            rows = cursor.fetchall()
+        finally:
+            conn.close()
+        for row in rows:
+            yield dict(zip(columns, row))
+        if on_progress is not None:
+            on_progress(min(start + chunk_size, len(ids)), len(ids))
+
+
+def _chunks(items: Iterable[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    chunk: List[Dict[str, Any]] = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _split_header(header: bytes) -> List[bytes]:
+    # Only the leading numeric fields are touched; later quoted fields may contain ';'
+    return header.split(b";", _DATE_TO + 1)
+
+
+def write_extf_csv(invoices: Iterable[Dict[str, Any]], config, path: Union[str, Path],
+                   export_csv: ExportCsv, chunk_size: int = CHUNK_SIZE,
+                   stats: Optional[Dict[str, int]] = None) -> int:
+    """
+    Write an EXTF Buchungsstapel chunk by chunk with the existing exporter.
+    Returns the number of booking rows; counts invoices/bookings into stats.
+    Nothing is written when there are no invoices.
+    """
+    path = Path(path)
+    body_path = path.with_name(path.name + ".body")
+    header: Optional[List[bytes]] = None
+    column_line = b""
+    rows = 0
+    invoice_count = 0
+    try:
+        with open(body_path, "wb") as body, tempfile.TemporaryDirectory(prefix="datev-") as tmp:
+            chunk_path = os.path.join(tmp, "chunk.csv")
+            for chunk in _chunks(invoices, chunk_size):
+                export_csv(chunk, config, chunk_path)
+                with open(chunk_path, "rb") as rendered:
+                    lines = rendered.read().splitlines(keepends=True)
+                invoice_count += len(chunk)
+                if len(lines) < 2:
+                    continue
+                fields = _split_header(lines[0])
+                if header is None:
+                    header, column_line = fields, lines[1]
+                else:
+                    # Belegdatum range over all chunks (YYYYMMDD compares as bytes)
+                    header[_DATE_FROM] = min(filter(None, (header[_DATE_FROM], fields[_DATE_FROM])), default=b"")
+                    header[_DATE_TO] = max(filter(None, (header[_DATE_TO], fields[_DATE_TO])), default=b"")
+                for line in lines[2:]:
+                    if line.strip():
+                        body.write(line)
+                        rows += 1
+
+        if header is not None:
+            with open(path, "wb") as out:
+                out.write(b";".join(header))
+                out.write(column_line)
+                with open(body_path, "rb") as body:
+                    shutil.copyfileobj(body, out, 1024 * 1024)
+    finally:
+        if body_path.exists():
+            body_path.unlink()
+    if stats is not None:
+        stats["invoices"] = stats.get("invoices", 0) + invoice_count
+        stats["buchungen"] = stats.get("buchungen", 0) + rows
+    return rows
@@ -0,0 +1,163 @@
+"""
+SBS Deutschland – SQLite Connection Pool
+Per-thread pooled connections to invoices.db with tuned pragmas.
+
+app.py and rate_limiter.py opened a fresh sqlite3.connect("invoices.db")
+in nearly every helper (get_user_info, is_admin_user, get_user_plan, ...):
+every call re-read the schema, started with a cold page cache and an
+empty statement cache, and used the default busy handling. Now:
+- get_db() hands out a connection from the calling thread's idle stack
+- conn.close() returns it (rolling back anything uncommitted and resetting
+  row_factory), so existing call sites keep their connect/close shape
+- every connection is set up once with WAL, synchronous=NORMAL,
+  cache_size, mmap_size, busy_timeout and a larger statement cache
+- connections are subclasses of sqlite3.Connection, so pandas/mbr
+  isinstance checks keep working
+"""
+
+import os
+import sqlite3
+import threading
+import logging
+from typing import Any, Dict, List
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = os.getenv("INVOICES_DB_PATH", "invoices.db")
+BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "16384"))
+MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(128 * 1024 * 1024)))
+STATEMENT_CACHE_SIZE = 256
+# Idle connections kept per thread (nested helpers need more than one)
+MAX_IDLE_PER_THREAD = 4
+
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3.Connection whose close() returns it to its thread's pool."""
+
+    _pool: "ConnectionPool" = None
+    _idle: List["PooledConnection"] = None
+    _checked_out = False
+
+    def close(self):
+        if self._pool is None or not self._checked_out:
+            return
+        self._checked_out = False
+        self._pool._release(self)
+
+    def discard(self):
+        """Really close the connection."""
+        self._checked_out = False
+        sqlite3.Connection.close(self)
+
+
+class ConnectionPool:
+    """
+    Usage:
+        conn = get_db()
+        conn.row_factory = sqlite3.Row
+        rows = conn.execute("SELECT ...").fetchall()
+        conn.close()                # back to the pool
+    """
+
+    def __init__(self, db_path: str = DB_PATH, max_idle_per_thread: int = MAX_IDLE_PER_THREAD):
+        self.db_path = db_path
+        self.max_idle_per_thread = max_idle_per_thread
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+
+    def _open(self) -> PooledConnection:
+        conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False,
+                               factory=PooledConnection, cached_statements=STATEMENT_CACHE_SIZE)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+        conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        with self._lock:
+            self.created += 1
+        return conn
+
+    def _idle_stack(self) -> List[PooledConnection]:
+        idle = getattr(self._local, "idle", None)
+        if idle is None:
+            idle = self._local.idle = []
+        return idle
+
+    def connect(self) -> PooledConnection:
+        idle = self._idle_stack()
+        if idle:
+            conn = idle.pop()
+            with self._lock:
+                self.reused += 1
+        else:
+            conn = self._open()
+            conn._pool = self
+            conn._idle = idle
+        conn._checked_out = True
+        return conn
+
+    def _release(self, conn: PooledConnection):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.row_factory = None
+            conn.text_factory = str
+            conn.isolation_level = ""
+        except sqlite3.Error as e:
+            logger.warning(f"Discarding broken pooled connection: {e}")
+            self._discard(conn)
+            return
+        if len(conn._idle) >= self.max_idle_per_thread:
+            self._discard(conn)
+            return
+        conn._idle.append(conn)
+
+    def _discard(self, conn: PooledConnection):
+        try:
+            conn.discard()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self.discarded += 1
+
+    def close_thread_connections(self):
+        """Close the idle connections of the calling thread."""
+        idle = self._idle_stack()
+        while idle:
+            self._discard(idle.pop())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "db_path": self.db_path,
+                "created": self.created,
+                "reused": self.reused,
+                "discarded": self.discarded,
+            }
+
+
+# Global instance
+db_pool = ConnectionPool()
+
+_pools: Dict[str, ConnectionPool] = {os.path.abspath(DB_PATH): db_pool}
+_pools_lock = threading.Lock()
+
+
+def pool_for(db_path: str) -> ConnectionPool:
+    """Shared pool for a database file (one per path per process)."""
+    key = os.path.abspath(db_path)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(db_path)
+        return pool
+
+
+def get_db() -> PooledConnection:
+    """Pooled replacement for sqlite3.connect("invoices.db")."""
+    return db_pool.connect()
@@ -0,0 +1,534 @@
+"""
+SBS Deutschland – Near-Duplicate Index
+Persistent blocking + MinHash/LSH index for similar-invoice lookup.
+
+detect_all_duplicates compared every new invoice against the user's whole
+history, which gets expensive for tenants with 200k+ invoices. This index
+answers "which stored invoices look like this one?" with bucket lookups:
+- Blocking on normalized supplier, amount bucket (~5%) and date window (30 days);
+  neighbouring amount/date buckets are probed too
+- MinHash signature over invoice-number 3-grams and line-item words,
+  split into LSH bands; only invoices sharing a band in a probed block
+  are compared
+- LSH candidates are verified like detect_all_duplicates did: the invoice
+  numbers must match (sequential numbers share most 3-grams but are
+  different invoices), the amount within DUP_AMOUNT_TOLERANCE and the date
+  within DUP_DATE_TOLERANCE_DAYS
+- every saved invoice is indexed after save_invoices: job post-processing
+  matches and adds the job's invoices, other save paths (demo upload, a
+  failed post-processing) call index_job(); a tenant's history is
+  backfilled from the invoices table on its first lookup, and candidates
+  whose invoice was deleted are dropped from the index
+- rebuildable offline:
+      python -m web.duplicate_index rebuild [--db INVOICES_DB_PATH]
+"""
+
+import json
+import math
+import os
+import random
+import re
+import sqlite3
+import threading
+import zlib
+import logging
+from datetime import date, datetime
+from difflib import SequenceMatcher
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from web.db_pool import DB_PATH, pool_for
+from web.post_processing import normalize_supplier
+
+logger = logging.getLogger(__name__)
+
+NUM_PERM = int(os.getenv("DUP_INDEX_NUM_PERM", "64"))
+NUM_BANDS = int(os.getenv("DUP_INDEX_BANDS", "16"))
+DEFAULT_THRESHOLD = float(os.getenv("DUP_INDEX_THRESHOLD", "0.5"))
+AMOUNT_TOLERANCE = float(os.getenv("DUP_AMOUNT_TOLERANCE", "0.01"))
+DATE_TOLERANCE_DAYS = int(os.getenv("DUP_DATE_TOLERANCE_DAYS", "14"))
+# Numbers with the same digits may differ in prefix/separators ("RE 815" vs "R-815")
+NUMBER_SIMILARITY = 0.8
+
+AMOUNT_BUCKET_RATIO = 1.05
+DATE_WINDOW_DAYS = 30
+
+# Fields that may carry line-item / description text
+_TEXT_FIELDS = ("positionen", "line_items", "beschreibung", "leistungsbeschreibung", "verwendungszweck")
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+# (invoice_id, other_invoice_id, similarity)
+Candidate = Tuple[int, int, float]
+
+
+def _permutations(num_perm: int) -> List[Tuple[int, int]]:
+    rng = random.Random(4711)  # fixed seed: signatures must be stable across processes
+    return [(rng.randint(1, _MERSENNE_PRIME - 1), rng.randint(0, _MERSENNE_PRIME - 1))
+            for _ in range(num_perm)]
+
+
+def _parse_date(value: Any) -> Optional[date]:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    text = str(value or "").strip()[:10]
+    for fmt in ("%Y-%m-%d", "%d.%m.%Y"):
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def amount_bucket(value: Any) -> Optional[int]:
+    try:
+        amount = abs(float(value))
+    except (TypeError, ValueError):
+        return None
+    if amount < 1:
+        return 0
+    return int(math.log(amount) / math.log(AMOUNT_BUCKET_RATIO))
+
+
+def date_window(value: Any) -> Optional[int]:
+    parsed = _parse_date(value)
+    return parsed.toordinal() // DATE_WINDOW_DAYS if parsed else None
+
+
+def _amount(value: Any) -> Optional[float]:
+    try:
+        return abs(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def number_key(value: Any) -> str:
+    """'RE-2024-000815' -> 're2024000815'."""
+    return re.sub(r"[^0-9a-z]", "", str(value or "").lower())
+
+
+def numbers_match(a: str, b: str) -> bool:
+    """Same invoice number up to OCR noise in prefix/separators; different digits never match."""
+    if a == b:
+        return True
+    digits_a, digits_b = re.sub(r"\D", "", a), re.sub(r"\D", "", b)
+    if not digits_a or digits_a != digits_b:
+        return False
+    return SequenceMatcher(None, a, b).ratio() >= NUMBER_SIMILARITY
+
+
+def is_duplicate(invoice: Dict[str, Any], number: str, amount: Optional[float], datum: Optional[str]) -> bool:
+    """Exact check for an LSH candidate (stored number key, amount and date)."""
+    own_number = number_key(invoice.get("rechnungsnummer"))
+    if own_number and number and not numbers_match(own_number, number):
+        return False
+    own_amount = _amount(invoice.get("betrag_brutto"))
+    if own_amount is not None and amount is not None:
+        if abs(own_amount - amount) > AMOUNT_TOLERANCE * max(own_amount, amount, 1.0):
+            return False
+    own_date, other_date = _parse_date(invoice.get("datum")), _parse_date(datum)
+    if own_date is not None and other_date is not None:
+        if abs((own_date - other_date).days) > DATE_TOLERANCE_DAYS:
+            return False
+    return True
+
+
+def shingles(invoice: Dict[str, Any]) -> set:
+    """Invoice-number character 3-grams plus line-item words."""
+    result = set()
+    number = number_key(invoice.get("rechnungsnummer"))
+    if number:
+        if len(number) < 3:
+            result.add("n:" + number)
+        result.update("n:" + number[i:i + 3] for i in range(len(number) - 2))
+    for field_name in _TEXT_FIELDS:
+        value = invoice.get(field_name)
+        if not value:
+            continue
+        if not isinstance(value, str):
+            value = json.dumps(value, ensure_ascii=False, default=str)
+        result.update("w:" + word for word in re.findall(r"\w{3,}", value.lower()))
+    return result
+
+
+class DuplicateIndex:
+    """
+    SQLite-backed near-duplicate index, partitioned by tenant.
+
+    Usage:
+        pairs = duplicate_index.match_and_add(user_id, invoices)
+        similar = duplicate_index.candidates(user_id, invoice)
+    """
+
+    def __init__(self, db_path: str = DB_PATH, num_perm: int = NUM_PERM,
+                 bands: int = NUM_BANDS, threshold: float = DEFAULT_THRESHOLD):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.db_path = db_path
+        self._pool = pool_for(db_path)
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self._perms = _permutations(num_perm)
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.compared = 0
+        self.rejected = 0
+        self.backfilled = 0
+        self.stale_removed = 0
+        self._built: set = set()
+        self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        return self._pool.connect()
+
+    def _init_db(self):
+        """Create index tables if not exists."""
+        try:
+            conn = self._connect()
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS dup_index_invoices (
+                    tenant_key TEXT NOT NULL,
+                    invoice_id INTEGER NOT NULL,
+                    block_key TEXT NOT NULL,
+                    signature TEXT NOT NULL,
+                    number_key TEXT,
+                    amount REAL,
+                    datum TEXT,
+                    PRIMARY KEY (tenant_key, invoice_id)
+                )
+            """)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(dup_index_invoices)").fetchall()}
+            for column, kind in (("number_key", "TEXT"), ("amount", "REAL"), ("datum", "TEXT")):
+                if column not in columns:
+                    # Index from before verification: entries lack the fields, backfill again
+                    conn.execute(f"ALTER TABLE dup_index_invoices ADD COLUMN {column} {kind}")
+                    conn.execute("DROP TABLE IF EXISTS dup_index_tenants")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS dup_index_tenants (
+                    tenant_key TEXT PRIMARY KEY,
+                    built_at TEXT DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS dup_index_bands (
+                    tenant_key TEXT NOT NULL,
+                    band_key TEXT NOT NULL,
+                    invoice_id INTEGER NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_dup_index_bands ON dup_index_bands(tenant_key, band_key)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_dup_index_bands_invoice ON dup_index_bands(tenant_key, invoice_id)")
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            logger.error(f"Duplicate index DB init failed: {e}")
+
+    # ------------------------------------------------------------------
+    # Signatures
+    # ------------------------------------------------------------------
+
+    def signature(self, tokens: Iterable[str]) -> Optional[List[int]]:
+        hashed = [zlib.crc32(t.encode("utf-8")) for t in tokens]
+        if not hashed:
+            return None
+        return [min(((a * x + b) % _MERSENNE_PRIME) & _MAX_HASH for x in hashed) for a, b in self._perms]
+
+    def _band_hashes(self, signature: List[int]) -> List[str]:
+        return [
+            f"{band}:{zlib.crc32(json.dumps(signature[band * self.rows:(band + 1) * self.rows]).encode()):08x}"
+            for band in range(self.bands)
+        ]
+
+    @staticmethod
+    def _block(supplier: str, amount: Optional[int], window: Optional[int]) -> str:
+        return f"{supplier}|{'*' if amount is None else amount}|{'*' if window is None else window}"
+
+    def _blocks_for(self, invoice: Dict[str, Any]) -> Tuple[str, List[str]]:
+        """Own block key plus neighbouring blocks to probe."""
+        supplier = normalize_supplier(invoice.get("rechnungsaussteller"))
+        amount = amount_bucket(invoice.get("betrag_brutto"))
+        window = date_window(invoice.get("datum"))
+        amounts = [None] if amount is None else [amount - 1, amount, amount + 1]
+        windows = [None] if window is None else [window - 1, window, window + 1]
+        probes = [self._block(supplier, a, w) for a in amounts for w in windows]
+        return self._block(supplier, amount, window), probes
+
+    @staticmethod
+    def similarity(sig_a: List[int], sig_b: List[int]) -> float:
+        return sum(1 for a, b in zip(sig_a, sig_b) if a == b) / len(sig_a)
+
+    # ------------------------------------------------------------------
+    # Lookup / update
+    # ------------------------------------------------------------------
+
+    def _lookup(self, conn: sqlite3.Connection, tenant: str, invoice: Dict[str, Any],
+                signature: List[int], probes: List[str]) -> List[Tuple[int, float]]:
+        bands = self._band_hashes(signature)
+        keys = [f"{block}|{band}" for block in probes for band in bands]
+        placeholders = ",".join("?" * len(keys))
+        ids = {row[0] for row in conn.execute(
+            f"SELECT DISTINCT invoice_id FROM dup_index_bands WHERE tenant_key = ? AND band_key IN ({placeholders})",
+            [tenant, *keys],
+        )}
+        ids.discard(invoice.get("id"))
+        if not ids:
+            return []
+        placeholders = ",".join("?" * len(ids))
+        rows = conn.execute(
+            f"""SELECT invoice_id, signature, number_key, amount, datum FROM dup_index_invoices
+                WHERE tenant_key = ? AND invoice_id IN ({placeholders})""",
+            [tenant, *ids],
+        ).fetchall()
+        rows = self._drop_deleted(conn, tenant, rows)
+        with self._lock:
+            self.lookups += 1
+            self.compared += len(rows)
+        matches = []
+        rejected = 0
+        for other_id, other_sig, number, amount, datum in rows:
+            score = self.similarity(signature, json.loads(other_sig))
+            if score < self.threshold:
+                continue
+            if is_duplicate(invoice, number, amount, datum):
+                matches.append((other_id, round(score, 3)))
+            else:
+                rejected += 1
+        if rejected:
+            with self._lock:
+                self.rejected += rejected
+        return sorted(matches, key=lambda m: -m[1])
+
+    def _drop_deleted(self, conn: sqlite3.Connection, tenant: str, rows: List[tuple]) -> List[tuple]:
+        """Remove candidates whose invoice no longer exists (deleted by the database module)."""
+        if not rows or not _has_table(conn, "invoices"):
+            return rows
+        ids = [row[0] for row in rows]
+        placeholders = ",".join("?" * len(ids))
+        live = {row[0] for row in conn.execute(f"SELECT id FROM invoices WHERE id IN ({placeholders})", ids)}
+        stale = [i for i in ids if i not in live]
+        if stale:
+            self._remove(conn, tenant, stale)
+            with self._lock:
+                self.stale_removed += len(stale)
+        return [row for row in rows if row[0] in live]
+
+    def _add(self, conn: sqlite3.Connection, tenant: str, invoice: Dict[str, Any],
+             block: str, signature: List[int]):
+        invoice_id = invoice["id"]
+        datum = _parse_date(invoice.get("datum"))
+        conn.execute("DELETE FROM dup_index_bands WHERE tenant_key = ? AND invoice_id = ?", (tenant, invoice_id))
+        conn.execute("""
+            INSERT INTO dup_index_invoices (tenant_key, invoice_id, block_key, signature, number_key, amount, datum)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(tenant_key, invoice_id) DO UPDATE SET
+                block_key = excluded.block_key, signature = excluded.signature,
+                number_key = excluded.number_key, amount = excluded.amount, datum = excluded.datum
+        """, (tenant, invoice_id, block, json.dumps(signature), number_key(invoice.get("rechnungsnummer")),
+              _amount(invoice.get("betrag_brutto")), datum.isoformat() if datum else None))
+        conn.executemany(
+            "INSERT INTO dup_index_bands (tenant_key, band_key, invoice_id) VALUES (?, ?, ?)",
+            [(tenant, f"{block}|{band}", invoice_id) for band in self._band_hashes(signature)],
+        )
+
+    def _add_all(self, conn: sqlite3.Connection, tenant: str, invoices: Iterable[Dict[str, Any]]) -> int:
+        count = 0
+        for invoice in invoices:
+            signature = self.signature(shingles(invoice))
+            if invoice.get("id") is None or signature is None:
+                continue
+            block, _ = self._blocks_for(invoice)
+            self._add(conn, tenant, invoice, block, signature)
+            count += 1
+        return count
+
+    @staticmethod
+    def _remove(conn: sqlite3.Connection, tenant: str, invoice_ids: Iterable[int]):
+        ids = [(tenant, i) for i in invoice_ids]
+        conn.executemany("DELETE FROM dup_index_bands WHERE tenant_key = ? AND invoice_id = ?", ids)
+        conn.executemany("DELETE FROM dup_index_invoices WHERE tenant_key = ? AND invoice_id = ?", ids)
+
+    def _ensure_built(self, conn: sqlite3.Connection, tenant: str, exclude: Iterable[int] = ()):
+        """Backfill a tenant's history from the invoices table on first use (once per tenant)."""
+        if tenant in self._built:
+            return
+        if conn.execute("SELECT 1 FROM dup_index_tenants WHERE tenant_key = ?", (tenant,)).fetchone() is None:
+            # The batch being matched is left out: it is looked up and added by the caller
+            skip = set(exclude)
+            history = [inv for inv in _tenant_invoices(conn, tenant) if inv.get("id") not in skip]
+            count = self._add_all(conn, tenant, history)
+            conn.execute("INSERT OR IGNORE INTO dup_index_tenants (tenant_key) VALUES (?)", (tenant,))
+            conn.commit()
+            with self._lock:
+                self.backfilled += count
+            if count:
+                logger.info(f"Duplicate index backfilled {count} invoices for tenant {tenant}")
+        self._built.add(tenant)
+
+    def candidates(self, tenant: Any, invoice: Dict[str, Any]) -> List[Tuple[int, float]]:
+        """Stored invoices similar to `invoice` as (invoice_id, similarity), best first."""
+        signature = self.signature(shingles(invoice))
+        if signature is None:
+            return []
+        _, probes = self._blocks_for(invoice)
+        tenant = str(tenant)
+        conn = self._connect()
+        try:
+            self._ensure_built(conn, tenant)
+            matches = self._lookup(conn, tenant, invoice, signature, probes)
+            conn.commit()
+            return matches
+        finally:
+            conn.close()
+
+    def match_and_add(self, tenant: Any, invoices: Iterable[Dict[str, Any]]) -> List[Candidate]:
+        """
+        Look up each invoice, then index it – in one transaction.
+        Near-duplicates inside the same batch are found as well.
+        """
+        tenant = str(tenant)
+        invoices = list(invoices)
+        pairs: List[Candidate] = []
+        conn = self._connect()
+        try:
+            self._ensure_built(conn, tenant, exclude=[inv.get("id") for inv in invoices])
+            for invoice in invoices:
+                if invoice.get("id") is None:
+                    continue
+                signature = self.signature(shingles(invoice))
+                if signature is None:
+                    continue
+                block, probes = self._blocks_for(invoice)
+                for other_id, score in self._lookup(conn, tenant, invoice, signature, probes):
+                    pairs.append((invoice["id"], other_id, score))
+                self._add(conn, tenant, invoice, block, signature)
+            conn.commit()
+        finally:
+            conn.close()
+        return pairs
+
+    def add(self, tenant: Any, invoices: Iterable[Dict[str, Any]]) -> int:
+        """Index invoices without lookup. Returns the number indexed."""
+        conn = self._connect()
+        try:
+            count = self._add_all(conn, str(tenant), invoices)
+            conn.commit()
+        finally:
+            conn.close()
+        return count
+
+    def index_job(self, tenant: Any, job_id: str) -> int:
+        """Index a job's saved invoices from the invoices table (saves outside job post-processing)."""
+        conn = self._connect()
+        try:
+            count = self._add_all(conn, str(tenant), _job_invoices(conn, job_id))
+            conn.commit()
+        finally:
+            conn.close()
+        return count
+
+    def remove(self, tenant: Any, invoice_ids: Iterable[int]):
+        """Drop deleted invoices from the index."""
+        conn = self._connect()
+        try:
+            self._remove(conn, str(tenant), invoice_ids)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def rebuild(self, tenant: Any, invoices: Iterable[Dict[str, Any]]) -> int:
+        """Drop a tenant's index and re-index all given invoices."""
+        tenant = str(tenant)
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM dup_index_bands WHERE tenant_key = ?", (tenant,))
+            conn.execute("DELETE FROM dup_index_invoices WHERE tenant_key = ?", (tenant,))
+            count = self._add_all(conn, tenant, invoices)
+            conn.execute("INSERT OR IGNORE INTO dup_index_tenants (tenant_key) VALUES (?)", (tenant,))
+            conn.commit()
+        finally:
+            conn.close()
+        self._built.add(tenant)
+        return count
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "lookups": self.lookups,
+                "avg_compared": round(self.compared / self.lookups, 1) if self.lookups else 0.0,
+                "num_perm": self.num_perm,
+                "bands": self.bands,
+                "threshold": self.threshold,
+                "rejected": self.rejected,
+                "backfilled": self.backfilled,
+                "stale_removed": self.stale_removed,
+                "tenants_built": len(self._built),
+            }
+
+
+def _has_table(conn: sqlite3.Connection, name: str) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone() is not None
+
+
+def _tenant_invoices(conn: sqlite3.Connection, tenant: str) -> List[Dict[str, Any]]:
+    """All stored invoices of one tenant ("anon": jobs without user)."""
+    if not (_has_table(conn, "invoices") and _has_table(conn, "jobs")):
+        return []
+    where = "j.user_id IS NULL" if tenant == "anon" else "j.user_id = ?"
+    cursor = conn.execute(
+        f"SELECT i.* FROM invoices i JOIN jobs j ON i.job_id = j.job_id WHERE {where} ORDER BY i.id",
+        () if tenant == "anon" else (tenant,),
+    )
+    columns = [col[0] for col in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def _job_invoices(conn: sqlite3.Connection, job_id: str) -> List[Dict[str, Any]]:
+    if not _has_table(conn, "invoices"):
+        return []
+    cursor = conn.execute("SELECT * FROM invoices WHERE job_id = ? ORDER BY id", (job_id,))
+    columns = [col[0] for col in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def rebuild_from_database(db_path: str = DB_PATH, index: Optional[DuplicateIndex] = None) -> Dict[str, int]:
+    """Offline rebuild for all tenants from the invoices/jobs tables (tenants are also backfilled lazily)."""
+    index = index or DuplicateIndex(db_path)
+    conn = pool_for(db_path).connect()
+    conn.row_factory = sqlite3.Row
+    try:
+        rows = conn.execute("""
+            SELECT i.*, j.user_id AS tenant_user_id
+            FROM invoices i
+            JOIN jobs j ON i.job_id = j.job_id
+            ORDER BY j.user_id, i.id
+        """).fetchall()
+    finally:
+        conn.close()
+
+    by_tenant: Dict[Any, List[Dict[str, Any]]] = {}
+    for row in rows:
+        inv = dict(row)
+        tenant = inv.pop("tenant_user_id")
+        by_tenant.setdefault("anon" if tenant is None else tenant, []).append(inv)
+    return {str(tenant): index.rebuild(tenant, invoices) for tenant, invoices in by_tenant.items()}
+
+
+# Global instance
+duplicate_index = DuplicateIndex()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Near-duplicate index maintenance")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--db", default=DB_PATH)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    counts = rebuild_from_database(args.db, DuplicateIndex(args.db))
+    logger.info(f"Rebuilt duplicate index: {sum(counts.values())} invoices, {len(counts)} tenants")
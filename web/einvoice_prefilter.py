@@ -0,0 +1,71 @@
+"""
+SBS Deutschland – E-Invoice Prefilter
+Cheap check for embedded ZUGFeRD/Factur-X/XRechnung XML before parse_einvoice.
+
+Most inbound PDFs are plain scans or print-to-PDF invoices, yet every one
+went through the full parse_einvoice (PDF object tree + attachment walk).
+The prefilter memory-maps the file and does a single regex pass over the
+raw bytes for:
+- embedded file names (factur-x.xml, zugferd-invoice.xml, xrechnung.xml),
+  as written in /EmbeddedFiles name trees and /F /UF file specs
+  (ASCII and UTF-16BE)
+- the PDF/A-3 XMP extension schemas ZUGFeRD/Factur-X require, which stay
+  visible when the file spec itself sits in a compressed object stream
+Only files with a hit get the full parse. Set EINVOICE_PREFILTER=0 to
+always parse.
+"""
+
+import mmap
+import os
+import re
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Dict, Optional, Union
+
+PREFILTER_ENABLED = os.getenv("EINVOICE_PREFILTER", "1") != "0"
+
+EMBEDDED_XML_NAMES = ("factur-x.xml", "zugferd-invoice.xml", "xrechnung.xml")
+XMP_MARKERS = (b"urn:factur-x:pdfa:", b"urn:zugferd:pdfa:", b"urn:ferd:pdfa:")
+
+
+def _build_pattern() -> "re.Pattern[bytes]":
+    needles = []
+    for name in EMBEDDED_XML_NAMES:
+        needles.append(name.encode("ascii"))
+        needles.append(name.encode("utf-16-be"))
+    needles.extend(XMP_MARKERS)
+    return re.compile(b"|".join(re.escape(n) for n in needles), re.IGNORECASE)
+
+
+_PATTERN = _build_pattern()
+
+
+@dataclass
+class PrefilterResult:
+    has_embedded_xml: bool
+    marker: Optional[str]
+    scan_ms: float
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def scan_pdf(path: Union[str, Path]) -> PrefilterResult:
+    """Look for e-invoice markers without parsing the PDF."""
+    start = time.perf_counter()
+    match = None
+    try:
+        with open(path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                found = _PATTERN.search(data)
+                if found:
+                    match = found.group(0).replace(b"\x00", b"").decode("ascii", "replace").lower()
+    except (OSError, ValueError):
+        # Empty or unreadable file – parse_einvoice would not find XML either
+        pass
+    return PrefilterResult(
+        has_embedded_xml=match is not None,
+        marker=match,
+        scan_ms=round((time.perf_counter() - start) * 1000, 3),
+    )
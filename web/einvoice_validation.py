@@ -0,0 +1,125 @@
+"""
+SBS Deutschland – E-Invoice Validation
+Streaming well-formedness check and profile detection for e-invoice XML.
+
+validate_einvoice used to build a full ElementTree with ET.fromstring and
+then lowercase the entire XML string to look for profile markers – for
+every invoice in process_invoices_background. Now:
+- the XML is fed in chunks to an incremental pull parser (iterparse-style);
+  processed elements are cleared, so no full tree is kept
+- the profile comes from the root element/namespace and the header
+  identifiers (GuidelineSpecifiedDocumentContextParameter/ID for CII,
+  CustomizationID for UBL); inspection stops after the header
+- results are memoized by SHA-256 of the XML
+"""
+
+import hashlib
+import os
+import threading
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+VALIDATION_CACHE_SIZE = int(os.getenv("EINVOICE_VALIDATION_CACHE_SIZE", "512"))
+
+_FEED_CHUNK = 64 * 1024
+# Elements after which the header is over and no profile markers follow
+_HEADER_END = {"ExchangedDocumentContext", "SpecifiedExchangedDocumentContext", "CustomizationID"}
+_MAX_HEADER_ELEMENTS = 200
+
+ValidationResult = Tuple[bool, str, str]
+
+_cache: "OrderedDict[bytes, ValidationResult]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _split(tag: str) -> Tuple[str, str]:
+    """'{ns}Local' -> ('ns', 'Local')"""
+    if tag.startswith("{"):
+        ns, _, local = tag[1:].partition("}")
+        return ns, local
+    return "", tag
+
+
+def detect_profile(root_tag: str, identifiers: str) -> str:
+    """Profile from root element and header identifiers (same labels as before)."""
+    ns, local = _split(root_tag)
+    root = f"{ns} {local}".lower()
+    ids = identifiers.lower()
+    profile = ""
+
+    # XRechnung / EN16931 / CII
+    if "xrechnung" in ids or "urn:cen.eu:en16931:2017" in ids or "crossindustryinvoice" in root:
+        profile = "XRechnung / EN16931 (CII)"
+
+    # ZUGFeRD / Factur-X
+    if ("zugferd" in ids or "factur-x" in ids or "crossindustrydocument" in root
+            or "zugferd" in root or "factur-x" in root):
+        profile = f"{profile} + ZUGFeRD/Factur-X" if profile else "ZUGFeRD / Factur-X"
+
+    return profile
+
+
+def _validate(xml: str) -> ValidationResult:
+    parser = ET.XMLPullParser(events=("start", "end"))
+    root_tag: Optional[str] = None
+    root_elem = None
+    identifiers = []
+    inspecting = True
+    seen = 0
+
+    try:
+        for offset in range(0, len(xml), _FEED_CHUNK):
+            parser.feed(xml[offset:offset + _FEED_CHUNK])
+            for event, elem in parser.read_events():
+                if event == "start":
+                    if root_tag is None:
+                        root_tag, root_elem = elem.tag, elem
+                    continue
+                local = _split(elem.tag)[1]
+                if inspecting:
+                    seen += 1
+                    if local in ("ID", "CustomizationID", "ProfileID") and elem.text:
+                        identifiers.append(elem.text.strip())
+                    if local in _HEADER_END or seen >= _MAX_HEADER_ELEMENTS:
+                        inspecting = False
+                # Only well-formedness matters from here on – drop finished subtrees
+                if elem is not root_elem and not inspecting:
+                    root_elem.clear()
+        parser.close()
+    except ET.ParseError as e:
+        return False, f"XML nicht parsbar: {e}", ""
+
+    profile = detect_profile(root_tag or "", " ".join(identifiers))
+    # -> wenn wir irgendein Profil erkannt haben und das XML syntaktisch OK ist, werten wir es als 'valid'
+    if profile:
+        return True, f"E-Rechnung erkannt ({profile}), XML syntaktisch gültig.", profile
+
+    # Fallback: generische XML-Rechnung
+    return True, "XML syntaktisch gültig, aber kein spezifisches E-Rechnungs-Profil erkannt.", ""
+
+
+def validate_einvoice(xml_string: Optional[str]) -> ValidationResult:
+    """
+    E-Rechnungs-Erkennung / -Validierung:
+    - Prüft, ob das XML wohlgeformt ist (streamend)
+    - Erkennt XRechnung / ZUGFeRD / Factur-X an Root-Element und Header-IDs
+    - Gibt (is_valid, message, detected_profile) zurück
+    """
+    if not xml_string or xml_string.isspace():
+        return False, "Kein XML übergeben – PDF- oder Basis-Rechnung.", ""
+    xml = xml_string.lstrip() if xml_string[0].isspace() else xml_string
+
+    digest = hashlib.sha256(xml.encode("utf-8", "surrogatepass")).digest()
+    with _cache_lock:
+        cached = _cache.get(digest)
+        if cached is not None:
+            _cache.move_to_end(digest)
+            return cached
+
+    result = _validate(xml)
+    with _cache_lock:
+        _cache[digest] = result
+        while len(_cache) > VALIDATION_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return result
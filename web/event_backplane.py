@@ -0,0 +1,188 @@
+"""
+SBS Deutschland – Event Backplane
+Cross-worker pub/sub for WebSocket/SSE fan-out.
+
+The WebSocket registry lives in each uvicorn worker's memory, so a job
+processed on worker A could not reach a browser connected to worker B.
+Every worker now publishes job progress and alert messages to a shared
+backplane and delivers whatever arrives there to its own local sockets.
+
+Backends (EVENT_BACKPLANE):
+- "local":  in-process only (single worker, tests)
+- "sqlite": shared event_bus table in invoices.db (WAL); every worker tails
+  it by id every EVENT_BACKPLANE_POLL seconds. Rows are pruned after
+  EVENT_BACKPLANE_RETENTION seconds.
+A Redis/NATS backend only needs the same publish/start/stop/stats methods.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import logging
+from typing import Any, Callable, Dict, Optional
+
+from web.db_pool import DB_PATH, pool_for
+
+logger = logging.getLogger(__name__)
+
+BACKPLANE_KIND = os.getenv("EVENT_BACKPLANE", "local")
+DEFAULT_POLL_INTERVAL = float(os.getenv("EVENT_BACKPLANE_POLL", "0.1"))
+DEFAULT_RETENTION_SECONDS = int(os.getenv("EVENT_BACKPLANE_RETENTION", "300"))
+
+Deliver = Callable[[str, Dict[str, Any]], None]
+
+
+class LocalBackplane:
+    """Delivers straight back into this process."""
+
+    distributed = False
+
+    def __init__(self):
+        self._deliver: Optional[Deliver] = None
+        self.published = 0
+
+    def start(self, deliver: Deliver):
+        self._deliver = deliver
+
+    def publish(self, topic: str, message: Dict[str, Any]):
+        self.published += 1
+        if self._deliver is not None:
+            self._deliver(topic, message)
+
+    def stop(self):
+        self._deliver = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "local", "published": self.published}
+
+
+class SQLiteBackplane:
+    """
+    Shared append-only event table, tailed by a poller thread per worker.
+    Messages published by this worker come back through the same path, so
+    local and remote subscribers see the same order.
+    """
+
+    distributed = True
+
+    def __init__(self, db_path: str = DB_PATH, poll_interval: float = DEFAULT_POLL_INTERVAL,
+                 retention_seconds: int = DEFAULT_RETENTION_SECONDS):
+        self.db_path = db_path
+        self._pool = pool_for(db_path)
+        self.poll_interval = poll_interval
+        self.retention_seconds = retention_seconds
+        self._deliver: Optional[Deliver] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._last_id = 0
+        self.published = 0
+        self.delivered = 0
+        self.last_lag_ms = 0.0
+        self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        return self._pool.connect()
+
+    def _init_db(self):
+        """Create event table if not exists."""
+        try:
+            conn = self._connect()
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS event_bus (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    topic TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_event_bus_created ON event_bus(created_at)")
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            logger.error(f"Event backplane DB init failed: {e}")
+
+    def start(self, deliver: Deliver):
+        if self._thread is not None:
+            return
+        self._deliver = deliver
+        conn = self._connect()
+        try:
+            # Only new messages – a worker joining late does not replay history
+            self._last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM event_bus").fetchone()[0]
+        finally:
+            conn.close()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._poll_loop, daemon=True, name="event-backplane")
+        self._thread.start()
+
+    def publish(self, topic: str, message: Dict[str, Any]):
+        try:
+            conn = self._connect()
+            conn.execute(
+                "INSERT INTO event_bus (topic, payload, created_at) VALUES (?, ?, ?)",
+                (topic, json.dumps(message, ensure_ascii=False, default=str), time.time()),
+            )
+            conn.commit()
+            conn.close()
+            self.published += 1
+        except Exception as e:
+            # Progress events are best effort – never fail a job because of them
+            logger.error(f"Event backplane publish failed: {e}")
+
+    def _poll_loop(self):
+        conn = self._connect()
+        polls = 0
+        try:
+            while not self._stop.is_set():
+                try:
+                    rows = conn.execute(
+                        "SELECT id, topic, payload, created_at FROM event_bus WHERE id > ? ORDER BY id LIMIT 500",
+                        (self._last_id,),
+                    ).fetchall()
+                    for row_id, topic, payload, created_at in rows:
+                        self._last_id = row_id
+                        self.last_lag_ms = round((time.time() - created_at) * 1000, 1)
+                        self.delivered += 1
+                        try:
+                            self._deliver(topic, json.loads(payload))
+                        except Exception as e:
+                            logger.error(f"Event delivery failed for {topic}: {e}")
+                    polls += 1
+                    if polls % 600 == 0:
+                        conn.execute("DELETE FROM event_bus WHERE created_at < ?",
+                                     (time.time() - self.retention_seconds,))
+                        conn.commit()
+                    if len(rows) == 500:
+                        continue
+                except Exception as e:
+                    logger.error(f"Event backplane poll failed: {e}")
+                self._stop.wait(self.poll_interval)
+        finally:
+            conn.close()
+            # The poller thread ends here: do not leave its idle connection behind
+            self._pool.close_thread_connections()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._thread = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "sqlite",
+            "published": self.published,
+            "delivered": self.delivered,
+            "last_id": self._last_id,
+            "last_lag_ms": self.last_lag_ms,
+        }
+
+
+def create_backplane(kind: str = BACKPLANE_KIND, db_path: str = DB_PATH):
+    if kind == "sqlite":
+        return SQLiteBackplane(db_path)
+    if kind != "local":
+        logger.warning(f"Unknown EVENT_BACKPLANE '{kind}', using local")
+    return LocalBackplane()
@@ -0,0 +1,189 @@
+"""
+SBS Deutschland – Export Artifacts
+Lazily built, content-addressed export files (XLSX, CSV, DATEV).
+
+Every completed job used to run ExportManager().export_all(['xlsx', 'csv'])
+and export_to_datev, although most users download one format or none and
+the openpyxl workbook is the slowest step after extraction. Exports are now
+built on the first /api/download/{job_id}/{format} request:
+- artifact key = SHA-256 of (job, format, data version); the data version
+  is a hash of the job's results, so edited results get a new artifact
+- concurrent requests for the same artifact wait for one build
+- the key doubles as the download ETag
+- jobs store /api/download URLs as exported_files; email notifications
+  get real files via attachments(), which builds the same artifacts
+- artifacts older than EXPORT_ARTIFACT_MAX_AGE_DAYS are pruned
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import logging
+from concurrent.futures import Future
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_DIR = os.getenv("EXPORT_ARTIFACT_DIR", "exports/artifacts")
+MAX_AGE_SECONDS = int(os.getenv("EXPORT_ARTIFACT_MAX_AGE_DAYS", "30")) * 86400
+
+EXTENSIONS = {"xlsx": ".xlsx", "csv": ".csv", "datev": ".csv"}
+
+# results -> path of the rendered file
+Renderer = Callable[[List[Dict[str, Any]]], Union[str, Path, None]]
+
+
+@dataclass
+class Artifact:
+    path: Path
+    key: str
+    size: int
+    built: bool
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.key}"'
+
+
+def data_version(results: List[Dict[str, Any]]) -> str:
+    """Stable hash of a job's results."""
+    payload = json.dumps(results, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def download_url(job_id: str, fmt: str) -> str:
+    return f"/api/download/{job_id}/{fmt}"
+
+
+def is_download_url(location: str) -> bool:
+    """exported_files holds download URLs (lazy artifacts) or, for older jobs, file paths."""
+    return str(location).startswith("/api/download/")
+
+
+class ExportArtifactStore:
+    """
+    Usage:
+        artifact = export_artifacts.get_or_build(job_id, "xlsx", results)
+        FileResponse(artifact.path, headers={"ETag": artifact.etag})
+    """
+
+    def __init__(self, renderers: Optional[Dict[str, Renderer]] = None,
+                 root: Union[str, Path] = ARTIFACT_DIR, max_age_seconds: int = MAX_AGE_SECONDS):
+        self.renderers: Dict[str, Renderer] = dict(renderers or {})
+        self.root = Path(root)
+        self.max_age_seconds = max_age_seconds
+        self._building: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.builds = 0
+        self.hits = 0
+        self.coalesced = 0
+
+    def register(self, fmt: str, renderer: Renderer):
+        self.renderers[fmt] = renderer
+
+    def formats(self) -> List[str]:
+        return sorted(self.renderers)
+
+    def artifact_key(self, job_id: str, fmt: str, version: str) -> str:
+        return hashlib.sha256(f"{job_id}:{fmt}:{version}".encode("utf-8")).hexdigest()
+
+    def _path(self, key: str, fmt: str) -> Path:
+        return self.root / key[:2] / f"{key}{EXTENSIONS.get(fmt, '')}"
+
+    def get_or_build(self, job_id: str, fmt: str, results: List[Dict[str, Any]]) -> Artifact:
+        """Return the artifact, building it once if missing. Raises KeyError for unknown formats."""
+        if fmt not in self.renderers:
+            raise KeyError(fmt)
+        key = self.artifact_key(job_id, fmt, data_version(results))
+        path = self._path(key, fmt)
+
+        with self._lock:
+            if path.exists():
+                self.hits += 1
+                return Artifact(path, key, path.stat().st_size, built=False)
+            future = self._building.get(key)
+            owner = future is None
+            if owner:
+                future = self._building[key] = Future()
+            else:
+                self.coalesced += 1
+
+        if not owner:
+            return future.result()
+
+        try:
+            artifact = self._build(key, path, fmt, results)
+            future.set_result(artifact)
+            return artifact
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._building.pop(key, None)
+
+    def attachments(self, job_id: str, exported_files: Dict[str, str],
+                    results: List[Dict[str, Any]]) -> Dict[str, str]:
+        """
+        {format: file path} for email attachments. Download URLs are built as
+        artifacts; older jobs may still hold real file paths, which are kept
+        if they exist. Formats that fail to build are left out.
+        """
+        files: Dict[str, str] = {}
+        for fmt, location in (exported_files or {}).items():
+            if results and fmt in self.renderers:
+                try:
+                    files[fmt] = str(self.get_or_build(job_id, fmt, results).path)
+                except Exception as e:
+                    logger.error(f"Export {fmt} for {job_id} could not be attached: {e}")
+            elif location and not is_download_url(location) and Path(location).exists():
+                files[fmt] = location
+        return files
+
+    def _build(self, key: str, path: Path, fmt: str, results: List[Dict[str, Any]]) -> Artifact:
+        start = time.perf_counter()
+        rendered = self.renderers[fmt](results)
+        if not rendered or not Path(rendered).exists():
+            raise RuntimeError(f"Export {fmt} produced no file")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        shutil.move(str(rendered), tmp)
+        os.replace(tmp, path)
+
+        with self._lock:
+            self.builds += 1
+            prune_due = self.builds % 50 == 0
+        logger.info(f"Export artifact {fmt} built in {time.perf_counter() - start:.2f}s ({path.name})")
+        if prune_due:
+            self.prune()
+        return Artifact(path, key, path.stat().st_size, built=True)
+
+    def prune(self) -> int:
+        """Delete artifacts older than max_age_seconds."""
+        if not self.root.exists():
+            return 0
+        cutoff = time.time() - self.max_age_seconds
+        removed = 0
+        for artifact in self.root.glob("*/*"):
+            try:
+                if artifact.stat().st_mtime < cutoff:
+                    artifact.unlink()
+                    removed += 1
+            except OSError:
+                continue
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "builds": self.builds,
+                "hits": self.hits,
+                "coalesced": self.coalesced,
+                "building": len(self._building),
+                "formats": self.formats(),
+            }
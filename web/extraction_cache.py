@@ -0,0 +1,193 @@
+"""
+SBS Deutschland – Extraction Cache
+Content-addressed cache for invoice extraction results.
+
+Re-uploaded PDFs (email forwards, re-runs after failed exports, demo files)
+are looked up by SHA-256 of their bytes before parse_einvoice / the LLM:
+- Keyed by (tenant, content hash, extractor version) – no cross-tenant hits
+- TTL and max-entry eviction (least recently hit first)
+- Hit/miss counters for job stats
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import logging
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+
+from web.db_pool import DB_PATH, pool_for
+
+logger = logging.getLogger(__name__)
+
+# Bump when prompts/models/parsers change so old results are not reused
+EXTRACTOR_VERSION = os.getenv("EXTRACTOR_VERSION", "1")
+
+DEFAULT_TTL_SECONDS = int(os.getenv("EXTRACTION_CACHE_TTL_DAYS", "30")) * 86400
+DEFAULT_MAX_ENTRIES = int(os.getenv("EXTRACTION_CACHE_MAX_ENTRIES", "50000"))
+
+# Keys that describe one upload, not the document content
+_PER_UPLOAD_KEYS = ("filename",)
+
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path: Union[str, Path]) -> str:
+    """SHA-256 of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ExtractionCache:
+    """
+    SQLite-backed extraction cache.
+
+    Usage:
+        data, hit = extraction_cache.get_or_extract(user_id, pdf_path, extract_fn)
+    """
+
+    def __init__(self, db_path: str = DB_PATH, ttl_seconds: int = DEFAULT_TTL_SECONDS,
+                 max_entries: int = DEFAULT_MAX_ENTRIES, version: str = EXTRACTOR_VERSION):
+        self.db_path = db_path
+        self._pool = pool_for(db_path)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        self._puts_since_evict = 0
+        self._lock = threading.Lock()
+        self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        return self._pool.connect()
+
+    def _init_db(self):
+        """Create cache table if not exists."""
+        try:
+            conn = self._connect()
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS extraction_cache (
+                    tenant_key TEXT NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    extractor_version TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_hit_at REAL NOT NULL,
+                    hits INTEGER DEFAULT 0,
+                    PRIMARY KEY (tenant_key, content_hash, extractor_version)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_extraction_cache_lru ON extraction_cache(last_hit_at)")
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            logger.error(f"Extraction cache DB init failed: {e}")
+
+    def get(self, tenant: Any, content_hash: str) -> Optional[Dict[str, Any]]:
+        """Return a fresh copy of the cached result, or None."""
+        now = time.time()
+        try:
+            conn = self._connect()
+            row = conn.execute("""
+                SELECT data, created_at FROM extraction_cache
+                WHERE tenant_key = ? AND content_hash = ? AND extractor_version = ?
+            """, (str(tenant), content_hash, self.version)).fetchone()
+            if row and now - row[1] <= self.ttl_seconds:
+                conn.execute("""
+                    UPDATE extraction_cache SET last_hit_at = ?, hits = hits + 1
+                    WHERE tenant_key = ? AND content_hash = ? AND extractor_version = ?
+                """, (now, str(tenant), content_hash, self.version))
+                conn.commit()
+                conn.close()
+                with self._lock:
+                    self.hits += 1
+                return json.loads(row[0])
+            conn.close()
+        except Exception as e:
+            logger.error(f"Extraction cache lookup failed: {e}")
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, tenant: Any, content_hash: str, data: Dict[str, Any]):
+        """Store an extraction result (per-upload keys are stripped)."""
+        payload = {k: v for k, v in data.items() if k not in _PER_UPLOAD_KEYS}
+        now = time.time()
+        try:
+            conn = self._connect()
+            conn.execute("""
+                INSERT INTO extraction_cache
+                    (tenant_key, content_hash, extractor_version, data, created_at, last_hit_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(tenant_key, content_hash, extractor_version)
+                DO UPDATE SET data = excluded.data, created_at = excluded.created_at,
+                              last_hit_at = excluded.last_hit_at
+            """, (str(tenant), content_hash, self.version,
+                  json.dumps(payload, ensure_ascii=False, default=str), now, now))
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            logger.error(f"Extraction cache store failed: {e}")
+            return
+
+        with self._lock:
+            self._puts_since_evict += 1
+            due = self._puts_since_evict >= 100
+            if due:
+                self._puts_since_evict = 0
+        if due:
+            self.evict()
+
+    def get_or_extract(self, tenant: Any, path: Union[str, Path],
+                       extract: Callable[[], Dict[str, Any]],
+                       content_hash: Optional[str] = None) -> Tuple[Dict[str, Any], bool]:
+        """Return (data, cache_hit). Calls extract() only on a miss."""
+        content_hash = content_hash or hash_file(path)
+        cached = self.get(tenant, content_hash)
+        if cached is not None:
+            return cached, True
+        data = extract()
+        if data:
+            self.put(tenant, content_hash, data)
+        return data, False
+
+    def evict(self) -> int:
+        """Drop expired entries and trim to max_entries (least recently hit first)."""
+        try:
+            conn = self._connect()
+            expired = conn.execute(
+                "DELETE FROM extraction_cache WHERE created_at < ?",
+                (time.time() - self.ttl_seconds,),
+            ).rowcount
+            trimmed = conn.execute("""
+                DELETE FROM extraction_cache WHERE rowid IN (
+                    SELECT rowid FROM extraction_cache ORDER BY last_hit_at DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,)).rowcount
+            conn.commit()
+            conn.close()
+            return expired + trimmed
+        except Exception as e:
+            logger.error(f"Extraction cache eviction failed: {e}")
+            return 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 3) if total else 0.0,
+                "extractor_version": self.version,
+            }
+
+
+# Global instance
+extraction_cache = ExtractionCache()
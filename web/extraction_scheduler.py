@@ -0,0 +1,173 @@
+"""
+SBS Deutschland – Extraction Scheduler
+Process-wide bounded worker pool with per-tenant fair scheduling.
+
+Replaces the per-job ThreadPoolExecutor in process_invoices_background:
+- One global concurrency cap for LLM calls and PDF parsing (EXTRACTION_MAX_WORKERS)
+- Per-tenant FIFO queues served weighted round-robin, so a 2,000-PDF batch
+  cannot starve a 3-PDF upload
+- Queue depth and per-tenant in-flight counts for monitoring
+"""
+
+import os
+import threading
+import logging
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_WORKERS = int(os.getenv("EXTRACTION_MAX_WORKERS", "12"))
+
+
+class _TenantQueue:
+    __slots__ = ("tasks", "weight", "credit", "in_flight", "completed")
+
+    def __init__(self, weight: int):
+        self.tasks: Deque[Tuple[Future, Callable, tuple, dict]] = deque()
+        self.weight = weight
+        self.credit = weight
+        self.in_flight = 0
+        self.completed = 0
+
+
+class ExtractionScheduler:
+    """
+    Fixed-size thread pool fed from per-tenant queues.
+
+    Each tenant with pending work sits in a ring; a worker takes up to
+    `weight` tasks from the tenant at the head before rotating it to the
+    tail (weighted round-robin). Tenants leave the ring when drained.
+
+    Usage:
+        future = extraction_scheduler.submit(user_id, process_single_pdf, pdf_path)
+        for f in as_completed(futures): ...
+    """
+
+    def __init__(self, max_workers: int = DEFAULT_MAX_WORKERS,
+                 weights: Optional[Dict[Any, int]] = None, name: str = "extract"):
+        self.max_workers = max(1, max_workers)
+        self.weights = dict(weights or {})
+        self.name = name
+        self._tenants: Dict[Any, _TenantQueue] = {}
+        self._ring: Deque[Any] = deque()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._shutdown = False
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    def submit(self, tenant: Any, fn: Callable, *args, **kwargs) -> Future:
+        """Queue fn(*args, **kwargs) for the given tenant/user."""
+        future: Future = Future()
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("ExtractionScheduler is shut down")
+            queue = self._tenants.get(tenant)
+            if queue is None:
+                queue = _TenantQueue(max(1, self.weights.get(tenant, 1)))
+                self._tenants[tenant] = queue
+            if not queue.tasks:
+                self._ring.append(tenant)
+            queue.tasks.append((future, fn, args, kwargs))
+            self._ensure_threads()
+            self._cond.notify()
+        return future
+
+    def set_weight(self, tenant: Any, weight: int):
+        """Give a tenant a larger share (e.g. Enterprise plan)."""
+        with self._cond:
+            self.weights[tenant] = max(1, weight)
+            if tenant in self._tenants:
+                self._tenants[tenant].weight = self.weights[tenant]
+
+    def stats(self) -> Dict[str, Any]:
+        """Snapshot for monitoring: global and per-tenant queue/in-flight counts."""
+        with self._cond:
+            tenants = {
+                str(key): {"queued": len(q.tasks), "in_flight": q.in_flight, "completed": q.completed}
+                for key, q in self._tenants.items()
+                if q.tasks or q.in_flight
+            }
+            return {
+                "max_workers": self.max_workers,
+                "threads": len(self._threads),
+                "queue_depth": sum(len(q.tasks) for q in self._tenants.values()),
+                "in_flight": sum(q.in_flight for q in self._tenants.values()),
+                "active_tenants": len(tenants),
+                "tenants": tenants,
+            }
+
+    def shutdown(self, wait: bool = True):
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    # ------------------------------------------------------------------
+    # Internals
+    # ------------------------------------------------------------------
+
+    def _ensure_threads(self):
+        # Threads are started lazily, up to the global cap
+        if len(self._threads) < self.max_workers:
+            thread = threading.Thread(
+                target=self._worker, daemon=True, name=f"{self.name}-{len(self._threads)}"
+            )
+            self._threads.append(thread)
+            thread.start()
+
+    def _next_task(self):
+        """Pick the next task (caller holds the lock)."""
+        while self._ring:
+            tenant = self._ring[0]
+            queue = self._tenants[tenant]
+            if not queue.tasks:
+                self._ring.popleft()
+                queue.credit = queue.weight
+                continue
+
+            task = queue.tasks.popleft()
+            queue.credit -= 1
+            if not queue.tasks:
+                self._ring.popleft()
+                queue.credit = queue.weight
+            elif queue.credit <= 0:
+                self._ring.rotate(-1)
+                queue.credit = queue.weight
+            return tenant, queue, task
+        return None
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                picked = self._next_task()
+                while picked is None:
+                    if self._shutdown:
+                        return
+                    self._cond.wait()
+                    picked = self._next_task()
+                tenant, queue, (future, fn, args, kwargs) = picked
+                queue.in_flight += 1
+
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(fn(*args, **kwargs))
+                    except BaseException as e:
+                        future.set_exception(e)
+            finally:
+                with self._cond:
+                    queue.in_flight -= 1
+                    queue.completed += 1
+                    if not queue.tasks and not queue.in_flight and self._tenants.get(tenant) is queue:
+                        del self._tenants[tenant]
+
+
+# Global instance
+extraction_scheduler = ExtractionScheduler()
@@ -0,0 +1,226 @@
+"""
+SBS Deutschland – Identity Cache
+Who is the user and what may they do – loaded once per request.
+
+A dashboard request called get_user_info, is_admin_user, require_admin,
+is_admin_or_owner, has_product_access (twice) and has_permission, and each
+of them opened its own connection to query users, subscriptions or roles.
+Now:
+- identities.get(user_id) returns an Identity built from one users row,
+  kept in a process cache for IDENTITY_CACHE_TTL seconds
+- entitlement checks owned by other modules (rbac, multi_product_
+  subscriptions) are registered as named checks and memoized on the
+  Identity, so each (check, args) runs at most once per TTL
+- identity_for(request) pins the Identity on request.state, so one request
+  sees one consistent snapshot even if the cache entry expires meanwhile
+- role, plan and profile mutations call identities.invalidate(user_id)
+  (without a user id when it is unknown, e.g. Stripe webhooks); other
+  workers pick the change up when their entry expires
+"""
+
+import os
+import threading
+import time
+import logging
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from web.db_pool import DB_PATH, pool_for
+
+logger = logging.getLogger(__name__)
+
+IDENTITY_CACHE_TTL = float(os.getenv("IDENTITY_CACHE_TTL", "15"))
+MAX_ENTRIES = int(os.getenv("IDENTITY_CACHE_SIZE", "10000"))
+
+Check = Callable[..., Any]
+
+
+class Identity:
+    """Snapshot of one user: users row plus memoized entitlement checks."""
+
+    __slots__ = ("user_id", "row", "_checks", "_results", "_lock")
+
+    def __init__(self, user_id: int, row: Optional[Dict[str, Any]], checks: Dict[str, Check]):
+        self.user_id = user_id
+        self.row = row              # None: user not found (or DB error)
+        self._checks = checks
+        self._results: Dict[Tuple, Any] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def exists(self) -> bool:
+        return self.row is not None
+
+    @property
+    def email(self) -> str:
+        return (self.row or {}).get("email") or ""
+
+    @property
+    def name(self) -> str:
+        return (self.row or {}).get("name") or ""
+
+    @property
+    def is_admin(self) -> bool:
+        return bool((self.row or {}).get("is_admin"))
+
+    @property
+    def is_active(self) -> bool:
+        value = (self.row or {}).get("is_active")
+        return value is None or bool(value)
+
+    @property
+    def plan(self) -> str:
+        return (self.row or {}).get("plan") or "Free"
+
+    def user_info(self) -> Dict[str, Any]:
+        """Dict in the shape templates expect from get_user_info()."""
+        if self.row is None:
+            return {"id": self.user_id, "email": "", "name": "User", "is_admin": False, "plan": "Free"}
+        return {
+            "id": self.user_id,
+            "email": self.email,
+            "name": self.name,
+            "is_admin": self.is_admin,
+            "plan": "Enterprise" if self.is_admin else "Free",
+        }
+
+    def check(self, name: str, *args) -> Any:
+        """Run a registered check once; later calls with the same args are served from memory."""
+        key = (name, *args)
+        with self._lock:
+            if key in self._results:
+                return self._results[key]
+        try:
+            check = self._checks[name]
+        except KeyError:
+            raise KeyError(f"Identity check '{name}' is not registered") from None
+        # Errors propagate and are not memoized
+        result = check(self.user_id, *args)
+        with self._lock:
+            self._results.setdefault(key, result)
+        return result
+
+    def has_permission(self, permission) -> bool:
+        return bool(self.check("permission", permission))
+
+    def is_admin_or_owner(self) -> bool:
+        return bool(self.check("admin_or_owner"))
+
+    def product_access(self, product: str) -> Dict[str, Any]:
+        return self.check("product", product)
+
+
+class IdentityCache:
+    """
+    Usage:
+        identities.register("permission", has_permission)   # (user_id, *args)
+        identity = identity_for(request)
+        if identity.is_admin or identity.has_permission(Permission.INVOICE_APPROVE): ...
+        identities.invalidate(user_id)                       # after a role/plan/profile change
+    """
+
+    def __init__(self, db_path: str = DB_PATH, ttl: float = IDENTITY_CACHE_TTL,
+                 max_entries: int = MAX_ENTRIES, clock: Callable[[], float] = time.monotonic):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._clock = clock
+        self._pool = pool_for(db_path)
+        self._lock = threading.Lock()
+        self._entries: Dict[int, Tuple[Identity, float]] = {}
+        self._checks: Dict[str, Check] = {}
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.invalidations = 0
+
+    def register(self, name: str, check: Check):
+        """check(user_id, *args) -> result; registered checks are memoized per Identity."""
+        self._checks[name] = check
+
+    def _load(self, user_id: int) -> Tuple[Optional[Dict[str, Any]], bool]:
+        """(users row as dict or None, ok) – ok is False on DB errors."""
+        try:
+            conn = self._pool.connect()
+            try:
+                cursor = conn.execute("SELECT * FROM users WHERE id = ?", (user_id,))
+                row = cursor.fetchone()
+                columns = [col[0] for col in cursor.description]
+            finally:
+                conn.close()
+            return (dict(zip(columns, row)) if row else None), True
+        except Exception as e:
+            logger.error(f"Identity load failed for user {user_id}: {e}")
+            return None, False
+
+    def get(self, user_id: Optional[int]) -> Optional[Identity]:
+        if not user_id:
+            return None
+        user_id = int(user_id)
+        now = self._clock()
+        with self._lock:
+            cached = self._entries.get(user_id)
+            if cached is not None and cached[1] > now:
+                self.hits += 1
+                return cached[0]
+            self.misses += 1
+
+        row, ok = self._load(user_id)
+        identity = Identity(user_id, row, self._checks)
+        with self._lock:
+            if not ok:
+                # DB error: serve this request, retry on the next one
+                self.errors += 1
+                return identity
+            if len(self._entries) >= self.max_entries:
+                self._evict(now)
+            self._entries[user_id] = (identity, now + self.ttl)
+        return identity
+
+    def _evict(self, now: float):
+        """Drop expired entries; if still full, the oldest quarter. Caller holds the lock."""
+        for key in [k for k, (_, expires) in self._entries.items() if expires <= now]:
+            del self._entries[key]
+        if len(self._entries) >= self.max_entries:
+            for key in list(self._entries)[:max(1, self.max_entries // 4)]:
+                del self._entries[key]
+
+    def invalidate(self, user_id: Optional[int] = None):
+        """Forget cached identities (one user, or all when the user is unknown)."""
+        with self._lock:
+            self.invalidations += 1
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(int(user_id), None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "errors": self.errors,
+                "invalidations": self.invalidations,
+                "checks": sorted(self._checks),
+            }
+
+
+def identity_for(request, cache: Optional[IdentityCache] = None) -> Optional[Identity]:
+    """The request's Identity (None when not logged in), loaded once and pinned on request.state."""
+    try:
+        user_id = request.session.get("user_id")
+    except Exception:
+        user_id = None
+    state = getattr(request, "state", None)
+    identity = getattr(state, "identity", None) if state is not None else None
+    if identity is not None and user_id and identity.user_id == int(user_id):
+        return identity
+    identity = (cache or identities).get(user_id)
+    if identity is not None and state is not None:
+        state.identity = identity
+    return identity
+
+
+# Global instance
+identities = IdentityCache()
@@ -0,0 +1,431 @@
+"""
+SBS Deutschland – Durable Job Store
+Persistent job state and work queue shared by all uvicorn workers.
+
+Jobs live in a SQLite table (WAL mode) instead of a per-process dict:
+- Any worker can answer /api/status and /api/results for any job
+- /api/process only enqueues; a worker claims the job with a lease
+- A heartbeat thread extends the lease while the job is running
+- Expired leases (crashed worker, deploy) are re-claimed by another worker
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from web.db_pool import DB_PATH, pool_for
+
+logger = logging.getLogger(__name__)
+
+# Job states that still need a worker
+ACTIVE_STATES = ("uploaded", "queued", "processing")
+
+DEFAULT_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "120"))
+DEFAULT_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# Finished jobs (incl. their payload) are deleted after this many hours
+DEFAULT_RETENTION_HOURS = float(os.getenv("JOB_RETENTION_HOURS", "24"))
+FINISHED_STATES = ("completed", "failed")
+# Jobs run concurrently per process, so several tenants' files reach the
+# extraction scheduler at once (its round-robin needs more than one tenant)
+DEFAULT_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", "4"))
+
+
+class JobStore:
+    """
+    SQLite-backed job store with lease-based claiming.
+
+    The job payload (files, progress, results, stats, ...) is stored as JSON;
+    status and lease columns are kept separately so claiming is a single
+    indexed UPDATE inside an IMMEDIATE transaction.
+    """
+
+    def __init__(self, db_path: str = DB_PATH, lease_seconds: int = DEFAULT_LEASE_SECONDS,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS, retention_hours: float = DEFAULT_RETENTION_HOURS):
+        self.db_path = db_path
+        self._pool = pool_for(db_path)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retention_hours = retention_hours
+        self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = self._pool.connect()
+        # Autocommit: claim/release use explicit BEGIN IMMEDIATE (reset when returned to the pool)
+        conn.isolation_level = None
+        return conn
+
+    def _init_db(self):
+        """Create job queue table if not exists."""
+        conn = self._connect()
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS job_queue (
+                    job_id TEXT PRIMARY KEY,
+                    user_id INTEGER,
+                    status TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    attempts INTEGER DEFAULT 0,
+                    queued_at REAL,
+                    lease_owner TEXT,
+                    lease_expires_at REAL,
+                    heartbeat_at REAL,
+                    created_at REAL,
+                    updated_at REAL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_job_queue_claim ON job_queue(status, lease_expires_at, queued_at)")
+        finally:
+            conn.close()
+
+    # ------------------------------------------------------------------
+    # Dict-like access (replaces the former processing_jobs dict)
+    # ------------------------------------------------------------------
+
+    def __contains__(self, job_id: str) -> bool:
+        return self.get(job_id) is not None
+
+    def __getitem__(self, job_id: str) -> Dict[str, Any]:
+        job = self.get(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        return job
+
+    def __setitem__(self, job_id: str, data: Dict[str, Any]):
+        self.create(job_id, data)
+
+    def __len__(self) -> int:
+        """Number of jobs that are not finished yet."""
+        conn = self._connect()
+        try:
+            placeholders = ",".join("?" for _ in ACTIVE_STATES)
+            row = conn.execute(
+                f"SELECT COUNT(*) FROM job_queue WHERE status IN ({placeholders})", ACTIVE_STATES
+            ).fetchone()
+            return row[0]
+        finally:
+            conn.close()
+
+    def get(self, job_id: str, default: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """Return a snapshot of the job dict (mutations are not persisted)."""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT status, data FROM job_queue WHERE job_id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+        if not row:
+            return default
+        job = json.loads(row[1])
+        job["status"] = row[0]
+        return job
+
+    # ------------------------------------------------------------------
+    # Mutations
+    # ------------------------------------------------------------------
+
+    def create(self, job_id: str, data: Dict[str, Any]):
+        """Insert or replace a job."""
+        now = time.time()
+        status = data.get("status", "uploaded")
+        conn = self._connect()
+        try:
+            conn.execute("""
+                INSERT INTO job_queue (job_id, user_id, status, data, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(job_id) DO UPDATE SET
+                    user_id = excluded.user_id, status = excluded.status,
+                    data = excluded.data, updated_at = excluded.updated_at
+            """, (job_id, _as_int(data.get("user_id")), status, _dumps(data), now, now))
+        finally:
+            conn.close()
+
+    def update(self, job_id: str, fields: Dict[str, Any]) -> bool:
+        """Merge fields into the job payload. Returns False if the job is unknown."""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT status, data FROM job_queue WHERE job_id = ?", (job_id,)).fetchone()
+            if not row:
+                conn.execute("ROLLBACK")
+                return False
+            job = json.loads(row[1])
+            job.update(fields)
+            status = fields.get("status", row[0])
+            job["status"] = status
+            conn.execute(
+                "UPDATE job_queue SET status = ?, data = ?, updated_at = ? WHERE job_id = ?",
+                (status, _dumps(job), time.time(), job_id),
+            )
+            conn.execute("COMMIT")
+            return True
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    # ------------------------------------------------------------------
+    # Queue operations
+    # ------------------------------------------------------------------
+
+    def enqueue(self, job_id: str) -> bool:
+        """
+        Mark a job as ready for processing.
+        Returns False if the job is unknown or already queued/processing.
+        """
+        conn = self._connect()
+        try:
+            # Re-enqueued jobs (user retries) get a fresh attempt budget
+            cursor = conn.execute("""
+                UPDATE job_queue
+                SET status = 'queued', attempts = 0, queued_at = ?, updated_at = ?
+                WHERE job_id = ? AND status NOT IN ('queued', 'processing')
+            """, (time.time(), time.time(), job_id))
+            return cursor.rowcount == 1
+        finally:
+            conn.close()
+
+    def claim(self, worker_id: str) -> Optional[str]:
+        """
+        Claim the oldest queued job (or one whose lease expired).
+        Returns the job_id or None if nothing is claimable.
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("""
+                SELECT job_id, attempts FROM job_queue
+                WHERE status = 'queued'
+                   OR (status = 'processing' AND lease_expires_at < ?)
+                ORDER BY queued_at
+                LIMIT 1
+            """, (now,)).fetchone()
+            if not row:
+                conn.execute("COMMIT")
+                return None
+
+            job_id, attempts = row
+            if attempts >= self.max_attempts:
+                # Poison job: give up instead of crashing workers forever
+                self._finish_locked(conn, job_id, "failed", {"error": "max_attempts_exceeded"})
+                conn.execute("COMMIT")
+                logger.error(f"Job {job_id} exceeded {self.max_attempts} attempts, marked failed")
+                return None
+
+            conn.execute("""
+                UPDATE job_queue
+                SET status = 'processing', lease_owner = ?, lease_expires_at = ?,
+                    heartbeat_at = ?, attempts = attempts + 1, updated_at = ?
+                WHERE job_id = ?
+            """, (worker_id, now + self.lease_seconds, now, now, job_id))
+            conn.execute("COMMIT")
+            return job_id
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def heartbeat(self, job_id: str, worker_id: str) -> bool:
+        """
+        Extend the lease. Returns False if the lease was lost to another worker.
+        The handler may already have set the final status; the lease is held until release().
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            cursor = conn.execute("""
+                UPDATE job_queue SET lease_expires_at = ?, heartbeat_at = ?
+                WHERE job_id = ? AND lease_owner = ?
+            """, (now + self.lease_seconds, now, job_id, worker_id))
+            return cursor.rowcount == 1
+        finally:
+            conn.close()
+
+    def release(self, job_id: str, worker_id: str, status: str = "completed",
+                fields: Optional[Dict[str, Any]] = None) -> bool:
+        """Finish a claimed job and drop the lease."""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT lease_owner FROM job_queue WHERE job_id = ?", (job_id,)).fetchone()
+            if not row or row[0] != worker_id:
+                conn.execute("ROLLBACK")
+                return False
+            self._finish_locked(conn, job_id, status, fields or {})
+            conn.execute("COMMIT")
+            return True
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _finish_locked(self, conn: sqlite3.Connection, job_id: str, status: str, fields: Dict[str, Any]):
+        row = conn.execute("SELECT data FROM job_queue WHERE job_id = ?", (job_id,)).fetchone()
+        job = json.loads(row[0]) if row else {}
+        job.update(fields)
+        job["status"] = status
+        conn.execute("""
+            UPDATE job_queue
+            SET status = ?, data = ?, lease_owner = NULL, lease_expires_at = NULL, updated_at = ?
+            WHERE job_id = ?
+        """, (status, _dumps(job), time.time(), job_id))
+
+    def prune(self, now: Optional[float] = None) -> int:
+        """Delete finished jobs older than retention_hours (their invoices live in the invoices table)."""
+        cutoff = (now or time.time()) - self.retention_hours * 3600
+        conn = self._connect()
+        try:
+            placeholders = ",".join("?" for _ in FINISHED_STATES)
+            cursor = conn.execute(
+                f"DELETE FROM job_queue WHERE status IN ({placeholders}) AND lease_owner IS NULL AND updated_at < ?",
+                (*FINISHED_STATES, cutoff),
+            )
+            if cursor.rowcount:
+                logger.info(f"Pruned {cursor.rowcount} finished jobs from job_queue")
+            return cursor.rowcount
+        finally:
+            conn.close()
+
+    def queue_stats(self) -> Dict[str, int]:
+        """Job counts per status (for health/monitoring)."""
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT status, COUNT(*) FROM job_queue GROUP BY status").fetchall()
+            return {status: count for status, count in rows}
+        finally:
+            conn.close()
+
+
+class _LeaseHeartbeat(threading.Thread):
+    """
+    Keeps a job lease alive from a separate thread.
+    A thread (not an asyncio task) so the lease survives handlers that block the event loop.
+    """
+
+    def __init__(self, store: JobStore, job_id: str, worker_id: str):
+        super().__init__(daemon=True, name=f"lease-{job_id[:8]}")
+        self.store = store
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.lost = False
+        self._stop_event = threading.Event()
+
+    def run(self):
+        interval = max(1.0, self.store.lease_seconds / 3)
+        while not self._stop_event.wait(interval):
+            try:
+                if not self.store.heartbeat(self.job_id, self.worker_id):
+                    self.lost = True
+                    logger.warning(f"Lease lost for job {self.job_id}")
+                    return
+            except Exception as e:
+                logger.error(f"Heartbeat failed for job {self.job_id}: {e}")
+
+    def stop(self):
+        self._stop_event.set()
+
+
+class JobQueueWorker:
+    """
+    Per-process worker loop: claims jobs from the store and runs the handler,
+    up to `concurrency` jobs at a time (a task set bounded by a semaphore).
+
+    Usage:
+        worker = JobQueueWorker(job_store, process_invoices_background)
+        asyncio.create_task(worker.run())
+    """
+
+    def __init__(self, store: JobStore, handler: Callable[[str], Awaitable[None]],
+                 poll_interval: float = 1.0, worker_id: Optional[str] = None,
+                 concurrency: int = DEFAULT_CONCURRENCY):
+        self.store = store
+        self.handler = handler
+        self.poll_interval = poll_interval
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.concurrency = max(1, concurrency)
+        self._tasks: Set[asyncio.Task] = set()
+        self._stopped = False
+        self.completed = 0
+
+    async def run(self):
+        logger.info(f"Job worker {self.worker_id} started (concurrency {self.concurrency})")
+        slots = asyncio.Semaphore(self.concurrency)
+        while not self._stopped:
+            # Only claim when a slot is free – otherwise leave the job to other workers
+            await slots.acquire()
+            try:
+                job_id = await asyncio.to_thread(self.store.claim, self.worker_id)
+            except Exception as e:
+                logger.error(f"Job claim failed: {e}")
+                job_id = None
+
+            if not job_id:
+                slots.release()
+                await asyncio.sleep(self.poll_interval)
+                continue
+
+            task = asyncio.create_task(self._run_in_slot(job_id, slots))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run_in_slot(self, job_id: str, slots: asyncio.Semaphore):
+        try:
+            await self.run_job(job_id)
+        except Exception:
+            logger.exception(f"Job {job_id}: release failed")
+        finally:
+            self.completed += 1
+            slots.release()
+
+    async def run_job(self, job_id: str):
+        heartbeat = _LeaseHeartbeat(self.store, job_id, self.worker_id)
+        heartbeat.start()
+        try:
+            await self.handler(job_id)
+            status = "completed"
+            fields = {}
+        except Exception as e:
+            logger.exception(f"Job {job_id} failed in worker {self.worker_id}")
+            status = "failed"
+            fields = {"error": str(e)}
+        finally:
+            heartbeat.stop()
+
+        if heartbeat.lost:
+            # Another worker owns the job now; do not overwrite its state
+            return
+        current = await asyncio.to_thread(self.store.get, job_id) or {}
+        if status == "completed" and current.get("status") not in (None, "processing"):
+            status = current["status"]
+        await asyncio.to_thread(self.store.release, job_id, self.worker_id, status, fields)
+
+    def stop(self):
+        self._stopped = True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "worker_id": self.worker_id,
+            "concurrency": self.concurrency,
+            "running": len(self._tasks),
+            "completed": self.completed,
+        }
+
+
+def _dumps(data: Dict[str, Any]) -> str:
+    return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def _as_int(value: Any) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
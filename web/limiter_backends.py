@@ -0,0 +1,301 @@
+"""
+SBS Deutschland – Rate Limiter Backends
+Shared burst counters so limits hold across uvicorn workers and hosts.
+
+EnterpriseRateLimiter kept its per-minute windows in process memory: with
+N workers a Free-plan user got N× the PLAN_LIMITS burst allowance, which
+also undermined the LLM/MBR cost control. The counting now lives behind a
+small backend interface (hit/peek/stats, sliding window per key).
+
+Backends (RATE_LIMIT_BACKEND):
+- "memory": per-process dict (single worker, tests)
+- "sqlite": rate_limit_windows table in RATE_LIMIT_SQLITE_PATH; every hit
+  is one BEGIN IMMEDIATE transaction, so workers on one host count
+  atomically
+- "redis":  any server speaking the Redis protocol (RATE_LIMIT_REDIS_URL);
+  INCR on the current window key, rolled back with DECR when over the
+  limit – never over-admits, needs no scripting support
+Backend errors raise BackendUnavailable; the limiter then fails open or
+closed according to RATE_LIMIT_FAIL_MODE.
+"""
+
+import os
+import socket
+import sqlite3
+import threading
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from web.db_pool import pool_for
+
+logger = logging.getLogger(__name__)
+
+BACKEND_KIND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+FAIL_OPEN = os.getenv("RATE_LIMIT_FAIL_MODE", "open") != "closed"
+# Kept out of invoices.db: one write per guarded request
+SQLITE_PATH = os.getenv("RATE_LIMIT_SQLITE_PATH", "rate_limits.db")
+REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0")
+REDIS_TIMEOUT_SECONDS = float(os.getenv("RATE_LIMIT_REDIS_TIMEOUT", "0.25"))
+KEY_PREFIX = "rl:"
+
+
+class BackendUnavailable(Exception):
+    """The shared counter store could not be reached or answered with an error."""
+
+
+def _window(now: float, window: int) -> Tuple[int, float]:
+    """(start of the current window, weight of the previous window)."""
+    start = int(now - (now % window))
+    return start, 1 - (now - start) / window
+
+
+class MemoryBackend:
+    """Sliding-window counters in this process only."""
+
+    shared = False
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key -> [window_start, previous_count, current_count]
+        self.windows: Dict[str, List[int]] = {}
+        self.last_cleanup = 0.0
+
+    def _entry(self, key: str, window: int, now: float) -> Tuple[List[int], float]:
+        """Caller holds the lock."""
+        start, weight = _window(now, window)
+        entry = self.windows.get(key)
+        if entry is None or start - entry[0] >= 2 * window:
+            entry = self.windows[key] = [start, 0, 0]
+        elif entry[0] != start:
+            entry[0], entry[1], entry[2] = start, entry[2], 0
+        return entry, entry[1] * weight + entry[2]
+
+    def _cleanup(self, now: float, window: int):
+        """Drop windows that no longer affect any decision. Caller holds the lock."""
+        if now - self.last_cleanup < 30:
+            return
+        for key in [k for k, w in self.windows.items() if now - w[0] >= 2 * window]:
+            del self.windows[key]
+        self.last_cleanup = now
+
+    def hit(self, key: str, limit: int, window: int, now: float) -> Tuple[bool, float]:
+        with self._lock:
+            self._cleanup(now, window)
+            entry, estimate = self._entry(key, window, now)
+            if estimate >= limit:
+                return False, estimate
+            entry[2] += 1
+            return True, estimate + 1
+
+    def peek(self, key: str, window: int, now: float) -> float:
+        with self._lock:
+            return self._entry(key, window, now)[1]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"backend": "memory", "keys": len(self.windows)}
+
+
+class SQLiteBackend:
+    """Counters in a shared SQLite file; BEGIN IMMEDIATE serialises hits across processes."""
+
+    shared = True
+
+    def __init__(self, db_path: str = SQLITE_PATH, prune_interval: float = 60):
+        self.db_path = db_path
+        self.prune_interval = prune_interval
+        self._pool = pool_for(db_path)
+        self._last_prune = 0.0
+        self._init_db()
+
+    def _init_db(self):
+        try:
+            conn = self._pool.connect()
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS rate_limit_windows (
+                    key TEXT NOT NULL,
+                    window_start INTEGER NOT NULL,
+                    count INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (key, window_start)
+                ) WITHOUT ROWID
+            """)
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            logger.error(f"Rate limit window table init failed: {e}")
+
+    def _counts(self, conn, key: str, start: int, window: int) -> Tuple[int, int]:
+        rows = dict(conn.execute(
+            "SELECT window_start, count FROM rate_limit_windows WHERE key = ? AND window_start IN (?, ?)",
+            (key, start - window, start),
+        ).fetchall())
+        return rows.get(start - window, 0), rows.get(start, 0)
+
+    def hit(self, key: str, limit: int, window: int, now: float) -> Tuple[bool, float]:
+        start, weight = _window(now, window)
+        try:
+            conn = self._pool.connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                previous, current = self._counts(conn, key, start, window)
+                estimate = previous * weight + current
+                allowed = estimate < limit
+                if allowed:
+                    conn.execute("""
+                        INSERT INTO rate_limit_windows (key, window_start, count) VALUES (?, ?, 1)
+                        ON CONFLICT(key, window_start) DO UPDATE SET count = count + 1
+                    """, (key, start))
+                    estimate += 1
+                if now - self._last_prune >= self.prune_interval:
+                    self._last_prune = now
+                    conn.execute("DELETE FROM rate_limit_windows WHERE window_start < ?", (start - 2 * window,))
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            raise BackendUnavailable(f"sqlite: {e}") from e
+        return allowed, estimate
+
+    def peek(self, key: str, window: int, now: float) -> float:
+        start, weight = _window(now, window)
+        try:
+            conn = self._pool.connect()
+            try:
+                previous, current = self._counts(conn, key, start, window)
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            raise BackendUnavailable(f"sqlite: {e}") from e
+        return previous * weight + current
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "sqlite", "db_path": self.db_path}
+
+
+class RespError(Exception):
+    """Error reply from the server (-ERR ...)."""
+
+
+class RespConnection:
+    """Minimal Redis protocol (RESP2) client: pipelined commands over one socket."""
+
+    def __init__(self, host: str, port: int, db: int = 0, password: Optional[str] = None,
+                 timeout: float = REDIS_TIMEOUT_SECONDS):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.settimeout(timeout)
+        self._file = self.sock.makefile("rb")
+        if password:
+            self.pipeline(("AUTH", password))
+        if db:
+            self.pipeline(("SELECT", db))
+
+    @staticmethod
+    def _encode(command) -> bytes:
+        parts = [b"*%d\r\n" % len(command)]
+        for arg in command:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(parts)
+
+    def _read(self):
+        line = self._file.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("connection closed")
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body.decode()
+        if kind == b"-":
+            raise RespError(body.decode())
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            size = int(body)
+            if size < 0:
+                return None
+            data = self._file.read(size + 2)
+            return data[:-2]
+        if kind == b"*":
+            size = int(body)
+            return None if size < 0 else [self._read() for _ in range(size)]
+        raise ConnectionError(f"unexpected reply {line!r}")
+
+    def pipeline(self, *commands) -> list:
+        self.sock.sendall(b"".join(self._encode(command) for command in commands))
+        return [self._read() for _ in commands]
+
+    def close(self):
+        try:
+            self._file.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class RedisBackend:
+    """Fixed-window keys per (key, window start), combined into a sliding window."""
+
+    shared = True
+
+    def __init__(self, url: str = REDIS_URL, prefix: str = KEY_PREFIX, timeout: float = REDIS_TIMEOUT_SECONDS):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.db = int((parsed.path or "/0").lstrip("/") or 0)
+        self.password = parsed.password
+        self.prefix = prefix
+        self.timeout = timeout
+        self._local = threading.local()
+        self.errors = 0
+
+    def _conn(self) -> RespConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = RespConnection(self.host, self.port, self.db, self.password, self.timeout)
+        return conn
+
+    def _call(self, *commands) -> list:
+        try:
+            return self._conn().pipeline(*commands)
+        except (OSError, ConnectionError, RespError, ValueError) as e:
+            conn = getattr(self._local, "conn", None)
+            if conn is not None:
+                conn.close()
+                self._local.conn = None
+            self.errors += 1
+            raise BackendUnavailable(f"redis {self.host}:{self.port}: {e}") from e
+
+    def _keys(self, key: str, start: int, window: int) -> Tuple[str, str]:
+        return f"{self.prefix}{key}:{start}", f"{self.prefix}{key}:{start - window}"
+
+    def hit(self, key: str, limit: int, window: int, now: float) -> Tuple[bool, float]:
+        start, weight = _window(now, window)
+        current_key, previous_key = self._keys(key, start, window)
+        current, _, previous = self._call(
+            ("INCR", current_key),
+            ("PEXPIRE", current_key, 2 * window * 1000),
+            ("GET", previous_key),
+        )
+        estimate = int(previous or 0) * weight + current
+        if estimate - 1 < limit:
+            return True, estimate
+        self._call(("DECR", current_key))
+        return False, estimate - 1
+
+    def peek(self, key: str, window: int, now: float) -> float:
+        start, weight = _window(now, window)
+        current, previous = self._call(("MGET", *self._keys(key, start, window)))[0]
+        return int(previous or 0) * weight + int(current or 0)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "redis", "server": f"{self.host}:{self.port}/{self.db}", "errors": self.errors}
+
+
+def create_backend(kind: str = BACKEND_KIND):
+    if kind == "sqlite":
+        return SQLiteBackend()
+    if kind == "redis":
+        return RedisBackend()
+    if kind != "memory":
+        logger.warning(f"Unknown RATE_LIMIT_BACKEND '{kind}', using memory")
+    return MemoryBackend()
@@ -0,0 +1,259 @@
+"""
+SBS Deutschland – Event Loop Stall Monitor
+Measures event-loop lag and records which route and call site blocked it.
+
+Many async handlers in app.py still run synchronous I/O; one slow call
+stalls every request on the worker, but only shows up as generally
+"slow requests". Now:
+- a monitor task sleeps LOOP_MONITOR_INTERVAL and compares the scheduled
+  with the actual wake-up time (lag)
+- a watchdog thread notices when the monitor has not run for longer than
+  LOOP_STALL_THRESHOLD_MS and samples the loop thread's current frame
+  (sys._current_frames), i.e. the code that is blocking right now
+- stalls are aggregated per (route, call site) with count/total/max and
+  the last stack; /api/admin/loop-stalls shows the worst offenders
+Route = the ASGI scope found on the sampled stack; call site = innermost
+frame outside the standard library and site-packages.
+"""
+
+import asyncio
+import os
+import sys
+import sysconfig
+import threading
+import time
+import traceback
+import logging
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv("LOOP_MONITOR", "1") == "1"
+INTERVAL_SECONDS = float(os.getenv("LOOP_MONITOR_INTERVAL", "0.05"))
+THRESHOLD_SECONDS = int(os.getenv("LOOP_STALL_THRESHOLD_MS", "100")) / 1000
+MAX_SITES = 200
+STACK_DEPTH = 25
+RECENT_LAGS = 1000
+
+_LIBRARY_PATHS = tuple(
+    os.path.realpath(path) for path in {
+        sysconfig.get_paths()["stdlib"], sysconfig.get_paths()["purelib"], sysconfig.get_paths()["platlib"],
+    }
+)
+
+StallKey = Tuple[str, str]
+
+
+_THIS_FILE = os.path.realpath(__file__)
+
+
+def _is_library(filename: str) -> bool:
+    path = os.path.realpath(filename)
+    return path == _THIS_FILE or path.startswith(_LIBRARY_PATHS) or filename.startswith("<")
+
+
+def _route_of(frame) -> str:
+    """Route template (or path) from the first ASGI scope on the stack."""
+    while frame is not None:
+        code = frame.f_code
+        has_scope = "scope" in code.co_varnames or "scope" in code.co_cellvars or "scope" in code.co_freevars
+        scope = frame.f_locals.get("scope") if has_scope else None
+        if isinstance(scope, dict) and scope.get("type") in ("http", "websocket"):
+            route = scope.get("route")
+            return f"{scope.get('method', 'WS')} {getattr(route, 'path', None) or scope.get('path', '?')}"
+        frame = frame.f_back
+    return "-"
+
+
+def _call_site(stack: traceback.StackSummary) -> str:
+    for entry in reversed(stack):
+        if not _is_library(entry.filename):
+            return f"{os.path.basename(entry.filename)}:{entry.lineno} in {entry.name}"
+    if stack:
+        entry = stack[-1]
+        return f"{os.path.basename(entry.filename)}:{entry.lineno} in {entry.name}"
+    return "-"
+
+
+class _Site:
+    __slots__ = ("count", "total_ms", "max_ms", "last_seen", "stack")
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.last_seen = 0.0
+        self.stack: List[str] = []
+
+
+class LoopStallMonitor:
+    """
+    Usage (on the event loop):
+        loop_monitor.start()
+        ...
+        loop_monitor.report()
+        loop_monitor.stop()
+    """
+
+    def __init__(self, interval: float = INTERVAL_SECONDS, threshold: float = THRESHOLD_SECONDS,
+                 sample_interval: Optional[float] = None):
+        self.interval = interval
+        self.threshold = threshold
+        self.sample_interval = sample_interval or max(threshold / 4, 0.005)
+        self._lock = threading.Lock()
+        self._sites: Dict[StallKey, _Site] = {}
+        self._lags: Deque[float] = deque(maxlen=RECENT_LAGS)
+        self._pending: Optional[Tuple[float, StallKey, List[str]]] = None
+        self._last_beat = time.perf_counter()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.ticks = 0
+        self.stalls = 0
+        self.max_lag_ms = 0.0
+        self.started_at: Optional[float] = None
+
+    # ------------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------------
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.perf_counter()
+        self._stop.clear()
+        self.started_at = time.time()
+        self._task = asyncio.get_running_loop().create_task(self._monitor())
+        self._watchdog = threading.Thread(target=self._watch, daemon=True, name="loop-watchdog")
+        self._watchdog.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._watchdog is not None:
+            self._watchdog.join(timeout=1)
+            self._watchdog = None
+
+    # ------------------------------------------------------------------
+    # Monitor task (event loop) and watchdog (thread)
+    # ------------------------------------------------------------------
+
+    async def _monitor(self):
+        while not self._stop.is_set():
+            beat = time.perf_counter()
+            self._last_beat = beat
+            await asyncio.sleep(self.interval)
+            lag = time.perf_counter() - beat - self.interval
+            self._record(beat, max(lag, 0.0))
+
+    def _record(self, beat: float, lag: float):
+        with self._lock:
+            self.ticks += 1
+            self._lags.append(lag)
+            self.max_lag_ms = max(self.max_lag_ms, lag * 1000)
+            pending, self._pending = self._pending, None
+            if lag < self.threshold:
+                return
+            self.stalls += 1
+            if pending is not None and pending[0] == beat:
+                key, stack = pending[1], pending[2]
+            else:
+                # Stall ended before the watchdog could sample it
+                key, stack = ("-", "unsampled"), []
+            site = self._sites.get(key)
+            if site is None:
+                if len(self._sites) >= MAX_SITES:
+                    del self._sites[min(self._sites, key=lambda k: self._sites[k].total_ms)]
+                site = self._sites[key] = _Site()
+            lag_ms = lag * 1000
+            site.count += 1
+            site.total_ms += lag_ms
+            site.max_ms = max(site.max_ms, lag_ms)
+            site.last_seen = time.time()
+            site.stack = stack
+        logger.warning(f"Event loop blocked {lag * 1000:.0f}ms by {key[1]} ({key[0]})")
+
+    def _watch(self):
+        while not self._stop.wait(self.sample_interval):
+            beat = self._last_beat
+            if time.perf_counter() - beat < self.threshold:
+                continue
+            with self._lock:
+                if self._pending is not None and self._pending[0] == beat:
+                    continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            try:
+                stack = traceback.extract_stack(frame, limit=STACK_DEPTH)
+                key = (_route_of(frame), _call_site(stack))
+                lines = [line.rstrip() for line in stack.format()]
+            except Exception as e:
+                key, lines = ("-", f"sampling failed: {e}"), []
+            finally:
+                del frame
+            with self._lock:
+                self._pending = (beat, key, lines)
+
+    # ------------------------------------------------------------------
+    # Reporting
+    # ------------------------------------------------------------------
+
+    def report(self, limit: int = 20) -> Dict[str, Any]:
+        with self._lock:
+            ranked = sorted(self._sites.items(), key=lambda item: item[1].total_ms, reverse=True)[:limit]
+            return {
+                **self._summary(),
+                "sites": [
+                    {
+                        "route": route,
+                        "call_site": call_site,
+                        "count": site.count,
+                        "total_ms": round(site.total_ms, 1),
+                        "max_ms": round(site.max_ms, 1),
+                        "avg_ms": round(site.total_ms / site.count, 1),
+                        "last_seen": site.last_seen,
+                        "stack": site.stack,
+                    }
+                    for (route, call_site), site in ranked
+                ],
+            }
+
+    def _summary(self) -> Dict[str, Any]:
+        """Caller holds the lock."""
+        lags = sorted(self._lags)
+
+        def pct(p: float) -> float:
+            return round(lags[min(len(lags) - 1, int(len(lags) * p))] * 1000, 1) if lags else 0.0
+
+        return {
+            "pid": os.getpid(),
+            "running": self._task is not None,
+            "threshold_ms": round(self.threshold * 1000),
+            "ticks": self.ticks,
+            "stalls": self.stalls,
+            "max_lag_ms": round(self.max_lag_ms, 1),
+            "lag_p50_ms": pct(0.5),
+            "lag_p99_ms": pct(0.99),
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return self._summary()
+
+    def reset(self):
+        with self._lock:
+            self._sites.clear()
+            self._lags.clear()
+            self.ticks = 0
+            self.stalls = 0
+            self.max_lag_ms = 0.0
+
+
+# Global instance
+loop_monitor = LoopStallMonitor()
@@ -0,0 +1,166 @@
+"""
+SBS Deutschland – Blocking I/O Offload
+Bounded threadpool for DB, HTTP and extraction work called from async routes.
+
+Almost every route in app.py is async def but ran sqlite3 queries,
+requests.post (Slack), SendGrid calls or whole extractions inline on the
+event loop – one slow query stalled every request on the worker. Now:
+- run_blocking(fn, ...) runs sync work in one shared, bounded pool
+  (BLOCKING_IO_WORKERS) and awaits it; contextvars are carried over
+- @offload_route runs a route whose body is purely synchronous in that
+  pool (FastAPI still sees the original signature)
+- adb (AsyncDB) offers awaitable fetchone/fetchall/execute/run on pooled
+  invoices.db connections; pool threads keep their connections warm
+- http_post / http_get wrap requests for webhooks (Slack, Teams)
+"""
+
+import asyncio
+import contextvars
+import functools
+import os
+import sqlite3
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+WORKERS = int(os.getenv("BLOCKING_IO_WORKERS", "16"))
+HTTP_TIMEOUT_SECONDS = 10
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+_stats = {"submitted": 0, "in_flight": 0, "max_in_flight": 0, "errors": 0}
+
+
+def get_pool() -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="blocking-io")
+        return _pool
+
+
+def _tracked(call: Callable[[], Any]) -> Any:
+    with _pool_lock:
+        _stats["in_flight"] += 1
+        _stats["max_in_flight"] = max(_stats["max_in_flight"], _stats["in_flight"])
+    try:
+        return call()
+    except Exception:
+        with _pool_lock:
+            _stats["errors"] += 1
+        raise
+    finally:
+        with _pool_lock:
+            _stats["in_flight"] -= 1
+
+
+async def run_blocking(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """Run fn(*args, **kwargs) in the bounded pool and await the result."""
+    loop = asyncio.get_running_loop()
+    call = functools.partial(contextvars.copy_context().run, fn, *args, **kwargs)
+    with _pool_lock:
+        _stats["submitted"] += 1
+    return await loop.run_in_executor(get_pool(), _tracked, call)
+
+
+def offload_route(fn: Callable[..., Any]) -> Callable[..., Any]:
+    """
+    Decorator for routes with a synchronous body:
+
+        @app.get("/admin")
+        @offload_route
+        def admin_page(request: Request): ...
+    """
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        return await run_blocking(fn, *args, **kwargs)
+    return wrapper
+
+
+class ExecResult(NamedTuple):
+    rowcount: int
+    lastrowid: Optional[int]
+
+
+class AsyncDB:
+    """
+    Usage:
+        row = await adb.fetchone("SELECT plan FROM users WHERE id = ?", (user_id,))
+        await adb.execute("UPDATE users SET plan = ? WHERE id = ?", (plan, user_id))
+        result = await adb.run(lambda conn: ...)     # several statements, one connection
+    """
+
+    def __init__(self, connect: Optional[Callable[[], sqlite3.Connection]] = None,
+                 row_factory: Optional[Callable] = sqlite3.Row):
+        self._connect = connect
+        self.row_factory = row_factory
+
+    def connect(self) -> sqlite3.Connection:
+        if self._connect is not None:
+            return self._connect()
+        from web.db_pool import get_db
+        return get_db()
+
+    def _with_connection(self, work: Callable[[sqlite3.Connection], Any]) -> Any:
+        conn = self.connect()
+        try:
+            conn.row_factory = self.row_factory
+            return work(conn)
+        finally:
+            conn.close()
+
+    async def run(self, work: Callable[[sqlite3.Connection], Any]) -> Any:
+        """work(conn) runs in the pool; it commits itself if it writes."""
+        return await run_blocking(self._with_connection, work)
+
+    async def fetchone(self, sql: str, params: Sequence[Any] = ()) -> Optional[sqlite3.Row]:
+        return await self.run(lambda conn: conn.execute(sql, params).fetchone())
+
+    async def fetchall(self, sql: str, params: Sequence[Any] = ()) -> List[sqlite3.Row]:
+        return await self.run(lambda conn: conn.execute(sql, params).fetchall())
+
+    async def execute(self, sql: str, params: Sequence[Any] = ()) -> ExecResult:
+        def work(conn):
+            cursor = conn.execute(sql, params)
+            conn.commit()
+            return ExecResult(cursor.rowcount, cursor.lastrowid)
+        return await self.run(work)
+
+    async def executemany(self, sql: str, seq_of_params: Sequence[Sequence[Any]]) -> int:
+        def work(conn):
+            cursor = conn.executemany(sql, seq_of_params)
+            conn.commit()
+            return cursor.rowcount
+        return await self.run(work)
+
+
+async def http_post(url: str, **kwargs):
+    import requests
+    kwargs.setdefault("timeout", HTTP_TIMEOUT_SECONDS)
+    return await run_blocking(requests.post, url, **kwargs)
+
+
+async def http_get(url: str, **kwargs):
+    import requests
+    kwargs.setdefault("timeout", HTTP_TIMEOUT_SECONDS)
+    return await run_blocking(requests.get, url, **kwargs)
+
+
+def pool_stats() -> Dict[str, Any]:
+    with _pool_lock:
+        return {"workers": WORKERS, **_stats}
+
+
+def shutdown_pool(wait: bool = False):
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=wait)
+
+
+# Global instance
+adb = AsyncDB()
@@ -0,0 +1,172 @@
+"""
+SBS Deutschland – Parse Pool
+Process pool for CPU-bound PDF/e-invoice parsing and a two-stage pipeline.
+
+parse_einvoice (PDF attachment + XML parsing) used to run on the same
+threads as the LLM calls, so a batch of large ZUGFeRD PDFs serialized on
+the GIL while the network sat idle. The pipeline now has two stages:
+- CPU stage: parse functions run in a ProcessPoolExecutor sized to cores
+  (PARSE_POOL_WORKERS)
+- I/O stage: LLM extraction runs on the extraction scheduler threads
+- A bounded number of files (PIPELINE_MAX_PENDING) may sit between
+  parsing and extraction, so parsing runs ahead without piling up results
+"""
+
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import logging
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+from web.einvoice_prefilter import PREFILTER_ENABLED, scan_pdf
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = int(os.getenv("PARSE_POOL_WORKERS", str(os.cpu_count() or 2)))
+DEFAULT_MAX_PENDING = int(os.getenv("PIPELINE_MAX_PENDING", "32"))
+
+
+class ParsePool:
+    """
+    Lazily started process pool. workers=0 parses inline (tests, dev).
+    If the pool is broken, that submit runs inline and the next one starts
+    a fresh pool.
+
+    Functions and arguments must be picklable (module-level functions).
+    """
+
+    def __init__(self, workers: int = DEFAULT_WORKERS):
+        self.workers = max(0, workers)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.inline = 0
+
+    def _get_executor(self) -> Optional[ProcessPoolExecutor]:
+        with self._lock:
+            if self._executor is None and self.workers:
+                # spawn: forking a process that runs threads and sqlite connections is unsafe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    def submit(self, fn: Callable, *args) -> Future:
+        executor = self._get_executor()
+        if executor is not None:
+            try:
+                future = executor.submit(fn, *args)
+                with self._lock:
+                    self.submitted += 1
+                return future
+            except (BrokenProcessPool, RuntimeError) as e:
+                logger.error(f"Parse pool unavailable, restarting: {e}")
+                with self._lock:
+                    self._executor = None
+        return self._run_inline(fn, *args)
+
+    def _run_inline(self, fn: Callable, *args) -> Future:
+        future: Future = Future()
+        with self._lock:
+            self.inline += 1
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "started": self._executor is not None,
+                "submitted": self.submitted,
+                "inline": self.inline,
+            }
+
+    def shutdown(self, wait: bool = True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+def parse_einvoice_file(path: Any) -> Tuple[bool, Dict[str, Any], Dict[str, Any]]:
+    """
+    Picklable wrapper around einvoice_import.parse_einvoice for the process pool.
+    Returns (is_einvoice, data, prefilter) – the full parse only runs when
+    the prefilter finds embedded e-invoice XML.
+    """
+    prefilter = scan_pdf(path).to_dict() if PREFILTER_ENABLED else {"has_embedded_xml": True, "marker": None, "scan_ms": 0.0}
+    prefilter["parse_ms"] = None
+    if not prefilter["has_embedded_xml"]:
+        return False, {}, prefilter
+
+    from einvoice_import import parse_einvoice
+    start = time.perf_counter()
+    is_einv, data = parse_einvoice(str(path))
+    prefilter["parse_ms"] = round((time.perf_counter() - start) * 1000, 3)
+    return is_einv, data, prefilter
+
+
+def run_staged(items: Iterable[Any], parse: Callable[[Any], Any],
+               extract: Callable[[Any, Any], Any],
+               submit_io: Callable[..., Future],
+               pool: "ParsePool",
+               max_pending: int = DEFAULT_MAX_PENDING) -> Iterator[Tuple[Any, str, Any]]:
+    """
+    Run parse(item) in the process pool, then extract(item, parsed) via
+    submit_io (e.g. the extraction scheduler). Yields (item, status, payload)
+    as items finish, status being "success" or "error".
+
+    At most max_pending items are between submission and completion, so the
+    CPU stage can work ahead of the I/O stage only by that much.
+    """
+    items = list(items)
+    results: "queue.Queue[Tuple[Any, str, Any]]" = queue.Queue()
+    handoff: "queue.Queue[Tuple[Any, Future]]" = queue.Queue()
+    slots = threading.BoundedSemaphore(max(1, max_pending))
+
+    def finish(item, status, payload):
+        results.put((item, status, payload))
+        slots.release()
+
+    def feed():
+        for item in items:
+            slots.acquire()
+            future = pool.submit(parse, item)
+            future.add_done_callback(lambda f, item=item: handoff.put((item, f)))
+
+    def dispatch():
+        for _ in items:
+            item, parsed = handoff.get()
+            error = parsed.exception()
+            if error is not None:
+                finish(item, "error", f"parse failed: {error}")
+                continue
+            try:
+                io_future = submit_io(extract, item, parsed.result())
+            except Exception as e:
+                finish(item, "error", str(e))
+                continue
+            io_future.add_done_callback(
+                lambda f, item=item: finish(item, "error", str(f.exception())) if f.exception()
+                else finish(item, "success", f.result())
+            )
+
+    def drain():
+        for _ in items:
+            yield results.get()
+
+    # Stages start immediately, not on first iteration
+    threading.Thread(target=feed, daemon=True, name="pipeline-feed").start()
+    threading.Thread(target=dispatch, daemon=True, name="pipeline-dispatch").start()
+    return drain()
+
+
+# Global instance
+parse_pool = ParsePool()
@@ -0,0 +1,202 @@
+"""
+SBS Deutschland – Batch Post-Processing
+Set-based duplicate detection and categorization for a whole job.
+
+process_invoices_background used to loop over get_invoices_by_job twice and,
+per invoice, query hash duplicates, run the AI similarity check, predict a
+category and write the assignment. This stage works on the job's invoice set:
+- invoices are loaded once
+- hash duplicates come from one job-level query
+- exact duplicates inside the same batch are grouped in memory
+- the similarity check runs once over all invoices (so the near-duplicate
+  index learns every saved invoice); already flagged ones get no extra pairs
+- one category prediction per distinct invoice content: only invoices whose
+  prediction inputs are identical (e.g. the same PDF twice) share a call
+- all writes are collected and handed to the writer in one call;
+  PostProcessingWriter stores duplicate pairs and category assignments with
+  executemany on one pooled connection and commits once (a failure rolls
+  back both)
+"""
+
+import re
+import json
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from web.db_pool import DB_PATH, pool_for
+
+logger = logging.getLogger(__name__)
+
+# (invoice_id, other_invoice_id, confidence, method)
+DuplicatePair = Tuple[int, int, float, str]
+# (invoice_id, category_id, confidence)
+CategoryAssignment = Tuple[int, Any, float]
+
+# Same rows duplicate_detection.save_duplicate_detection and
+# database.assign_category_to_invoice write one call (and commit) at a time
+DUPLICATE_INSERT_SQL = """
+    INSERT INTO duplicate_detections (invoice_id, duplicate_of_id, detection_method, confidence)
+    VALUES (?, ?, ?, ?)
+"""
+CATEGORY_ASSIGN_SQL = """
+    INSERT OR REPLACE INTO invoice_categories (invoice_id, category_id, confidence, assigned_by)
+    VALUES (?, ?, ?, 'ai')
+"""
+
+# Row bookkeeping that does not describe the invoice itself
+_NON_CONTENT_FIELDS = frozenset({"id", "job_id", "created_at", "updated_at"})
+
+
+@dataclass
+class PostProcessingResult:
+    duplicate_count: int = 0
+    similar_count: int = 0
+    categorized: int = 0
+    category_predictions: int = 0
+    duplicate_pairs: List[DuplicatePair] = field(default_factory=list)
+    category_assignments: List[CategoryAssignment] = field(default_factory=list)
+
+    @property
+    def total_issues(self) -> int:
+        return self.duplicate_count + self.similar_count
+
+
+def normalize_supplier(name: Optional[str]) -> str:
+    """Lowercase, strip legal forms and punctuation: 'Müller GmbH & Co. KG' -> 'müller'."""
+    text = (name or "").lower()
+    text = re.sub(r"\b(gmbh|ag|kg|ug|ohg|gbr|e\.?\s?k|co|mbh|haftungsbeschränkt|ltd|inc|sarl|bv)\b\.?", " ", text)
+    text = re.sub(r"[^\w]+", " ", text)
+    return " ".join(text.split())
+
+
+def _exact_key(inv: Dict[str, Any]) -> Optional[tuple]:
+    number = (inv.get("rechnungsnummer") or "").strip().lower()
+    if not number:
+        return None
+    try:
+        amount = round(float(inv.get("betrag_brutto") or 0), 2)
+    except (TypeError, ValueError):
+        amount = None
+    return normalize_supplier(inv.get("rechnungsaussteller")), number, amount
+
+
+def _prediction_key(inv: Dict[str, Any]) -> str:
+    """Everything predict_category could look at, so equal keys mean equal predictions."""
+    content = {k: v for k, v in inv.items() if k not in _NON_CONTENT_FIELDS}
+    return json.dumps(content, sort_keys=True, ensure_ascii=False, default=str)
+
+
+class JobPostProcessor:
+    """
+    Runs duplicate detection and categorization over one job's invoices.
+
+    Database and model access is injected so the stage stays independent of
+    the legacy database/duplicate_detection/category_ai modules:
+        load_invoices(job_id) -> list of invoice dicts (with 'id')
+        hash_duplicates(job_id) -> list of detection dicts (with 'invoice_id')
+        find_similar(invoices, user_id) -> list of DuplicatePair (sees every
+            invoice of the job; pairs for already flagged invoices are dropped)
+        predict_category(invoice, user_id) -> (category_id, confidence, reasoning)
+        write(category_assignments, duplicate_pairs) -> None
+    """
+
+    def __init__(
+        self,
+        load_invoices: Callable[[str], List[Dict[str, Any]]],
+        hash_duplicates: Callable[[str], List[Dict[str, Any]]],
+        find_similar: Callable[[List[Dict[str, Any]], Any], List[DuplicatePair]],
+        predict_category: Callable[[Dict[str, Any], Any], tuple],
+        write: Callable[[List[CategoryAssignment], List[DuplicatePair]], None],
+    ):
+        self.load_invoices = load_invoices
+        self.hash_duplicates = hash_duplicates
+        self.find_similar = find_similar
+        self.predict_category = predict_category
+        self.write = write
+
+    def run(self, job_id: str, user_id: Any) -> PostProcessingResult:
+        result = PostProcessingResult()
+        invoices = [dict(inv) for inv in self.load_invoices(job_id)]
+        if not invoices:
+            return result
+
+        self._detect_duplicates(job_id, user_id, invoices, result)
+        self._categorize(user_id, invoices, result)
+
+        self.write(result.category_assignments, result.duplicate_pairs)
+        return result
+
+    # ------------------------------------------------------------------
+
+    def _detect_duplicates(self, job_id: str, user_id: Any, invoices: List[Dict[str, Any]],
+                           result: PostProcessingResult):
+        # 1) Hash-Duplikate: eine Abfrage für den ganzen Job
+        hash_dups = self.hash_duplicates(job_id) or []
+        result.duplicate_count = len(hash_dups)
+        flagged = {d.get("invoice_id") for d in hash_dups if d.get("invoice_id") is not None}
+
+        # 2) Exakte Duplikate innerhalb des Batches (gleicher Lieferant/Nummer/Betrag)
+        first_seen: Dict[tuple, int] = {}
+        for inv in invoices:
+            key = _exact_key(inv)
+            if key is None or inv["id"] in flagged:
+                continue
+            if key in first_seen:
+                result.duplicate_pairs.append((inv["id"], first_seen[key], 1.0, "exact"))
+                result.similar_count += 1
+                flagged.add(inv["id"])
+            else:
+                first_seen[key] = inv["id"]
+
+        # 3) Ähnlichkeit als ein Aufruf über alle Rechnungen – der Index nimmt jede
+        #    gespeicherte Rechnung auf; bereits markierte bekommen keine weiteren Paare
+        similar = [pair for pair in self.find_similar(invoices, user_id) or [] if pair[0] not in flagged]
+        result.duplicate_pairs.extend(similar)
+        result.similar_count += len(similar)
+
+    def _categorize(self, user_id: Any, invoices: Iterable[Dict[str, Any]], result: PostProcessingResult):
+        # Vorhersage pro Rechnung – Lieferanten mit gemischten Kategorien bleiben korrekt.
+        # Nur inhaltlich identische Rechnungen teilen sich einen Aufruf.
+        groups: Dict[str, List[Dict[str, Any]]] = {}
+        for inv in invoices:
+            groups.setdefault(_prediction_key(inv), []).append(inv)
+
+        for members in groups.values():
+            try:
+                category_id, confidence, _reasoning = self.predict_category(members[0], user_id)
+            except Exception as e:
+                logger.warning(f"Category prediction failed for invoice {members[0]['id']}: {e}")
+                continue
+            result.category_predictions += 1
+            for inv in members:
+                result.category_assignments.append((inv["id"], category_id, confidence))
+        result.categorized = len(result.category_assignments)
+
+
+class PostProcessingWriter:
+    """
+    JobPostProcessor's write(): one transaction per job instead of one per row.
+
+    Usage:
+        JobPostProcessor(..., write=PostProcessingWriter(db_path))
+    """
+
+    def __init__(self, db_path: str = DB_PATH):
+        self.db_path = db_path
+        self._pool = pool_for(db_path)
+
+    def __call__(self, category_assignments: List[CategoryAssignment], duplicate_pairs: List[DuplicatePair]):
+        if not category_assignments and not duplicate_pairs:
+            return
+        conn = self._pool.connect()
+        try:
+            # Commits both or, on any error, rolls back both
+            with conn:
+                conn.executemany(DUPLICATE_INSERT_SQL, [
+                    (invoice_id, other_id, method, confidence)
+                    for invoice_id, other_id, confidence, method in duplicate_pairs
+                ])
+                conn.executemany(CATEGORY_ASSIGN_SQL, category_assignments)
+        finally:
+            conn.close()
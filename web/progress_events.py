@@ -0,0 +1,303 @@
+"""
+SBS Deutschland – Job Progress Events
+Typed, coalesced progress events for WebSocket and SSE clients.
+
+The UI used to poll /api/status/{job_id}, re-serializing the whole job for
+every poll. The pipeline now publishes typed events instead:
+    file_started, file_extracted, file_failed, progress, exported, saved, completed, failed
+Events are published from worker threads and flushed at most every
+PROGRESS_MIN_INTERVAL seconds per job, as one "job_update" message carrying
+the latest progress state plus the events since the last flush.
+
+Flushed messages (and system alerts) go through the event backplane, so
+every uvicorn worker delivers them to its own WebSocket/SSE clients. With
+the local backplane, jobs without subscribers cost a dict lookup. Other
+modules that need cross-worker messages (API-key revocations) register a
+topic listener instead of running a second backplane.
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+import logging
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from web.event_backplane import create_backplane
+
+logger = logging.getLogger(__name__)
+
+MIN_INTERVAL = float(os.getenv("PROGRESS_MIN_INTERVAL", "0.25"))
+# Per message; the rest is counted in "dropped_events"
+MAX_EVENTS_PER_MESSAGE = 50
+SUBSCRIBER_QUEUE_SIZE = 100
+
+EVENT_TYPES = ("file_started", "file_extracted", "file_failed", "progress", "exported", "saved", "completed", "failed")
+TERMINAL_EVENTS = ("completed", "failed")
+TERMINAL_STATUSES = ("completed", "failed")
+ALERTS_TOPIC = "alerts"
+# Channels of jobs that never sent a terminal event (crashed worker)
+STALE_CHANNEL_SECONDS = 3600
+
+
+def job_topic(job_id: str) -> str:
+    return f"job:{job_id}"
+
+
+def job_snapshot(job_id: str, job: Dict[str, Any]) -> Dict[str, Any]:
+    """Initial message for a new client: current state from the job store."""
+    return {
+        "type": "snapshot",
+        "job_id": job_id,
+        "state": {
+            "status": job.get("status"),
+            "processed": job.get("processed", 0),
+            "total": job.get("total", len(job.get("files") or [])),
+            "progress": job.get("progress", 0),
+        },
+    }
+
+
+def is_terminal(message: Dict[str, Any]) -> bool:
+    if message.get("state", {}).get("status") in TERMINAL_STATUSES:
+        return True
+    return any(event["type"] in TERMINAL_EVENTS for event in message.get("events", ()))
+
+
+def sse_format(message: Dict[str, Any]) -> str:
+    """One Server-Sent Events frame; event name = message type."""
+    return f"event: {message['type']}\ndata: {json.dumps(message, ensure_ascii=False, default=str)}\n\n"
+
+
+class Subscription:
+    """One connected client (WebSocket or SSE) for one topic."""
+
+    def __init__(self, topic: str, maxsize: int = SUBSCRIBER_QUEUE_SIZE):
+        self.topic = topic
+        self.queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(maxsize=maxsize)
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.dropped = 0
+
+    def offer(self, message: Dict[str, Any]):
+        """Runs on the subscriber's event loop."""
+        # Slow client: drop the oldest message, the newest state matters most
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(message)
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class _JobChannel:
+    __slots__ = ("events", "dropped_events", "state", "seq", "last_flush", "terminal", "touched")
+
+    def __init__(self):
+        self.events: List[Dict[str, Any]] = []
+        self.dropped_events = 0
+        self.state: Dict[str, Any] = {}
+        self.seq = 0
+        self.last_flush = 0.0
+        self.terminal = False
+        self.touched = time.monotonic()
+
+
+class ProgressHub:
+    """
+    Per-process event hub on top of an event backplane.
+
+    Usage:
+        progress_hub.publish(job_id, "file_extracted", filename=name, processed=3, total=10)
+        sub = progress_hub.subscribe(job_id)      # on the event loop
+        message = await sub.get()
+        progress_hub.unsubscribe(sub)
+    """
+
+    def __init__(self, min_interval: float = MIN_INTERVAL, backplane=None):
+        self.min_interval = min_interval
+        self.backplane = backplane if backplane is not None else create_backplane()
+        self._channels: Dict[str, _JobChannel] = {}
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        self._listeners: Dict[str, List[Callable[[str, Dict[str, Any]], None]]] = {}
+        self._cond = threading.Condition()
+        self._flusher: Optional[threading.Thread] = None
+        self._stopped = False
+        self.published = 0
+        self.messages = 0
+        self.delivered = 0
+
+    def _ensure_started(self):
+        """Caller holds the lock."""
+        if self._flusher is None and not self._stopped:
+            self.backplane.start(self._deliver)
+            self._flusher = threading.Thread(target=self._flush_loop, daemon=True, name="progress-flush")
+            self._flusher.start()
+
+    # ------------------------------------------------------------------
+    # Subscribers (event loop)
+    # ------------------------------------------------------------------
+
+    def subscribe(self, job_id: str) -> Subscription:
+        return self._subscribe(job_topic(job_id))
+
+    def subscribe_alerts(self) -> Subscription:
+        return self._subscribe(ALERTS_TOPIC)
+
+    def _subscribe(self, topic: str) -> Subscription:
+        sub = Subscription(topic)
+        sub.loop = asyncio.get_running_loop()
+        with self._cond:
+            self._ensure_started()
+            self._subscribers.setdefault(topic, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._cond:
+            subs = self._subscribers.get(sub.topic)
+            if subs is None:
+                return
+            subs.discard(sub)
+            if not subs:
+                del self._subscribers[sub.topic]
+
+    def add_listener(self, topic: str, callback: Callable[[str, Dict[str, Any]], None]):
+        """callback(topic, message) for every message on topic; runs on the backplane's thread."""
+        with self._cond:
+            self._ensure_started()
+            self._listeners.setdefault(topic, []).append(callback)
+
+    def remove_listener(self, topic: str, callback: Callable[[str, Dict[str, Any]], None]):
+        with self._cond:
+            listeners = self._listeners.get(topic, [])
+            if callback in listeners:
+                listeners.remove(callback)
+            if not listeners:
+                self._listeners.pop(topic, None)
+
+    def _deliver(self, topic: str, message: Dict[str, Any]):
+        """Called by the backplane (any thread): hand the message to listeners and local clients."""
+        with self._cond:
+            subs = list(self._subscribers.get(topic, ()))
+            listeners = list(self._listeners.get(topic, ()))
+            self.delivered += len(subs)
+        for callback in listeners:
+            try:
+                callback(topic, message)
+            except Exception as e:
+                logger.error(f"Listener for {topic} failed: {e}")
+        for sub in subs:
+            try:
+                sub.loop.call_soon_threadsafe(sub.offer, message)
+            except RuntimeError:
+                # Loop closed (shutdown) – nobody is listening anymore
+                pass
+
+    # ------------------------------------------------------------------
+    # Publishing (any thread, any worker)
+    # ------------------------------------------------------------------
+
+    def publish(self, job_id: str, event_type: str, **data):
+        """Record an event; state keys (processed/total/progress/status) update the job snapshot."""
+        if event_type not in EVENT_TYPES:
+            raise ValueError(f"Unknown progress event: {event_type}")
+        with self._cond:
+            channel = self._channels.get(job_id)
+            if channel is None:
+                # Without a shared backplane, only local clients can listen
+                if not self.backplane.distributed and job_topic(job_id) not in self._subscribers:
+                    return
+                self._ensure_started()
+                channel = self._channels[job_id] = _JobChannel()
+            self.published += 1
+            for key in ("processed", "total", "progress", "status"):
+                if key in data:
+                    channel.state[key] = data.pop(key)
+            first = not channel.events and not channel.dropped_events
+            if len(channel.events) < MAX_EVENTS_PER_MESSAGE:
+                channel.events.append({"type": event_type, "ts": time.time(), **data})
+            else:
+                channel.dropped_events += 1
+            channel.touched = time.monotonic()
+            if event_type in TERMINAL_EVENTS:
+                channel.terminal = True
+            if first or channel.terminal:
+                self._cond.notify()
+
+    def broadcast_alert(self, message: Dict[str, Any]):
+        """System alerts to every connected alert client on every worker."""
+        with self._cond:
+            self._ensure_started()
+        self.backplane.publish(ALERTS_TOPIC, {"type": "alert", **message})
+
+    def _take_due(self, now: float) -> List[tuple]:
+        """Caller holds the lock: build messages for channels that may flush now."""
+        due = []
+        for job_id, channel in list(self._channels.items()):
+            pending = channel.events or channel.dropped_events
+            if pending and (channel.terminal or now - channel.last_flush >= self.min_interval):
+                channel.seq += 1
+                channel.last_flush = now
+                due.append((job_topic(job_id), {
+                    "type": "job_update",
+                    "job_id": job_id,
+                    "seq": channel.seq,
+                    "state": dict(channel.state),
+                    "events": channel.events,
+                    "dropped_events": channel.dropped_events,
+                }))
+                channel.events = []
+                channel.dropped_events = 0
+            if channel.terminal or now - channel.touched > STALE_CHANNEL_SECONDS:
+                if not channel.events:
+                    del self._channels[job_id]
+        return due
+
+    def _next_wait(self, now: float) -> Optional[float]:
+        waits = [channel.last_flush + self.min_interval - now
+                 for channel in self._channels.values() if channel.events or channel.dropped_events]
+        return max(0.0, min(waits)) if waits else None
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                if self._stopped:
+                    return
+                now = time.monotonic()
+                due = self._take_due(now)
+                if not due:
+                    self._cond.wait(timeout=self._next_wait(now))
+                    continue
+                self.messages += len(due)
+            for topic, message in due:
+                self.backplane.publish(topic, message)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            subs = [sub for topic_subs in self._subscribers.values() for sub in topic_subs]
+            return {
+                "jobs_active": len(self._channels),
+                "topics_watched": len(self._subscribers),
+                "listeners": sorted(self._listeners),
+                "subscribers": len(subs),
+                "queued_messages": sum(sub.queue.qsize() for sub in subs),
+                "dropped_messages": sum(sub.dropped for sub in subs),
+                "events_published": self.published,
+                "messages_sent": self.messages,
+                "deliveries": self.delivered,
+                "backplane": self.backplane.stats(),
+            }
+
+    def shutdown(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self.backplane.stop()
+
+
+# Global instance
+progress_hub = ProgressHub()
@@ -0,0 +1,208 @@
+"""
+SBS Deutschland – Query Indexes
+Managed composite indexes and the hot SQLite queries they serve.
+
+Dashboard, DATEV, Zahlungen, audit log and MBR queries filtered jobs by
+user_id, joined invoices on job_id and counted "today" with
+DATE(created_at) = DATE('now') – without indexes and with the column
+wrapped in a function, every one of them scanned the whole table. Now:
+- MANAGED_INDEXES lists the composite indexes (equality column first,
+  range/sort column second); ensure_indexes() creates the missing ones at
+  startup and ANALYZEs them, skipping tables/columns that do not exist yet
+- date filters are sargable ranges (col >= start AND col < end) instead of
+  DATE(col) = ..., so the index on col can be used
+- the hot statements live here as constants, so tests/test_query_indexes.py
+  can EXPLAIN QUERY PLAN exactly what app.py runs
+"""
+
+import sqlite3
+import logging
+from datetime import date, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# (index name, table, columns)
+MANAGED_INDEXES: Tuple[Tuple[str, str, Tuple[str, ...]], ...] = (
+    ("idx_jobs_user_created", "jobs", ("user_id", "created_at")),
+    ("idx_jobs_created", "jobs", ("created_at",)),
+    ("idx_invoices_job_id", "invoices", ("job_id",)),
+    ("idx_invoices_created", "invoices", ("created_at",)),
+    ("idx_api_costs_job_id", "api_costs", ("job_id",)),
+    ("idx_audit_user_ts", "audit_log", ("user_id", "timestamp")),
+    ("idx_audit_action_ts", "audit_log", ("action", "timestamp")),
+    ("idx_audit_ts", "audit_log", ("timestamp",)),
+    ("idx_rechnungen_user_datum", "rechnungen", ("user_id", "rechnungs_datum")),
+    ("idx_zahlungsbedingungen_invoice_bezahlt", "zahlungsbedingungen", ("invoice_id", "bezahlt_am")),
+    ("idx_zahlungsbedingungen_status_datum", "zahlungsbedingungen", ("zahlungsstatus", "geplantes_zahldatum")),
+)
+
+# ---------------------------------------------------------------------------
+# Hot queries (used by app.py, plan-checked in tests)
+# ---------------------------------------------------------------------------
+
+# "Today" in UTC like DATE('now') before, but as a range on the raw column
+INVOICES_TODAY_SQL = (
+    "SELECT COUNT(*) FROM invoices WHERE created_at >= DATE('now') AND created_at < DATE('now', '+1 day')"
+)
+JOBS_TODAY_SQL = "SELECT COUNT(*) FROM jobs WHERE created_at >= DATE('now') AND created_at < DATE('now', '+1 day')"
+
+USER_INVOICE_COUNT_SQL = """
+    SELECT COUNT(*) FROM invoices i
+    JOIN jobs j ON i.job_id = j.job_id
+    WHERE j.user_id = ?
+"""
+
+USER_RECENT_INVOICES_SQL = """
+    SELECT i.rechnungsnummer, i.rechnungsaussteller, i.created_at
+    FROM invoices i
+    JOIN jobs j ON i.job_id = j.job_id
+    WHERE j.user_id = ?
+    ORDER BY i.created_at DESC
+    LIMIT 5
+"""
+
+USER_COMPLETED_JOBS_SQL = """
+    SELECT job_id, upload_path, total_files, created_at
+    FROM jobs WHERE user_id = ? AND status = 'completed'
+    ORDER BY created_at DESC LIMIT 20
+"""
+
+USER_JOB_COSTS_SQL = """
+    SELECT
+        j.job_id,
+        j.created_at,
+        j.total_files,
+        COALESCE(SUM(ac.cost_usd), 0) as total_cost
+    FROM jobs j
+    LEFT JOIN api_costs ac ON j.job_id = ac.job_id
+    WHERE j.user_id = ?
+    GROUP BY j.job_id
+    ORDER BY j.created_at DESC
+    LIMIT 50
+"""
+
+USER_APPROVED_INVOICES_SQL = """
+    SELECT i.id, i.rechnungsnummer, i.datum, i.rechnungsaussteller,
+           i.betrag_brutto, i.mwst_satz, i.waehrung, i.status
+    FROM invoices i
+    JOIN jobs j ON i.job_id = j.job_id
+    WHERE i.status = 'approved' AND j.user_id = ?
+    ORDER BY i.datum DESC
+    LIMIT 100
+"""
+
+AUDIT_ACTIVE_USERS_TODAY_SQL = (
+    "SELECT COUNT(DISTINCT user_id) FROM audit_log "
+    "WHERE timestamp >= DATE('now') AND timestamp < DATE('now', '+1 day')"
+)
+AUDIT_TODAY_SQL = (
+    "SELECT COUNT(*) as count FROM audit_log "
+    "WHERE timestamp >= DATE('now') AND timestamp < DATE('now', '+1 day')"
+)
+AUDIT_LOGINS_7D_SQL = (
+    "SELECT COUNT(*) as count FROM audit_log WHERE action = 'auth.login' AND timestamp >= datetime('now', '-7 days')"
+)
+AUDIT_FAILED_LOGINS_SQL = "SELECT COUNT(*) as count FROM audit_log WHERE action = 'auth.login_failed'"
+AUDIT_USER_TODAY_SQL = (
+    "SELECT COUNT(*) as count FROM audit_log "
+    "WHERE user_id = ? AND timestamp >= DATE('now') AND timestamp < DATE('now', '+1 day')"
+)
+AUDIT_USER_LOGINS_7D_SQL = (
+    "SELECT COUNT(*) as count FROM audit_log "
+    "WHERE user_id = ? AND action = 'auth.login' AND timestamp >= datetime('now', '-7 days')"
+)
+AUDIT_USER_FAILED_LOGINS_SQL = (
+    "SELECT COUNT(*) as count FROM audit_log WHERE user_id = ? AND action = 'auth.login_failed'"
+)
+
+PAYMENT_STATS_SQL = """
+    SELECT
+        strftime('%Y-%m', z.bezahlt_am) as monat,
+        COUNT(*) as anzahl,
+        SUM(CASE WHEN z.bezahlt_am <= z.skonto_datum THEN z.skonto_betrag ELSE 0 END) as skonto_genutzt,
+        SUM(CASE WHEN z.bezahlt_am > z.skonto_datum AND z.skonto_betrag > 0 THEN z.skonto_betrag ELSE 0 END) as skonto_verpasst,
+        SUM(z.bezahlt_betrag) as gesamt_bezahlt
+    FROM zahlungsbedingungen z
+    JOIN invoices i ON z.invoice_id = i.id
+    JOIN jobs j ON i.job_id = j.job_id
+    WHERE z.bezahlt_am IS NOT NULL
+      AND j.user_id = ?
+      AND z.bezahlt_am >= date('now', '-' || ? || ' months')
+    GROUP BY monat
+    ORDER BY monat
+"""
+
+PLANNED_PAYMENTS_SQL = """
+    SELECT z.*, i.rechnungsaussteller, i.betrag_brutto, i.iban, i.bic
+    FROM zahlungsbedingungen z
+    JOIN invoices i ON z.invoice_id = i.id
+    WHERE z.zahlungsstatus = 'geplant'
+    ORDER BY z.geplantes_zahldatum
+"""
+
+MBR_MONTHS_SQL = """
+    SELECT DISTINCT
+        strftime('%Y', rechnungs_datum) as year,
+        strftime('%m', rechnungs_datum) as month,
+        COUNT(*) as invoice_count
+    FROM rechnungen
+    WHERE user_id = ? AND rechnungs_datum IS NOT NULL
+    GROUP BY year, month
+    ORDER BY year DESC, month DESC
+    LIMIT 24
+"""
+
+
+def day_range(day: Optional[date] = None) -> Tuple[str, str]:
+    """(start, end_exclusive) ISO strings for col >= ? AND col < ? on one day (default: local today)."""
+    day = day or date.today()
+    return day.isoformat(), (day + timedelta(days=1)).isoformat()
+
+
+# ---------------------------------------------------------------------------
+# Index management
+# ---------------------------------------------------------------------------
+
+_stats = {"created": 0, "existing": 0, "skipped": 0}
+
+
+def _columns(conn: sqlite3.Connection, table: str) -> List[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})").fetchall()]
+
+
+def ensure_indexes(conn: sqlite3.Connection, tables: Optional[Iterable[str]] = None) -> Dict[str, List[str]]:
+    """
+    Create the missing MANAGED_INDEXES (optionally only for some tables).
+    Tables or columns that do not exist (yet) are skipped.
+    """
+    only = set(tables) if tables is not None else None
+    existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'").fetchall()}
+    result: Dict[str, List[str]] = {"created": [], "existing": [], "skipped": []}
+    for name, table, columns in MANAGED_INDEXES:
+        if only is not None and table not in only:
+            continue
+        if name in existing:
+            result["existing"].append(name)
+            continue
+        available = _columns(conn, table)
+        if not available or not all(column in available for column in columns):
+            result["skipped"].append(name)
+            continue
+        try:
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})")
+            conn.execute(f"ANALYZE {name}")
+            result["created"].append(name)
+        except sqlite3.Error as e:
+            logger.warning(f"Index {name} on {table} could not be created: {e}")
+            result["skipped"].append(name)
+    conn.commit()
+    for key, names in result.items():
+        _stats[key] += len(names)
+    if result["created"]:
+        logger.info(f"Created indexes: {', '.join(result['created'])}")
+    return result
+
+
+def stats() -> Dict[str, Any]:
+    return {"managed": len(MANAGED_INDEXES), **_stats}
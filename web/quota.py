@@ -0,0 +1,454 @@
+"""
+SBS Deutschland – Quota Service
+One API for usage quotas: demo uploads, copilot demo, invoice limits and
+the plan limiter's monthly counters.
+
+Every quota used to be its own ad-hoc counter: get_demo_usage ran CREATE
+TABLE plus a DATE(used_at) count per call, copilot_demo_status a LIKE
+'YYYY-MM-DD%' scan, check_rate_limit its own rate_limit_usage counter and
+check_invoice_limit a subscriptions lookup on every upload. Now:
+- counters are keyed (subject, quota name, period bucket) – subject is an
+  IP or user id, bucket the day/month the period maps to
+- counts live in memory; a total is read from quota_usage and re-read
+  every QUOTA_REFRESH_INTERVAL seconds, increments are flushed as one batch
+  every QUOTA_FLUSH_INTERVAL seconds (each flush re-reads the totals, so
+  other workers' usage is picked up)
+- the last QUOTA_STRICT_MARGIN units below a limit are consumed with a
+  check-and-increment in the DB, so several workers cannot each admit up
+  to the limit (demo quotas with small limits are always strict)
+- quotas owned by another module (invoice limits in database.py) are
+  registered as external: their status is cached for a short TTL,
+  invalidated on add() and on plan/subscription changes
+API: status(), consume() (atomic check + count), refund() (give a consumed
+unit back when the work failed), add(), invalidate().
+"""
+
+import os
+import threading
+import time
+import logging
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from web.db_pool import DB_PATH, pool_for
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL_SECONDS = float(os.getenv("QUOTA_FLUSH_INTERVAL", "5"))
+EXTERNAL_TTL_SECONDS = float(os.getenv("QUOTA_EXTERNAL_TTL", "30"))
+REFRESH_INTERVAL_SECONDS = float(os.getenv("QUOTA_REFRESH_INTERVAL", "5"))
+STRICT_MARGIN = int(os.getenv("QUOTA_STRICT_MARGIN", "10"))
+# Cached totals unused this long are dropped (and re-read on next use)
+IDLE_SECONDS = 300
+
+PERIOD_FORMATS = {"day": "%Y-%m-%d", "month": "%Y-%m"}
+EXTERNAL = "external"
+
+
+class Quota(NamedTuple):
+    name: str
+    period: str                   # "day" | "month" | "total" | "external"
+    limit: Optional[int] = None   # default; callers may pass a per-plan limit
+
+
+class QuotaStatus(NamedTuple):
+    used: int
+    limit: Optional[int]
+    allowed: bool
+    info: Dict[str, Any] = {}
+
+    @property
+    def remaining(self) -> int:
+        return max(0, self.limit - self.used) if self.limit is not None else 0
+
+
+DEMO_UPLOAD = Quota("demo_upload", "day", 3)
+COPILOT_DEMO = Quota("copilot_demo", "day", 3)
+INVOICES = Quota("invoices", EXTERNAL)
+
+
+def plan_quota(endpoint_type: str) -> Quota:
+    """Monthly counter of the plan limiter (limit comes from PLAN_LIMITS)."""
+    return Quota(f"plan:{endpoint_type}", "month")
+
+
+Key = Tuple[str, str, str]  # (subject, quota name, bucket)
+
+
+class _Counter:
+    __slots__ = ("base", "pending", "last_used", "read_at", "version")
+
+    def __init__(self, base: int, now: float):
+        self.base = base        # count in the DB as of the last read/flush
+        self.pending = 0        # increments not written yet (negative after a refund)
+        self.last_used = now
+        self.read_at = now
+        self.version = 0        # bumped whenever base is set from a write
+
+    @property
+    def count(self) -> int:
+        return self.base + self.pending
+
+
+class _External(NamedTuple):
+    load: Callable[[str], Dict[str, Any]]
+    record: Optional[Callable[[str, int], Any]]
+    ttl: float
+
+
+class QuotaService:
+    """
+    Usage:
+        status = quota.consume(ip, DEMO_UPLOAD)          # allowed → counted
+        status = quota.status(user_id, plan_quota("mbr"), limit=20)
+        quota.add(user_id, INVOICES, len(results))
+        quota.invalidate(INVOICES, user_id)              # after a plan change
+    """
+
+    def __init__(self, db_path: str = DB_PATH, flush_interval: float = FLUSH_INTERVAL_SECONDS,
+                 refresh_interval: float = REFRESH_INTERVAL_SECONDS, strict_margin: int = STRICT_MARGIN,
+                 clock: Callable[[], float] = time.time):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.refresh_interval = refresh_interval
+        self.strict_margin = strict_margin
+        self._clock = clock
+        self._pool = pool_for(db_path)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._counters: Dict[Key, _Counter] = {}
+        self._external: Dict[str, _External] = {}
+        self._external_cache: Dict[Tuple[str, str], Tuple[Dict[str, Any], float]] = {}
+        self._flusher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.flushes = 0
+        self.flushed_increments = 0
+        self.flush_errors = 0
+        self.external_loads = 0
+        self.refreshes = 0
+        self.strict_consumes = 0
+        self._init_db()
+
+    def _init_db(self):
+        try:
+            conn = self._pool.connect()
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS quota_usage (
+                    subject TEXT NOT NULL,
+                    quota TEXT NOT NULL,
+                    bucket TEXT NOT NULL,
+                    count INTEGER NOT NULL DEFAULT 0,
+                    updated_at TEXT,
+                    PRIMARY KEY (subject, quota, bucket)
+                )
+            """)
+            # Demo logs (file/question per use); counting happens in quota_usage
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS demo_usage (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    ip_address TEXT NOT NULL,
+                    used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    filename TEXT
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS copilot_demo_usage (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    ip_address TEXT,
+                    question TEXT,
+                    created_at TEXT
+                )
+            """)
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            logger.error(f"Quota DB init failed: {e}")
+
+    def bucket(self, period: str) -> str:
+        fmt = PERIOD_FORMATS.get(period)
+        return time.strftime(fmt, time.localtime(self._clock())) if fmt else "-"
+
+    # ------------------------------------------------------------------
+    # Counters
+    # ------------------------------------------------------------------
+
+    def _read(self, key: Key) -> Optional[int]:
+        """Stored total, None on DB errors."""
+        try:
+            conn = self._pool.connect()
+            try:
+                row = conn.execute(
+                    "SELECT count FROM quota_usage WHERE subject = ? AND quota = ? AND bucket = ?", key
+                ).fetchone()
+            finally:
+                conn.close()
+            return row[0] if row else 0
+        except Exception as e:
+            logger.error(f"Quota read failed for {key}: {e}")
+            return None
+
+    def _key(self, subject, quota: Quota) -> Key:
+        return (str(subject), quota.name, self.bucket(quota.period))
+
+    def _counter(self, subject, quota: Quota) -> _Counter:
+        """
+        Cached counter for the current bucket, re-read after refresh_interval
+        so other workers' flushed usage shows up. Caller must NOT hold the lock.
+        """
+        key = self._key(subject, quota)
+        now = self._clock()
+        with self._lock:
+            counter = self._counters.get(key)
+            if counter is not None:
+                counter.last_used = now
+                if now - counter.read_at < self.refresh_interval:
+                    return counter
+                version = counter.version
+        base = self._read(key)
+        with self._lock:
+            if counter is None:
+                counter = self._counters.get(key)
+                if counter is None:
+                    counter = self._counters[key] = _Counter(base or 0, now)
+                return counter
+            # A flush or strict consume that set base meanwhile has the newer total
+            if base is not None and counter.version == version:
+                counter.base = base
+                counter.read_at = now
+                self.refreshes += 1
+            return counter
+
+    @staticmethod
+    def _status(used: int, limit: Optional[int]) -> QuotaStatus:
+        return QuotaStatus(used, limit, limit is None or used < limit)
+
+    def status(self, subject, quota: Quota, limit: Optional[int] = None) -> QuotaStatus:
+        if quota.period == EXTERNAL:
+            return self._external_status(str(subject), quota.name)
+        limit = quota.limit if limit is None else limit
+        return self._status(self._counter(subject, quota).count, limit)
+
+    def consume(self, subject, quota: Quota, limit: Optional[int] = None, amount: int = 1) -> QuotaStatus:
+        """Atomically check and count; the returned status is the one before counting."""
+        if quota.period == EXTERNAL:
+            status = self._external_status(str(subject), quota.name)
+            if status.allowed:
+                self.add(subject, quota, amount)
+            return status
+        limit = quota.limit if limit is None else limit
+        counter = self._counter(subject, quota)
+        with self._lock:
+            status = self._status(counter.count, limit)
+            if limit is not None and counter.count + amount > limit:
+                return QuotaStatus(status.used, limit, False)
+            strict = limit is not None and counter.count + amount > limit - self.strict_margin
+            if not strict:
+                counter.pending += amount
+        if strict:
+            return self._consume_strict(self._key(subject, quota), counter, limit, amount)
+        self._ensure_flusher()
+        return status
+
+    def _consume_strict(self, key: Key, counter: _Counter, limit: int, amount: int) -> QuotaStatus:
+        """Check and count against the DB total (plus this worker's pending) in one transaction."""
+        with self._flush_lock:
+            try:
+                conn = self._pool.connect()
+                try:
+                    conn.execute("BEGIN IMMEDIATE")
+                    row = conn.execute(
+                        "SELECT count FROM quota_usage WHERE subject = ? AND quota = ? AND bucket = ?", key
+                    ).fetchone()
+                    stored = row[0] if row else 0
+                    with self._lock:
+                        pending = counter.pending
+                    used = stored + pending
+                    if used + amount > limit:
+                        conn.rollback()
+                        with self._lock:
+                            counter.base, counter.read_at = stored, self._clock()
+                            counter.version += 1
+                        return QuotaStatus(used, limit, False)
+                    self._upsert(conn, [(*key, pending + amount)])
+                    conn.commit()
+                finally:
+                    conn.close()
+            except Exception as e:
+                # DB unavailable: fall back to the in-memory decision already made
+                logger.error(f"Quota strict consume failed for {key}: {e}")
+                with self._lock:
+                    status = self._status(counter.count, limit)
+                    counter.pending += amount
+                self._ensure_flusher()
+                return status
+            with self._lock:
+                counter.pending -= pending
+                counter.base, counter.read_at = stored + pending + amount, self._clock()
+                counter.version += 1
+                self.strict_consumes += 1
+            return self._status(used, limit)
+
+    def refund(self, subject, quota: Quota, amount: int = 1):
+        """Give back units taken by consume() when the work they paid for failed."""
+        if quota.period == EXTERNAL:
+            return
+        counter = self._counter(subject, quota)
+        with self._lock:
+            counter.pending -= amount
+        self._ensure_flusher()
+
+    def add(self, subject, quota: Quota, amount: int = 1) -> QuotaStatus:
+        """Count usage that already happened (no limit check); returns the new status."""
+        if quota.period == EXTERNAL:
+            external = self._external[quota.name]
+            if external.record is not None:
+                external.record(str(subject), amount)
+            self.invalidate(quota, subject)
+            return QuotaStatus(0, None, True)
+        counter = self._counter(subject, quota)
+        with self._lock:
+            counter.pending += amount
+            count = counter.count
+        self._ensure_flusher()
+        return self._status(count, quota.limit)
+
+    # ------------------------------------------------------------------
+    # External quotas
+    # ------------------------------------------------------------------
+
+    def register_external(self, quota: Quota, load: Callable[[str], Dict[str, Any]],
+                          record: Optional[Callable[[str, int], Any]] = None, ttl: float = EXTERNAL_TTL_SECONDS):
+        """load(subject) -> status dict with at least "allowed"; record(subject, amount) persists usage."""
+        self._external[quota.name] = _External(load, record, ttl)
+
+    def _external_status(self, subject: str, name: str) -> QuotaStatus:
+        now = self._clock()
+        with self._lock:
+            cached = self._external_cache.get((name, subject))
+        if cached is not None and cached[1] > now:
+            info = cached[0]
+        else:
+            external = self._external.get(name)
+            if external is None:
+                raise KeyError(f"Quota '{name}' is not registered")
+            info = external.load(subject)
+            with self._lock:
+                self.external_loads += 1
+                self._external_cache[(name, subject)] = (info, now + external.ttl)
+        return QuotaStatus(info.get("used", 0), info.get("limit"),
+                           bool(info.get("allowed") or info.get("is_admin")), info)
+
+    def invalidate(self, quota: Quota, subject=None):
+        """Forget cached state (one subject, or all when the subject is unknown, e.g. Stripe webhooks)."""
+        with self._lock:
+            if quota.period == EXTERNAL:
+                cache = self._external_cache
+                keys = [k for k in cache if k[0] == quota.name and (subject is None or k[1] == str(subject))]
+                for key in keys:
+                    del cache[key]
+            else:
+                # Re-read from the DB on next use; pending increments stay
+                keys = [k for k, c in self._counters.items()
+                        if k[1] == quota.name and (subject is None or k[0] == str(subject)) and not c.pending]
+                for key in keys:
+                    del self._counters[key]
+
+    # ------------------------------------------------------------------
+    # Write-behind
+    # ------------------------------------------------------------------
+
+    def _ensure_flusher(self):
+        if self._flusher is not None or self.flush_interval <= 0:
+            return
+        with self._flush_lock:
+            if self._flusher is None:
+                self._stop.clear()
+                self._flusher = threading.Thread(target=self._flush_loop, daemon=True, name="quota-flush")
+                self._flusher.start()
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    @staticmethod
+    def _upsert(conn, rows: List[Tuple[str, str, str, int]]):
+        # Deltas are negative after refunds; totals never drop below zero
+        conn.executemany("""
+            UPDATE quota_usage SET count = MAX(0, count + ?), updated_at = datetime('now')
+            WHERE subject = ? AND quota = ? AND bucket = ?
+        """, [(delta, subject, name, bucket) for subject, name, bucket, delta in rows])
+        conn.executemany("""
+            INSERT OR IGNORE INTO quota_usage (subject, quota, bucket, count, updated_at)
+            VALUES (?, ?, ?, MAX(0, ?), datetime('now'))
+        """, rows)
+
+    def flush(self) -> int:
+        """Write pending increments in one transaction; returns the number of increments written."""
+        with self._flush_lock:
+            now = self._clock()
+            with self._lock:
+                batch: List[Tuple[Key, _Counter, int]] = [
+                    (key, counter, counter.pending) for key, counter in self._counters.items() if counter.pending
+                ]
+                # Idle totals (incl. past buckets) are re-read on next use
+                for key in [k for k, c in self._counters.items() if not c.pending and now - c.last_used > IDLE_SECONDS]:
+                    del self._counters[key]
+            if not batch:
+                return 0
+            try:
+                conn = self._pool.connect()
+                try:
+                    self._upsert(conn, [(*key, delta) for key, _, delta in batch])
+                    totals = [
+                        conn.execute(
+                            "SELECT count FROM quota_usage WHERE subject = ? AND quota = ? AND bucket = ?", key
+                        ).fetchone()[0]
+                        for key, _, _ in batch
+                    ]
+                    conn.commit()
+                finally:
+                    conn.close()
+            except Exception as e:
+                # Pending increments stay in memory for the next flush
+                logger.error(f"Quota flush failed: {e}")
+                with self._lock:
+                    self.flush_errors += 1
+                return 0
+            written = sum(delta for _, _, delta in batch)
+            with self._lock:
+                for (key, counter, delta), total in zip(batch, totals):
+                    # total includes this flush and other workers' usage; pending was
+                    # counted until now so the count never dipped during the write
+                    counter.pending -= delta
+                    counter.base, counter.read_at = total, now
+                    counter.version += 1
+                    self._counters.setdefault(key, counter)
+                self.flushes += 1
+                self.flushed_increments += written
+            return written
+
+    def stop(self):
+        """Stop the background flusher and write what is pending."""
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join(timeout=self.flush_interval + 1)
+            self._flusher = None
+        self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "counters": len(self._counters),
+                "pending": sum(c.pending for c in self._counters.values()),
+                "flushes": self.flushes,
+                "flushed_increments": self.flushed_increments,
+                "flush_errors": self.flush_errors,
+                "refreshes": self.refreshes,
+                "strict_consumes": self.strict_consumes,
+                "external": sorted(self._external),
+                "external_cached": len(self._external_cache),
+                "external_loads": self.external_loads,
+            }
+
+
+# Global instance
+quota = QuotaService()
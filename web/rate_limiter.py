@@ -1,128 +1,154 @@
 """
 SBS Deutschland – Enterprise Rate Limiter
 Plan-based rate limiting with user isolation and cost control.
+
+check_rate_limit used to open three SQLite connections per guarded request
+(plan lookup, monthly usage read, monthly usage write) and filtered a list
+of timestamps per key twice for the burst check. Now:
+- burst limits are O(1) sliding-window counters (previous and current
+  window count, weighted by the elapsed fraction of the current window),
+  kept in a pluggable backend (limiter_backends.py) so they can be shared
+  across workers and hosts
+- monthly usage is a plan:<endpoint> counter of the quota service
+  (quota.py): counted in memory, written behind in batches
+- user plans are cached for PLAN_CACHE_TTL seconds; invalidate_user_plan()
+  drops them when a subscription changes
 """
 
+import math
+import os
+import threading
 import time
-import sqlite3
 import logging
-from collections import defaultdict
-from typing import Optional, Tuple
+from typing import Callable, Dict, Optional, Tuple
 from fastapi import Request, HTTPException
 
+from web.db_pool import DB_PATH, get_db, pool_for
+from web.limiter_backends import BackendUnavailable, FAIL_OPEN, create_backend
+from web.quota import QuotaService, plan_quota, quota as quota_service
+
 logger = logging.getLogger(__name__)
 
+BURST_WINDOW_SECONDS = 60
+PLAN_CACHE_TTL = int(os.getenv("PLAN_CACHE_TTL", "60"))
+
 
 class EnterpriseRateLimiter:
     """
     Enterprise Rate Limiter with:
     - Plan-based limits (Free, Starter, Professional, Enterprise)
     - User-specific tracking (not just IP)
-    - Persistent monthly counters for billing
+    - Persistent monthly counters for billing (write-behind)
     - LLM/MBR cost control
     """
     
-    def __init__(self, db_path: str = "invoices.db"):
+    def __init__(self, db_path: str = DB_PATH, clock: Callable[[], float] = time.time,
+                 backend=None, fail_open: bool = FAIL_OPEN, quota: Optional[QuotaService] = None):
         self.db_path = db_path
-        # In-memory for burst protection (per minute)
-        self.burst_requests = defaultdict(list)
-        self.last_cleanup = time.time()
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.backend = backend if backend is not None else create_backend()
+        self.fail_open = fail_open
+        self.backend_errors = 0
+        self._last_backend_log = float("-inf")
+        self.quota = quota if quota is not None else QuotaService(db_path, clock=clock)
         
-        # Initialize DB table for monthly counters
-        self._init_db()
+        # Monthly counters moved from rate_limit_usage to quota_usage
+        self._import_legacy_usage()
     
-    def _init_db(self):
-        """Create rate limit tracking table if not exists."""
+    def _import_legacy_usage(self):
+        """Copy rate_limit_usage rows into quota_usage once (the old table is left as is)."""
         try:
-            conn = sqlite3.connect(self.db_path)
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS rate_limit_usage (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    endpoint_type TEXT,
-                    year_month TEXT,
-                    count INTEGER DEFAULT 0,
-                    last_updated TEXT,
-                    UNIQUE(user_id, endpoint_type, year_month)
-                )
-            """)
-            conn.execute("CREATE INDEX IF NOT EXISTS idx_rate_user_month ON rate_limit_usage(user_id, year_month)")
-            conn.commit()
-            conn.close()
+            conn = pool_for(self.db_path).connect()
+            try:
+                legacy = conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'rate_limit_usage'"
+                ).fetchone()
+                imported = conn.execute("SELECT 1 FROM quota_usage WHERE quota LIKE 'plan:%' LIMIT 1").fetchone()
+                if legacy and not imported:
+                    conn.execute("""
+                        INSERT OR IGNORE INTO quota_usage (subject, quota, bucket, count, updated_at)
+                        SELECT CAST(user_id AS TEXT), 'plan:' || endpoint_type, year_month, count, last_updated
+                        FROM rate_limit_usage
+                    """)
+                    conn.commit()
+            finally:
+                conn.close()
         except Exception as e:
-            logger.error(f"Rate limiter DB init failed: {e}")
-    
-    def _cleanup_burst(self):
-        """Clean old burst entries."""
-        now = time.time()
-        if now - self.last_cleanup < 30:
-            return
-        
-        cutoff = now - 60
-        for key in list(self.burst_requests.keys()):
-            self.burst_requests[key] = [ts for ts in self.burst_requests[key] if ts > cutoff]
-            if not self.burst_requests[key]:
-                del self.burst_requests[key]
-        self.last_cleanup = now
-    
-    def _get_year_month(self) -> str:
-        """Current year-month string."""
-        return time.strftime("%Y-%m")
+            logger.error(f"Rate limit usage import failed: {e}")
     
-    def _get_monthly_usage(self, user_id: int, endpoint_type: str) -> int:
-        """Get current month's usage count."""
+    # ------------------------------------------------------------------
+    # Burst limits (sliding window in the configured backend)
+    # ------------------------------------------------------------------
+
+    def _backend_failed(self, error: Exception) -> bool:
+        """Count and log (at most once a minute) a backend error; returns whether to allow."""
+        now = self._clock()
+        with self._lock:
+            self.backend_errors += 1
+            log = now - self._last_backend_log >= 60
+            if log:
+                self._last_backend_log = now
+        if log:
+            mode = "open" if self.fail_open else "closed"
+            logger.error(f"Rate limit backend unavailable, failing {mode}: {error}")
+        return self.fail_open
+
+    def check_burst_limit(self, key: str, limit: int = 60, window: int = BURST_WINDOW_SECONDS) -> bool:
+        """Check per-minute burst limit (shared across workers unless the backend is "memory")."""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.execute(
-                "SELECT count FROM rate_limit_usage WHERE user_id = ? AND endpoint_type = ? AND year_month = ?",
-                (user_id, endpoint_type, self._get_year_month())
-            )
-            row = cursor.fetchone()
-            conn.close()
-            return row[0] if row else 0
-        except Exception as e:
-            logger.error(f"Get monthly usage failed: {e}")
-            return 0
+            allowed, _ = self.backend.hit(key, limit, window, self._clock())
+        except BackendUnavailable as e:
+            return self._backend_failed(e)
+        return allowed
     
-    def _increment_monthly_usage(self, user_id: int, endpoint_type: str):
-        """Increment monthly usage counter."""
+    def get_burst_remaining(self, key: str, limit: int = 60, window: int = BURST_WINDOW_SECONDS) -> int:
+        """Get remaining burst requests."""
         try:
-            conn = sqlite3.connect(self.db_path)
-            conn.execute("""
-                INSERT INTO rate_limit_usage (user_id, endpoint_type, year_month, count, last_updated)
-                VALUES (?, ?, ?, 1, datetime('now'))
-                ON CONFLICT(user_id, endpoint_type, year_month) 
-                DO UPDATE SET count = count + 1, last_updated = datetime('now')
-            """, (user_id, endpoint_type, self._get_year_month()))
-            conn.commit()
-            conn.close()
-        except Exception as e:
-            logger.error(f"Increment usage failed: {e}")
-    
-    def check_burst_limit(self, key: str, limit: int = 60, window: int = 60) -> bool:
-        """Check per-minute burst limit (in-memory)."""
-        self._cleanup_burst()
-        
-        now = time.time()
-        cutoff = now - window
-        recent = [ts for ts in self.burst_requests[key] if ts > cutoff]
-        
-        if len(recent) >= limit:
-            return False
-        
-        self.burst_requests[key].append(now)
-        return True
+            estimate = self.backend.peek(key, window, self._clock())
+        except BackendUnavailable:
+            return limit if self.fail_open else 0
+        return max(0, limit - math.ceil(estimate))
+
+    # ------------------------------------------------------------------
+    # Monthly usage (quota service)
+    # ------------------------------------------------------------------
+
+    def _get_monthly_usage(self, user_id: int, endpoint_type: str) -> int:
+        """Get current month's usage count (including unflushed increments)."""
+        return self.quota.status(user_id, plan_quota(endpoint_type)).used
     
-    def get_burst_remaining(self, key: str, limit: int = 60, window: int = 60) -> int:
-        """Get remaining burst requests."""
-        now = time.time()
-        cutoff = now - window
-        recent = [ts for ts in self.burst_requests[key] if ts > cutoff]
-        return max(0, limit - len(recent))
+    def _increment_monthly_usage(self, user_id: int, endpoint_type: str):
+        """Increment monthly usage counter (flushed in the background)."""
+        self.quota.add(user_id, plan_quota(endpoint_type))
+
+    def consume_monthly(self, user_id: int, endpoint_type: str, limit: int) -> Tuple[bool, int]:
+        """
+        Atomically check and count one request against the monthly limit.
+        Returns (allowed, usage before this request).
+        """
+        status = self.quota.consume(user_id, plan_quota(endpoint_type), limit=limit)
+        return status.allowed, status.used
+
+    def flush(self) -> int:
+        return self.quota.flush()
+
+    def stop(self):
+        """Write pending monthly counts."""
+        self.quota.stop()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {
+                "fail_open": self.fail_open,
+                "backend_errors": self.backend_errors,
+                "plan_cache": plan_cache_stats(),
+            }
+        return {"burst": self.backend.stats(), **stats}
 
 
 # Global instance
-limiter = EnterpriseRateLimiter()
+limiter = EnterpriseRateLimiter(quota=quota_service)
 
 
 # ============================================================
@@ -173,25 +199,60 @@ def get_client_ip(request: Request) -> str:
     return request.client.host or "unknown"
 
 
+_plan_cache: Dict[int, Tuple[str, float]] = {}
+_plan_lock = threading.Lock()
+_plan_stats = {"hits": 0, "misses": 0}
+
+
+def invalidate_user_plan(user_id: Optional[int] = None):
+    """Forget cached plans (one user, or all when the user is unknown, e.g. Stripe webhooks)."""
+    with _plan_lock:
+        if user_id is None:
+            _plan_cache.clear()
+        else:
+            _plan_cache.pop(user_id, None)
+
+
+def plan_cache_stats() -> dict:
+    with _plan_lock:
+        return {"size": len(_plan_cache), "ttl": PLAN_CACHE_TTL, **_plan_stats}
+
+
 def get_user_plan(user_id: Optional[int]) -> str:
-    """Get user's subscription plan."""
+    """Get user's subscription plan (cached for PLAN_CACHE_TTL seconds)."""
     if not user_id:
         return "Free"
     
+    now = time.monotonic()
+    with _plan_lock:
+        cached = _plan_cache.get(user_id)
+        if cached is not None and cached[1] > now:
+            _plan_stats["hits"] += 1
+            return cached[0]
+        _plan_stats["misses"] += 1
+    
+    plan = _load_user_plan(user_id)
+    if plan is None:
+        # DB error: fall back to Free for this request only
+        return "Free"
+    with _plan_lock:
+        _plan_cache[user_id] = (plan, now + PLAN_CACHE_TTL)
+    return plan
+
+
+def _load_user_plan(user_id: int) -> Optional[str]:
     try:
-        conn = sqlite3.connect("invoices.db")
+        conn = get_db()
         cursor = conn.execute(
             "SELECT plan FROM users WHERE id = ?", (user_id,)
         )
         row = cursor.fetchone()
         conn.close()
         
-        if row and row[0]:
-            return row[0]
+        return row[0] if row and row[0] else "Free"
     except Exception as e:
         logger.error(f"Get user plan failed: {e}")
-    
-    return "Free"
+        return None
 
 
 def check_rate_limit(
@@ -253,9 +314,9 @@ def check_rate_limit(
     
     # Check monthly limit (for authenticated users)
     if user_id:
-        monthly_usage = limiter._get_monthly_usage(user_id, limit_type)
+        allowed, monthly_usage = limiter.consume_monthly(user_id, limit_type, monthly_limit)
         
-        if monthly_usage >= monthly_limit:
+        if not allowed:
             raise HTTPException(
                 status_code=429,
                 detail={
@@ -275,8 +336,6 @@ def check_rate_limit(
                 }
             )
         
-        # Increment usage
-        limiter._increment_monthly_usage(user_id, limit_type)
         monthly_remaining = monthly_limit - monthly_usage - 1
     else:
         monthly_remaining = monthly_limit
@@ -311,19 +370,9 @@ def rate_limit_headers(limit_info: dict) -> dict:
 def get_usage_stats(user_id: int) -> dict:
     """Get usage statistics for a user."""
     try:
-        conn = sqlite3.connect("invoices.db")
-        conn.row_factory = sqlite3.Row
-        cursor = conn.execute("""
-            SELECT endpoint_type, count 
-            FROM rate_limit_usage 
-            WHERE user_id = ? AND year_month = ?
-        """, (user_id, time.strftime("%Y-%m")))
-        
-        usage = {row["endpoint_type"]: row["count"] for row in cursor.fetchall()}
-        conn.close()
-        
         plan = get_user_plan(user_id)
         plan_limits = PLAN_LIMITS.get(plan, DEFAULT_LIMITS)
+        usage = {endpoint: limiter._get_monthly_usage(user_id, endpoint) for endpoint in plan_limits}
         
         return {
             "plan": plan,
@@ -0,0 +1,142 @@
+"""
+SBS Deutschland – Result Journal
+Crash-safe, incremental persistence of per-file extraction results.
+
+Every finished PDF is appended to a job_results table while the batch is
+still running (commits every RESULT_JOURNAL_BATCH rows). If a worker dies
+at PDF 480 of 500, the job is re-claimed from the job store and
+process_invoices_background resumes with the 20 missing files instead of
+paying for 500 LLM calls again. The journal is cleared once the job's
+invoices are saved.
+"""
+
+import json
+import os
+import sqlite3
+import time
+import logging
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from web.db_pool import DB_PATH, pool_for
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = int(os.getenv("RESULT_JOURNAL_BATCH", "10"))
+
+
+class ResultJournal:
+    """
+    SQLite-backed journal of extraction results per job.
+
+    Usage:
+        results, done = result_journal.load(job_id)
+        with result_journal.writer(job_id) as journal:
+            journal.add_result(filename, data)
+    """
+
+    def __init__(self, db_path: str = DB_PATH, batch_size: int = DEFAULT_BATCH_SIZE):
+        self.db_path = db_path
+        self._pool = pool_for(db_path)
+        self.batch_size = max(1, batch_size)
+        self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        return self._pool.connect()
+
+    def _init_db(self):
+        """Create journal table if not exists."""
+        try:
+            conn = self._connect()
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS job_results (
+                    job_id TEXT NOT NULL,
+                    filename TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    data TEXT,
+                    created_at REAL,
+                    PRIMARY KEY (job_id, filename)
+                )
+            """)
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            logger.error(f"Result journal DB init failed: {e}")
+
+    def load(self, job_id: str) -> Tuple[List[Dict[str, Any]], Set[str]]:
+        """
+        Return (results, done_filenames) already journaled for a job.
+        Failed files are not returned as done, so a resumed job retries them.
+        """
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT filename, data FROM job_results WHERE job_id = ? AND status = 'success' ORDER BY created_at",
+                (job_id,),
+            ).fetchall()
+        finally:
+            conn.close()
+        results = [json.loads(data) for _, data in rows]
+        return results, {filename for filename, _ in rows}
+
+    def writer(self, job_id: str) -> "JournalWriter":
+        return JournalWriter(self, job_id)
+
+    def clear(self, job_id: str):
+        """Drop journal rows once the job's invoices are persisted."""
+        try:
+            conn = self._connect()
+            conn.execute("DELETE FROM job_results WHERE job_id = ?", (job_id,))
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            logger.error(f"Result journal clear failed for {job_id}: {e}")
+
+
+class JournalWriter:
+    """Buffers journal rows and commits them in batches on one connection."""
+
+    def __init__(self, journal: ResultJournal, job_id: str):
+        self.journal = journal
+        self.job_id = job_id
+        self._pending: List[tuple] = []
+        self._conn: Optional[sqlite3.Connection] = None
+        self.written = 0
+
+    def __enter__(self) -> "JournalWriter":
+        self._conn = self.journal._connect()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.flush()
+        finally:
+            self._conn.close()
+            self._conn = None
+
+    def add_result(self, filename: str, data: Dict[str, Any]):
+        self._add(filename, "success", json.dumps(data, ensure_ascii=False, default=str))
+
+    def add_failure(self, filename: str, error: str):
+        self._add(filename, "error", json.dumps({"error": error}, ensure_ascii=False))
+
+    def _add(self, filename: str, status: str, payload: str):
+        self._pending.append((self.job_id, filename, status, payload, time.time()))
+        if len(self._pending) >= self.journal.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        try:
+            self._conn.executemany("""
+                INSERT INTO job_results (job_id, filename, status, data, created_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(job_id, filename) DO UPDATE SET
+                    status = excluded.status, data = excluded.data, created_at = excluded.created_at
+            """, self._pending)
+            self._conn.commit()
+            self.written += len(self._pending)
+            self._pending = []
+        except Exception as e:
+            # Journal is a safety net – never fail the job because of it
+            logger.error(f"Result journal flush failed for {self.job_id}: {e}")
@@ -0,0 +1,270 @@
+"""
+SBS Deutschland – Retention Sweeper
+Persistent deletion schedule for uploads (DSGVO).
+
+Every finished job used to start asyncio.create_task(cleanup_uploads(...)),
+a coroutine sleeping 60 minutes per job: thousands of pending tasks, and
+every scheduled deletion was lost on restart or deploy. Now:
+- deletions are rows in retention_index (kind, path, tenant, delete_after)
+- upload directories are registered on upload (safety net for failed jobs)
+  and rescheduled to UPLOAD_RETENTION_MINUTES when the job finishes
+- one sweeper per worker deletes due rows in batches
+- failed deletions are retried with backoff instead of being forgotten
+"""
+
+import asyncio
+import os
+import shutil
+import sqlite3
+import time
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from web.db_pool import DB_PATH, pool_for
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_RETENTION_MINUTES = int(os.getenv("UPLOAD_RETENTION_MINUTES", "60"))
+# Uploads whose job never finishes are still deleted after this
+UPLOAD_MAX_RETENTION_HOURS = int(os.getenv("UPLOAD_MAX_RETENTION_HOURS", "24"))
+SWEEP_INTERVAL_SECONDS = int(os.getenv("RETENTION_SWEEP_INTERVAL", "60"))
+SWEEP_BATCH_SIZE = int(os.getenv("RETENTION_SWEEP_BATCH", "200"))
+RETRY_BACKOFF_SECONDS = 300
+
+KIND_UPLOAD = "upload"
+
+
+def _timestamp(value: Union[datetime, float, int]) -> float:
+    return value.timestamp() if isinstance(value, datetime) else float(value)
+
+
+class RetentionIndex:
+    """
+    Usage:
+        retention_index.schedule_path(upload_path, delete_after, tenant_id=user_id)
+        retention_index.sweep()
+    """
+
+    def __init__(self, db_path: str = DB_PATH, batch_size: int = SWEEP_BATCH_SIZE):
+        self.db_path = db_path
+        self._pool = pool_for(db_path)
+        self.batch_size = batch_size
+        self.deleted = 0
+        self.failed = 0
+        self.sweeps = 0
+        self.last_sweep_ms = 0.0
+        self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        return self._pool.connect()
+
+    def _init_db(self):
+        """Create retention table if not exists."""
+        try:
+            conn = self._connect()
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS retention_index (
+                    kind TEXT NOT NULL,
+                    ref TEXT NOT NULL,
+                    tenant_id TEXT,
+                    delete_after REAL NOT NULL,
+                    attempts INTEGER DEFAULT 0,
+                    last_error TEXT,
+                    created_at REAL,
+                    PRIMARY KEY (kind, ref)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_retention_due ON retention_index(delete_after)")
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            logger.error(f"Retention index DB init failed: {e}")
+
+    # ------------------------------------------------------------------
+    # Scheduling
+    # ------------------------------------------------------------------
+
+    def schedule(self, kind: str, ref: str, delete_after: Union[datetime, float],
+                 tenant_id: Optional[Any] = None):
+        """Insert or move a deletion; the latest call wins."""
+        conn = self._connect()
+        try:
+            conn.execute("""
+                INSERT INTO retention_index (kind, ref, tenant_id, delete_after, created_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(kind, ref) DO UPDATE SET
+                    delete_after = excluded.delete_after,
+                    tenant_id = COALESCE(excluded.tenant_id, retention_index.tenant_id),
+                    attempts = 0, last_error = NULL
+            """, (kind, ref, None if tenant_id is None else str(tenant_id), _timestamp(delete_after), time.time()))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def schedule_path(self, path: Union[str, Path], delete_after: Union[datetime, float],
+                      tenant_id: Optional[Any] = None, kind: str = KIND_UPLOAD):
+        self.schedule(kind, str(Path(path).resolve()), delete_after, tenant_id)
+
+    def cancel(self, kind: str, ref: str):
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM retention_index WHERE kind = ? AND ref = ?", (kind, ref))
+            conn.commit()
+        finally:
+            conn.close()
+
+    # ------------------------------------------------------------------
+    # Sweeping
+    # ------------------------------------------------------------------
+
+    def due(self, now: Optional[float] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        conn = self._connect()
+        try:
+            rows = conn.execute("""
+                SELECT kind, ref, tenant_id, delete_after, attempts FROM retention_index
+                WHERE delete_after <= ? ORDER BY delete_after LIMIT ?
+            """, (time.time() if now is None else now, limit or self.batch_size)).fetchall()
+        finally:
+            conn.close()
+        return [dict(zip(("kind", "ref", "tenant_id", "delete_after", "attempts"), row)) for row in rows]
+
+    def sweep(self, now: Optional[float] = None, max_batches: int = 10) -> int:
+        """Delete everything due, batch by batch. Returns the number of deleted entries."""
+        start = time.perf_counter()
+        now = time.time() if now is None else now
+        deleted = 0
+        for _ in range(max_batches):
+            batch = self.due(now)
+            if not batch:
+                break
+            deleted += self._sweep_batch(batch, now)
+            if len(batch) < self.batch_size:
+                break
+        self.sweeps += 1
+        self.last_sweep_ms = round((time.perf_counter() - start) * 1000, 1)
+        if deleted:
+            logger.info(f"Retention sweep: {deleted} entries deleted in {self.last_sweep_ms}ms")
+        return deleted
+
+    def _sweep_batch(self, batch: List[Dict[str, Any]], now: float) -> int:
+        done: List[tuple] = []
+        failed: List[tuple] = []
+
+        # Every kind is path-based (uploads, exports): the ref is the path
+        for entry in batch:
+            kind, ref = entry["kind"], entry["ref"]
+            try:
+                path = Path(ref)
+                if path.is_dir():
+                    shutil.rmtree(path)
+                elif path.exists():
+                    path.unlink()
+                done.append((kind, ref, None))
+            except OSError as e:
+                failed.append((kind, ref, str(e)))
+
+        conn = self._connect()
+        try:
+            conn.executemany("DELETE FROM retention_index WHERE kind = ? AND ref = ?",
+                             [(kind, ref) for kind, ref, _ in done])
+            conn.executemany("""
+                UPDATE retention_index
+                SET attempts = attempts + 1, last_error = ?, delete_after = ? + ? * (attempts + 1)
+                WHERE kind = ? AND ref = ?
+            """, [(error, now, RETRY_BACKOFF_SECONDS, kind, ref) for kind, ref, error in failed])
+            conn.commit()
+        finally:
+            conn.close()
+
+        for kind, ref, error in failed:
+            logger.warning(f"Retention: {kind} {ref} not deleted ({error})")
+        self.deleted += len(done)
+        self.failed += len(failed)
+        return len(done)
+
+    def adopt_orphans(self, root: Union[str, Path], delete_after_seconds: int, kind: str = KIND_UPLOAD) -> int:
+        """
+        Register directories under root that are not scheduled yet (e.g. uploads
+        from before the index existed), counting their age from the mtime.
+        """
+        root = Path(root)
+        if not root.exists():
+            return 0
+        conn = self._connect()
+        try:
+            known = {row[0] for row in conn.execute("SELECT ref FROM retention_index WHERE kind = ?", (kind,))}
+        finally:
+            conn.close()
+        adopted = 0
+        for path in root.iterdir():
+            ref = str(path.resolve())
+            if not path.is_dir() or ref in known:
+                continue
+            try:
+                self.schedule(kind, ref, path.stat().st_mtime + delete_after_seconds)
+                adopted += 1
+            except (OSError, sqlite3.Error) as e:
+                logger.error(f"Retention: could not adopt {path}: {e}")
+        return adopted
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            conn = self._connect()
+            try:
+                pending = dict(conn.execute("SELECT kind, COUNT(*) FROM retention_index GROUP BY kind").fetchall())
+                overdue = conn.execute("SELECT COUNT(*) FROM retention_index WHERE delete_after <= ?",
+                                       (time.time(),)).fetchone()[0]
+            finally:
+                conn.close()
+        except Exception as e:
+            return {"error": str(e)}
+        return {
+            "pending": pending,
+            "overdue": overdue,
+            "deleted": self.deleted,
+            "failed": self.failed,
+            "sweeps": self.sweeps,
+            "last_sweep_ms": self.last_sweep_ms,
+        }
+
+
+class RetentionSweeper:
+    """Single periodic task per worker; hooks (e.g. artifact pruning) run every hook_every ticks."""
+
+    def __init__(self, index: RetentionIndex, interval: float = SWEEP_INTERVAL_SECONDS,
+                 hooks: Optional[List[Callable[[], Any]]] = None, hook_every: int = 60):
+        self.index = index
+        self.interval = interval
+        self.hooks = list(hooks or [])
+        self.hook_every = hook_every
+        self._ticks = 0
+        self._stopped = False
+
+    def run_once(self) -> int:
+        deleted = self.index.sweep()
+        self._ticks += 1
+        if (self._ticks - 1) % self.hook_every:
+            return deleted
+        for hook in self.hooks:
+            try:
+                hook()
+            except Exception as e:
+                logger.error(f"Retention hook failed: {e}")
+        return deleted
+
+    async def run(self):
+        while not self._stopped:
+            try:
+                await asyncio.to_thread(self.run_once)
+            except Exception as e:
+                logger.error(f"Retention sweep failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def stop(self):
+        self._stopped = True
+
+
+# Global instance
+retention_index = RetentionIndex()
@@ -132,8 +132,9 @@ async def process_oauth_user(provider: str, oauth_id: str, email: str, name: str
     """
     import sqlite3
     from database import DB_PATH
+    from web.db_pool import pool_for
     
-    conn = sqlite3.connect(DB_PATH)
+    conn = pool_for(DB_PATH).connect()
     conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
     
@@ -0,0 +1,17 @@
+"""
+Point the module-level singletons (quota, identities, duplicate_index, ...)
+at a throwaway database before any web module is imported, so the suite
+never writes to ./invoices.db.
+"""
+
+import os
+import shutil
+import tempfile
+
+_DB_DIR = tempfile.mkdtemp(prefix="sbs-tests-")
+os.environ["INVOICES_DB_PATH"] = os.path.join(_DB_DIR, "invoices.db")
+os.environ["RATE_LIMIT_SQLITE_PATH"] = os.path.join(_DB_DIR, "rate_limits.db")
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(_DB_DIR, ignore_errors=True)
@@ -0,0 +1,206 @@
+import sqlite3
+import time
+
+import pytest
+
+from web.api_key_cache import ApiKeyCache, key_hash
+from web.event_backplane import LocalBackplane, SQLiteBackplane
+from web.progress_events import ProgressHub
+
+KEYS = {
+    "sbs_live_anna": {"id": 1, "user_id": 7, "permissions": "read"},
+    "sbs_live_anna2": {"id": 2, "user_id": 7, "permissions": "write"},
+    "sbs_live_ben": {"id": 3, "user_id": 8, "permissions": "read"},
+}
+
+
+class FakeClock:
+    def __init__(self, now: float = 1_800_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FakeApiKeys:
+    """Stand-in for api_keys.validate_api_key."""
+
+    def __init__(self):
+        self.calls = []
+        self.revoked = set()
+        self.before_return = None
+
+    def validate(self, api_key):
+        self.calls.append(api_key)
+        info = KEYS.get(api_key)
+        if self.before_return is not None:
+            self.before_return()
+        if info is None or info["id"] in self.revoked:
+            return None
+        return dict(info)
+
+
+def _cache(tmp_path, clock=None, hub=None, **kwargs):
+    kwargs.setdefault("flush_interval", 0)
+    cache = ApiKeyCache(str(tmp_path / "invoices.db"), clock=clock or FakeClock(),
+                        hub=hub or ProgressHub(backplane=LocalBackplane()), **kwargs)
+    api_keys = FakeApiKeys()
+    cache.register(api_keys.validate)
+    return cache, api_keys
+
+
+class TestValidation:
+    def test_hits_skip_the_validator(self, tmp_path):
+        cache, api_keys = _cache(tmp_path)
+        for _ in range(10):
+            assert cache.validate("sbs_live_anna")["user_id"] == 7
+        assert api_keys.calls == ["sbs_live_anna"]
+        assert cache.stats()["hits"] == 9
+
+    def test_only_the_hash_is_kept(self, tmp_path):
+        cache, _ = _cache(tmp_path)
+        cache.validate("sbs_live_anna")
+        assert list(cache._entries) == [key_hash("sbs_live_anna")]
+
+    def test_returned_info_is_a_copy(self, tmp_path):
+        cache, _ = _cache(tmp_path)
+        cache.validate("sbs_live_anna")["permissions"] = "admin"
+        assert cache.validate("sbs_live_anna")["permissions"] == "read"
+
+    def test_ttl_and_negative_ttl(self, tmp_path):
+        clock = FakeClock()
+        cache, api_keys = _cache(tmp_path, clock, ttl=60, negative_ttl=10)
+        assert cache.validate("guess") is None
+        assert cache.validate("guess") is None
+        cache.validate("sbs_live_anna")
+
+        clock.now += 11
+        assert cache.validate("guess") is None
+        cache.validate("sbs_live_anna")
+        clock.now += 50
+        cache.validate("sbs_live_anna")
+        assert api_keys.calls == ["guess", "sbs_live_anna", "guess", "sbs_live_anna"]
+
+    def test_lru_is_bounded(self, tmp_path):
+        cache, api_keys = _cache(tmp_path, max_entries=2)
+        cache.validate("sbs_live_anna")
+        cache.validate("sbs_live_ben")
+        cache.validate("sbs_live_anna")      # most recently used
+        cache.validate("sbs_live_anna2")     # evicts ben
+        assert cache.stats()["size"] == 2
+        cache.validate("sbs_live_anna")
+        cache.validate("sbs_live_ben")
+        assert api_keys.calls.count("sbs_live_anna") == 1
+        assert api_keys.calls.count("sbs_live_ben") == 2
+
+    def test_empty_key(self, tmp_path):
+        cache, api_keys = _cache(tmp_path)
+        assert cache.validate("") is None
+        assert api_keys.calls == []
+
+
+class TestRevocation:
+    def test_revoke_evicts_immediately(self, tmp_path):
+        cache, api_keys = _cache(tmp_path)
+        cache.validate("sbs_live_anna")
+        api_keys.revoked.add(1)
+        cache.revoke(1)
+        assert cache.validate("sbs_live_anna") is None
+
+    def test_revoke_all_keys_of_a_user(self, tmp_path):
+        cache, api_keys = _cache(tmp_path)
+        for key in KEYS:
+            cache.validate(key)
+        cache.revoke(user_id=7)
+        for key in KEYS:
+            cache.validate(key)
+        assert api_keys.calls.count("sbs_live_anna") == 2
+        assert api_keys.calls.count("sbs_live_anna2") == 2
+        assert api_keys.calls.count("sbs_live_ben") == 1
+
+    def test_validation_racing_a_revocation_is_not_cached(self, tmp_path):
+        cache, api_keys = _cache(tmp_path)
+        api_keys.before_return = lambda: cache.revoke(1)
+        assert cache.validate("sbs_live_anna") is not None
+        api_keys.before_return = None
+        api_keys.revoked.add(1)
+        assert cache.validate("sbs_live_anna") is None
+
+    def test_revocation_reaches_other_workers(self, tmp_path):
+        path = str(tmp_path / "invoices.db")
+        hub_a = ProgressHub(backplane=SQLiteBackplane(path, poll_interval=0.01))
+        hub_b = ProgressHub(backplane=SQLiteBackplane(path, poll_interval=0.01))
+        worker_a, _ = _cache(tmp_path, hub=hub_a)
+        worker_b, api_keys_b = _cache(tmp_path, hub=hub_b)
+        worker_a.start()
+        worker_b.start()
+        try:
+            worker_b.validate("sbs_live_anna")
+            worker_a.revoke(1)
+            deadline = time.time() + 2
+            while worker_b.stats()["size"] and time.time() < deadline:
+                time.sleep(0.01)
+            assert worker_b.stats()["size"] == 0
+            assert worker_b.stats()["remote_revocations"] == 1
+            worker_b.validate("sbs_live_anna")
+            assert api_keys_b.calls == ["sbs_live_anna", "sbs_live_anna"]
+            # The cache shares the hub's backplane instead of polling on its own
+            assert worker_b.hub.backplane is hub_b.backplane
+        finally:
+            worker_a.stop()
+            worker_b.stop()
+            hub_a.shutdown()
+            hub_b.shutdown()
+
+    def test_stop_leaves_the_shared_backplane_running(self, tmp_path):
+        hub = ProgressHub(backplane=LocalBackplane())
+        cache, _ = _cache(tmp_path, hub=hub)
+        cache.start()
+        assert hub.stats()["listeners"] == ["api_keys:revoked"]
+        cache.stop()
+        assert hub.stats()["listeners"] == []
+        assert not hub._stopped
+        hub.shutdown()
+
+
+class TestLastUsed:
+    @pytest.fixture
+    def db(self, tmp_path):
+        conn = sqlite3.connect(str(tmp_path / "invoices.db"))
+        conn.execute("CREATE TABLE api_keys (id INTEGER PRIMARY KEY, user_id INTEGER, last_used_at TEXT)")
+        conn.executemany("INSERT INTO api_keys (id, user_id) VALUES (?, ?)", [(1, 7), (2, 7), (3, 8)])
+        conn.commit()
+        yield conn
+        conn.close()
+
+    def test_hits_are_written_in_one_batch(self, tmp_path, db):
+        clock = FakeClock()
+        cache, _ = _cache(tmp_path, clock)
+        for key in ("sbs_live_anna", "sbs_live_ben"):
+            for _ in range(5):
+                cache.validate(key)
+        assert cache.stats()["pending_last_used"] == 2
+        assert cache.flush() == 2
+        assert cache.flush() == 0
+
+        rows = dict(db.execute("SELECT id, last_used_at FROM api_keys").fetchall())
+        expected = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(clock.now))
+        assert rows == {1: expected, 2: None, 3: expected}
+
+    def test_stop_flushes(self, tmp_path, db):
+        cache, _ = _cache(tmp_path, flush_interval=0.01)
+        cache.validate("sbs_live_anna")
+        cache.validate("sbs_live_anna")
+        cache.stop()
+        assert db.execute("SELECT last_used_at FROM api_keys WHERE id = 1").fetchone()[0] is not None
+
+    def test_missing_column_is_skipped(self, tmp_path):
+        conn = sqlite3.connect(str(tmp_path / "invoices.db"))
+        conn.execute("CREATE TABLE api_keys (id INTEGER PRIMARY KEY)")
+        conn.commit()
+        conn.close()
+        cache, _ = _cache(tmp_path)
+        cache.validate("sbs_live_anna")
+        cache.validate("sbs_live_anna")
+        assert cache.flush() == 0
+        assert cache.stats()["flush_errors"] == 0
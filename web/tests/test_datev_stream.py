@@ -0,0 +1,102 @@
+import sqlite3
+from datetime import date
+from types import SimpleNamespace
+
+import pytest
+
+from web.datev_stream import iter_invoices, write_extf_csv
+
+# Stand-in for the EXTF 700 layout of export_invoices_to_datev_csv: more columns
+# than the leading booking fields, including quoted text and cp1252 characters
+COLUMNS = ["Umsatz (ohne Soll/Haben-Kz)", "Soll/Haben-Kennzeichen", "WKZ Umsatz", "Konto",
+           "Gegenkonto (ohne BU-Schlüssel)", "Belegdatum", "Belegfeld 1", "Buchungstext",
+           "Beleginfo - Art 1", "Beleginfo - Inhalt 1", "KOST1 - Kostenstelle", "Leistungsdatum", "Festschreibung"]
+
+
+def fake_export_csv(invoices, config, filepath):
+    dates = sorted(inv["datum"].replace("-", "") for inv in invoices)
+    header = ['"EXTF"', "700", "21", '"Buchungsstapel"', "13", "20240401120000000", "", '"SB"', '""', '""',
+              config.berater_nummer, config.mandanten_nummer, "20240101", "4", dates[0], dates[-1],
+              '"Test; Export"', '""', "1", "0", "0", '"EUR"']
+    rows = [
+        ";".join([f"{inv['betrag_brutto']:.2f}".replace(".", ","), '"S"', '"EUR"', "3400", "70000",
+                  inv["datum"][8:10] + inv["datum"][5:7], f'"{inv["rechnungsnummer"]}"',
+                  f'"{inv["rechnungsaussteller"]}"', '"Rechnung"', f'"{inv["id"]}"', '""', "", "0"])
+        for inv in invoices
+    ]
+    with open(filepath, "w", encoding="cp1252", newline="") as f:
+        f.write("\r\n".join([";".join(header), ";".join(f'"{c}"' for c in COLUMNS), *rows]) + "\r\n")
+
+
+def _config():
+    return SimpleNamespace(berater_nummer="12345", mandanten_nummer="00001",
+                           wirtschaftsjahr_beginn=date(2024, 1, 1),
+                           kontenrahmen=SimpleNamespace(name="SKR03"), bezeichnung="Test")
+
+
+def _db(tmp_path, count):
+    db_path = str(tmp_path / "invoices.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE invoices (id INTEGER PRIMARY KEY, rechnungsnummer TEXT, datum TEXT, "
+                 "betrag_brutto REAL, rechnungsaussteller TEXT)")
+    conn.executemany(
+        "INSERT INTO invoices VALUES (?, ?, ?, ?, ?)",
+        [(i, f"RE-{i}", f"2024-03-{(i * 11) % 28 + 1:02d}", 100.5 + i, "Müller GmbH") for i in range(1, count + 1)],
+    )
+    conn.commit()
+    conn.close()
+    return db_path
+
+
+class TestIterInvoices:
+    def test_loads_more_ids_than_sqlite_variable_limit_in_chunks(self, tmp_path):
+        db_path = _db(tmp_path, 1500)
+        progress = []
+        ids = list(range(1500, 0, -1)) + [5, 99999]
+
+        invoices = list(iter_invoices(db_path, ids, chunk_size=400,
+                                      on_progress=lambda done, total: progress.append((done, total))))
+
+        assert len(invoices) == 1500
+        assert len({inv["id"] for inv in invoices}) == 1500
+        assert progress == [(400, 1501), (800, 1501), (1200, 1501), (1501, 1501)]
+
+
+class TestWriteExtfCsv:
+    def test_chunked_output_matches_one_export(self, tmp_path):
+        db_path = _db(tmp_path, 30)
+        path = tmp_path / "EXTF_Buchungen.csv"
+        stats = {}
+
+        count = write_extf_csv(iter_invoices(db_path, range(1, 31), chunk_size=7), _config(), path,
+                               fake_export_csv, chunk_size=7, stats=stats)
+
+        expected = tmp_path / "expected.csv"
+        fake_export_csv(list(iter_invoices(db_path, range(1, 31))), _config(), str(expected))
+        assert path.read_bytes() == expected.read_bytes()
+        assert count == 30
+        assert stats == {"invoices": 30, "buchungen": 30}
+        assert not (tmp_path / "EXTF_Buchungen.csv.body").exists()
+
+    def test_empty_selection_writes_nothing(self, tmp_path):
+        path = tmp_path / "empty.csv"
+        assert write_extf_csv([], _config(), path, fake_export_csv) == 0
+        assert not path.exists()
+
+    def test_matches_datev_exporter(self, tmp_path):
+        datev = pytest.importorskip("datev")
+        db_path = _db(tmp_path, 25)
+        config = datev.DatevExportConfig(berater_nummer="12345", mandanten_nummer="00001",
+                                         wirtschaftsjahr_beginn=date(2024, 1, 1),
+                                         kontenrahmen=datev.Kontenrahmen.SKR03, bezeichnung="Test")
+        path = tmp_path / "streamed.csv"
+        write_extf_csv(iter_invoices(db_path, range(1, 26)), config, path,
+                       datev.export_invoices_to_datev_csv, chunk_size=4)
+        expected = tmp_path / "expected.csv"
+        datev.export_invoices_to_datev_csv(list(iter_invoices(db_path, range(1, 26))), config, str(expected))
+
+        streamed, reference = path.read_bytes().splitlines(), expected.read_bytes().splitlines()
+        # Header field 5 is the creation timestamp
+        assert streamed[0].split(b";")[:5] + streamed[0].split(b";")[6:] == \
+            reference[0].split(b";")[:5] + reference[0].split(b";")[6:]
+        assert streamed[1:] == reference[1:]
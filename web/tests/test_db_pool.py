@@ -0,0 +1,69 @@
+import sqlite3
+import threading
+
+from web.db_pool import ConnectionPool, pool_for
+
+
+def _pool(tmp_path, **kwargs):
+    return ConnectionPool(str(tmp_path / "invoices.db"), **kwargs)
+
+
+class TestConnectionPool:
+    def test_close_returns_connection_for_reuse_in_same_thread(self, tmp_path):
+        pool = _pool(tmp_path)
+        conn = pool.connect()
+        conn.close()
+        conn.close()  # double close is harmless
+
+        assert pool.connect() is conn
+        assert pool.stats()["created"] == 1
+        assert pool.stats()["reused"] == 1
+
+    def test_nested_checkouts_get_separate_connections(self, tmp_path):
+        pool = _pool(tmp_path)
+        outer = pool.connect()
+        inner = pool.connect()
+        assert outer is not inner
+        inner.close()
+        outer.close()
+
+    def test_threads_do_not_share_connections(self, tmp_path):
+        pool = _pool(tmp_path)
+        main = pool.connect()
+        main.close()
+        seen = []
+        thread = threading.Thread(target=lambda: seen.append(pool.connect()))
+        thread.start()
+        thread.join()
+        assert seen[0] is not main
+
+    def test_pragmas_and_connection_type(self, tmp_path):
+        conn = _pool(tmp_path).connect()
+        assert isinstance(conn, sqlite3.Connection)
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1
+        assert conn.execute("PRAGMA busy_timeout").fetchone()[0] == 5000
+
+    def test_release_rolls_back_and_resets_row_factory(self, tmp_path):
+        pool = _pool(tmp_path)
+        conn = pool.connect()
+        conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT)")
+        conn.commit()
+        conn.row_factory = sqlite3.Row
+        conn.execute("INSERT INTO users (name) VALUES ('uncommitted')")
+        conn.close()
+
+        conn = pool.connect()
+        assert conn.row_factory is None
+        assert conn.execute("SELECT COUNT(*) FROM users").fetchone() == (0,)
+
+    def test_idle_connections_per_thread_are_capped(self, tmp_path):
+        pool = _pool(tmp_path, max_idle_per_thread=2)
+        conns = [pool.connect() for _ in range(4)]
+        for conn in conns:
+            conn.close()
+        assert pool.stats()["discarded"] == 2
+
+    def test_pool_for_shares_pool_per_path(self, tmp_path):
+        path = str(tmp_path / "other.db")
+        assert pool_for(path) is pool_for(path)
@@ -0,0 +1,140 @@
+import sqlite3
+
+from web.duplicate_index import DuplicateIndex, amount_bucket, rebuild_from_database
+
+
+def _history(tmp_path, rows=(("job-1", 5, 1, "RE-1001", 100.0, "2024-03-01"),)):
+    db = str(tmp_path / "index.db")
+    conn = sqlite3.connect(db)
+    conn.execute("CREATE TABLE jobs (job_id TEXT, user_id INTEGER)")
+    conn.execute("""CREATE TABLE invoices (id INTEGER, job_id TEXT, rechnungsnummer TEXT,
+                    rechnungsaussteller TEXT, betrag_brutto REAL, datum TEXT)""")
+    for job_id, user_id, invoice_id, number, amount, datum in rows:
+        conn.execute("INSERT INTO jobs VALUES (?, ?)", (job_id, user_id))
+        conn.execute("INSERT INTO invoices VALUES (?, ?, ?, 'Müller GmbH', ?, ?)",
+                     (invoice_id, job_id, number, amount, datum))
+    conn.commit()
+    conn.close()
+    return db
+
+
+def _index(tmp_path, **kwargs):
+    return DuplicateIndex(db_path=str(tmp_path / "index.db"), **kwargs)
+
+
+def _invoice(invoice_id, number, supplier="Müller GmbH", amount=1190.0, datum="2024-03-15", **extra):
+    return {"id": invoice_id, "rechnungsnummer": number, "rechnungsaussteller": supplier,
+            "betrag_brutto": amount, "datum": datum, **extra}
+
+
+class TestDuplicateIndex:
+    def test_finds_near_duplicate_across_batches(self, tmp_path):
+        index = _index(tmp_path)
+        index.match_and_add(1, [_invoice(1, "RE-2024-000815", positionen="Wartung Hydraulikpumpe März")])
+
+        pairs = index.match_and_add(1, [
+            _invoice(2, "RE2024000815", supplier="Müller GmbH & Co. KG", amount=1195.0,
+                     datum="2024-03-18", positionen="Wartung Hydraulikpumpe März"),
+        ])
+        assert [(a, b) for a, b, _ in pairs] == [(2, 1)]
+        assert pairs[0][2] >= index.threshold
+
+    def test_other_supplier_or_amount_is_not_probed(self, tmp_path):
+        index = _index(tmp_path)
+        index.add(1, [_invoice(1, "RE-2024-000815")])
+
+        assert index.candidates(1, _invoice(9, "RE-2024-000815", supplier="Schmidt AG")) == []
+        assert index.candidates(1, _invoice(9, "RE-2024-000815", amount=5000.0)) == []
+        assert index.candidates(1, _invoice(9, "RE-2024-000815", datum="2023-01-01")) == []
+
+    def test_tenants_are_isolated(self, tmp_path):
+        index = _index(tmp_path)
+        index.add(1, [_invoice(1, "RE-2024-000815")])
+
+        assert index.candidates(2, _invoice(9, "RE-2024-000815")) == []
+        assert [m[0] for m in index.candidates(1, _invoice(9, "RE-2024-000815"))] == [1]
+
+    def test_lookup_compares_only_bucket_members(self, tmp_path):
+        index = _index(tmp_path)
+        index.add(1, [_invoice(i, f"X-{i:06d}", supplier=f"Lieferant {i % 50}") for i in range(1, 501)])
+
+        index.candidates(1, _invoice(999, "X-000007", supplier="Lieferant 7"))
+        assert index.stats()["avg_compared"] <= 10
+
+    def test_rebuild_from_database(self, tmp_path):
+        db = _history(tmp_path)
+        index = DuplicateIndex(db_path=db)
+        assert rebuild_from_database(db, index) == {"5": 1}
+        assert [m[0] for m in index.candidates(5, _invoice(2, "RE-1001", amount=100.0, datum="2024-03-01"))] == [1]
+
+    def test_amount_bucket(self):
+        assert amount_bucket("abc") is None
+        assert amount_bucket(1000) == amount_bucket(1010)
+
+    def test_sequential_numbers_are_not_duplicates(self, tmp_path):
+        index = _index(tmp_path)
+        index.add(1, [_invoice(1, "RE-2024-000815"), _invoice(2, "2024-0417")])
+
+        assert index.candidates(1, _invoice(9, "RE-2024-000816")) == []
+        assert index.candidates(1, _invoice(9, "2024-0418")) == []
+        assert index.stats()["rejected"] == 2
+
+    def test_candidates_outside_tolerance_are_rejected(self, tmp_path):
+        index = _index(tmp_path)
+        index.add(1, [_invoice(1, "RE-2024-000815")])
+
+        # Neighbouring buckets are probed, but 4% / 40 days apart is another invoice
+        assert index.candidates(1, _invoice(9, "RE-2024-000815", amount=1240.0)) == []
+        assert index.candidates(1, _invoice(9, "RE-2024-000815", datum="2024-04-24")) == []
+        assert [m[0] for m in index.candidates(1, _invoice(9, "RE 2024 000815", amount=1195.0))] == [1]
+
+    def test_history_is_backfilled_on_first_use(self, tmp_path):
+        db = _history(tmp_path, [
+            ("job-1", 5, 1, "RE-1001", 100.0, "2024-03-01"),
+            ("job-2", 5, 2, "RE-1001", 100.0, "2024-03-02"),
+            ("job-3", 6, 3, "RE-1001", 100.0, "2024-03-01"),
+        ])
+        index = DuplicateIndex(db_path=db)
+
+        # Invoice 2 was just saved: matched against the backfilled history, not against itself
+        pairs = index.match_and_add(5, [_invoice(2, "RE-1001", amount=100.0, datum="2024-03-02")])
+        assert [(a, b) for a, b, _ in pairs] == [(2, 1)]
+        assert index.stats()["backfilled"] == 1
+
+        index.match_and_add(5, [_invoice(4, "X-1")])
+        assert index.stats()["backfilled"] == 1
+
+    def test_invoices_saved_outside_the_pipeline_are_indexed(self, tmp_path):
+        db = _history(tmp_path)
+        index = DuplicateIndex(db_path=db)
+        index.match_and_add(5, [_invoice(2, "X-1")])   # tenant 5 is backfilled now
+
+        # Demo upload: save_invoices without job post-processing
+        conn = sqlite3.connect(db)
+        conn.execute("INSERT INTO jobs VALUES ('demo-1', 5)")
+        conn.execute("INSERT INTO invoices VALUES (3, 'demo-1', 'RE-2002', 'Müller GmbH', 250.0, '2024-05-01')")
+        conn.commit()
+        conn.close()
+        assert index.index_job(5, "demo-1") == 1
+
+        probe = _invoice(9, "RE-2002", amount=250.0, datum="2024-05-02")
+        assert [m[0] for m in index.candidates(5, probe)] == [3]
+
+    def test_deleted_invoices_are_dropped(self, tmp_path):
+        db = _history(tmp_path)
+        index = DuplicateIndex(db_path=db)
+        probe = _invoice(9, "RE-1001", amount=100.0, datum="2024-03-01")
+        assert [m[0] for m in index.candidates(5, probe)] == [1]
+
+        conn = sqlite3.connect(db)
+        conn.execute("DELETE FROM invoices WHERE id = 1")
+        conn.commit()
+        conn.close()
+        assert index.candidates(5, probe) == []
+        assert index.stats()["stale_removed"] == 1
+
+    def test_remove(self, tmp_path):
+        index = _index(tmp_path)
+        index.add(1, [_invoice(1, "RE-2024-000815")])
+        index.remove(1, [1])
+        assert index.candidates(1, _invoice(9, "RE-2024-000815")) == []
@@ -0,0 +1,42 @@
+from web.einvoice_prefilter import scan_pdf
+from web.parse_pool import parse_einvoice_file
+
+PLAIN_PDF = b"%PDF-1.7\n1 0 obj << /Type /Catalog /Pages 2 0 R >> endobj\ntrailer << /Root 1 0 R >>\n%%EOF"
+
+
+def _pdf(tmp_path, body: bytes, name: str = "rechnung.pdf"):
+    path = tmp_path / name
+    path.write_bytes(body)
+    return path
+
+
+class TestScanPdf:
+    def test_plain_pdf_is_skipped(self, tmp_path):
+        result = scan_pdf(_pdf(tmp_path, PLAIN_PDF))
+        assert result.has_embedded_xml is False
+        assert result.marker is None
+        assert result.scan_ms >= 0
+
+    def test_embedded_file_name(self, tmp_path):
+        body = PLAIN_PDF + b"\n<< /Names [(ZUGFeRD-invoice.xml) 5 0 R] >> /EmbeddedFiles"
+        result = scan_pdf(_pdf(tmp_path, body))
+        assert result.has_embedded_xml is True
+        assert result.marker == "zugferd-invoice.xml"
+
+    def test_utf16_file_spec(self, tmp_path):
+        body = PLAIN_PDF + b"/UF (\xfe\xff" + "factur-x.xml".encode("utf-16-be") + b")"
+        assert scan_pdf(_pdf(tmp_path, body)).marker == "factur-x.xml"
+
+    def test_xmp_schema_marker(self, tmp_path):
+        body = PLAIN_PDF + b'<rdf:Description xmlns:fx="urn:factur-x:pdfa:CrossIndustryDocument:invoice:1p0#">'
+        assert scan_pdf(_pdf(tmp_path, body)).has_embedded_xml is True
+
+    def test_empty_file(self, tmp_path):
+        assert scan_pdf(_pdf(tmp_path, b"")).has_embedded_xml is False
+
+
+class TestParseEinvoiceFile:
+    def test_skip_does_not_run_full_parse(self, tmp_path):
+        is_einv, data, prefilter = parse_einvoice_file(_pdf(tmp_path, PLAIN_PDF))
+        assert (is_einv, data) == (False, {})
+        assert prefilter["parse_ms"] is None
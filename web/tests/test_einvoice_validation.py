@@ -0,0 +1,59 @@
+from web import einvoice_validation
+from web.einvoice_validation import validate_einvoice
+
+XRECHNUNG_CII = """<?xml version="1.0" encoding="UTF-8"?>
+<rsm:CrossIndustryInvoice xmlns:rsm="urn:un:unece:uncefact:data:standard:CrossIndustryInvoice:100"
+    xmlns:ram="urn:un:unece:uncefact:data:standard:ReusableAggregateBusinessInformationEntity:100">
+  <rsm:ExchangedDocumentContext>
+    <ram:GuidelineSpecifiedDocumentContextParameter>
+      <ram:ID>urn:cen.eu:en16931:2017#compliant#urn:xeinkauf.de:kosit:xrechnung_3.0</ram:ID>
+    </ram:GuidelineSpecifiedDocumentContextParameter>
+  </rsm:ExchangedDocumentContext>
+  <rsm:ExchangedDocument><ram:ID>RE-1</ram:ID></rsm:ExchangedDocument>
+  {lines}
+</rsm:CrossIndustryInvoice>"""
+
+FACTURX_CII = XRECHNUNG_CII.replace(
+    "urn:cen.eu:en16931:2017#compliant#urn:xeinkauf.de:kosit:xrechnung_3.0", "urn:factur-x.eu:1p0:basic"
+)
+
+
+class TestValidateEinvoice:
+    def test_empty_xml(self):
+        assert validate_einvoice("") == (False, "Kein XML übergeben – PDF- oder Basis-Rechnung.", "")
+        assert validate_einvoice("   \n")[0] is False
+
+    def test_xrechnung_profile_from_header(self):
+        is_valid, message, profile = validate_einvoice(XRECHNUNG_CII.format(lines=""))
+        assert is_valid is True
+        assert profile == "XRechnung / EN16931 (CII)"
+
+    def test_facturx_profile(self):
+        _, _, profile = validate_einvoice("\n  " + FACTURX_CII.format(lines=""))
+        assert profile == "XRechnung / EN16931 (CII) + ZUGFeRD/Factur-X"
+
+    def test_markers_after_header_are_ignored(self):
+        xml = "<Invoice><Header/><Note>bitte an zugferd-Postfach</Note></Invoice>"
+        assert validate_einvoice(xml) == (
+            True, "XML syntaktisch gültig, aber kein spezifisches E-Rechnungs-Profil erkannt.", ""
+        )
+
+    def test_malformed_xml_after_header_is_rejected(self):
+        lines = "<ram:Line>" * 3 + "</ram:Line>" * 2
+        is_valid, message, _ = validate_einvoice(XRECHNUNG_CII.format(lines=lines))
+        assert is_valid is False
+        assert message.startswith("XML nicht parsbar")
+
+    def test_large_document_spanning_chunks(self):
+        lines = "".join(f"<ram:Line><ram:Note>Position {i}</ram:Note></ram:Line>" for i in range(5000))
+        assert validate_einvoice(XRECHNUNG_CII.format(lines=lines))[0] is True
+
+    def test_results_are_memoized_by_hash(self, monkeypatch):
+        xml = XRECHNUNG_CII.format(lines="<ram:Line/>")
+        first = validate_einvoice(xml)
+
+        def fail(_):
+            raise AssertionError("should be served from cache")
+
+        monkeypatch.setattr(einvoice_validation, "_validate", fail)
+        assert validate_einvoice(xml) == first
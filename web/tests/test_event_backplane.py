@@ -0,0 +1,79 @@
+import asyncio
+
+from web.event_backplane import LocalBackplane, SQLiteBackplane, create_backplane
+from web.progress_events import ProgressHub
+
+
+def _sqlite_hub(tmp_path):
+    return ProgressHub(min_interval=0.05, backplane=SQLiteBackplane(str(tmp_path / "bus.db"), poll_interval=0.02))
+
+
+class TestSQLiteBackplane:
+    def test_job_events_reach_subscribers_on_other_worker(self, tmp_path):
+        worker_a, worker_b = _sqlite_hub(tmp_path), _sqlite_hub(tmp_path)
+
+        async def scenario():
+            sub = worker_b.subscribe("job-1")
+            # Worker A has no local clients but still publishes to the backplane
+            await asyncio.to_thread(worker_a.publish, "job-1", "file_extracted", filename="a.pdf", processed=1)
+            await asyncio.to_thread(worker_a.publish, "job-1", "completed", status="completed")
+            messages = []
+            while not messages or messages[-1]["state"].get("status") != "completed":
+                message = await sub.get(timeout=2)
+                assert message is not None
+                messages.append(message)
+            return messages
+
+        try:
+            messages = asyncio.run(scenario())
+        finally:
+            worker_a.shutdown()
+            worker_b.shutdown()
+
+        events = [e["type"] for m in messages for e in m["events"]]
+        assert events == ["file_extracted", "completed"]
+        assert worker_b.stats()["backplane"]["delivered"] >= 1
+        assert worker_a.stats()["backplane"]["published"] == len(messages)
+
+    def test_alerts_are_broadcast_to_all_workers(self, tmp_path):
+        hubs = [_sqlite_hub(tmp_path) for _ in range(2)]
+
+        async def scenario():
+            subs = [hub.subscribe_alerts() for hub in hubs]
+            await asyncio.to_thread(hubs[0].broadcast_alert, {"alerts": ["disk"], "count": 1})
+            return [await sub.get(timeout=2) for sub in subs]
+
+        try:
+            received = asyncio.run(scenario())
+        finally:
+            for hub in hubs:
+                hub.shutdown()
+
+        assert [m["alerts"] for m in received] == [["disk"], ["disk"]]
+
+
+class TestLocalBackplane:
+    def test_slow_client_metrics(self):
+        hub = ProgressHub(min_interval=0, backplane=LocalBackplane())
+
+        async def scenario():
+            sub = hub.subscribe("job-1")
+            sub.queue = asyncio.Queue(maxsize=1)
+            for i in range(3):
+                await asyncio.to_thread(hub.publish, "job-1", "completed", filename=f"{i}.pdf")
+                await asyncio.sleep(0.05)
+            return hub.stats()
+
+        try:
+            stats = asyncio.run(scenario())
+        finally:
+            hub.shutdown()
+
+        assert stats["subscribers"] == 1
+        assert stats["queued_messages"] == 1
+        assert stats["dropped_messages"] == 2
+
+    def test_factory(self, tmp_path):
+        assert isinstance(create_backplane("local"), LocalBackplane)
+        assert isinstance(create_backplane("sqlite", str(tmp_path / "bus.db")), SQLiteBackplane)
+        assert isinstance(create_backplane("nope"), LocalBackplane)
@@ -0,0 +1,96 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from web.export_artifacts import ExportArtifactStore, download_url
+
+
+def _store(tmp_path, delay=0.0):
+    calls = []
+
+    def render_csv(results):
+        calls.append(len(results))
+        time.sleep(delay)
+        out = tmp_path / f"render-{len(calls)}-{threading.get_ident()}.csv"
+        out.write_text("\n".join(str(r["betrag_brutto"]) for r in results))
+        return out
+
+    return ExportArtifactStore({"csv": render_csv}, root=tmp_path / "artifacts"), calls
+
+
+RESULTS = [{"rechnungsnummer": "R-1", "betrag_brutto": 119.0}]
+
+
+class TestExportArtifactStore:
+    def test_built_once_then_served(self, tmp_path):
+        store, calls = _store(tmp_path)
+        first = store.get_or_build("job-1", "csv", RESULTS)
+        second = store.get_or_build("job-1", "csv", RESULTS)
+
+        assert first.built and not second.built
+        assert first.path == second.path and first.etag == second.etag
+        assert first.path.read_text() == "119.0"
+        assert calls == [1]
+
+    def test_concurrent_requests_are_coalesced(self, tmp_path):
+        store, calls = _store(tmp_path, delay=0.2)
+        with ThreadPoolExecutor(max_workers=5) as pool:
+            artifacts = list(pool.map(lambda _: store.get_or_build("job-1", "csv", RESULTS), range(5)))
+
+        assert calls == [1]
+        assert len({a.path for a in artifacts}) == 1
+        assert store.stats()["coalesced"] == 4
+
+    def test_changed_results_get_new_artifact(self, tmp_path):
+        store, calls = _store(tmp_path)
+        old = store.get_or_build("job-1", "csv", RESULTS)
+        new = store.get_or_build("job-1", "csv", [{**RESULTS[0], "betrag_brutto": 238.0}])
+
+        assert old.etag != new.etag
+        assert new.path.read_text() == "238.0"
+        assert len(calls) == 2
+
+    def test_unknown_format_and_failed_render(self, tmp_path):
+        store = ExportArtifactStore({"xlsx": lambda results: None}, root=tmp_path)
+        with pytest.raises(KeyError):
+            store.get_or_build("job-1", "pdf", RESULTS)
+        with pytest.raises(RuntimeError):
+            store.get_or_build("job-1", "xlsx", RESULTS)
+        assert store.stats()["building"] == 0
+
+    def test_prune_removes_old_artifacts(self, tmp_path):
+        store, _ = _store(tmp_path)
+        artifact = store.get_or_build("job-1", "csv", RESULTS)
+        os.utime(artifact.path, (0, 0))
+
+        assert store.prune() == 1
+        assert not artifact.path.exists()
+
+
+class TestAttachments:
+    def test_download_urls_become_files(self, tmp_path):
+        store, calls = _store(tmp_path)
+        legacy = tmp_path / "legacy.xlsx"
+        legacy.write_text("xlsx")
+        exported_files = {
+            "csv": download_url("job-1", "csv"),
+            "xlsx": str(legacy),                        # older job: file built at completion
+            "datev": download_url("job-1", "datev"),    # no renderer: nothing to attach
+            "pdf": str(tmp_path / "gone.pdf"),
+        }
+
+        files = store.attachments("job-1", exported_files, RESULTS)
+        assert set(files) == {"csv", "xlsx"}
+        assert open(files["csv"]).read() == "119.0"
+        assert files["xlsx"] == str(legacy)
+
+        # Same artifact the download route serves
+        assert files["csv"] == str(store.get_or_build("job-1", "csv", RESULTS).path)
+        assert calls == [1]
+
+    def test_failed_render_is_left_out(self, tmp_path):
+        store = ExportArtifactStore({"xlsx": lambda results: None}, root=tmp_path)
+        assert store.attachments("job-1", {"xlsx": download_url("job-1", "xlsx")}, RESULTS) == {}
@@ -0,0 +1,59 @@
+import time
+
+from web.extraction_cache import ExtractionCache, hash_file
+
+
+def _cache(tmp_path, **kwargs):
+    return ExtractionCache(db_path=str(tmp_path / "cache.db"), **kwargs)
+
+
+def _pdf(tmp_path, name, content=b"%PDF-1.4 invoice 4711"):
+    path = tmp_path / name
+    path.write_bytes(content)
+    return path
+
+
+class TestExtractionCache:
+    def test_identical_bytes_hit_without_extraction(self, tmp_path):
+        cache = _cache(tmp_path)
+        calls = []
+
+        def extract():
+            calls.append(1)
+            return {"rechnungsnummer": "R-1", "filename": "a.pdf"}
+
+        first, hit_1 = cache.get_or_extract(1, _pdf(tmp_path, "a.pdf"), extract)
+        second, hit_2 = cache.get_or_extract(1, _pdf(tmp_path, "copy.pdf"), extract)
+
+        assert (hit_1, hit_2) == (False, True)
+        assert len(calls) == 1
+        assert second["rechnungsnummer"] == "R-1"
+        assert "filename" not in second
+        assert cache.stats()["hit_ratio"] == 0.5
+
+    def test_tenant_isolation(self, tmp_path):
+        cache = _cache(tmp_path)
+        path = _pdf(tmp_path, "a.pdf")
+        cache.put(1, hash_file(path), {"rechnungsnummer": "R-1"})
+
+        assert cache.get(2, hash_file(path)) is None
+
+    def test_extractor_version_bump_invalidates(self, tmp_path):
+        path = _pdf(tmp_path, "a.pdf")
+        _cache(tmp_path, version="1").put(1, hash_file(path), {"rechnungsnummer": "R-1"})
+
+        assert _cache(tmp_path, version="2").get(1, hash_file(path)) is None
+
+    def test_ttl_and_size_eviction(self, tmp_path):
+        cache = _cache(tmp_path, max_entries=2)
+        for i in range(3):
+            cache.put(1, f"hash-{i}", {"n": i})
+            time.sleep(0.01)
+        cache.get(1, "hash-0")  # refresh LRU position
+
+        assert cache.evict() == 1
+        assert cache.get(1, "hash-1") is None
+        assert cache.get(1, "hash-0") == {"n": 0}
+
+        expired = _cache(tmp_path, ttl_seconds=-1)
+        assert expired.get(1, "hash-2") is None
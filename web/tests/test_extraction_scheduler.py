@@ -0,0 +1,81 @@
+import threading
+
+from web.extraction_scheduler import ExtractionScheduler
+
+
+class TestExtractionScheduler:
+    def test_small_batch_not_starved_by_large_batch(self):
+        scheduler = ExtractionScheduler(max_workers=1)
+        gate = threading.Event()
+        order = []
+
+        def task(name):
+            gate.wait(5)
+            order.append(name)
+
+        futures = [scheduler.submit("big", task, f"big-{i}") for i in range(10)]
+        futures += [scheduler.submit("small", task, f"small-{i}") for i in range(2)]
+        gate.set()
+        for f in futures:
+            f.result(timeout=5)
+        scheduler.shutdown()
+
+        # Round-robin: the small tenant finishes within the first few slots
+        assert order.index("small-1") <= 4
+
+    def test_weight_gives_larger_share(self):
+        scheduler = ExtractionScheduler(max_workers=1, weights={"enterprise": 3})
+        gate = threading.Event()
+        order = []
+
+        def task(name):
+            gate.wait(5)
+            order.append(name)
+
+        futures = [scheduler.submit("free", task, "free") for _ in range(4)]
+        futures += [scheduler.submit("enterprise", task, "enterprise") for _ in range(6)]
+        gate.set()
+        for f in futures:
+            f.result(timeout=5)
+        scheduler.shutdown()
+
+        assert order[1:5].count("enterprise") == 3
+
+    def test_global_cap_and_stats(self):
+        scheduler = ExtractionScheduler(max_workers=2)
+        gate = threading.Event()
+        started = threading.Semaphore(0)
+
+        def task():
+            started.release()
+            gate.wait(5)
+            return "ok"
+
+        futures = [scheduler.submit(7, task) for _ in range(5)]
+        started.acquire(timeout=5)
+        started.acquire(timeout=5)
+
+        stats = scheduler.stats()
+        assert stats["threads"] == 2
+        assert stats["in_flight"] == 2
+        assert stats["queue_depth"] == 3
+        assert stats["tenants"]["7"] == {"queued": 3, "in_flight": 2, "completed": 0}
+
+        gate.set()
+        assert [f.result(timeout=5) for f in futures] == ["ok"] * 5
+        scheduler.shutdown()
+        assert scheduler.stats()["queue_depth"] == 0
+
+    def test_exception_propagates_to_future(self):
+        scheduler = ExtractionScheduler(max_workers=1)
+
+        def boom():
+            raise ValueError("kaputt")
+
+        future = scheduler.submit("t", boom)
+        try:
+            future.result(timeout=5)
+            raise AssertionError("expected ValueError")
+        except ValueError as e:
+            assert str(e) == "kaputt"
+        scheduler.shutdown()
@@ -0,0 +1,147 @@
+import sqlite3
+from types import SimpleNamespace
+
+import pytest
+
+from web.identity import IdentityCache, identity_for
+
+
+class FakeClock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "invoices.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, email TEXT, name TEXT, is_admin INTEGER, "
+                 "is_active INTEGER, plan TEXT)")
+    conn.execute("INSERT INTO users VALUES (7, 'anna@example.com', 'Anna', 1, 1, 'Business')")
+    conn.execute("INSERT INTO users VALUES (8, 'ben@example.com', NULL, 0, 0, NULL)")
+    conn.commit()
+    conn.close()
+    return path
+
+
+def _set_admin(db_path, user_id, is_admin):
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE users SET is_admin = ? WHERE id = ?", (is_admin, user_id))
+    conn.commit()
+    conn.close()
+
+
+def _request(user_id=7):
+    return SimpleNamespace(session={"user_id": user_id}, state=SimpleNamespace())
+
+
+class TestIdentity:
+    def test_fields_from_users_row(self, db_path):
+        cache = IdentityCache(db_path)
+        anna, ben = cache.get(7), cache.get(8)
+        assert (anna.email, anna.name, anna.is_admin, anna.is_active, anna.plan) == (
+            "anna@example.com", "Anna", True, True, "Business")
+        assert (ben.name, ben.is_admin, ben.is_active, ben.plan) == ("", False, False, "Free")
+        assert anna.user_info() == {"id": 7, "email": "anna@example.com", "name": "Anna",
+                                    "is_admin": True, "plan": "Enterprise"}
+
+    def test_unknown_user(self, db_path):
+        cache = IdentityCache(db_path)
+        assert cache.get(None) is None
+        identity = cache.get(99)
+        assert identity.exists is False
+        assert identity.user_info()["name"] == "User"
+
+    def test_checks_are_memoized_per_args(self, db_path):
+        cache = IdentityCache(db_path)
+        calls = []
+
+        def has_permission(user_id, permission):
+            calls.append((user_id, permission))
+            return permission == "approve"
+
+        cache.register("permission", has_permission)
+        identity = cache.get(7)
+        assert identity.has_permission("approve") is True
+        assert identity.has_permission("approve") is True
+        assert identity.has_permission("export") is False
+        assert cache.get(7).has_permission("export") is False
+        assert calls == [(7, "approve"), (7, "export")]
+
+    def test_check_errors_are_not_memoized(self, db_path):
+        cache = IdentityCache(db_path)
+        results = iter([RuntimeError("db locked"), {"plan": "starter"}])
+
+        def product(user_id, name):
+            result = next(results)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        cache.register("product", product)
+        identity = cache.get(7)
+        with pytest.raises(RuntimeError):
+            identity.product_access("invoice")
+        assert identity.product_access("invoice") == {"plan": "starter"}
+
+
+class TestCache:
+    def test_served_from_memory_until_ttl(self, db_path):
+        clock = FakeClock()
+        cache = IdentityCache(db_path, ttl=15, clock=clock)
+        cache.get(7)
+        before = cache._pool.stats()
+        for _ in range(20):
+            assert cache.get(7).is_admin
+        assert cache._pool.stats() == before
+
+        _set_admin(db_path, 7, 0)
+        clock.now += 16
+        assert cache.get(7).is_admin is False
+        assert cache.stats()["hits"] == 20
+
+    def test_invalidate_reloads(self, db_path):
+        cache = IdentityCache(db_path)
+        assert cache.get(7).is_admin
+        _set_admin(db_path, 7, 0)
+        cache.invalidate("7")
+        assert cache.get(7).is_admin is False
+
+        cache.get(8)
+        cache.invalidate()
+        assert cache.stats()["size"] == 0
+
+    def test_db_errors_are_not_cached(self, tmp_path):
+        cache = IdentityCache(str(tmp_path / "empty.db"))
+        identity = cache.get(7)
+        assert identity.exists is False
+        assert cache.stats()["size"] == 0
+        assert cache.stats()["errors"] == 1
+
+    def test_size_is_bounded(self, db_path):
+        cache = IdentityCache(db_path, max_entries=4)
+        for user_id in range(1, 20):
+            cache.get(user_id)
+        assert cache.stats()["size"] <= 4
+
+
+class TestRequestScope:
+    def test_one_identity_per_request(self, db_path):
+        clock = FakeClock()
+        cache = IdentityCache(db_path, ttl=15, clock=clock)
+        request = _request()
+        first = identity_for(request, cache)
+        clock.now += 60
+        assert identity_for(request, cache) is first
+        assert cache.stats()["misses"] == 1
+
+    def test_anonymous_and_switched_user(self, db_path):
+        cache = IdentityCache(db_path)
+        assert identity_for(_request(None), cache) is None
+        request = _request(7)
+        identity_for(request, cache)
+        request.session["user_id"] = 8
+        assert identity_for(request, cache).user_id == 8
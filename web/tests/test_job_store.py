@@ -0,0 +1,177 @@
+import asyncio
+import time
+
+from web.extraction_scheduler import ExtractionScheduler
+from web.job_store import JobStore, JobQueueWorker
+
+
+def _store(tmp_path, **kwargs):
+    return JobStore(db_path=str(tmp_path / "jobs.db"), **kwargs)
+
+
+class TestJobStore:
+    def test_job_visible_from_second_store_instance(self, tmp_path):
+        store_a = _store(tmp_path)
+        store_b = _store(tmp_path)
+        store_a["job-1"] = {"user_id": 7, "status": "uploaded", "files": [{"filename": "a.pdf"}]}
+
+        assert "job-1" in store_b
+        assert store_b["job-1"]["files"][0]["filename"] == "a.pdf"
+        assert store_b.get("missing") is None
+
+    def test_update_merges_fields(self, tmp_path):
+        store = _store(tmp_path)
+        store["job-1"] = {"status": "uploaded", "total": 3}
+        store.update("job-1", {"processed": 2, "status": "processing"})
+
+        job = store["job-1"]
+        assert job["total"] == 3
+        assert job["processed"] == 2
+        assert job["status"] == "processing"
+
+    def test_enqueue_is_idempotent(self, tmp_path):
+        store = _store(tmp_path)
+        store["job-1"] = {"status": "uploaded"}
+
+        assert store.enqueue("job-1") is True
+        assert store.enqueue("job-1") is False
+        assert store["job-1"]["status"] == "queued"
+
+    def test_claim_is_exclusive(self, tmp_path):
+        store = _store(tmp_path)
+        store["job-1"] = {"status": "uploaded"}
+        store.enqueue("job-1")
+
+        assert store.claim("worker-a") == "job-1"
+        assert store.claim("worker-b") is None
+
+    def test_expired_lease_is_reclaimed(self, tmp_path):
+        store = _store(tmp_path, lease_seconds=-1)
+        store["job-1"] = {"status": "uploaded"}
+        store.enqueue("job-1")
+
+        assert store.claim("worker-a") == "job-1"
+        assert store.claim("worker-b") == "job-1"
+        assert store.heartbeat("job-1", "worker-a") is False
+        assert store.release("job-1", "worker-a") is False
+
+    def test_poison_job_marked_failed(self, tmp_path):
+        store = _store(tmp_path, lease_seconds=-1, max_attempts=1)
+        store["job-1"] = {"status": "uploaded"}
+        store.enqueue("job-1")
+
+        assert store.claim("worker-a") == "job-1"
+        assert store.claim("worker-b") is None
+        assert store["job-1"]["status"] == "failed"
+
+    def test_worker_runs_handler_and_releases(self, tmp_path):
+        store = _store(tmp_path)
+        store["job-1"] = {"status": "uploaded"}
+        store.enqueue("job-1")
+        seen = []
+
+        async def handler(job_id):
+            seen.append(job_id)
+            store.update(job_id, {"successful": 1})
+
+        worker = JobQueueWorker(store, handler, worker_id="worker-a")
+        job_id = store.claim(worker.worker_id)
+        asyncio.run(worker.run_job(job_id))
+
+        assert seen == ["job-1"]
+        assert store["job-1"]["status"] == "completed"
+        assert store["job-1"]["successful"] == 1
+        assert len(store) == 0
+
+    def test_final_status_set_by_handler_keeps_lease(self, tmp_path):
+        store = _store(tmp_path)
+        store["job-1"] = {"status": "uploaded"}
+        store.enqueue("job-1")
+        job_id = store.claim("worker-a")
+
+        store.update(job_id, {"status": "completed"})
+        assert store.heartbeat(job_id, "worker-a") is True
+        assert store.release(job_id, "worker-a", "completed") is True
+
+    def test_reenqueue_resets_attempts(self, tmp_path):
+        store = _store(tmp_path, lease_seconds=-1, max_attempts=1)
+        store["job-1"] = {"status": "uploaded"}
+        store.enqueue("job-1")
+        store.claim("worker-a")
+        store.claim("worker-b")  # exceeded → failed
+
+        assert store.enqueue("job-1") is True
+        assert store.claim("worker-c") == "job-1"
+
+    def test_prune_deletes_old_finished_jobs(self, tmp_path):
+        store = _store(tmp_path, retention_hours=1)
+        for job_id, status in (("done", "completed"), ("broken", "failed"), ("running", "processing")):
+            store[job_id] = {"status": status, "results": [{"betrag_brutto": 1}]}
+
+        assert store.prune() == 0
+        assert store.prune(now=time.time() + 7200) == 2
+        assert "done" not in store and "broken" not in store
+        assert "running" in store
+
+
+class TestWorkerConcurrency:
+    def test_small_job_finishes_while_large_job_runs(self, tmp_path):
+        """The app's shape: jobs claimed by the worker, files fanned out to the shared scheduler."""
+        store = _store(tmp_path)
+        scheduler = ExtractionScheduler(max_workers=2)
+        finished = []
+
+        def extract(filename):
+            time.sleep(0.02)
+            return filename
+
+        async def handler(job_id):
+            job = store[job_id]
+            futures = [scheduler.submit(job["user_id"], extract, name) for name in job["files"]]
+            await asyncio.to_thread(lambda: [f.result(timeout=10) for f in futures])
+            finished.append(job_id)
+
+        store["large"] = {"status": "uploaded", "user_id": 1, "files": [f"big-{i}.pdf" for i in range(40)]}
+        store["small"] = {"status": "uploaded", "user_id": 2, "files": ["small.pdf"]}
+        store.enqueue("large")
+        store.enqueue("small")
+
+        async def main():
+            worker = JobQueueWorker(store, handler, poll_interval=0.01, worker_id="worker-a", concurrency=2)
+            runner = asyncio.create_task(worker.run())
+            while worker.completed < 2:
+                await asyncio.sleep(0.01)
+            worker.stop()
+            runner.cancel()
+
+        asyncio.run(asyncio.wait_for(main(), timeout=20))
+        scheduler.shutdown()
+
+        assert finished == ["small", "large"]
+        assert store["small"]["status"] == "completed"
+        assert store["large"]["status"] == "completed"
+
+    def test_concurrency_limit(self, tmp_path):
+        store = _store(tmp_path)
+        running, peak = [0], [0]
+
+        async def handler(job_id):
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+            await asyncio.sleep(0.05)
+            running[0] -= 1
+
+        for i in range(6):
+            store[f"job-{i}"] = {"status": "uploaded"}
+            store.enqueue(f"job-{i}")
+
+        async def main():
+            worker = JobQueueWorker(store, handler, poll_interval=0.01, worker_id="worker-a", concurrency=2)
+            runner = asyncio.create_task(worker.run())
+            while worker.completed < 6:
+                await asyncio.sleep(0.01)
+            worker.stop()
+            runner.cancel()
+
+        asyncio.run(asyncio.wait_for(main(), timeout=20))
+        assert peak[0] == 2
@@ -0,0 +1,166 @@
+import multiprocessing
+import socketserver
+import threading
+
+import pytest
+
+from web.limiter_backends import (
+    BackendUnavailable, MemoryBackend, RedisBackend, RespConnection, SQLiteBackend, create_backend,
+)
+from web.rate_limiter import EnterpriseRateLimiter
+
+NOW = 1_800_000_000 - 1_800_000_000 % 60
+
+
+class _RespHandler(socketserver.StreamRequestHandler):
+    """Redis protocol stand-in: the handful of commands the backend uses."""
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:])):
+            size = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(size + 2)[:-2])
+        return args
+
+    def _reply(self, value):
+        if value is None:
+            self.wfile.write(b"$-1\r\n")
+        elif isinstance(value, int):
+            self.wfile.write(b":%d\r\n" % value)
+        elif isinstance(value, list):
+            self.wfile.write(b"*%d\r\n" % len(value))
+            for item in value:
+                self._reply(item)
+        elif isinstance(value, Exception):
+            self.wfile.write(b"-ERR %s\r\n" % str(value).encode())
+        elif value == "OK":
+            self.wfile.write(b"+OK\r\n")
+        else:
+            self.wfile.write(b"$%d\r\n%s\r\n" % (len(value), value))
+
+    def handle(self):
+        server = self.server
+        while True:
+            command = self._read_command()
+            if command is None:
+                return
+            name, args = command[0].upper(), command[1:]
+            with server.lock:
+                server.commands.append(name)
+                if name in (b"INCR", b"DECR"):
+                    value = int(server.data.get(args[0], b"0")) + (1 if name == b"INCR" else -1)
+                    server.data[args[0]] = str(value).encode()
+                    reply = value
+                elif name == b"GET":
+                    reply = server.data.get(args[0])
+                elif name == b"MGET":
+                    reply = [server.data.get(key) for key in args]
+                elif name == b"PEXPIRE":
+                    reply = 1
+                elif name in (b"SELECT", b"AUTH"):
+                    reply = "OK"
+                else:
+                    reply = Exception(f"unknown command '{name.decode()}'")
+            self._reply(reply)
+
+
+@pytest.fixture
+def resp_server():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), _RespHandler)
+    server.daemon_threads = True
+    server.data, server.commands, server.lock = {}, [], threading.Lock()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _redis(server) -> RedisBackend:
+    host, port = server.server_address
+    return RedisBackend(f"redis://{host}:{port}/0")
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return MemoryBackend()
+    if request.param == "sqlite":
+        return SQLiteBackend(str(tmp_path / "rate_limits.db"))
+    return _redis(request.getfixturevalue("resp_server"))
+
+
+class TestBackendSemantics:
+    def test_limit_and_sliding_decay(self, backend):
+        results = [backend.hit("k", 5, 60, NOW + 1)[0] for _ in range(6)]
+        assert results == [True] * 5 + [False]
+        assert backend.peek("k", 60, NOW + 1) == 5
+
+        # Half-way through the next window the previous one weighs 2.5
+        assert [backend.hit("k", 5, 60, NOW + 90)[0] for _ in range(4)] == [True, True, True, False]
+        assert backend.peek("k", 60, NOW + 300) == 0
+
+    def test_keys_are_isolated(self, backend):
+        assert backend.hit("a", 1, 60, NOW)[0] is True
+        assert backend.hit("b", 1, 60, NOW)[0] is True
+        assert backend.hit("a", 1, 60, NOW)[0] is False
+
+
+class TestSharedAcrossWorkers:
+    def test_sqlite_workers_share_one_allowance(self, tmp_path):
+        path = str(tmp_path / "rate_limits.db")
+        workers = [SQLiteBackend(path) for _ in range(3)]
+        allowed = sum(worker.hit("user:7", 10, 60, NOW)[0] for _ in range(10) for worker in workers)
+        assert allowed == 10
+
+    def test_sqlite_counts_atomically_across_processes(self, tmp_path):
+        path = str(tmp_path / "rate_limits.db")
+        SQLiteBackend(path)
+        ctx = multiprocessing.get_context("spawn")
+        with ctx.Pool(4) as pool:
+            allowed = pool.starmap(_hammer, [(path, 30)] * 4)
+        assert sum(allowed) == 50
+
+    def test_redis_workers_share_one_allowance(self, resp_server):
+        workers = [_redis(resp_server) for _ in range(3)]
+        allowed = sum(worker.hit("user:7", 10, 60, NOW)[0] for _ in range(10) for worker in workers)
+        assert allowed == 10
+        # Rejected hits were rolled back
+        assert resp_server.data[f"rl:user:7:{NOW}".encode()] == b"10"
+
+
+def _hammer(path: str, hits: int) -> int:
+    backend = SQLiteBackend(path)
+    return sum(backend.hit("user:7", 50, 60, NOW)[0] for _ in range(hits))
+
+
+class TestFailureModes:
+    def _unreachable(self):
+        return RedisBackend("redis://127.0.0.1:1/0", timeout=0.05)
+
+    def test_unreachable_backend_raises(self):
+        with pytest.raises(BackendUnavailable):
+            self._unreachable().hit("k", 5, 60, NOW)
+
+    @pytest.mark.parametrize("fail_open", [True, False])
+    def test_limiter_fails_open_or_closed(self, tmp_path, fail_open):
+        limiter = EnterpriseRateLimiter(str(tmp_path / "invoices.db"),
+                                        backend=self._unreachable(), fail_open=fail_open)
+        assert limiter.check_burst_limit("k", 5) is fail_open
+        assert limiter.get_burst_remaining("k", 5) == (5 if fail_open else 0)
+        assert limiter.stats()["backend_errors"] == 1
+
+    def test_error_reply_raises_and_reconnects(self, resp_server):
+        backend = _redis(resp_server)
+        with pytest.raises(BackendUnavailable):
+            backend._call(("FLUSHALL",))
+        assert backend.hit("k", 5, 60, NOW) == (True, 1)
+
+    def test_resp_encoding(self):
+        assert RespConnection._encode(("INCR", "rl:k", 60)) == b"*3\r\n$4\r\nINCR\r\n$4\r\nrl:k\r\n$2\r\n60\r\n"
+
+    def test_unknown_backend_falls_back_to_memory(self):
+        assert isinstance(create_backend("memcached"), MemoryBackend)
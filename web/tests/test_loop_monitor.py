@@ -0,0 +1,68 @@
+import asyncio
+import time
+
+from web.loop_monitor import LoopStallMonitor
+
+
+def _blocking_handler(scope):
+    time.sleep(0.25)
+
+
+async def _route(scope):
+    _blocking_handler(scope)
+
+
+def _run(scenario, **kwargs):
+    monitor = LoopStallMonitor(interval=0.01, threshold=0.08, **kwargs)
+
+    async def main():
+        monitor.start()
+        await asyncio.sleep(0.05)
+        try:
+            await scenario()
+            await asyncio.sleep(0.05)
+        finally:
+            monitor.stop()
+
+    asyncio.run(main())
+    return monitor
+
+
+class TestLoopStallMonitor:
+    def test_stall_is_attributed_to_route_and_call_site(self):
+        scope = {"type": "http", "method": "GET", "path": "/api/invoices/7", "route": None}
+
+        async def scenario():
+            await _route(scope)
+            await asyncio.sleep(0.05)
+            await _route(scope)
+
+        report = _run(scenario).report()
+
+        assert report["stalls"] == 2
+        site = report["sites"][0]
+        assert site["route"] == "GET /api/invoices/7"
+        assert site["call_site"].startswith("test_loop_monitor.py:")
+        assert site["call_site"].endswith("in _blocking_handler")
+        assert site["count"] == 2
+        assert site["max_ms"] >= 150
+        assert any("_route" in line for line in site["stack"])
+
+    def test_no_stalls_for_cooperative_code(self):
+        async def scenario():
+            for _ in range(10):
+                await asyncio.sleep(0.01)
+
+        monitor = _run(scenario)
+        assert monitor.stats()["stalls"] == 0
+        assert monitor.stats()["ticks"] > 5
+        assert monitor.report()["sites"] == []
+
+    def test_reset_clears_sites(self):
+        async def scenario():
+            time.sleep(0.2)
+
+        monitor = _run(scenario)
+        assert monitor.stats()["stalls"] == 1
+        monitor.reset()
+        assert monitor.report()["sites"] == [] and monitor.stats()["stalls"] == 0
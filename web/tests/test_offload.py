@@ -0,0 +1,161 @@
+import asyncio
+import sqlite3
+import time
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from fastapi import FastAPI, Request
+
+from web.offload import AsyncDB, offload_route, run_blocking
+
+# An async route may not hold the event loop longer than this
+LOOP_BLOCK_THRESHOLD = 0.1
+SLOW_CALL_SECONDS = 0.3
+
+
+async def _max_loop_lag(scenario) -> float:
+    """Run scenario() while a ticker measures the longest gap between loop iterations."""
+    lags = []
+    done = asyncio.Event()
+
+    async def ticker():
+        last = time.perf_counter()
+        while not done.is_set():
+            await asyncio.sleep(0.005)
+            now = time.perf_counter()
+            lags.append(now - last - 0.005)
+            last = now
+
+    task = asyncio.create_task(ticker())
+    await asyncio.sleep(0.02)
+    try:
+        await scenario()
+    finally:
+        done.set()
+        await task
+    return max(lags)
+
+
+def _slow_db(tmp_path):
+    db_path = str(tmp_path / "invoices.db")
+
+    def connect():
+        conn = sqlite3.connect(db_path, check_same_thread=False)
+        conn.create_function("slow", 1, lambda x: time.sleep(SLOW_CALL_SECONDS) or x)
+        return conn
+
+    conn = connect()
+    conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, plan TEXT)")
+    conn.execute("INSERT INTO users (plan) VALUES ('Professional')")
+    conn.commit()
+    conn.close()
+    return AsyncDB(connect=connect)
+
+
+def _app(db: AsyncDB) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/sync/{user_id}")
+    @offload_route
+    def sync_route(user_id: int, request: Request):
+        time.sleep(SLOW_CALL_SECONDS)
+        return {"user_id": user_id}
+
+    @app.get("/plan")
+    async def plan_route():
+        row = await db.fetchone("SELECT slow(plan) AS plan FROM users WHERE id = ?", (1,))
+        return {"plan": row["plan"]}
+
+    @app.get("/webhook")
+    async def webhook_route():
+        await run_blocking(time.sleep, SLOW_CALL_SECONDS)
+        return {"sent": True}
+
+    @app.get("/inline")
+    async def inline_route():
+        time.sleep(SLOW_CALL_SECONDS)
+        return {}
+
+    return app
+
+
+def _get(app: FastAPI, *paths):
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            responses.extend(await asyncio.gather(*(client.get(path) for path in paths)))
+
+    responses = []
+    lag = asyncio.run(_max_loop_lag(scenario))
+    return lag, responses
+
+
+class TestLoopNotBlocked:
+    def test_offloaded_routes_keep_the_loop_responsive(self, tmp_path):
+        lag, responses = _get(_app(_slow_db(tmp_path)), "/sync/7", "/plan", "/webhook")
+
+        assert [r.status_code for r in responses] == [200, 200, 200]
+        assert responses[0].json() == {"user_id": 7}
+        assert responses[1].json() == {"plan": "Professional"}
+        assert lag < LOOP_BLOCK_THRESHOLD, f"event loop blocked for {lag:.3f}s"
+
+    def test_probe_detects_inline_blocking(self, tmp_path):
+        lag, _ = _get(_app(_slow_db(tmp_path)), "/inline")
+        assert lag >= LOOP_BLOCK_THRESHOLD
+
+
+class TestAsyncDB:
+    def test_execute_and_fetch(self, tmp_path):
+        db = _slow_db(tmp_path)
+
+        async def scenario():
+            result = await db.execute("INSERT INTO users (plan) VALUES (?)", ("Free",))
+            rows = await db.fetchall("SELECT id, plan FROM users ORDER BY id")
+            count = await db.run(lambda conn: conn.execute("SELECT COUNT(*) FROM users").fetchone()[0])
+            return result, rows, count
+
+        result, rows, count = asyncio.run(scenario())
+        assert result.rowcount == 1 and result.lastrowid == 2
+        assert [tuple(row) for row in rows] == [(1, "Professional"), (2, "Free")]
+        assert count == 2
+
+
+class TestAppRoutes:
+    """The real app's job routes, with a job store whose reads are slow."""
+
+    JOB = {"status": "completed", "files": ["a.pdf"], "created_at": "2024-03-01T10:00:00",
+           "successful": 1, "total": 1, "results": [{}], "failed": [], "stats": {}, "exported_files": {}}
+
+    def test_job_routes_keep_the_loop_responsive(self, monkeypatch):
+        app_module = pytest.importorskip("web.app")
+
+        def slow_get(job_id, default=None):
+            time.sleep(SLOW_CALL_SECONDS)
+            return dict(self.JOB)
+
+        monkeypatch.setattr(app_module.processing_jobs, "get", slow_get)
+        lag, responses = _get(app_module.app, "/api/status/job-1", "/api/results/job-1")
+
+        assert [r.status_code for r in responses] == [200, 200]
+        assert responses[0].json()["status"] == "completed"
+        assert lag < LOOP_BLOCK_THRESHOLD, f"event loop blocked for {lag:.3f}s"
+
+    def test_system_routes_keep_the_loop_responsive(self, monkeypatch):
+        app_module = pytest.importorskip("web.app")
+
+        def slow(result):
+            return lambda: time.sleep(SLOW_CALL_SECONDS) or result
+
+        monkeypatch.setattr(app_module, "get_system_status", slow({"status": "ok"}))
+        monkeypatch.setattr(app_module, "run_system_check", slow([]))
+        responses = []
+
+        async def scenario():
+            request = SimpleNamespace(session={"user_id": 1})
+            responses.extend(await asyncio.gather(app_module.system_status(),
+                                                  app_module.trigger_system_check(request)))
+
+        lag = asyncio.run(_max_loop_lag(scenario))
+        assert responses == [{"status": "ok"}, {"alerts": [], "count": 0}]
+        assert lag < LOOP_BLOCK_THRESHOLD, f"event loop blocked for {lag:.3f}s"
@@ -0,0 +1,64 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from web.parse_pool import ParsePool, run_staged
+
+
+def _fail_on_bad(item):
+    if item == "bad":
+        raise ValueError("broken xml")
+    return item.upper()
+
+
+class TestRunStaged:
+    def test_results_and_errors_from_both_stages(self):
+        with ThreadPoolExecutor(max_workers=2) as io:
+            out = list(run_staged(
+                ["a", "bad", "c", "d"], _fail_on_bad,
+                lambda item, parsed: None if item == "d" else parsed + "!",
+                io.submit, ParsePool(workers=0),
+            ))
+
+        by_item = {item: (status, payload) for item, status, payload in out}
+        assert by_item["a"] == ("success", "A!")
+        assert by_item["c"] == ("success", "C!")
+        assert by_item["bad"][0] == "error" and "broken xml" in by_item["bad"][1]
+        assert by_item["d"] == ("success", None)
+
+    def test_parsing_runs_ahead_only_up_to_max_pending(self):
+        parsed = []
+        release = threading.Event()
+
+        def parse(item):
+            parsed.append(item)
+            return item
+
+        def extract(item, value):
+            release.wait(5)
+            return value
+
+        with ThreadPoolExecutor(max_workers=1) as io:
+            results = run_staged(range(10), parse, extract, io.submit, ParsePool(workers=0), max_pending=3)
+            time.sleep(0.2)
+            assert len(parsed) == 3
+            release.set()
+            assert sorted(r[2] for r in results) == list(range(10))
+
+    def test_process_pool_stage(self, tmp_path):
+        files = []
+        for i in range(3):
+            path = tmp_path / f"{i}.pdf"
+            path.write_bytes(b"x" * (i + 1))
+            files.append(str(path))
+
+        pool = ParsePool(workers=2)
+        try:
+            with ThreadPoolExecutor(max_workers=2) as io:
+                out = list(run_staged(files, os.path.getsize, lambda item, size: size, io.submit, pool))
+        finally:
+            pool.shutdown()
+
+        assert sorted(payload for _, _, payload in out) == [1, 2, 3]
+        assert pool.stats()["submitted"] == 3
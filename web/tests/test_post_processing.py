@@ -0,0 +1,140 @@
+import sqlite3
+
+import pytest
+
+from web.post_processing import JobPostProcessor, PostProcessingWriter, normalize_supplier
+
+
+def _invoices():
+    return [
+        {"id": 1, "rechnungsaussteller": "Müller GmbH", "rechnungsnummer": "R-1", "betrag_brutto": 100},
+        {"id": 2, "rechnungsaussteller": "Müller GmbH & Co. KG", "rechnungsnummer": "R-2", "betrag_brutto": 50},
+        {"id": 3, "rechnungsaussteller": "Müller GmbH", "rechnungsnummer": "r-1", "betrag_brutto": 100.0},
+        {"id": 4, "rechnungsaussteller": "Schmidt AG", "rechnungsnummer": "S-9", "betrag_brutto": 70},
+        {"id": 5, "rechnungsaussteller": "", "rechnungsnummer": "", "betrag_brutto": 0},
+    ]
+
+
+class _Recorder:
+    def __init__(self):
+        self.load_calls = 0
+        self.similar_inputs = []
+        self.predictions = []
+        self.writes = []
+
+    def load(self, job_id):
+        self.load_calls += 1
+        return _invoices()
+
+    def hash_dups(self, job_id):
+        return [{"invoice_id": 4, "detection_id": 99}]
+
+    def similar(self, invoices, user_id):
+        self.similar_inputs.append([inv["id"] for inv in invoices])
+        return [(2, 1234, 0.8, "ai"), (3, 1, 0.9, "ai")]
+
+    def predict(self, invoice, user_id):
+        self.predictions.append(invoice["id"])
+        return (10 + invoice["id"], 0.9, "ok")
+
+    def write(self, assignments, pairs):
+        self.writes.append((list(assignments), list(pairs)))
+
+
+def _processor(rec):
+    return JobPostProcessor(
+        load_invoices=rec.load,
+        hash_duplicates=rec.hash_dups,
+        find_similar=rec.similar,
+        predict_category=rec.predict,
+        write=rec.write,
+    )
+
+
+class TestJobPostProcessor:
+    def test_runs_as_set_operations(self):
+        rec = _Recorder()
+        result = _processor(rec).run("job-1", 7)
+
+        assert rec.load_calls == 1
+        # Every invoice reaches the similarity check (the index must learn all of them) ...
+        assert rec.similar_inputs == [[1, 2, 3, 4, 5]]
+        assert result.duplicate_count == 1
+        assert result.similar_count == 2
+        # ... but the in-batch duplicate (3) keeps only its exact pair
+        assert (3, 1, 1.0, "exact") in result.duplicate_pairs
+        assert (3, 1, 0.9, "ai") not in result.duplicate_pairs
+
+    def test_prediction_per_invoice(self):
+        rec = _Recorder()
+        result = _processor(rec).run("job-1", 7)
+
+        # Same supplier does not mean same category (e.g. hardware and services)
+        assert rec.predictions == [1, 2, 3, 4, 5]
+        assert result.categorized == 5
+        assert (2, 12, 0.9) in result.category_assignments
+
+    def test_identical_invoices_share_a_prediction(self):
+        rec = _Recorder()
+        invoices = [
+            {"id": 1, "rechnungsaussteller": "Müller GmbH", "rechnungsnummer": "R-1", "betrag_brutto": 100},
+            {"id": 2, "rechnungsaussteller": "Müller GmbH", "rechnungsnummer": "R-1", "betrag_brutto": 100},
+            {"id": 3, "rechnungsaussteller": "Müller GmbH", "rechnungsnummer": "R-1", "betrag_brutto": 100,
+             "positionen": "Wartung"},
+        ]
+        rec.load = lambda job_id: invoices
+        result = _processor(rec).run("job-1", 7)
+
+        assert rec.predictions == [1, 3]
+        assert sorted(result.category_assignments) == [(1, 11, 0.9), (2, 11, 0.9), (3, 13, 0.9)]
+
+    def test_single_write(self):
+        rec = _Recorder()
+        _processor(rec).run("job-1", 7)
+
+        assert len(rec.writes) == 1
+        assignments, pairs = rec.writes[0]
+        assert len(assignments) == 5
+        assert len(pairs) == 2
+
+    def test_normalize_supplier(self):
+        assert normalize_supplier("Müller GmbH & Co. KG") == "müller"
+        assert normalize_supplier(None) == ""
+
+
+class TestPostProcessingWriter:
+    @pytest.fixture
+    def db_path(self, tmp_path):
+        path = str(tmp_path / "invoices.db")
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE duplicate_detections (id INTEGER PRIMARY KEY, invoice_id INTEGER, "
+                     "duplicate_of_id INTEGER, detection_method TEXT, confidence REAL)")
+        conn.execute("CREATE TABLE invoice_categories (invoice_id INTEGER PRIMARY KEY, "
+                     "category_id INTEGER NOT NULL, confidence REAL, assigned_by TEXT)")
+        conn.commit()
+        conn.close()
+        return path
+
+    def _rows(self, db_path):
+        conn = sqlite3.connect(db_path)
+        try:
+            return (conn.execute("SELECT invoice_id, duplicate_of_id, detection_method, confidence "
+                                 "FROM duplicate_detections ORDER BY invoice_id").fetchall(),
+                    conn.execute("SELECT invoice_id, category_id, assigned_by FROM invoice_categories "
+                                 "ORDER BY invoice_id").fetchall())
+        finally:
+            conn.close()
+
+    def test_writes_pairs_and_categories(self, db_path):
+        PostProcessingWriter(db_path)([(1, 11, 0.9), (2, 12, 0.8)], [(2, 1, 0.95, "lsh")])
+        assert self._rows(db_path) == ([(2, 1, "lsh", 0.95)], [(1, 11, "ai"), (2, 12, "ai")])
+
+    def test_failure_rolls_back_both(self, db_path):
+        writer = PostProcessingWriter(db_path)
+        with pytest.raises(sqlite3.IntegrityError):
+            writer([(1, 11, 0.9), (2, None, 0.8)], [(2, 1, 0.95, "lsh")])
+        assert self._rows(db_path) == ([], [])
+        # The pooled connection is usable again afterwards
+        writer([(1, 11, 0.9)], [])
+        assert self._rows(db_path) == ([], [(1, 11, "ai")])
+
@@ -0,0 +1,73 @@
+import asyncio
+
+from web.progress_events import ProgressHub, Subscription, is_terminal, job_snapshot, sse_format
+
+
+class TestProgressHub:
+    def test_events_are_coalesced_per_interval(self):
+        async def scenario():
+            hub = ProgressHub(min_interval=0.2)
+            sub = hub.subscribe("job-1")
+
+            def worker():
+                for i in range(20):
+                    hub.publish("job-1", "file_extracted", filename=f"{i}.pdf", processed=i + 1, total=20)
+
+            await asyncio.to_thread(worker)
+            first = await sub.get(timeout=1)
+            second = await sub.get(timeout=0.5)
+            return hub, first, second
+
+        hub, first, second = asyncio.run(scenario())
+        # All 20 events fit into the first (immediate) and one coalesced follow-up message
+        messages = [m for m in (first, second) if m]
+        assert sum(len(m["events"]) for m in messages) == 20
+        assert messages[-1]["state"] == {"processed": 20, "total": 20}
+        assert hub.stats()["messages_sent"] == len(messages) <= 2
+
+    def test_terminal_event_is_flushed_immediately(self):
+        async def scenario():
+            hub = ProgressHub(min_interval=10)
+            sub = hub.subscribe("job-1")
+            hub.publish("job-1", "file_started", filename="a.pdf")
+            first = await sub.get(timeout=1)
+            hub.publish("job-1", "completed", status="completed", progress=100)
+            return first, await sub.get(timeout=1)
+
+        first, final = asyncio.run(scenario())
+        assert first["events"][0]["type"] == "file_started"
+        assert is_terminal(final)
+        assert final["state"] == {"status": "completed", "progress": 100}
+
+    def test_publish_without_subscribers_is_noop(self):
+        hub = ProgressHub()
+        hub.publish("job-1", "file_extracted", filename="a.pdf")
+        assert hub.stats()["events_published"] == 0
+
+    def test_slow_client_drops_oldest(self):
+        async def scenario():
+            sub = Subscription("job-1", maxsize=2)
+            for seq in range(5):
+                sub.offer({"seq": seq})
+            return sub, [(await sub.get(timeout=1))["seq"] for _ in range(2)]
+
+        sub, seqs = asyncio.run(scenario())
+        assert seqs == [3, 4]
+        assert sub.dropped == 3
+
+    def test_topic_listeners_get_backplane_messages(self):
+        hub = ProgressHub()
+        received = []
+        hub.add_listener("api_keys:revoked", lambda topic, message: received.append((topic, message)))
+        hub.add_listener("other", lambda topic, message: 1 / 0)
+        hub.backplane.publish("api_keys:revoked", {"key_id": 1})
+        hub.backplane.publish("other", {})
+        assert received == [("api_keys:revoked", {"key_id": 1})]
+        hub.shutdown()
+
+
+def test_snapshot_and_sse_frame():
+    snapshot = job_snapshot("job-1", {"status": "processing", "files": [{}, {}], "processed": 1})
+    assert snapshot["state"] == {"status": "processing", "processed": 1, "total": 2, "progress": 0}
+    assert not is_terminal(snapshot)
+    assert sse_format(snapshot).startswith("event: snapshot\ndata: {")
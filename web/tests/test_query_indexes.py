@@ -0,0 +1,160 @@
+import sqlite3
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from web import query_indexes as qi
+
+SCHEMA = """
+CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT, email TEXT);
+CREATE TABLE jobs (job_id TEXT PRIMARY KEY, user_id INTEGER, status TEXT, upload_path TEXT,
+                   total_files INTEGER, created_at TEXT);
+CREATE TABLE invoices (id INTEGER PRIMARY KEY, job_id TEXT, rechnungsnummer TEXT, rechnungsaussteller TEXT,
+                       datum TEXT, betrag_brutto REAL, mwst_satz REAL, waehrung TEXT, status TEXT,
+                       iban TEXT, bic TEXT, created_at TEXT);
+CREATE TABLE api_costs (id INTEGER PRIMARY KEY, job_id TEXT, cost_usd REAL);
+CREATE TABLE audit_log (id INTEGER PRIMARY KEY, user_id INTEGER, action TEXT, timestamp TEXT);
+CREATE TABLE rechnungen (id INTEGER PRIMARY KEY, user_id INTEGER, rechnungs_datum TEXT, netto_betrag REAL,
+                         brutto_betrag REAL, lieferant TEXT, kategorie_id INTEGER);
+CREATE TABLE zahlungsbedingungen (id INTEGER PRIMARY KEY, invoice_id INTEGER, bezahlt_am TEXT,
+                                  skonto_datum TEXT, skonto_betrag REAL, bezahlt_betrag REAL,
+                                  zahlungsstatus TEXT, geplantes_zahldatum TEXT);
+CREATE TABLE budget_kategorien (id INTEGER PRIMARY KEY, name TEXT, aktiv INTEGER);
+CREATE TABLE budgets (id INTEGER PRIMARY KEY, kategorie_id INTEGER, jahr INTEGER, monat INTEGER, betrag REAL);
+"""
+
+USERS = 50
+JOBS_PER_USER = 10
+INVOICES_PER_JOB = 5
+
+
+def _populate(conn):
+    start = datetime(2025, 1, 1)
+    actions = ["auth.login", "auth.login_failed", "invoice.upload", "invoice.export"]
+    for user_id in range(1, USERS + 1):
+        conn.execute("INSERT INTO users VALUES (?, ?, ?)", (user_id, f"User {user_id}", f"u{user_id}@example.de"))
+        for j in range(JOBS_PER_USER):
+            job_id = f"job-{user_id}-{j}"
+            created = (start + timedelta(days=j * 7, hours=user_id)).isoformat(" ")
+            conn.execute("INSERT INTO jobs VALUES (?, ?, 'completed', '/tmp', ?, ?)",
+                         (job_id, user_id, INVOICES_PER_JOB, created))
+            conn.execute("INSERT INTO api_costs (job_id, cost_usd) VALUES (?, 0.02)", (job_id,))
+            for k in range(INVOICES_PER_JOB):
+                cur = conn.execute(
+                    "INSERT INTO invoices (job_id, rechnungsnummer, datum, status, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (job_id, f"R{k}", created[:10], "approved" if k % 2 else "pending", created),
+                )
+                conn.execute(
+                    "INSERT INTO zahlungsbedingungen (invoice_id, bezahlt_am, zahlungsstatus, geplantes_zahldatum) "
+                    "VALUES (?, ?, ?, ?)",
+                    (cur.lastrowid, created[:10] if k % 2 else None, "bezahlt" if k % 2 else "geplant", created[:10]),
+                )
+                conn.execute("INSERT INTO rechnungen (user_id, rechnungs_datum, netto_betrag, brutto_betrag, lieferant)"
+                             " VALUES (?, ?, 100, 119, 'ACME')", (user_id, created[:10]))
+            conn.execute("INSERT INTO audit_log (user_id, action, timestamp) VALUES (?, ?, ?)",
+                         (user_id, actions[j % len(actions)], created))
+    conn.commit()
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    conn.executescript(SCHEMA)
+    _populate(conn)
+    yield conn
+    conn.close()
+
+
+HOT_QUERIES = [
+    ("invoices_today", qi.INVOICES_TODAY_SQL, ()),
+    ("jobs_today", qi.JOBS_TODAY_SQL, ()),
+    ("user_invoice_count", qi.USER_INVOICE_COUNT_SQL, (7,)),
+    ("user_recent_invoices", qi.USER_RECENT_INVOICES_SQL, (7,)),
+    ("user_completed_jobs", qi.USER_COMPLETED_JOBS_SQL, (7,)),
+    ("user_job_costs", qi.USER_JOB_COSTS_SQL, (7,)),
+    ("user_approved_invoices", qi.USER_APPROVED_INVOICES_SQL, (7,)),
+    ("audit_active_today", qi.AUDIT_ACTIVE_USERS_TODAY_SQL, ()),
+    ("audit_today", qi.AUDIT_TODAY_SQL, ()),
+    ("audit_logins_7d", qi.AUDIT_LOGINS_7D_SQL, ()),
+    ("audit_failed_logins", qi.AUDIT_FAILED_LOGINS_SQL, ()),
+    ("audit_user_today", qi.AUDIT_USER_TODAY_SQL, (7,)),
+    ("audit_user_logins_7d", qi.AUDIT_USER_LOGINS_7D_SQL, (7,)),
+    ("audit_user_failed_logins", qi.AUDIT_USER_FAILED_LOGINS_SQL, (7,)),
+    ("payment_stats", qi.PAYMENT_STATS_SQL, (7, 6)),
+    ("planned_payments", qi.PLANNED_PAYMENTS_SQL, ()),
+    ("mbr_months", qi.MBR_MONTHS_SQL, (7,)),
+]
+
+
+def _plan(conn, sql, params=()):
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()]
+
+
+def _full_scans(plan):
+    """Plan steps that read a whole table or index (SEARCH ... = index lookup)."""
+    return [step for step in plan if step.startswith("SCAN ") and "CONSTANT ROW" not in step]
+
+
+class TestHotQueryPlans:
+    @pytest.mark.parametrize("name,sql,params", HOT_QUERIES, ids=[q[0] for q in HOT_QUERIES])
+    def test_no_full_scan_with_managed_indexes(self, conn, name, sql, params):
+        qi.ensure_indexes(conn)
+        plan = _plan(conn, sql, params)
+        assert _full_scans(plan) == [], f"{name}: {plan}"
+
+    def test_without_indexes_the_date_filter_scans(self, conn):
+        assert _full_scans(_plan(conn, qi.INVOICES_TODAY_SQL))
+        assert _full_scans(_plan(conn, qi.USER_INVOICE_COUNT_SQL, (7,)))
+
+    def test_mbr_aggregation_queries_use_index(self, conn):
+        mbr_data = pytest.importorskip("mbr.data")
+        qi.ensure_indexes(conn)
+        statements = []
+        conn.set_trace_callback(statements.append)
+        data = mbr_data.aggregate_mbr_data(conn, window=mbr_data.custom_month_window(2025, 2), user_id=7)
+        conn.set_trace_callback(None)
+
+        assert data.invoice_count == 4 * INVOICES_PER_JOB
+        rechnungen = [s for s in statements if "FROM rechnungen" in s and "MAX(" not in s]
+        assert rechnungen
+        for sql in rechnungen:
+            assert _full_scans(_plan(conn, sql)) == [], sql
+
+
+class TestSargableRanges:
+    def test_day_range_matches_date_function(self, conn):
+        day = date(2025, 1, 8)
+        conn.executemany("INSERT INTO audit_log (user_id, action, timestamp) VALUES (1, 'x', ?)", [
+            ("2025-01-08 00:00:00",), ("2025-01-08T23:59:59",), ("2025-01-08",), ("2025-01-09 00:00:00",),
+            ("2025-01-07 23:59:59",),
+        ])
+        start, end = qi.day_range(day)
+        ranged = conn.execute("SELECT COUNT(*) FROM audit_log WHERE timestamp >= ? AND timestamp < ?",
+                              (start, end)).fetchone()[0]
+        wrapped = conn.execute("SELECT COUNT(*) FROM audit_log WHERE DATE(timestamp) = ?",
+                               (day.isoformat(),)).fetchone()[0]
+        assert ranged == wrapped
+
+    def test_day_range_bounds(self):
+        assert qi.day_range(date(2025, 12, 31)) == ("2025-12-31", "2026-01-01")
+
+
+class TestEnsureIndexes:
+    def test_idempotent_and_reports_existing(self, conn):
+        first = qi.ensure_indexes(conn)
+        second = qi.ensure_indexes(conn)
+        assert len(first["created"]) == len(qi.MANAGED_INDEXES)
+        assert second["created"] == []
+        assert sorted(second["existing"]) == sorted(first["created"])
+
+    def test_skips_missing_tables_and_columns(self):
+        conn = sqlite3.connect(":memory:")
+        conn.execute("CREATE TABLE jobs (job_id TEXT, created_at TEXT)")
+        result = qi.ensure_indexes(conn)
+        assert result["created"] == ["idx_jobs_created"]
+        assert "idx_jobs_user_created" in result["skipped"]
+        assert "idx_audit_ts" in result["skipped"]
+
+    def test_table_filter(self, conn):
+        result = qi.ensure_indexes(conn, tables=["api_costs"])
+        assert result == {"created": ["idx_api_costs_job_id"], "existing": [], "skipped": []}
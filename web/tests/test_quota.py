@@ -0,0 +1,195 @@
+import sqlite3
+import threading
+
+from web.quota import COPILOT_DEMO, DEMO_UPLOAD, INVOICES, Quota, QuotaService, plan_quota
+
+
+class FakeClock:
+    def __init__(self, now: float = 1_800_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _service(tmp_path, clock=None, **kwargs):
+    kwargs.setdefault("flush_interval", 0)
+    return QuotaService(str(tmp_path / "invoices.db"), clock=clock or FakeClock(), **kwargs)
+
+
+def _stored(tmp_path, subject, name):
+    conn = sqlite3.connect(str(tmp_path / "invoices.db"))
+    row = conn.execute("SELECT SUM(count) FROM quota_usage WHERE subject = ? AND quota = ?", (subject, name)).fetchone()
+    conn.close()
+    return row[0] or 0
+
+
+class TestCounters:
+    def test_daily_quota_resets_with_the_bucket(self, tmp_path):
+        clock = FakeClock()
+        quota = _service(tmp_path, clock)
+        assert [quota.consume("10.0.0.1", DEMO_UPLOAD).allowed for _ in range(4)] == [True, True, True, False]
+        status = quota.status("10.0.0.1", DEMO_UPLOAD)
+        assert (status.used, status.limit, status.remaining, status.allowed) == (3, 3, 0, False)
+
+        clock.now += 86400
+        assert quota.status("10.0.0.1", DEMO_UPLOAD).used == 0
+
+    def test_subjects_and_quotas_are_isolated(self, tmp_path):
+        quota = _service(tmp_path)
+        quota.add("10.0.0.1", DEMO_UPLOAD)
+        assert quota.status("10.0.0.2", DEMO_UPLOAD).used == 0
+        assert quota.status("10.0.0.1", COPILOT_DEMO).used == 0
+
+    def test_per_call_limit_overrides_default(self, tmp_path):
+        quota = _service(tmp_path)
+        assert quota.consume(7, plan_quota("mbr"), limit=1).allowed
+        status = quota.consume(7, plan_quota("mbr"), limit=1)
+        assert (status.allowed, status.used) == (False, 1)
+        assert quota.consume(7, plan_quota("mbr")).allowed  # no limit
+
+    def test_consume_is_atomic_across_threads(self, tmp_path):
+        quota = _service(tmp_path)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(quota.consume("k", Quota("q", "day", 10)).allowed))
+                   for _ in range(30)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert results.count(True) == 10
+
+    def test_hot_path_reads_the_db_once(self, tmp_path):
+        quota = _service(tmp_path)
+        quota.status("10.0.0.1", DEMO_UPLOAD)
+        before = quota._pool.stats()
+        for _ in range(100):
+            quota.status("10.0.0.1", DEMO_UPLOAD)
+            quota.consume("10.0.0.1", plan_quota("api"), limit=1000)
+        assert quota._pool.stats()["created"] == before["created"]
+        assert quota._pool.stats()["reused"] == before["reused"] + 1  # first plan:api read
+
+
+class TestPersistence:
+    def test_write_behind_and_other_workers(self, tmp_path):
+        worker_a = _service(tmp_path)
+        worker_b = _service(tmp_path)
+        worker_a.add("10.0.0.1", DEMO_UPLOAD)
+        assert _stored(tmp_path, "10.0.0.1", "demo_upload") == 0
+
+        worker_b.add("10.0.0.1", DEMO_UPLOAD)
+        assert worker_b.flush() == 1
+        assert worker_a.flush() == 1
+        assert _stored(tmp_path, "10.0.0.1", "demo_upload") == 2
+        assert worker_a.status("10.0.0.1", DEMO_UPLOAD).used == 2
+
+    def test_invalidate_rereads_the_db(self, tmp_path):
+        worker_a = _service(tmp_path)
+        worker_b = _service(tmp_path)
+        assert worker_a.status(7, plan_quota("mbr")).used == 0
+        worker_b.add(7, plan_quota("mbr"), 5)
+        worker_b.flush()
+
+        worker_a.invalidate(plan_quota("mbr"), 7)
+        assert worker_a.status(7, plan_quota("mbr")).used == 5
+
+    def test_demo_log_tables_are_created_at_init(self, tmp_path):
+        _service(tmp_path)
+        conn = sqlite3.connect(str(tmp_path / "invoices.db"))
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        conn.close()
+        assert {"quota_usage", "demo_usage", "copilot_demo_usage"} <= tables
+
+    def test_stop_flushes(self, tmp_path):
+        quota = _service(tmp_path, flush_interval=0.01)
+        quota.add("10.0.0.1", COPILOT_DEMO)
+        quota.stop()
+        assert _stored(tmp_path, "10.0.0.1", "copilot_demo") == 1
+
+
+    def test_workers_do_not_each_admit_up_to_the_limit(self, tmp_path):
+        worker_a = _service(tmp_path)
+        worker_b = _service(tmp_path)
+        # Both workers have cached the total before either counts
+        assert worker_a.status("10.0.0.1", DEMO_UPLOAD).used == 0
+        assert worker_b.status("10.0.0.1", DEMO_UPLOAD).used == 0
+        results = [worker.consume("10.0.0.1", DEMO_UPLOAD).allowed
+                   for worker in (worker_a, worker_b, worker_a, worker_b, worker_a, worker_b)]
+        assert results == [True, True, True, False, False, False]
+        assert _stored(tmp_path, "10.0.0.1", "demo_upload") == 3
+
+    def test_strict_consume_includes_pending_increments(self, tmp_path):
+        quota = _service(tmp_path)
+        q = Quota("q", "day", 20)
+        for _ in range(9):
+            assert quota.consume("k", q).allowed      # in memory, far from the limit
+        assert _stored(tmp_path, "k", "q") == 0
+        for _ in range(11):
+            assert quota.consume("k", q).allowed      # last units: counted in the DB
+        assert not quota.consume("k", q).allowed
+        assert _stored(tmp_path, "k", "q") == 20
+        assert quota.flush() == 0
+
+    def test_cached_total_is_refreshed(self, tmp_path):
+        clock = FakeClock()
+        worker_a = _service(tmp_path, clock, refresh_interval=5)
+        worker_b = _service(tmp_path, clock)
+        assert worker_a.status(7, plan_quota("mbr")).used == 0
+        worker_b.add(7, plan_quota("mbr"), 4)
+        worker_b.flush()
+        assert worker_a.status(7, plan_quota("mbr")).used == 0
+        clock.now += 6
+        assert worker_a.status(7, plan_quota("mbr")).used == 4
+
+    def test_refund_gives_the_unit_back(self, tmp_path):
+        worker_a = _service(tmp_path)
+        assert worker_a.consume("10.0.0.1", DEMO_UPLOAD).allowed
+        assert worker_a.consume("10.0.0.1", DEMO_UPLOAD).allowed
+        worker_a.refund("10.0.0.1", DEMO_UPLOAD)
+        assert worker_a.status("10.0.0.1", DEMO_UPLOAD).used == 1
+        worker_a.flush()
+        assert _stored(tmp_path, "10.0.0.1", "demo_upload") == 1
+        assert _service(tmp_path).status("10.0.0.1", DEMO_UPLOAD).used == 1
+
+
+class TestExternalQuota:
+    def _service(self, tmp_path, status):
+        quota = _service(tmp_path)
+        calls = {"load": [], "record": []}
+
+        def load(subject):
+            calls["load"].append(subject)
+            return dict(status)
+
+        quota.register_external(INVOICES, load, lambda subject, n: calls["record"].append((subject, n)), ttl=30)
+        return quota, calls
+
+    def test_status_is_cached_until_usage_is_recorded(self, tmp_path):
+        quota, calls = self._service(tmp_path, {"allowed": True, "used": 3, "limit": 50})
+        status = quota.status(7, INVOICES)
+        quota.status(7, INVOICES)
+        assert (status.used, status.limit, status.allowed) == (3, 50, True)
+        assert calls["load"] == ["7"]
+
+        quota.add(7, INVOICES, 4)
+        quota.status(7, INVOICES)
+        assert calls["record"] == [("7", 4)]
+        assert calls["load"] == ["7", "7"]
+
+    def test_info_and_admin_bypass(self, tmp_path):
+        quota, _ = self._service(tmp_path, {"allowed": False, "is_admin": True, "reason": "limit_reached"})
+        status = quota.status(7, INVOICES)
+        assert status.allowed is True
+        assert status.info["reason"] == "limit_reached"
+
+    def test_invalidate_all_subjects(self, tmp_path):
+        clock = FakeClock()
+        quota, calls = self._service(tmp_path, {"allowed": True})
+        quota._clock = clock
+        quota.status(7, INVOICES)
+        quota.status(8, INVOICES)
+        quota.invalidate(INVOICES)
+        quota.status(7, INVOICES)
+        clock.now += 31
+        quota.status(8, INVOICES)
+        assert calls["load"] == ["7", "8", "7", "8"]
@@ -0,0 +1,182 @@
+import sqlite3
+import time
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from web import rate_limiter as rl
+from web.quota import QuotaService
+
+
+class FakeClock:
+    def __init__(self, now: float = 1_800_000_000.0):
+        self.now = now - now % 60
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _limiter(tmp_path, clock=None, flush_interval=0, **kwargs):
+    path = str(tmp_path / "invoices.db")
+    clock = clock or FakeClock()
+    quota = QuotaService(path, flush_interval=flush_interval, clock=clock)
+    return rl.EnterpriseRateLimiter(path, clock=clock, quota=quota, **kwargs)
+
+
+def _db_count(tmp_path, user_id=7, endpoint_type="upload"):
+    conn = sqlite3.connect(str(tmp_path / "invoices.db"))
+    row = conn.execute("SELECT SUM(count) FROM quota_usage WHERE subject = ? AND quota = ?",
+                       (str(user_id), f"plan:{endpoint_type}")).fetchone()
+    conn.close()
+    return row[0] or 0
+
+
+def _request(user_id=7, ip="10.0.0.1"):
+    return SimpleNamespace(headers={}, client=SimpleNamespace(host=ip), session={"user_id": user_id})
+
+
+@pytest.fixture(autouse=True)
+def _fresh_plan_cache():
+    rl.invalidate_user_plan()
+    yield
+    rl.invalidate_user_plan()
+
+
+class TestSlidingWindow:
+    def test_blocks_at_limit_and_decays_with_previous_window(self, tmp_path):
+        clock = FakeClock()
+        limiter = _limiter(tmp_path, clock)
+
+        assert [limiter.check_burst_limit("k", 5) for _ in range(6)] == [True] * 5 + [False]
+        assert limiter.get_burst_remaining("k", 5) == 0
+
+        # Start of the next window: the previous 5 still count fully
+        clock.now += 60
+        assert limiter.check_burst_limit("k", 5) is False
+        # Half-way: previous window weighs 2.5
+        clock.now += 30
+        assert [limiter.check_burst_limit("k", 5) for _ in range(4)] == [True, True, True, False]
+        # Two windows later nothing is left
+        clock.now += 120
+        assert limiter.get_burst_remaining("k", 5) == 5
+
+    def test_keys_are_isolated_and_stale_keys_cleaned(self, tmp_path):
+        clock = FakeClock()
+        limiter = _limiter(tmp_path, clock)
+        assert limiter.check_burst_limit("a", 1) is True
+        assert limiter.check_burst_limit("b", 1) is True
+        assert limiter.check_burst_limit("a", 1) is False
+
+        clock.now += 180
+        limiter.check_burst_limit("c", 1)
+        assert set(limiter.backend.windows) == {"c"}
+
+
+class TestMonthlyWriteBehind:
+    def test_increments_are_buffered_until_flush(self, tmp_path):
+        limiter = _limiter(tmp_path)
+        for _ in range(3):
+            assert limiter.consume_monthly(7, "upload", 100)[0]
+
+        assert _db_count(tmp_path) == 0
+        assert limiter._get_monthly_usage(7, "upload") == 3
+        assert limiter.flush() == 3
+        assert _db_count(tmp_path) == 3
+        assert limiter.flush() == 0
+
+    def test_monthly_limit_and_other_workers_usage(self, tmp_path):
+        worker_a = _limiter(tmp_path)
+        worker_b = _limiter(tmp_path)
+        assert worker_a.consume_monthly(7, "mbr", 3) == (True, 0)
+        # Close to the limit the DB total is checked, so worker B sees worker A's use
+        assert worker_b.consume_monthly(7, "mbr", 3) == (True, 1)
+        worker_b.flush()
+        worker_a.flush()
+
+        assert worker_a.consume_monthly(7, "mbr", 3) == (True, 2)
+        assert worker_a.consume_monthly(7, "mbr", 3) == (False, 3)
+
+    def test_failed_flush_keeps_pending_increments(self, tmp_path):
+        limiter = _limiter(tmp_path)
+        limiter.consume_monthly(7, "upload", 100)
+        conn = sqlite3.connect(str(tmp_path / "invoices.db"))
+        conn.execute("ALTER TABLE quota_usage RENAME TO quota_usage_old")
+        conn.commit()
+
+        assert limiter.flush() == 0
+        assert limiter.quota.stats()["pending"] == 1
+
+        conn.execute("ALTER TABLE quota_usage_old RENAME TO quota_usage")
+        conn.commit()
+        conn.close()
+        assert limiter.flush() == 1
+        assert _db_count(tmp_path) == 1
+
+    def test_legacy_rate_limit_usage_is_imported(self, tmp_path):
+        conn = sqlite3.connect(str(tmp_path / "invoices.db"))
+        conn.execute("CREATE TABLE rate_limit_usage (user_id INTEGER, endpoint_type TEXT, year_month TEXT, "
+                     "count INTEGER, last_updated TEXT)")
+        month = time.strftime("%Y-%m", time.localtime(FakeClock()()))
+        conn.execute("INSERT INTO rate_limit_usage VALUES (7, 'mbr', ?, 2, NULL)", (month,))
+        conn.commit()
+        conn.close()
+
+        limiter = _limiter(tmp_path)
+        assert limiter.consume_monthly(7, "mbr", 3) == (True, 2)
+        assert _limiter(tmp_path).flush() == 0  # imported once, not doubled
+
+    def test_background_flusher_and_stop(self, tmp_path):
+        limiter = _limiter(tmp_path, flush_interval=0.01)
+        limiter.consume_monthly(7, "upload", 100)
+        limiter.stop()
+        assert _db_count(tmp_path) == 1
+
+
+class TestCheckRateLimit:
+    @pytest.fixture
+    def setup(self, tmp_path, monkeypatch):
+        limiter = _limiter(tmp_path)
+        monkeypatch.setattr(rl, "limiter", limiter)
+        loads = []
+
+        def load_plan(user_id):
+            loads.append(user_id)
+            return "Starter"
+
+        monkeypatch.setattr(rl, "_load_user_plan", load_plan)
+        return limiter, loads
+
+    def test_hot_path_touches_no_database(self, setup):
+        limiter, loads = setup
+        rl.check_rate_limit(_request(), "api")
+        before = limiter.quota._pool.stats()
+
+        for _ in range(50):
+            info = rl.check_rate_limit(_request(), "api")
+
+        assert limiter.quota._pool.stats() == before
+        assert loads == [7]
+        assert info["plan"] == "Starter"
+        assert info["monthly_remaining"] == 5000 - 51
+
+    def test_plan_invalidation_reloads(self, setup):
+        _, loads = setup
+        rl.get_user_plan(7)
+        rl.get_user_plan(7)
+        rl.invalidate_user_plan(7)
+        rl.get_user_plan(7)
+        assert loads == [7, 7]
+
+    def test_db_errors_are_not_cached(self, setup, monkeypatch):
+        monkeypatch.setattr(rl, "_load_user_plan", lambda user_id: None)
+        assert rl.get_user_plan(7) == "Free"
+        assert rl.plan_cache_stats()["size"] == 0
+
+    def test_burst_exceeded_raises_429(self, setup):
+        for _ in range(10):
+            rl.check_rate_limit(_request(), "upload")
+        with pytest.raises(HTTPException) as exc:
+            rl.check_rate_limit(_request(), "upload")
+        assert exc.value.status_code == 429
+        assert exc.value.detail["limit_type"] == "burst"
@@ -0,0 +1,39 @@
+from web.result_journal import ResultJournal
+
+
+def _journal(tmp_path, **kwargs):
+    return ResultJournal(db_path=str(tmp_path / "journal.db"), **kwargs)
+
+
+class TestResultJournal:
+    def test_results_survive_and_resume_skips_done_files(self, tmp_path):
+        journal = _journal(tmp_path, batch_size=2)
+        with journal.writer("job-1") as writer:
+            writer.add_result("a.pdf", {"filename": "a.pdf", "betrag_brutto": 10})
+            writer.add_failure("b.pdf", "timeout")
+            writer.add_result("c.pdf", {"filename": "c.pdf", "betrag_brutto": 20})
+
+        # New instance = restarted worker
+        results, done = _journal(tmp_path).load("job-1")
+        assert done == {"a.pdf", "c.pdf"}
+        assert [r["betrag_brutto"] for r in results] == [10, 20]
+
+    def test_batches_commit_before_writer_closes(self, tmp_path):
+        journal = _journal(tmp_path, batch_size=2)
+        writer = journal.writer("job-1").__enter__()
+        writer.add_result("a.pdf", {"n": 1})
+        assert journal.load("job-1")[1] == set()
+
+        writer.add_result("b.pdf", {"n": 2})
+        assert journal.load("job-1")[1] == {"a.pdf", "b.pdf"}
+        writer.__exit__(None, None, None)
+
+    def test_clear_removes_only_that_job(self, tmp_path):
+        journal = _journal(tmp_path)
+        for job_id in ("job-1", "job-2"):
+            with journal.writer(job_id) as writer:
+                writer.add_result("a.pdf", {"n": 1})
+
+        journal.clear("job-1")
+        assert journal.load("job-1") == ([], set())
+        assert journal.load("job-2")[1] == {"a.pdf"}
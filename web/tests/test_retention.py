@@ -0,0 +1,82 @@
+import time
+from datetime import datetime, timedelta
+
+from web.retention import RetentionIndex, RetentionSweeper
+
+
+def _index(tmp_path, **kwargs):
+    return RetentionIndex(db_path=str(tmp_path / "retention.db"), **kwargs)
+
+
+def _upload(tmp_path, name):
+    path = tmp_path / "uploads" / name
+    path.mkdir(parents=True)
+    (path / "rechnung.pdf").write_bytes(b"%PDF-1.4")
+    return path
+
+
+class TestRetentionIndex:
+    def test_sweep_deletes_only_due_uploads(self, tmp_path):
+        index = _index(tmp_path)
+        due = _upload(tmp_path, "job-1")
+        later = _upload(tmp_path, "job-2")
+        index.schedule_path(due, time.time() - 1, tenant_id=7)
+        index.schedule_path(later, time.time() + 3600, tenant_id=7)
+
+        assert index.sweep() == 1
+        assert not due.exists()
+        assert later.exists()
+        assert index.stats()["pending"] == {"upload": 1}
+
+    def test_schedule_survives_restart_and_latest_deadline_wins(self, tmp_path):
+        path = _upload(tmp_path, "job-1")
+        _index(tmp_path).schedule_path(path, datetime.now() + timedelta(hours=24))
+        _index(tmp_path).schedule_path(path, datetime.now() - timedelta(minutes=1))
+
+        assert _index(tmp_path).sweep() == 1
+        assert not path.exists()
+
+    def test_sweeps_in_batches(self, tmp_path):
+        index = _index(tmp_path, batch_size=3)
+        paths = [_upload(tmp_path, f"job-{i}") for i in range(7)]
+        for path in paths:
+            index.schedule_path(path, time.time() - 1)
+
+        assert index.sweep() == 7
+        assert not any(path.exists() for path in paths)
+
+    def test_failed_deletion_is_retried_later(self, tmp_path, monkeypatch):
+        index = _index(tmp_path)
+        path = _upload(tmp_path, "job-1")
+        index.schedule_path(path, time.time() - 1)
+
+        def fail(path):
+            raise OSError("busy")
+
+        monkeypatch.setattr("web.retention.shutil.rmtree", fail)
+        assert index.sweep() == 0
+        # Not dropped: rescheduled with backoff
+        assert index.stats()["pending"] == {"upload": 1}
+        assert index.due() == []
+        monkeypatch.undo()
+        assert index.sweep(now=time.time() + 3600) == 1
+        assert not path.exists()
+
+    def test_adopt_orphans_registers_unknown_directories(self, tmp_path):
+        index = _index(tmp_path)
+        known = _upload(tmp_path, "known")
+        _upload(tmp_path, "orphan")
+        index.schedule_path(known, time.time() + 3600)
+
+        assert index.adopt_orphans(tmp_path / "uploads", delete_after_seconds=0) == 1
+        assert index.sweep() == 1
+        assert known.exists()
+
+
+class TestRetentionSweeper:
+    def test_hooks_run_every_n_ticks(self, tmp_path):
+        runs = []
+        sweeper = RetentionSweeper(_index(tmp_path), hooks=[lambda: runs.append(1)], hook_every=3)
+        for _ in range(7):
+            sweeper.run_once()
+        assert len(runs) == 3
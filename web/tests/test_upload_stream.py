@@ -0,0 +1,43 @@
+import asyncio
+import hashlib
+import io
+
+import pytest
+from fastapi import UploadFile
+
+from web.upload_stream import UploadRejected, safe_filename, stream_upload_to_disk
+
+
+def _upload(content: bytes, filename: str = "rechnung.pdf") -> UploadFile:
+    return UploadFile(file=io.BytesIO(content), filename=filename)
+
+
+class TestStreamUploadToDisk:
+    def test_writes_file_and_hash(self, tmp_path):
+        content = b"%PDF-1.7\n" + b"x" * 5000
+        stored = asyncio.run(stream_upload_to_disk(_upload(content), tmp_path, 10_000, chunk_size=1024))
+
+        assert stored.path.read_bytes() == content
+        assert stored.size == len(content)
+        assert stored.sha256 == hashlib.sha256(content).hexdigest()
+
+    def test_size_limit_enforced_while_streaming(self, tmp_path):
+        content = b"%PDF-1.7\n" + b"x" * 5000
+        with pytest.raises(UploadRejected) as exc:
+            asyncio.run(stream_upload_to_disk(_upload(content), tmp_path, 2048, chunk_size=1024))
+
+        assert exc.value.reason == "too_large"
+        assert not (tmp_path / "rechnung.pdf").exists()
+
+    def test_rejects_non_pdf_magic(self, tmp_path):
+        with pytest.raises(UploadRejected) as exc:
+            asyncio.run(stream_upload_to_disk(_upload(b"PK\x03\x04zip"), tmp_path, 10_000))
+
+        assert exc.value.reason == "not_pdf"
+        assert list(tmp_path.iterdir()) == []
+
+    def test_filename_is_sanitized(self, tmp_path):
+        stored = asyncio.run(stream_upload_to_disk(_upload(b"%PDF-1.4", "../../etc/x.pdf"), tmp_path, 100))
+
+        assert stored.path == tmp_path / "x.pdf"
+        assert safe_filename("C:\\temp\\a.pdf") == "a.pdf"
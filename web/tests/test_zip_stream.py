@@ -0,0 +1,80 @@
+import io
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from web.zip_stream import render_ordered, start, stream_zip
+
+
+def _render(i):
+    return f"rechnung_{i}.xml", None if i == 3 else f"<Invoice>{i}</Invoice>".encode() * 200
+
+
+def _failing(at):
+    def render(i):
+        if i == at:
+            raise RuntimeError("render failed")
+        return f"{i}.xml", b"x" * 100
+    return render
+
+
+class TestStreamZip:
+    def test_streamed_archive_is_valid_and_ordered(self):
+        completed = []
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            chunks = list(stream_zip(render_ordered(range(10), _render, window=3, pool=pool),
+                                     on_complete=lambda size, count: completed.append((size, count))))
+
+        data = b"".join(chunks)
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            names = zf.namelist()
+            assert zf.read("rechnung_7.xml").startswith(b"<Invoice>7</Invoice>")
+
+        assert names == [f"rechnung_{i}.xml" for i in range(10) if i != 3]
+        assert completed == [(len(data), 9)]
+        # One chunk per written entry plus the central directory, not one big buffer
+        assert len(chunks) >= 9
+
+    def test_rendering_stays_within_window(self):
+        rendered = []
+        lock = threading.Lock()
+
+        def render(i):
+            with lock:
+                rendered.append(i)
+            return f"{i}.xml", b"x"
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            entries = render_ordered(range(100), render, window=5, pool=pool)
+            first = next(entries)
+            assert first == ("0.xml", b"x")
+            assert len(rendered) <= 5
+            assert len(list(entries)) == 99
+
+    def test_first_entry_is_rendered_before_streaming(self):
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            with pytest.raises(RuntimeError):
+                start(render_ordered(range(5), _failing(0), window=2, pool=pool))
+
+            entries = start(render_ordered(range(5), _render, window=2, pool=pool))
+            data = b"".join(stream_zip(entries))
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            assert len(zf.namelist()) == 4
+
+    def test_failure_mid_stream_leaves_no_valid_archive(self, caplog):
+        completed = []
+        chunks = []
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            stream = stream_zip(render_ordered(range(10), _failing(6), window=2, pool=pool),
+                                on_complete=lambda size, count: completed.append(count))
+            with pytest.raises(RuntimeError):
+                for chunk in stream:
+                    chunks.append(chunk)
+
+        assert chunks
+        with pytest.raises(zipfile.BadZipFile):
+            zipfile.ZipFile(io.BytesIO(b"".join(chunks)))
+        assert completed == []
+        assert "aborted after 6 entries" in caplog.text
@@ -0,0 +1,101 @@
+"""
+SBS Deutschland – Streaming Upload Writer
+Chunked, non-blocking upload persistence with hashing and hard size limits.
+
+upload_files used to call shutil.copyfileobj synchronously inside an async
+handler, blocking the event loop for every file. This writer:
+- reads the multipart part in chunks and writes them off the event loop
+- computes the SHA-256 while streaming (reused by the extraction cache)
+- enforces the byte limit on the actual stream, not on UploadFile.size
+- rejects non-PDF content on the first chunk (magic bytes)
+"""
+
+import asyncio
+import hashlib
+import logging
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from fastapi import UploadFile
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024  # 1 MB
+PDF_MAGIC = b"%PDF-"
+# PDF spec allows junk before the header; readers accept it within the first 1 KB
+PDF_MAGIC_WINDOW = 1024
+
+
+class UploadRejected(Exception):
+    """Upload part rejected while streaming (size or content type)."""
+
+    def __init__(self, reason: str, message: str):
+        super().__init__(message)
+        self.reason = reason
+        self.message = message
+
+
+@dataclass(frozen=True)
+class StoredUpload:
+    filename: str
+    path: Path
+    size: int
+    sha256: str
+
+
+def safe_filename(filename: Optional[str]) -> str:
+    """Strip directory components from a client-supplied filename."""
+    name = Path((filename or "").replace("\\", "/")).name
+    return name or "upload.pdf"
+
+
+async def stream_upload_to_disk(
+    upload: UploadFile,
+    target_dir: Path,
+    max_bytes: int,
+    require_pdf: bool = True,
+    chunk_size: int = CHUNK_SIZE,
+) -> StoredUpload:
+    """
+    Stream one UploadFile into target_dir.
+
+    Raises UploadRejected (and removes the partial file) if the part is
+    larger than max_bytes or does not look like a PDF.
+    """
+    filename = safe_filename(upload.filename)
+    path = target_dir / filename
+    digest = hashlib.sha256()
+    size = 0
+
+    handle = await asyncio.to_thread(open, path, "wb")
+    try:
+        first = True
+        while True:
+            chunk = await upload.read(chunk_size)
+            if not chunk:
+                break
+
+            if first:
+                first = False
+                if require_pdf and PDF_MAGIC not in chunk[:PDF_MAGIC_WINDOW]:
+                    raise UploadRejected("not_pdf", f"{filename}: keine gültige PDF-Datei")
+
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadRejected(
+                    "too_large", f"{filename}: Datei zu groß (max. {max_bytes // (1024 * 1024)} MB)"
+                )
+
+            digest.update(chunk)
+            await asyncio.to_thread(handle.write, chunk)
+
+        if first and require_pdf:
+            raise UploadRejected("empty", f"{filename}: leere Datei")
+    except BaseException:
+        await asyncio.to_thread(handle.close)
+        await asyncio.to_thread(path.unlink, True)
+        raise
+
+    await asyncio.to_thread(handle.close)
+    return StoredUpload(filename=filename, path=path, size=size, sha256=digest.hexdigest())
@@ -0,0 +1,138 @@
+"""
+SBS Deutschland – Streaming ZIP Export
+ZIP archives written chunk by chunk while the entries are rendered.
+
+export_job_xrechnung / export_job_zugferd used to render every invoice
+serially into a BytesIO and call getvalue() twice, so a 3,000-invoice
+ZUGFeRD export held hundreds of MB per request. Now:
+- entries are rendered in a shared, bounded pool (EXPORT_RENDER_WORKERS),
+  at most `window` invoices ahead of the writer, in input order
+- zipfile writes to a non-seekable sink (data descriptors), whose chunks
+  are yielded to StreamingResponse as soon as an entry is written
+- the archive size is counted while streaming and reported on completion
+  (for log_export)
+- start() renders the first entry before the response is started, so a
+  broken export still gets an error status; a failure after that is
+  logged and aborts the stream without the central directory (clients see
+  a damaged archive, not a valid truncated one)
+"""
+
+import itertools
+import os
+import threading
+import zipfile
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+RENDER_WORKERS = int(os.getenv("EXPORT_RENDER_WORKERS", "4"))
+RENDER_WINDOW = 16
+
+# (entry name, content) – content None skips the entry
+Entry = Tuple[str, Optional[bytes]]
+
+_render_pool: Optional[ThreadPoolExecutor] = None
+_render_pool_lock = threading.Lock()
+
+
+def _get_render_pool() -> ThreadPoolExecutor:
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            _render_pool = ThreadPoolExecutor(max_workers=RENDER_WORKERS, thread_name_prefix="export-render")
+        return _render_pool
+
+
+class _ChunkSink:
+    """Write-only, non-seekable file object collecting zipfile output."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self.bytes_written = 0
+        self.aborted = False
+
+    def write(self, data) -> int:
+        if data and not self.aborted:
+            self._chunks.append(bytes(data))
+            self.bytes_written += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def abort(self):
+        """Discard everything written from now on (the central directory on close)."""
+        self.aborted = True
+        self._chunks = []
+
+    def drain(self) -> Iterator[bytes]:
+        chunks, self._chunks = self._chunks, []
+        if chunks:
+            yield b"".join(chunks)
+
+
+def render_ordered(items: Iterable[Any], render: Callable[[Any], Entry],
+                   window: int = RENDER_WINDOW,
+                   pool: Optional[ThreadPoolExecutor] = None) -> Iterator[Entry]:
+    """Render items in the pool, at most `window` ahead, yielding results in input order."""
+    pool = pool or _get_render_pool()
+    pending: Deque = deque()
+    for item in items:
+        pending.append(pool.submit(render, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def start(entries: Iterable[Entry]) -> Iterator[Entry]:
+    """
+    Render up to the first entry with content now (call it before starting
+    the response; render errors propagate) and return an iterator over all
+    entries.
+    """
+    iterator = iter(entries)
+    head: List[Entry] = []
+    for name, content in iterator:
+        head.append((name, content))
+        if content is not None:
+            break
+    return itertools.chain(head, iterator)
+
+
+def stream_zip(entries: Iterable[Entry],
+               on_complete: Optional[Callable[[int, int], None]] = None,
+               name: str = "export") -> Iterator[bytes]:
+    """
+    Yield a ZIP archive in chunks. on_complete(total_bytes, entry_count) runs
+    after the last chunk, from the same thread as the iteration. If an entry
+    fails, the error is logged and re-raised without writing the central
+    directory; on_complete is not called.
+    """
+    sink = _ChunkSink()
+    count = 0
+    zf = zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED)
+    try:
+        for entry_name, content in entries:
+            if content is None:
+                continue
+            zf.writestr(entry_name, content)
+            count += 1
+            yield from sink.drain()
+    except BaseException as e:
+        if not isinstance(e, GeneratorExit):
+            logger.error(f"ZIP stream {name} aborted after {count} entries ({sink.bytes_written} bytes): {e}")
+        sink.abort()
+        zf.close()
+        raise
+    zf.close()
+    yield from sink.drain()
+
+    if on_complete is not None:
+        try:
+            on_complete(sink.bytes_written, count)
+        except Exception as e:
+            logger.error(f"ZIP stream completion callback failed: {e}")